@@ -0,0 +1,289 @@
+"""
+Almacén local de las actividades generadas.
+
+Cada actividad guarda la solicitud del profesor, las fechas, el diseño final
+(y la plantilla JSON si la hay) y el historial de refinamientos con el
+feedback que los originó. Todo vive en un único fichero SQLite con un índice
+FTS5 sobre título, solicitud y diseño, e índices por materia y nivel, de modo
+que el historial y la búsqueda responden en milisegundos aunque haya decenas
+de miles de actividades guardadas.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional
+
+DEFAULT_STORE_PATH = os.getenv("IA4EDU_STORE", os.path.join("output", "actividades.sqlite"))
+
+_TITLE_RE = re.compile(r"^#\s+(.+?)\s*$", re.MULTILINE)
+_FIELD_RES = {
+    "materia": re.compile(r"\*\*Materia:?\*\*:?\s*(.+)", re.IGNORECASE),
+    "nivel": re.compile(r"\*\*Nivel(?: educativo)?:?\*\*:?\s*(.+)", re.IGNORECASE),
+}
+_QUERY_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS activities (
+    id INTEGER PRIMARY KEY,
+    solicitud TEXT NOT NULL,
+    titulo TEXT NOT NULL,
+    materia TEXT NOT NULL DEFAULT '' COLLATE NOCASE,
+    nivel TEXT NOT NULL DEFAULT '' COLLATE NOCASE,
+    diseno TEXT NOT NULL,
+    plantilla TEXT,
+    refinamientos INTEGER NOT NULL DEFAULT 0,
+    guardada INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_activities_updated ON activities(updated_at);
+CREATE INDEX IF NOT EXISTS idx_activities_materia ON activities(materia, updated_at);
+CREATE INDEX IF NOT EXISTS idx_activities_nivel ON activities(nivel, updated_at);
+
+CREATE TABLE IF NOT EXISTS refinements (
+    id INTEGER PRIMARY KEY,
+    activity_id INTEGER NOT NULL REFERENCES activities(id) ON DELETE CASCADE,
+    orden INTEGER NOT NULL,
+    feedback TEXT NOT NULL,
+    diseno TEXT NOT NULL,
+    por_secciones INTEGER NOT NULL DEFAULT 0,
+    cambios TEXT NOT NULL DEFAULT '',
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_refinements_activity ON refinements(activity_id, orden);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS activities_fts USING fts5(
+    titulo, solicitud, diseno,
+    content='activities', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS activities_ai AFTER INSERT ON activities BEGIN
+    INSERT INTO activities_fts(rowid, titulo, solicitud, diseno)
+    VALUES (new.id, new.titulo, new.solicitud, new.diseno);
+END;
+CREATE TRIGGER IF NOT EXISTS activities_ad AFTER DELETE ON activities BEGIN
+    INSERT INTO activities_fts(activities_fts, rowid, titulo, solicitud, diseno)
+    VALUES ('delete', old.id, old.titulo, old.solicitud, old.diseno);
+END;
+CREATE TRIGGER IF NOT EXISTS activities_au AFTER UPDATE OF titulo, solicitud, diseno ON activities BEGIN
+    INSERT INTO activities_fts(activities_fts, rowid, titulo, solicitud, diseno)
+    VALUES ('delete', old.id, old.titulo, old.solicitud, old.diseno);
+    INSERT INTO activities_fts(rowid, titulo, solicitud, diseno)
+    VALUES (new.id, new.titulo, new.solicitud, new.diseno);
+END;
+"""
+
+
+def design_metadata(design: str, plantilla: Optional[Dict[str, Any]] = None) -> Dict[str, str]:
+    """Título, materia y nivel: de la plantilla si la hay, si no del markdown"""
+    if plantilla:
+        return {
+            "titulo": plantilla.get("titulo", ""),
+            "materia": plantilla.get("materia", ""),
+            "nivel": plantilla.get("nivel_educativo", ""),
+        }
+    title = _TITLE_RE.search(design)
+    meta = {"titulo": title.group(1) if title else ""}
+    for name, pattern in _FIELD_RES.items():
+        match = pattern.search(design)
+        meta[name] = match.group(1).strip() if match else ""
+    return meta
+
+
+def fts_query(text: str) -> str:
+    """Consulta FTS5 segura: cada palabra entre comillas, la última como prefijo"""
+    tokens = _QUERY_TOKEN_RE.findall(text)
+    if not tokens:
+        return ""
+    quoted = [f'"{token}"' for token in tokens]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+@dataclass
+class ActivitySummary:
+    """Fila del historial"""
+    id: int
+    titulo: str
+    solicitud: str
+    materia: str
+    nivel: str
+    refinamientos: int
+    created_at: float
+    updated_at: float
+    fragmento: str = ""
+
+
+@dataclass
+class RefinementRecord:
+    """Un paso de refinamiento de una actividad"""
+    orden: int
+    feedback: str
+    diseno: str
+    por_secciones: bool
+    cambios: str
+    created_at: float
+
+
+@dataclass
+class StoredActivity:
+    """Actividad completa con su historial de refinamientos"""
+    resumen: ActivitySummary
+    diseno: str
+    plantilla: Optional[Dict[str, Any]]
+    guardada: bool
+    historial: List[RefinementRecord] = field(default_factory=list)
+
+
+_SUMMARY_COLUMNS = "a.id, a.titulo, a.solicitud, a.materia, a.nivel, a.refinamientos, a.created_at, a.updated_at"
+
+
+class ActivityStore:
+    """Actividades generadas, su historial y la búsqueda de texto completo"""
+
+    def __init__(self, path: str = DEFAULT_STORE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def create(self, solicitud: str, diseno: str, plantilla: Optional[Dict[str, Any]] = None,
+               created_at: Optional[float] = None) -> int:
+        """Guarda una actividad recién diseñada y devuelve su id"""
+        return self.create_many([(solicitud, diseno, plantilla, created_at)])[0]
+
+    def create_many(self, records: Iterable[tuple]) -> List[int]:
+        """Inserta (solicitud, diseño, plantilla, fecha) en una sola transacción"""
+        ids = []
+        with self._lock:
+            for solicitud, diseno, plantilla, created_at in records:
+                now = created_at or time.time()
+                meta = design_metadata(diseno, plantilla)
+                cursor = self._conn.execute(
+                    "INSERT INTO activities (solicitud, titulo, materia, nivel, diseno, plantilla, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (solicitud, meta["titulo"] or solicitud[:80], meta["materia"], meta["nivel"], diseno,
+                     json.dumps(plantilla, ensure_ascii=False) if plantilla else None, now, now),
+                )
+                ids.append(cursor.lastrowid)
+            self._conn.commit()
+        return ids
+
+    def add_refinement(self, activity_id: int, feedback: str, diseno: str,
+                       plantilla: Optional[Dict[str, Any]] = None, por_secciones: bool = False,
+                       cambios: str = "") -> int:
+        """Añade un refinamiento al historial y actualiza el diseño final; devuelve su orden"""
+        now = time.time()
+        meta = design_metadata(diseno, plantilla)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT refinamientos, titulo, materia, nivel FROM activities WHERE id = ?", (activity_id,)
+            ).fetchone()
+            if row is None:
+                raise KeyError(f"No existe la actividad {activity_id}")
+            orden = row[0] + 1
+            self._conn.execute(
+                "INSERT INTO refinements (activity_id, orden, feedback, diseno, por_secciones, cambios, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (activity_id, orden, feedback, diseno, int(por_secciones), cambios, now),
+            )
+            self._conn.execute(
+                "UPDATE activities SET diseno = ?, plantilla = COALESCE(?, plantilla), titulo = ?, materia = ?, "
+                "nivel = ?, refinamientos = ?, updated_at = ? WHERE id = ?",
+                (diseno, json.dumps(plantilla, ensure_ascii=False) if plantilla else None,
+                 meta["titulo"] or row[1], meta["materia"] or row[2], meta["nivel"] or row[3],
+                 orden, now, activity_id),
+            )
+            self._conn.commit()
+        return orden
+
+    def mark_saved(self, activity_id: int):
+        with self._lock:
+            self._conn.execute("UPDATE activities SET guardada = 1 WHERE id = ?", (activity_id,))
+            self._conn.commit()
+
+    def delete(self, activity_id: int):
+        with self._lock:
+            self._conn.execute("DELETE FROM activities WHERE id = ?", (activity_id,))
+            self._conn.commit()
+
+    @staticmethod
+    def _filters(materia: Optional[str], nivel: Optional[str]):
+        clauses, params = [], []
+        if materia:
+            clauses.append("a.materia = ?")
+            params.append(materia)
+        if nivel:
+            clauses.append("a.nivel = ?")
+            params.append(nivel)
+        return clauses, params
+
+    def history(self, limit: int = 20, offset: int = 0, materia: Optional[str] = None,
+                nivel: Optional[str] = None) -> List[ActivitySummary]:
+        """Actividades más recientes primero (usa los índices por fecha, materia y nivel)"""
+        clauses, params = self._filters(materia, nivel)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {_SUMMARY_COLUMNS} FROM activities a {where} "
+                "ORDER BY a.updated_at DESC LIMIT ? OFFSET ?",
+                (*params, limit, offset),
+            ).fetchall()
+        return [ActivitySummary(*row) for row in rows]
+
+    def search(self, query: str, limit: int = 20, materia: Optional[str] = None,
+               nivel: Optional[str] = None) -> List[ActivitySummary]:
+        """Búsqueda de texto completo ordenada por relevancia (BM25, el título pesa más)"""
+        match = fts_query(query)
+        if not match:
+            return self.history(limit, materia=materia, nivel=nivel)
+        clauses, params = self._filters(materia, nivel)
+        extra = f"AND {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {_SUMMARY_COLUMNS}, snippet(activities_fts, 2, '«', '»', '…', 12) "
+                "FROM activities_fts JOIN activities a ON a.id = activities_fts.rowid "
+                f"WHERE activities_fts MATCH ? {extra} "
+                "ORDER BY bm25(activities_fts, 5.0, 2.0, 1.0) LIMIT ?",
+                (match, *params, limit),
+            ).fetchall()
+        return [ActivitySummary(*row) for row in rows]
+
+    def get(self, activity_id: int) -> Optional[StoredActivity]:
+        """Actividad con su diseño final y el historial de refinamientos"""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {_SUMMARY_COLUMNS}, a.diseno, a.plantilla, a.guardada FROM activities a WHERE a.id = ?",
+                (activity_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            steps = self._conn.execute(
+                "SELECT orden, feedback, diseno, por_secciones, cambios, created_at FROM refinements "
+                "WHERE activity_id = ? ORDER BY orden", (activity_id,),
+            ).fetchall()
+        return StoredActivity(
+            resumen=ActivitySummary(*row[:8]),
+            diseno=row[8],
+            plantilla=json.loads(row[9]) if row[9] else None,
+            guardada=bool(row[10]),
+            historial=[RefinementRecord(o, f, d, bool(s), c, t) for o, f, d, s, c, t in steps],
+        )
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM activities").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,199 @@
+"""
+Generación por lotes a partir de un fichero JSONL de solicitudes.
+
+Cada línea es un objeto JSON con la solicitud del profesor (``solicitud``,
+``request`` o ``body``) y, opcionalmente, un identificador (``request_id`` o
+``id``). Las solicitudes se reparten en un conjunto acotado de hilos, cada
+intento tiene un tiempo máximo y se reintenta con un crew nuevo y espera
+exponencial. Los
+resultados se escriben en el JSONL de salida en cuanto termina cada uno, de
+modo que una ejecución interrumpida puede reanudarse.
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from functools import partial
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set
+
+REQUEST_KEYS = ("solicitud", "request", "body")
+ID_KEYS = ("request_id", "id")
+
+
+@dataclass
+class BatchRequest:
+    """Solicitud leída del fichero de entrada"""
+    request_id: str
+    solicitud: str
+    extra: Dict[str, Any]
+
+
+@dataclass
+class BatchResult:
+    """Resultado de una solicitud del lote"""
+    request_id: str
+    solicitud: str
+    status: str  # "ok", "error" o "timeout"
+    attempts: int
+    elapsed_s: float
+    actividad: Optional[str] = None
+    error: Optional[str] = None
+
+    def to_json(self) -> str:
+        data = {
+            "request_id": self.request_id,
+            "solicitud": self.solicitud,
+            "status": self.status,
+            "attempts": self.attempts,
+            "elapsed_s": round(self.elapsed_s, 3),
+            "finished_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        if self.actividad is not None:
+            data["actividad"] = self.actividad
+        if self.error is not None:
+            data["error"] = self.error
+        return json.dumps(data, ensure_ascii=False)
+
+
+def read_requests(path: str) -> Iterator[BatchRequest]:
+    """Lee las solicitudes del JSONL (las líneas vacías se ignoran)"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"Línea {line_no} de {path} no es JSON válido: {e}")
+            text = next((data[key] for key in REQUEST_KEYS if data.get(key)), None)
+            if text is None:
+                raise ValueError(f"Línea {line_no} de {path} no tiene ninguno de los campos {REQUEST_KEYS}")
+            if data.get("title") and "body" in data and text == data["body"]:
+                text = f"{data['title']}. {text}"
+            request_id = next((str(data[key]) for key in ID_KEYS if data.get(key)), f"linea-{line_no}")
+            yield BatchRequest(request_id, text, data)
+
+
+def completed_ids(output_path: str) -> Set[str]:
+    """Identificadores ya resueltos con éxito en un fichero de salida previo"""
+    done: Set[str] = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                data = json.loads(line)
+            except ValueError:
+                continue
+            if data.get("status") == "ok":
+                done.add(str(data.get("request_id")))
+    return done
+
+
+def result_text(result: Any) -> str:
+    """Texto de un resultado de CrewAI (CrewOutput o cadena)"""
+    return result.raw if hasattr(result, "raw") else str(result)
+
+
+class _Attempt:
+    """Ejecución de una solicitud en un hilo propio que ocupa un hueco del lote
+
+    El hueco se toma al crear el intento (esperando a que quede uno libre) y se
+    libera cuando el hilo termina. Un hilo no se puede interrumpir: si vence el
+    plazo se sigue ejecutando (daemon) y conserva su hueco, de modo que los
+    intentos abandonados cuentan contra el número de hilos del lote.
+    """
+
+    def __init__(self, fn: Callable[[], Any], slots: threading.Semaphore):
+        self.outcome: Dict[str, Any] = {}
+        slots.acquire()
+
+        def target():
+            try:
+                self.outcome["value"] = fn()
+            except BaseException as e:
+                self.outcome["error"] = e
+            finally:
+                slots.release()
+
+        self.thread = threading.Thread(target=target, daemon=True)
+        self.thread.start()
+
+    def wait(self, timeout: Optional[float]) -> Any:
+        """Resultado del intento; TimeoutError si no termina a tiempo"""
+        self.thread.join(timeout or None)
+        if self.thread.is_alive():
+            raise TimeoutError(f"sin respuesta tras {timeout:.0f} s")
+        if "error" in self.outcome:
+            raise self.outcome["error"]
+        return self.outcome["value"]
+
+
+class BatchRunner:
+    """Ejecuta un lote de solicitudes con hilos, plazos y reintentos
+
+    ``crew_factory`` crea un IA4EDUCrew nuevo para cada intento: los agentes de
+    CrewAI no deben compartirse entre ejecuciones simultáneas, mientras que las
+    cachés (corpus, respuestas) sí se comparten. Como mucho ``workers``
+    intentos llaman al LLM a la vez, incluidos los que vencieron su plazo: el
+    reintento tras un plazo vencido lanza un crew nuevo en cuanto queda un hueco
+    libre. ``timeout`` limita cada intento en marcha; la espera por un hueco no
+    cuenta, así que una solicitud tarda como mucho ``(retries + 1) * timeout``
+    más esas esperas y las pausas entre reintentos.
+    """
+
+    def __init__(self, crew_factory: Callable[[], Any], workers: int = 4,
+                 timeout: Optional[float] = 600.0, retries: int = 2, backoff: float = 2.0):
+        self.crew_factory = crew_factory
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.retries = max(0, retries)
+        self.backoff = backoff
+        self._slots = threading.Semaphore(self.workers)
+
+    def run_one(self, request: BatchRequest) -> BatchResult:
+        """Resuelve una solicitud con reintentos"""
+        start = time.perf_counter()
+        status, error = "error", None
+        for attempt in range(1, self.retries + 2):
+            try:
+                crew = self.crew_factory()
+                result = _Attempt(partial(crew.design_activity, request.solicitud), self._slots).wait(self.timeout)
+                return BatchResult(request.request_id, request.solicitud, "ok", attempt,
+                                   time.perf_counter() - start, actividad=result_text(result))
+            except TimeoutError as e:
+                status, error = "timeout", str(e)
+            except Exception as e:
+                status, error = "error", f"{type(e).__name__}: {e}"
+            if attempt <= self.retries and self.backoff:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+        return BatchResult(request.request_id, request.solicitud, status, self.retries + 1,
+                           time.perf_counter() - start, error=error)
+
+    def run(self, requests: List[BatchRequest], output_path: str, resume: bool = True,
+            on_result: Optional[Callable[[BatchResult], None]] = None) -> List[BatchResult]:
+        """Procesa el lote escribiendo cada resultado en cuanto está listo"""
+        if resume:
+            done = completed_ids(output_path)
+            requests = [r for r in requests if r.request_id not in done]
+        if os.path.dirname(output_path):
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+        results: List[BatchResult] = []
+        write_lock = threading.Lock()
+        with open(output_path, "a" if resume else "w", encoding="utf-8") as out:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ia4edu-batch") as pool:
+                futures = [pool.submit(self.run_one, request) for request in requests]
+                for future in as_completed(futures):
+                    result = future.result()
+                    with write_lock:
+                        out.write(result.to_json() + "\n")
+                        out.flush()
+                    results.append(result)
+                    if on_result is not None:
+                        on_result(result)
+        return results
@@ -0,0 +1,364 @@
+"""
+Banco de pruebas del flujo completo sin red.
+
+Cada agente del crew recibe un ``StubLLM`` con latencia y velocidad de
+generación configurables, de modo que ``design_activity`` y
+``refine_activity`` se ejecutan de principio a fin con tiempos de modelo
+conocidos. Por etapa se mide el tiempo real, los tokens de prompt y de
+respuesta y el tamaño de los prompts; por escenario, el pico de memoria y el
+tiempo de CPU gastado en nuestro propio código. El resultado es un JSON que
+``compare_reports`` contrasta con una ejecución anterior para detectar
+regresiones de tamaño de prompt o de sobrecoste.
+"""
+
+import cProfile
+import json
+import os
+import platform
+import pstats
+import re
+import statistics
+import threading
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from crewai.llms.base_llm import BaseLLM
+from crewai.utilities.events import LLMStreamChunkEvent
+from crewai.utilities.events.crewai_event_bus import crewai_event_bus
+
+from agents.streaming import StreamMonitor
+from agents.tokens import estimate_tokens
+
+REPORT_VERSION = 1
+# Diferencia mínima de tiempo (s) para considerar una regresión: por debajo es ruido
+MIN_TIME_DELTA = 0.05
+AGENT_NAMES = ("analyst", "researcher", "designer", "refinement")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Ficheros que cuentan como código propio al repartir la CPU
+OWN_CODE = (os.path.join(ROOT, "agents") + os.sep, os.path.join(ROOT, "main.py"))
+
+SAMPLE_REQUEST = "Actividad de fracciones para 4º de primaria en parejas, con material manipulativo"
+SCOPED_FEEDBACK = "La adaptación para TDAH no me parece clara"
+GLOBAL_FEEDBACK = "Haz la actividad completa más corta"
+
+SAMPLE_DESIGN = """# Taller de Fracciones: La Pizzería del Aula
+
+## 1. Información general
+- **Materia:** Matemáticas
+- **Duración total:** 3 sesiones de 50 minutos
+- **Modalidad:** trabajo en parejas
+
+## 2. Objetivos
+- Comprender fracciones como partes de un todo
+- Comparar fracciones sencillas con material manipulativo
+- Explicar oralmente el razonamiento seguido
+
+## 3. Fases de la actividad
+
+### Fase 1: Exploración con pizzas de cartulina
+Cada pareja recibe una pizza de cartulina y la divide en partes iguales.
+**Adaptaciones:**
+- TEA: instrucciones visuales paso a paso.
+- TDAH: tareas cortas de 10 minutos con movimiento entre mesas.
+
+### Fase 2: Pedidos de fracciones
+Las parejas atienden pedidos ("quiero 3/4 de pizza") y los representan.
+**Adaptaciones:**
+- TDAH: temporizador visual y rol de repartidor.
+- Altas capacidades: pedidos con fracciones equivalentes.
+
+### Fase 3: Presentación
+Cada pareja presenta su menú de fracciones al resto de la clase.
+
+## 4. Asignación de estudiantes
+- Pareja 1: Elena (TEA) y Luis.
+- Pareja 2: Emma (TDAH) y Sara.
+- Pareja 3: Hugo (altas capacidades) y Nora.
+
+## 5. Materiales y recursos
+- Cartulinas, tijeras y rotuladores
+- Temporizador visual
+
+## 6. Evaluación
+- Rúbrica con tres niveles
+- Autoevaluación con semáforo
+"""
+
+FILLER = ("El análisis identifica la materia, el nivel, la duración y las necesidades "
+          "de los estudiantes con TEA, TDAH y altas capacidades. ")
+
+
+def _prompt_text(messages: Any) -> str:
+    if isinstance(messages, str):
+        return messages
+    return "\n".join(str(m.get("content", "")) for m in messages)
+
+
+@dataclass
+class CallRecord:
+    """Una llamada al LLM simulado"""
+    prompt_tokens: int
+    completion_tokens: int
+    prompt_chars: int
+    simulated_s: float
+
+
+class StubLLM(BaseLLM):
+    """LLM local con latencia fija y velocidad de generación en tokens/s
+
+    Responde con ``SAMPLE_DESIGN`` al diseñar y al reescribir entero, con
+    bloques ``<<<Sn>>>`` cuando el prompt pide secciones concretas y con
+    texto de relleno del tamaño pedido en el resto de etapas.
+    """
+
+    def __init__(self, name: str, latency: float = 0.2, tokens_per_second: float = 80.0,
+                 completion_tokens: int = 150, stream: bool = False):
+        super().__init__(model=f"stub/{name}", temperature=0.7)
+        self.name = name
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.stream = stream
+        self.calls: List[CallRecord] = []
+        self._lock = threading.Lock()
+
+    def respond(self, prompt: str) -> str:
+        keys = sorted(set(re.findall(r"<<<(S\d+)>>>", prompt)), key=lambda k: int(k[1:]))
+        if keys:
+            body = "\n".join(f"<<<{key}>>>\n**Adaptaciones:**\n- TDAH: pasos numerados y pausas activas\n<<<FIN>>>"
+                             for key in keys)
+            return f"{body}\n<<<CAMBIOS>>>\nAdaptaciones concretadas."
+        if self.name in ("designer", "refinement"):
+            return SAMPLE_DESIGN
+        repeats = max(1, self.completion_tokens // estimate_tokens(FILLER))
+        return (FILLER * repeats).strip()
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        prompt = _prompt_text(messages)
+        text = self.respond(prompt)
+        completion = estimate_tokens(text)
+        simulated = self.latency + completion / self.tokens_per_second
+        time.sleep(self.latency)
+        answer = f"Final Answer: {text}"
+        if self.stream:
+            words = re.findall(r"\S+\s*", answer)
+            for word in words:
+                time.sleep(completion / self.tokens_per_second / len(words))
+                crewai_event_bus.emit(self, LLMStreamChunkEvent(chunk=word))
+        else:
+            time.sleep(completion / self.tokens_per_second)
+        with self._lock:
+            self.calls.append(CallRecord(estimate_tokens(prompt), completion, len(prompt), simulated))
+        return answer
+
+
+@dataclass
+class StageResult:
+    """Medidas de una etapa del flujo"""
+    etapa: str
+    wall_s: Optional[float]
+    primer_token_s: Optional[float]
+    llamadas: int
+    prompt_tokens: int
+    completion_tokens: int
+    prompt_chars: int
+    llm_simulado_s: float
+
+
+@dataclass
+class ScenarioResult:
+    """Medidas de un escenario (mediana de las ejecuciones y una ejecución perfilada)"""
+    nombre: str
+    wall_s: float
+    cpu_s: float
+    sobrecoste_s: float
+    wall_s_ejecuciones: List[float]
+    memoria_pico_mb: float
+    cpu_propio_s: float
+    funciones_propias: List[Dict[str, Any]]
+    etapas: List[StageResult]
+    presupuestos: List[Dict[str, Any]] = field(default_factory=list)
+
+
+def install_stubs(crew, latency: float, tokens_per_second: float,
+                  completion_tokens: int = 150, stream: bool = False) -> Dict[str, StubLLM]:
+    """Sustituye el LLM de cada agente del crew por un StubLLM"""
+    stubs = {}
+    for name in AGENT_NAMES:
+        stub = StubLLM(name, latency, tokens_per_second, completion_tokens, stream)
+        getattr(crew, name).agent.llm = stub
+        stubs[name] = stub
+    # El diseño de ejemplo no cubre el aula: sin esto cada etapa haría llamadas extra
+    crew.fill_gaps = False
+    return stubs
+
+
+def _own_functions(profile: cProfile.Profile, top: int = 10):
+    """CPU propia (tiempo exclusivo en agents/ y main.py, sin el propio banco) y las funciones más caras"""
+    rows = []
+    for (filename, line, func), (_, calls, tottime, cumtime, _) in pstats.Stats(profile).stats.items():
+        if filename.startswith(OWN_CODE) and filename != os.path.abspath(__file__):
+            rows.append({
+                "funcion": f"{os.path.relpath(filename, ROOT)}:{line}({func})",
+                "llamadas": calls,
+                "cpu_s": round(tottime, 4),
+                "acumulado_s": round(cumtime, 4),
+            })
+    rows.sort(key=lambda r: r["cpu_s"], reverse=True)
+    return sum(r["cpu_s"] for r in rows), rows[:top]
+
+
+class BenchmarkRunner:
+    """Ejecuta los escenarios de diseño y refinamiento contra LLMs simulados"""
+
+    def __init__(self, crew_factory: Callable[[], Any], latency: float = 0.2,
+                 tokens_per_second: float = 80.0, completion_tokens: int = 150,
+                 runs: int = 3, stream: bool = False):
+        self.crew_factory = crew_factory
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.runs = max(1, runs)
+        self.stream = stream
+
+    def scenarios(self) -> Dict[str, Callable[[Any], Any]]:
+        return {
+            "diseno": lambda crew: crew.design_activity(SAMPLE_REQUEST),
+            "refinamiento_secciones": lambda crew: crew.refine_activity(SAMPLE_DESIGN, SCOPED_FEEDBACK),
+            "refinamiento_completo": lambda crew: crew.refine_activity(SAMPLE_DESIGN, GLOBAL_FEEDBACK),
+        }
+
+    def _execute(self, name: str, fn: Callable[[Any], Any]):
+        """Una ejecución: crew nuevo, stubs instalados y etapas seguidas por eventos"""
+        crew = self.crew_factory()
+        crew.verbose = False
+        for agent, _ in crew.design_stages() + crew.refine_stages():
+            agent.verbose = False
+        stubs = install_stubs(crew, self.latency, self.tokens_per_second,
+                              self.completion_tokens, self.stream)
+        stages = crew.design_stages() if name == "diseno" else crew.refine_stages()
+        with StreamMonitor(stages, exclusive=True) as monitor:
+            wall_start, cpu_start = time.perf_counter(), time.process_time()
+            fn(crew)
+            wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+        return crew, stubs, monitor, wall, cpu
+
+    def run_scenario(self, name: str, fn: Callable[[Any], Any]) -> ScenarioResult:
+        walls, cpus = [], []
+        for _ in range(self.runs):
+            crew, stubs, monitor, wall, cpu = self._execute(name, fn)
+            walls.append(wall)
+            cpus.append(cpu)
+
+        # Ejecución aparte con perfilado y memoria, que distorsionan los tiempos
+        profile = cProfile.Profile()
+        tracemalloc.start()
+        profile.enable()
+        try:
+            self._execute(name, fn)
+        finally:
+            profile.disable()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        own_cpu, own_functions = _own_functions(profile)
+
+        by_agent = {id(getattr(crew, name_).agent): stub for name_, stub in stubs.items()}
+        etapas = []
+        for stage in monitor.snapshot():
+            calls = by_agent[id(stage.agent)].calls
+            etapas.append(StageResult(
+                etapa=stage.label,
+                wall_s=None if stage.elapsed is None else round(stage.elapsed, 4),
+                primer_token_s=(None if stage.first_token_at is None
+                                else round(stage.first_token_at - stage.started_at, 4)),
+                llamadas=len(calls),
+                prompt_tokens=sum(c.prompt_tokens for c in calls),
+                completion_tokens=sum(c.completion_tokens for c in calls),
+                prompt_chars=sum(c.prompt_chars for c in calls),
+                llm_simulado_s=round(sum(c.simulated_s for c in calls), 4),
+            ))
+        wall = statistics.median(walls)
+        simulated = sum(s.llm_simulado_s for s in etapas)
+        return ScenarioResult(
+            nombre=name,
+            wall_s=round(wall, 4),
+            cpu_s=round(statistics.median(cpus), 4),
+            sobrecoste_s=round(max(0.0, wall - simulated), 4),
+            wall_s_ejecuciones=[round(w, 4) for w in walls],
+            memoria_pico_mb=round(peak / 1024 / 1024, 2),
+            cpu_propio_s=round(own_cpu, 4),
+            funciones_propias=own_functions,
+            etapas=etapas,
+            presupuestos=[
+                {"etapa": r.stage, "presupuesto": r.budget, "tokens": r.tokens_after,
+                 "compactados": r.compacted, "descartados": r.dropped}
+                for r in crew.budget_reports if r is not None
+            ],
+        )
+
+    def run(self, only: Optional[List[str]] = None,
+            on_result: Optional[Callable[[ScenarioResult], None]] = None) -> Dict[str, Any]:
+        """Ejecuta los escenarios (todos o los de ``only``) y devuelve el informe"""
+        results = {}
+        for name, fn in self.scenarios().items():
+            if only and name not in only:
+                continue
+            results[name] = self.run_scenario(name, fn)
+            if on_result is not None:
+                on_result(results[name])
+        return {
+            "version": REPORT_VERSION,
+            "fecha": datetime.now().isoformat(timespec="seconds"),
+            "config": {
+                "latencia_s": self.latency,
+                "tokens_por_segundo": self.tokens_per_second,
+                "tokens_respuesta": self.completion_tokens,
+                "ejecuciones": self.runs,
+                "streaming": self.stream,
+                "python": platform.python_version(),
+            },
+            "escenarios": {name: asdict(result) for name, result in results.items()},
+        }
+
+
+def save_report(report: Dict[str, Any], path: str):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def load_report(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare_reports(baseline: Dict[str, Any], current: Dict[str, Any],
+                    tolerance: float = 0.10) -> List[str]:
+    """Regresiones de ``current`` frente a ``baseline``
+
+    Los tokens de prompt por etapa son deterministas y se comparan con la
+    tolerancia indicada; el sobrecoste y la CPU propia dependen de la máquina,
+    así que solo se señalan si crecen más del doble de esa tolerancia y al
+    menos ``MIN_TIME_DELTA`` segundos.
+    """
+    regressions = []
+    for name, old in baseline.get("escenarios", {}).items():
+        new = current.get("escenarios", {}).get(name)
+        if new is None:
+            continue
+        old_stages = {s["etapa"]: s for s in old["etapas"]}
+        for stage in new["etapas"]:
+            before = old_stages.get(stage["etapa"])
+            if before and stage["prompt_tokens"] > before["prompt_tokens"] * (1 + tolerance):
+                regressions.append(
+                    f"{name}/{stage['etapa']}: prompt {before['prompt_tokens']} → {stage['prompt_tokens']} tokens"
+                )
+        for key in ("sobrecoste_s", "cpu_propio_s"):
+            if new[key] > old[key] * (1 + 2 * tolerance) and new[key] - old[key] >= MIN_TIME_DELTA:
+                regressions.append(f"{name}: {key} {old[key]:.3f} → {new[key]:.3f}")
+    return regressions
@@ -0,0 +1,164 @@
+"""
+Generación de varios diseños candidatos y puntuación local.
+
+El análisis y la investigación se hacen una sola vez; después se lanzan N
+diseños en paralelo con temperaturas distintas (o con el modelo más barato
+configurado para ``candidate``) y un puntuador sin LLM elige el mejor:
+
+- cobertura: estudiantes del aula con adaptación (o al menos mencionados),
+- secciones: apartados de ``PlantillaActividad`` con contenido,
+- estrategias: estrategias base de ``NEUROTIPOS_INFO`` de los neurotipos del aula,
+- agrupación: grupos del tamaño pedido en la solicitud.
+"""
+
+import copy
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence
+
+from agents.classroom import TYPICAL, neurotype_of
+from agents.grouping import group_size_from_request, group_sizes
+from agents.retrieval import tokenize
+from agents.structured import RENDER_GROUPS, StructuredResult
+from templates.activity_template import NEUROTIPOS_INFO
+
+# Temperaturas de los candidatos, en orden (el primero usa la del diseñador)
+CANDIDATE_TEMPERATURES = (None, 0.9, 0.5, 1.0, 0.3, 1.2)
+MAX_CANDIDATES = len(CANDIDATE_TEMPERATURES)
+
+WEIGHTS = {"cobertura": 0.35, "secciones": 0.25, "estrategias": 0.2, "agrupacion": 0.2}
+
+# Bloques que pide el prompt del diseñador y palabras que los delatan en un encabezado
+MARKDOWN_SECTIONS = (
+    ("información general", ("informacion general", "descripcion")),
+    ("objetivos", ("objetivo",)),
+    ("fases", ("fase",)),
+    ("asignación", ("asignacion", "agrupacion", "grupos", "parejas")),
+    ("materiales", ("material", "recurso")),
+    ("evaluación", ("evaluacion", "rubrica")),
+)
+_HEADING_RE = re.compile(r"^\s*(#{1,6}\s+.+|\*\*[^*]+\*\*:?\s*|[A-ZÁÉÍÓÚÑ0-9. ]{4,}:?)\s*$", re.MULTILINE)
+_GROUP_LINE_RE = re.compile(r"\b(grupo|pareja|equipo|trío|trio)\b", re.IGNORECASE)
+
+
+@dataclass
+class CandidateScore:
+    """Puntuación de un diseño candidato (de 0 a 1 en cada criterio)"""
+    indice: int
+    modelo: str
+    temperatura: Optional[float]
+    cobertura: float
+    secciones: float
+    estrategias: float
+    agrupacion: float
+    faltan: List[str] = field(default_factory=list)
+
+    @property
+    def total(self) -> float:
+        return round(sum(getattr(self, name) * weight for name, weight in WEIGHTS.items()), 4)
+
+
+def variant_llm(llm: Any, temperature: Optional[float]) -> Any:
+    """Copia del LLM con otra temperatura (atraviesa la caché y los niveles de la cascada)"""
+    if temperature is None:
+        return llm
+    inner = getattr(llm, "inner", None)
+    tiers = getattr(llm, "tiers", None)
+    variant = copy.copy(llm)
+    if inner is not None:
+        variant.inner = variant_llm(inner, temperature)
+    if tiers is not None:
+        variant.tiers = [(name, variant_llm(tier_llm, temperature)) for name, tier_llm in tiers]
+    variant.temperature = temperature
+    return variant
+
+
+def _folded(text: str) -> str:
+    return " ".join(tokenize(text))
+
+
+def mentions(text: str, student: dict) -> bool:
+    sid = str(student.get("id", ""))
+    name = student.get("nombre", "")
+    return bool((sid and re.search(rf"(?<![\w-]){re.escape(sid)}(?![\w-])", text))
+                or (name and name in text))
+
+
+def coverage(text: str, students: Sequence[dict], structure: Optional[StructuredResult] = None):
+    """Fracción de estudiantes atendidos y los ids que faltan
+
+    Con plantilla cuenta tener una adaptación en alguna tarea; sin ella,
+    aparecer en el diseño por id o por nombre.
+    """
+    if not students:
+        return 1.0, []
+    if structure is not None:
+        adapted = {ad.estudiante_id for fase in structure.actividad.fases for tarea in fase.tareas
+                   for ad in tarea.adaptaciones_por_estudiante}
+        missing = [str(s.get("id")) for s in students if str(s.get("id")) not in adapted]
+    else:
+        missing = [str(s.get("id")) for s in students if not mentions(text, s)]
+    return 1 - len(missing) / len(students), missing
+
+
+def section_score(text: str, structure: Optional[StructuredResult] = None) -> float:
+    """Fracción de apartados de la plantilla con contenido"""
+    if structure is not None:
+        data = structure.actividad.model_dump()
+        filled = sum(1 for _, fields in RENDER_GROUPS if any(data.get(name) for name in fields))
+        return filled / len(RENDER_GROUPS)
+    headings = " ".join(_folded(h) for h in _HEADING_RE.findall(text))
+    found = sum(1 for _, words in MARKDOWN_SECTIONS if any(_folded(w) in headings for w in words))
+    return found / len(MARKDOWN_SECTIONS)
+
+
+def strategy_score(text: str, students: Sequence[dict]) -> float:
+    """Fracción de estrategias base de los neurotipos del aula presentes en el diseño"""
+    neurotypes = {neurotype_of(s.get("diagnostico_formal", "")) for s in students} - {TYPICAL}
+    strategies = [strategy for name in sorted(neurotypes) if name in NEUROTIPOS_INFO
+                  for strategy in NEUROTIPOS_INFO[name]["estrategias_base"]]
+    if not strategies:
+        return 1.0
+    tokens = set(tokenize(text))
+    found = sum(1 for strategy in strategies if set(tokenize(strategy)) <= tokens)
+    return found / len(strategies)
+
+
+def grouping_score(text: str, students: Sequence[dict], request: str,
+                   structure: Optional[StructuredResult] = None) -> float:
+    """Fracción de grupos con el tamaño pedido (o el que resulta de repartir el aula)"""
+    allowed = set(group_sizes(len(students), group_size_from_request(request))) if students else set()
+    if structure is not None:
+        sizes = [len(group.estudiantes) for group in structure.actividad.asignaciones_grupos]
+    else:
+        sizes = []
+        for line in text.splitlines():
+            if _GROUP_LINE_RE.search(line):
+                members = sum(1 for s in students if mentions(line, s))
+                if members:
+                    sizes.append(members)
+    if not sizes:
+        return 0.0
+    return sum(1 for size in sizes if size in allowed) / len(sizes)
+
+
+def score_candidate(index: int, text: str, students: Sequence[dict], request: str,
+                    structure: Optional[StructuredResult] = None, model: str = "",
+                    temperature: Optional[float] = None) -> CandidateScore:
+    """Puntúa un diseño sin llamar al modelo"""
+    covered, missing = coverage(text, students, structure)
+    return CandidateScore(
+        indice=index,
+        modelo=model,
+        temperatura=temperature,
+        cobertura=round(covered, 4),
+        secciones=round(section_score(text, structure), 4),
+        estrategias=round(strategy_score(text, students), 4),
+        agrupacion=round(grouping_score(text, students, request, structure), 4),
+        faltan=missing,
+    )
+
+
+def rank_candidates(scores: Sequence[CandidateScore]) -> List[CandidateScore]:
+    """De mejor a peor; a igual puntuación gana el primero generado"""
+    return sorted(scores, key=lambda score: (-score.total, score.indice))
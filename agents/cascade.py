@@ -0,0 +1,293 @@
+"""
+Cascada de modelos con escalado por confianza.
+
+Cada etapa llama primero al nivel más rápido de la cascada
+(``config/llm.json``, bloque ``cascada``). Un validador local decide si la
+respuesta se acepta o si el mismo prompt se repite con el nivel siguiente:
+
+- completitud: los apartados que pide la tarea (o la plantilla, si es JSON),
+- cobertura: adaptaciones para los estudiantes del aula en el diseño,
+- longitud: respuestas vacías o demasiado cortas.
+
+El último nivel se acepta siempre. Solo se validan las llamadas de las
+tareas (las que llevan mensaje de sistema); las reparaciones de la plantilla
+y demás llamadas directas se quedan en el primer nivel. Las llamadas,
+escalados y latencias por etapa y nivel se acumulan en ``CascadeStats`` y cada
+escalado se emite además como ``LLMEscalationEvent`` en el bus de CrewAI.
+"""
+
+import statistics
+import threading
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+from crewai.llms.base_llm import BaseLLM
+from crewai.utilities.events.base_events import BaseEvent
+from crewai.utilities.events.crewai_event_bus import crewai_event_bus
+
+from agents.candidates import coverage, section_score
+from agents.corpus import get_corpus
+from agents.refinement import END_MARK
+from agents.retrieval import tokenize
+from agents.structured import build_activity, extract_json
+
+# Motivo del rechazo, o None si la respuesta se acepta
+Validator = Callable[[str, str], Optional[str]]
+
+MIN_CHARS = {"analyst": 300, "researcher": 300, "designer": 800, "refinement": 80}
+# Temas que debe tocar la entrega de cada tarea (basta una palabra de cada grupo)
+TOPICS = {
+    "analyst": (("resumen", "solicitud", "tema"),
+                ("neurotipo", "tea", "tdah", "capacidades", "apoyo"),
+                ("recomendacion", "recomendamos", "diseño", "propuesta")),
+    "researcher": (("actividad", "proyecto"),
+                   ("estrategia", "adaptacion"),
+                   ("agrupacion", "grupo", "pareja", "equipo"),
+                   ("material", "recurso"),
+                   ("fase", "sesion", "dia")),
+}
+MIN_TOPICS = 0.75
+MIN_COVERAGE = 0.75
+MIN_SECTIONS = 0.5
+MAX_UNRESOLVED = 2
+LATENCY_WINDOW = 1000
+
+
+def _stems(words: Sequence[str]) -> set:
+    return {stem for word in words for stem in tokenize(word)}
+
+
+_TOPIC_STEMS = {agent: [_stems(group) for group in groups] for agent, groups in TOPICS.items()}
+
+
+def final_answer(text: str) -> str:
+    """Texto tras ``Final Answer:`` (o la respuesta entera)"""
+    return text.split("Final Answer:", 1)[-1].strip()
+
+
+def is_task_call(messages: Any) -> bool:
+    """Llamada del ejecutor de una tarea (con mensaje de sistema), no una reparación directa"""
+    return isinstance(messages, list) and any(m.get("role") == "system" for m in messages)
+
+
+def prompt_text(messages: Any) -> str:
+    if isinstance(messages, str):
+        return messages
+    return "\n".join(str(m.get("content", "")) for m in messages)
+
+
+def length_issue(agent: str, answer: str) -> Optional[str]:
+    if not answer:
+        return "respuesta vacía"
+    minimum = MIN_CHARS.get(agent, 0)
+    if len(answer) < minimum:
+        return f"respuesta demasiado corta ({len(answer)} caracteres)"
+    return None
+
+
+def topic_issue(agent: str, answer: str) -> Optional[str]:
+    groups = _TOPIC_STEMS.get(agent)
+    if not groups:
+        return None
+    tokens = set(tokenize(answer))
+    found = sum(1 for stems in groups if stems & tokens)
+    if found / len(groups) < MIN_TOPICS:
+        return f"faltan apartados ({found} de {len(groups)})"
+    return None
+
+
+def text_validator(agent: str) -> Validator:
+    """Longitud y apartados de una entrega en texto libre (análisis, investigación)"""
+    def validate(prompt: str, answer: str) -> Optional[str]:
+        return length_issue(agent, answer) or topic_issue(agent, answer)
+    return validate
+
+
+def design_issue(prompt: str, answer: str) -> Optional[str]:
+    """Plantilla completa (o apartados del markdown) y adaptaciones para el aula"""
+    issue = length_issue("designer", answer)
+    if issue:
+        return issue
+    try:
+        students = get_corpus().students()
+    except Exception:
+        students = []
+    data = extract_json(answer)
+    if isinstance(data, dict):
+        structure = build_activity(data)
+        if len(structure.sin_resolver) > MAX_UNRESOLVED:
+            return f"plantilla incompleta ({len(structure.sin_resolver)} partes sin validar)"
+        covered, missing = coverage(answer, students, structure)
+    elif "FORMATO DE SALIDA" in prompt:
+        return "la respuesta no es JSON válido"
+    else:
+        if section_score(answer) < MIN_SECTIONS:
+            return "faltan apartados de la actividad"
+        covered, missing = coverage(answer, students)
+    if covered < MIN_COVERAGE:
+        return f"sin adaptación para {', '.join(missing)}"
+    return None
+
+
+def refinement_issue(prompt: str, answer: str) -> Optional[str]:
+    """Longitud y, si se piden secciones marcadas, que vengan sus marcadores"""
+    issue = length_issue("refinement", answer)
+    if issue:
+        return issue
+    if END_MARK in prompt and END_MARK not in answer:
+        return "faltan los marcadores de las secciones"
+    return None
+
+
+VALIDATORS: Dict[str, Validator] = {
+    "analyst": text_validator("analyst"),
+    "researcher": text_validator("researcher"),
+    "designer": design_issue,
+    "refinement": refinement_issue,
+}
+
+
+@dataclass
+class TierStats:
+    """Llamadas, escalados y latencias de una etapa en un nivel"""
+    llamadas: int = 0
+    escaladas: int = 0
+    latencias: Deque[float] = field(default_factory=lambda: deque(maxlen=LATENCY_WINDOW))
+    motivos: Counter = field(default_factory=Counter)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.latencias:
+            return None
+        values = sorted(self.latencias)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class CascadeStats:
+    """Contadores de la cascada por (etapa, nivel), seguros entre hilos"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[Tuple[str, str], TierStats] = {}
+
+    def record(self, agent: str, tier: str, seconds: float, reason: Optional[str] = None):
+        with self._lock:
+            stats = self._stats.setdefault((agent, tier), TierStats())
+            stats.llamadas += 1
+            stats.latencias.append(seconds)
+            if reason is not None:
+                stats.escaladas += 1
+                stats.motivos[reason.split(" (", 1)[0].split(" para ", 1)[0]] += 1
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """Una fila por etapa y nivel: llamadas, tasa de escalado y latencias p50/p95"""
+        with self._lock:
+            items = sorted(self._stats.items())
+            return [{
+                "agente": agent,
+                "nivel": tier,
+                "llamadas": stats.llamadas,
+                "escaladas": stats.escaladas,
+                "tasa_escalado": round(stats.escaladas / stats.llamadas, 3),
+                "p50_ms": round(statistics.median(stats.latencias) * 1000, 1),
+                "p95_ms": round(stats.percentile(0.95) * 1000, 1),
+                "motivos": dict(stats.motivos),
+            } for (agent, tier), stats in items]
+
+    def escalations(self) -> int:
+        with self._lock:
+            return sum(stats.escaladas for stats in self._stats.values())
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+class LLMEscalationEvent(BaseEvent):
+    """Respuesta de un nivel rechazada por el validador; el prompt pasa al siguiente"""
+    type: str = "ia4edu_llm_escalation"
+    agent: str
+    tier: str
+    next_tier: str
+    reason: str
+
+
+class CascadeLLM(BaseLLM):
+    """LLM de CrewAI que prueba los niveles de menor a mayor hasta que el validador acepta"""
+
+    def __init__(self, agent: str, tiers: Sequence[Tuple[str, BaseLLM]],
+                 validator: Optional[Validator] = None, stats: Optional["CascadeStats"] = None):
+        self.agent = agent
+        self.tiers = list(tiers)
+        self.validator = validator or VALIDATORS.get(agent) or (lambda prompt, answer: None)
+        self.stats = stats if stats is not None else get_cascade_stats()
+        first = self.tiers[0][1]
+        super().__init__(model=first.model, temperature=getattr(first, "temperature", None))
+
+    @property
+    def stop(self) -> Optional[List[str]]:
+        return self.tiers[0][1].stop
+
+    @stop.setter
+    def stop(self, value: Optional[List[str]]):
+        # CrewAI fija aquí las palabras de parada; deben llegar a todos los niveles
+        for _, llm in getattr(self, "tiers", []):
+            llm.stop = value
+
+    @property
+    def stream(self) -> bool:
+        return bool(getattr(self.tiers[0][1], "stream", False))
+
+    @stream.setter
+    def stream(self, value: bool):
+        for _, llm in self.tiers:
+            llm.stream = value
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        validate = not tools and not available_functions and is_task_call(messages)
+        last = len(self.tiers) - 1
+        for index, (tier, llm) in enumerate(self.tiers):
+            start = time.perf_counter()
+            response = llm.call(messages, tools, callbacks, available_functions, **kwargs)
+            reason = None
+            if validate and index < last:
+                text = response if isinstance(response, str) else str(response)
+                reason = self.validator(prompt_text(messages), final_answer(text))
+            self.stats.record(self.agent, tier, time.perf_counter() - start, reason)
+            if reason is None:
+                return response
+            crewai_event_bus.emit(self, LLMEscalationEvent(
+                agent=self.agent, tier=tier, next_tier=self.tiers[index + 1][0], reason=reason
+            ))
+        return response
+
+    def supports_stop_words(self) -> bool:
+        return self.tiers[0][1].supports_stop_words()
+
+    def supports_function_calling(self) -> bool:
+        return getattr(self.tiers[0][1], "supports_function_calling", lambda: False)()
+
+    def get_context_window_size(self) -> int:
+        return min(llm.get_context_window_size() for _, llm in self.tiers)
+
+
+def stage_llm(registry: Any, agent: str) -> BaseLLM:
+    """LLM del agente: la cascada de niveles si está configurada; si no, su modelo fijo"""
+    tiers = registry.config.cascade_for(agent)
+    if len(tiers) < 2:
+        return registry.llm_for(agent)
+    return CascadeLLM(agent, [(tier, registry.llm_for_tier(tier)) for tier in tiers])
+
+
+_shared_stats: Optional[CascadeStats] = None
+_shared_lock = threading.Lock()
+
+
+def get_cascade_stats() -> CascadeStats:
+    """Estadísticas compartidas del proceso"""
+    global _shared_stats
+    with _shared_lock:
+        if _shared_stats is None:
+            _shared_stats = CascadeStats()
+        return _shared_stats
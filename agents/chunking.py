@@ -0,0 +1,209 @@
+"""
+Troceado de las actividades markdown en secciones direccionables.
+
+Cada actividad se divide por encabezados (``##``, ``###``...) en secciones con
+metadatos (ruta de encabezados, tipo, líneas, tokens). El investigador recibe
+solo las secciones mejor puntuadas dentro de un presupuesto de tokens en vez
+de un prefijo ciego o el fichero completo.
+"""
+
+import re
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from agents.corpus import ActivityCorpus, ActivityDocument, get_corpus
+from agents.retrieval import BM25Index, fold_accents
+from agents.tokens import estimate_tokens
+
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+
+# Prefijos de palabra (sin tildes) que determinan el tipo de sección; un
+# espacio final exige la palabra completa
+SECTION_KINDS = (
+    ("adaptaciones", ("adaptacion", "apoyo", "neurotipo", "tea ", "tdah", "altas capacidades")),
+    ("evaluacion", ("evaluacion", "rubrica", "criterio")),
+    ("objetivos", ("objetivo",)),
+    ("materiales", ("material", "recurso")),
+    ("agrupacion", ("reparto", "asignacion", "grupo", "pareja", "rol ", "roles ")),
+    ("desarrollo", ("desarrollo", "tarea", "fase", "dinamica", "proceso", "estructura")),
+    ("dia", ("lunes", "martes", "miercoles", "jueves", "viernes", "sesion", "dia ")),
+)
+
+
+@dataclass(frozen=True)
+class ActivitySection:
+    """Sección de una actividad delimitada por un encabezado"""
+    section_id: str
+    archivo: str
+    actividad: str
+    titulo: str
+    ruta: Tuple[str, ...]
+    nivel: int
+    tipo: str
+    texto: str
+    linea_inicio: int
+    tokens: int
+
+    @property
+    def breadcrumb(self) -> str:
+        """Ruta de encabezados legible (Día › Subsección)"""
+        return " › ".join(self.ruta)
+
+
+def _slug(text: str) -> str:
+    return re.sub(r"[^a-z0-9ñ]+", "-", fold_accents(text)).strip("-")
+
+
+def section_kinds(text: str) -> List[str]:
+    """Tipos de sección cuyas palabras clave aparecen en el texto, en orden de prioridad"""
+    folded = " " + " ".join(re.findall(r"[a-z0-9ñ]+", fold_accents(text))) + " "
+    return [
+        kind for kind, keywords in SECTION_KINDS
+        if any(" " + keyword in folded for keyword in keywords)
+    ]
+
+
+def classify_section(ruta: Iterable[str]) -> str:
+    """Tipo de sección a partir de su ruta de encabezados (del más específico al general)"""
+    for heading in reversed(list(ruta)):
+        kinds = section_kinds(heading)
+        if kinds:
+            return kinds[0]
+    return "general"
+
+
+def chunk_markdown(text: str, archivo: str, actividad: str, max_level: int = 3) -> List[ActivitySection]:
+    """Divide un markdown en secciones por encabezados de nivel <= max_level
+
+    Los encabezados más profundos quedan dentro de su sección padre y las
+    secciones sin cuerpo propio solo aportan su título a la ruta de sus hijas.
+    """
+    lines = text.splitlines()
+    sections: List[ActivitySection] = []
+    stack: List[Tuple[int, str]] = []
+    current: Optional[Tuple[int, int, str]] = None  # (nivel, línea inicio, título)
+    body: List[str] = []
+    used_ids: Dict[str, int] = {}
+
+    def flush():
+        if current is None:
+            content = "\n".join(body).strip()
+            if not content:
+                return
+            level, start, title, ruta = 0, 1, "Preámbulo", ("Preámbulo",)
+        else:
+            level, start, title = current
+            # El título de nivel 1 es el del documento y no aporta a la ruta
+            ruta = tuple(heading for lvl, heading in stack if lvl > 1) or (title,)
+            if not "\n".join(body[1:]).strip():
+                return
+            content = "\n".join(body).strip()
+        base_id = f"{archivo}#{_slug('/'.join(ruta)) or 'seccion'}"
+        count = used_ids.get(base_id, 0)
+        used_ids[base_id] = count + 1
+        section_id = base_id if count == 0 else f"{base_id}-{count + 1}"
+        sections.append(ActivitySection(
+            section_id=section_id,
+            archivo=archivo,
+            actividad=actividad,
+            titulo=title,
+            ruta=ruta,
+            nivel=level,
+            tipo=classify_section(ruta),
+            texto=content,
+            linea_inicio=start,
+            tokens=estimate_tokens(content),
+        ))
+
+    for line_no, line in enumerate(lines, 1):
+        match = _HEADING_RE.match(line)
+        if match and len(match.group(1)) <= max_level:
+            flush()
+            level, title = len(match.group(1)), match.group(2)
+            while stack and stack[-1][0] >= level:
+                stack.pop()
+            stack.append((level, title))
+            current = (level, line_no, title)
+            body = [line]
+        else:
+            body.append(line)
+    flush()
+    return sections
+
+
+def chunk_activity(activity: ActivityDocument, max_level: int = 3) -> List[ActivitySection]:
+    """Secciones de una actividad de la biblioteca"""
+    return chunk_markdown(activity.contenido, activity.archivo, activity.nombre, max_level)
+
+
+class SectionIndex:
+    """Secciones de toda la biblioteca con un índice BM25 propio"""
+
+    def __init__(self, sections: List[ActivitySection]):
+        self.sections = {section.section_id: section for section in sections}
+        self.index = BM25Index.build(
+            (section.section_id, f"{section.actividad}\n{section.breadcrumb}\n{section.texto}")
+            for section in sections
+        )
+
+    def search(self, query: str, k: int = 10,
+               boost: Optional[Dict[str, float]] = None) -> List[Tuple[ActivitySection, float]]:
+        """Secciones mejor puntuadas; ``boost`` multiplica la puntuación por archivo"""
+        boost = boost or {}
+        depth = k * 3 if boost else k
+        results = []
+        for hit in self.index.search(query, depth):
+            section = self.sections[hit.doc_id]
+            results.append((section, hit.score * boost.get(section.archivo, 1.0)))
+        results.sort(key=lambda item: item[1], reverse=True)
+        return results[:k]
+
+
+_section_cache: Dict[int, Tuple[str, SectionIndex]] = {}
+_section_lock = threading.Lock()
+
+
+def get_section_index(corpus: Optional[ActivityCorpus] = None) -> SectionIndex:
+    """Índice de secciones de la biblioteca, reconstruido solo cuando cambia el corpus"""
+    corpus = corpus or get_corpus()
+    version = corpus.version()
+    with _section_lock:
+        cached = _section_cache.get(id(corpus))
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        sections: List[ActivitySection] = []
+        for activity in corpus.activities():
+            sections.extend(chunk_activity(activity))
+        index = SectionIndex(sections)
+        _section_cache[id(corpus)] = (version, index)
+        return index
+
+
+def select_sections(query: str, token_budget: int, corpus: Optional[ActivityCorpus] = None,
+                    boost: Optional[Dict[str, float]] = None,
+                    candidates: int = 30) -> List[ActivitySection]:
+    """Elige las secciones mejor puntuadas que caben en el presupuesto de tokens
+
+    Se devuelven agrupadas por actividad y en el orden del documento original.
+    """
+    chosen: List[ActivitySection] = []
+    used = 0
+    for section, _ in get_section_index(corpus).search(query, candidates, boost):
+        if used + section.tokens > token_budget:
+            continue
+        chosen.append(section)
+        used += section.tokens
+    order: Dict[str, int] = {}
+    for i, section in enumerate(chosen):
+        order.setdefault(section.archivo, i)
+    chosen.sort(key=lambda s: (order[s.archivo], s.linea_inicio))
+    return chosen
+
+
+def render_sections(sections: List[ActivitySection]) -> str:
+    """Texto de las secciones para el prompt, con su actividad y ruta de origen"""
+    parts = []
+    for section in sections:
+        parts.append(f"--- {section.actividad} › {section.breadcrumb} ({section.archivo}) ---\n{section.texto}")
+    return "\n\n".join(parts)
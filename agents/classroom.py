@@ -0,0 +1,195 @@
+"""
+Resumen precalculado del aula.
+
+El perfil del aula (neurotipos, fortalezas y apoyos de cada estudiante y
+competencias por reforzar) no depende de la solicitud, así que se calcula de
+forma determinista a partir de los perfiles y de ``NEUROTIPOS_INFO`` una sola
+vez por contenido del fichero de perfiles. El analista recibe este resumen y
+solo tiene que razonar sobre la solicitud nueva.
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from agents.profiles import SUBJECTS, detect_subjects
+from templates.activity_template import NEUROTIPOS_INFO
+
+TYPICAL = "Típico"
+# Prefijos de ``diagnostico_formal`` y el neurotipo de NEUROTIPOS_INFO al que corresponden
+DIAGNOSIS_PREFIXES = (("tea", "TEA"), ("tdah", "TDAH"), ("altas_capacidades", "Altas_Capacidades"),
+                      ("ninguno", TYPICAL))
+
+# Niveles que cuentan como brecha y como dominio de una competencia
+GAP_LEVELS = ("INICIADO", "EN_PROCESO")
+MASTERY_LEVELS = ("CONSEGUIDO", "SUPERADO")
+LEVEL_CODES = {"INICIADO": "I", "EN_PROCESO": "P", "SUPERADO": "S"}
+
+# Resúmenes guardados (huella -> resumen); el aula casi nunca cambia
+MAX_CACHED_DIGESTS = 8
+
+
+def neurotype_of(diagnosis: str) -> str:
+    """Neurotipo de NEUROTIPOS_INFO para un ``diagnostico_formal``"""
+    value = (diagnosis or "ninguno").lower()
+    for prefix, neurotype in DIAGNOSIS_PREFIXES:
+        if value.startswith(prefix):
+            return neurotype
+    return diagnosis
+
+
+def profile_hash(students: Sequence[dict]) -> str:
+    """Huella del contenido de los perfiles (independiente del orden de las claves)"""
+    payload = json.dumps(list(students), ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+@dataclass
+class StudentDigest:
+    """Fortalezas y apoyos de un estudiante"""
+    id: str
+    nombre: str
+    neurotipo: str
+    apoyo: str
+    canal: str
+    intereses: List[str]
+    necesidades: List[str]
+    tolerancia_baja: bool
+    dominadas: Dict[str, List[str]]
+    por_reforzar: Dict[str, List[Tuple[str, str]]]
+
+
+@dataclass
+class ClassroomDigest:
+    """Perfil del aula calculado sin LLM"""
+    huella: str
+    estudiantes: List[StudentDigest]
+    neurotipos: Dict[str, List[str]]
+    brechas: Dict[str, Dict[str, Dict[str, List[str]]]]
+    ampliacion: Dict[str, List[str]]
+    _rendered: Dict[tuple, str] = field(default_factory=dict, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @property
+    def total(self) -> int:
+        return len(self.estudiantes)
+
+    def neurotype_line(self) -> str:
+        """Recuento de neurotipos con los ids de cada uno"""
+        return "; ".join(f"{name} {len(ids)} ({','.join(ids)})" for name, ids in self.neurotipos.items())
+
+    def render(self, subjects: Optional[Sequence[str]] = None, minimal: bool = False) -> str:
+        """Texto compacto para el prompt, limitado a las materias indicadas"""
+        subjects = tuple(s for s in SUBJECTS if subjects is None or s in subjects)
+        key = (subjects, minimal)
+        with self._lock:
+            if key not in self._rendered:
+                self._rendered[key] = self._render(subjects, minimal)
+            return self._rendered[key]
+
+    def render_for_request(self, request_text: str = "") -> List[str]:
+        """Variantes para el prompt (completa y mínima) con las materias de la solicitud"""
+        subjects = detect_subjects(request_text) if request_text else list(SUBJECTS)
+        return [self.render(subjects), self.render(subjects, minimal=True)]
+
+    def _render(self, subjects: Tuple[str, ...], minimal: bool) -> str:
+        lines = [f"AULA PRECALCULADA ({self.total} estudiantes, huella {self.huella[:8]})",
+                 f"Neurotipos: {self.neurotype_line()}"]
+        if not minimal:
+            for name in self.neurotipos:
+                info = NEUROTIPOS_INFO.get(name)
+                if info is None or name == TYPICAL:
+                    continue
+                lines.append(f"- {name}: fortalezas {', '.join(info['fortalezas_comunes'])}; "
+                             f"desafíos {', '.join(info['desafios_comunes'])}; "
+                             f"estrategias {', '.join(info['estrategias_base'])}")
+
+        lines.append("Estudiantes (fortalezas / apoyos):")
+        for student in self.estudiantes:
+            strengths = [f"domina {s}" for s in subjects if s in student.dominadas]
+            if not minimal:
+                strengths += student.intereses
+            supports = list(student.necesidades)
+            if student.tolerancia_baja:
+                supports.append("tolerancia a la frustración baja")
+            lines.append(f"- {student.id} {student.nombre} ({student.neurotipo}, apoyo {student.apoyo}, "
+                         f"{student.canal}): {', '.join(strengths) or '-'} / {', '.join(supports) or '-'}")
+
+        gaps = []
+        for subject in subjects:
+            for name, levels in self.brechas.get(subject, {}).items():
+                groups = " ".join(f"{LEVEL_CODES[level]} {','.join(ids)}" for level, ids in levels.items())
+                gaps.append(f"{subject}.{name}: {groups}")
+        lines.append("Competencias por reforzar (I=iniciado, P=en proceso): " + ("; ".join(gaps) or "ninguna"))
+        advanced = [f"{subject}: {','.join(self.ampliacion[subject])}" for subject in subjects
+                    if self.ampliacion.get(subject)]
+        if advanced:
+            lines.append("Necesitan ampliación (todo SUPERADO): " + "; ".join(advanced))
+        return "\n".join(lines)
+
+
+def build_digest(students: Sequence[dict]) -> ClassroomDigest:
+    """Calcula el resumen del aula a partir de los perfiles"""
+    digests, neurotypes = [], OrderedDict()
+    gaps: Dict[str, Dict[str, Dict[str, List[str]]]] = {}
+    advanced: Dict[str, List[str]] = {}
+    for student in students:
+        sid = str(student.get("id", ""))
+        neurotype = neurotype_of(student.get("diagnostico_formal", ""))
+        neurotypes.setdefault(neurotype, []).append(sid)
+        mastered, pending = {}, {}
+        for subject in SUBJECTS:
+            competencies = student.get(subject) or {}
+            if competencies and all(level in MASTERY_LEVELS for level in competencies.values()):
+                mastered[subject] = list(competencies)
+            if competencies and all(level == "SUPERADO" for level in competencies.values()):
+                advanced.setdefault(subject, []).append(sid)
+            for name, level in competencies.items():
+                if level in GAP_LEVELS:
+                    pending.setdefault(subject, []).append((name, level))
+                    by_level = gaps.setdefault(subject, {}).setdefault(name, {})
+                    by_level.setdefault(level, []).append(sid)
+        digests.append(StudentDigest(
+            id=sid,
+            nombre=student.get("nombre", ""),
+            neurotipo=neurotype,
+            apoyo=student.get("nivel_apoyo", ""),
+            canal=student.get("canal_preferido", ""),
+            intereses=list(student.get("intereses") or []),
+            necesidades=list(student.get("necesidades_especiales") or []),
+            tolerancia_baja=student.get("tolerancia_frustracion") == "baja",
+            dominadas=mastered,
+            por_reforzar=pending,
+        ))
+    # Los neurotipos con necesidades específicas primero, el típico al final
+    ordered = OrderedDict(sorted(neurotypes.items(), key=lambda item: (item[0] == TYPICAL, -len(item[1]))))
+    for subject in gaps:
+        for name, levels in gaps[subject].items():
+            gaps[subject][name] = {level: levels[level] for level in GAP_LEVELS if level in levels}
+    return ClassroomDigest(profile_hash(students), digests, ordered, gaps, advanced)
+
+
+_digests: "OrderedDict[str, ClassroomDigest]" = OrderedDict()
+_digests_lock = threading.Lock()
+
+
+def classroom_digest(students: Optional[Sequence[dict]] = None) -> ClassroomDigest:
+    """Resumen del aula, calculado una vez por huella de los perfiles"""
+    if students is None:
+        from agents.corpus import get_corpus
+        students = get_corpus().students()
+    key = profile_hash(students)
+    with _digests_lock:
+        digest = _digests.get(key)
+        if digest is not None:
+            _digests.move_to_end(key)
+            return digest
+    digest = build_digest(students)
+    with _digests_lock:
+        _digests[key] = digest
+        while len(_digests) > MAX_CACHED_DIGESTS:
+            _digests.popitem(last=False)
+    return digest
@@ -0,0 +1,270 @@
+"""
+Corpus compartido en memoria: perfiles de estudiantes y biblioteca de actividades.
+
+Los ficheros se leen una sola vez por proceso y se vuelven a cargar únicamente
+cuando cambia su mtime o su tamaño.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+DATA_DIR = "data"
+PROFILES_FILE = "perfiles_4_primaria.json"
+ACTIVITY_PATTERN = "k_*.md"
+
+# Directorio de artefactos locales regenerables (índices, cachés)
+CACHE_DIR = os.getenv("IA4EDU_CACHE_DIR", os.path.join(".cache", "ia4edu"))
+
+# Segundos entre comprobaciones de la biblioteca en el corpus compartido
+SHARED_CHECK_INTERVAL = 1.0
+
+# Longitudes de los resúmenes usados en la biblioteca
+SUMMARY_CHARS = 500
+PREVIEW_CHARS = 200
+
+
+def _file_signature(path: str) -> Tuple[int, int]:
+    """Firma barata de un fichero: (mtime en ns, tamaño)"""
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+
+@dataclass(frozen=True)
+class ActivityDocument:
+    """Actividad de la biblioteca ya leída de disco"""
+    nombre: str
+    archivo: str
+    contenido: str
+    signature: Tuple[int, int]
+
+    @property
+    def resumen(self) -> str:
+        """Resumen para el contexto inicial (primeros caracteres)"""
+        if len(self.contenido) > SUMMARY_CHARS:
+            return self.contenido[:SUMMARY_CHARS] + "..."
+        return self.contenido
+
+
+def activity_name_from_path(file_path: str) -> str:
+    """Extrae el nombre de la actividad del nombre del archivo"""
+    base = os.path.basename(file_path)
+    return base.replace("k_", "").replace(".md", "").replace("_", " ").title()
+
+
+class ActivityCorpus:
+    """Caché de perfiles y actividades invalidada por mtime/tamaño de fichero"""
+
+    def __init__(self, data_dir: str = DATA_DIR, profiles_file: str = PROFILES_FILE,
+                 check_interval: float = 0.0):
+        self.data_dir = data_dir
+        # Segundos durante los que no se vuelve a listar la biblioteca en disco
+        self.check_interval = check_interval
+        self.profiles_path = os.path.join(data_dir, profiles_file)
+        self._lock = threading.RLock()
+
+        self._profiles: Optional[dict] = None
+        self._profiles_json: Optional[str] = None
+        self._profiles_signature: Optional[tuple] = None
+
+        # Aula elegida en el repositorio de perfiles (None: el fichero de perfiles)
+        self.classroom: Optional[str] = None
+        self._profile_store = None
+        self._classroom_checked_at: Optional[float] = None
+
+        self._activities: Dict[str, ActivityDocument] = {}
+        self._activities_checked_at: Optional[float] = None
+        self._generation = 0
+        self._version: Optional[Tuple[tuple, str]] = None
+        self._library_text: Dict[bool, str] = {}
+        self._library_key: Optional[int] = None
+
+        # Ficheros sueltos pedidos por load_full_activity fuera de la biblioteca
+        self._files: Dict[str, Tuple[Tuple[int, int], str]] = {}
+
+    # ------------------------------------------------------------------
+    # Perfiles
+    # ------------------------------------------------------------------
+    def profile_store(self):
+        """Repositorio indexado de aulas del directorio de datos (se abre al primer uso)"""
+        with self._lock:
+            if self._profile_store is None:
+                from agents.profile_store import ProfileStore
+                self._profile_store = ProfileStore(self.data_dir)
+            return self._profile_store
+
+    def select_classroom(self, classroom: Optional[str]):
+        """Elige el aula cuyos perfiles se usan (lanza ValueError si no existe)"""
+        from agents.profile_store import classroom_id_from_path
+        if classroom == classroom_id_from_path(self.profiles_path):
+            classroom = None
+        with self._lock:
+            if classroom is not None:
+                store = self.profile_store()
+                store.sync()
+                if store.classroom(classroom) is None:
+                    raise ValueError(f"No existe el aula {classroom}")
+                self._classroom_checked_at = time.monotonic()
+            self.classroom = classroom
+            self._profiles_signature = None
+
+    def _refresh_classroom(self):
+        store = self.profile_store()
+        now = time.monotonic()
+        if (self._classroom_checked_at is None
+                or now - self._classroom_checked_at >= self.check_interval):
+            store.sync()
+            self._classroom_checked_at = now
+        signature = store.signature(self.classroom)
+        if signature is None:
+            raise ValueError(f"No existe el aula {self.classroom}")
+        signature = (self.classroom, *signature)
+        if signature != self._profiles_signature:
+            data = {"aula": self.classroom, "estudiantes": store.students(self.classroom)}
+            self._profiles = data
+            self._profiles_json = json.dumps(data, ensure_ascii=False, indent=2)
+            self._profiles_signature = signature
+
+    def _refresh_profiles(self):
+        if self.classroom is not None:
+            self._refresh_classroom()
+            return
+        signature = _file_signature(self.profiles_path)
+        if signature != self._profiles_signature:
+            with open(self.profiles_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._profiles = data
+            self._profiles_json = json.dumps(data, ensure_ascii=False, indent=2)
+            self._profiles_signature = signature
+
+    def profiles(self) -> dict:
+        """Perfiles ya parseados (no modificar el objeto devuelto)"""
+        with self._lock:
+            self._refresh_profiles()
+            return self._profiles
+
+    def profiles_json(self) -> str:
+        """Perfiles serializados con indent=2, tal y como se envían en los prompts"""
+        with self._lock:
+            self._refresh_profiles()
+            return self._profiles_json
+
+    def students(self) -> List[dict]:
+        """Lista de estudiantes del aula"""
+        return self.profiles().get("estudiantes", [])
+
+    # ------------------------------------------------------------------
+    # Biblioteca de actividades
+    # ------------------------------------------------------------------
+    def _refresh_activities(self):
+        now = time.monotonic()
+        if (self._activities_checked_at is not None
+                and now - self._activities_checked_at < self.check_interval):
+            return
+        self._activities_checked_at = now
+        paths = sorted(glob.glob(os.path.join(self.data_dir, ACTIVITY_PATTERN)))
+        current: Dict[str, ActivityDocument] = {}
+        changed = len(paths) != len(self._activities)
+        for file_path in paths:
+            signature = _file_signature(file_path)
+            cached = self._activities.get(file_path)
+            if cached is not None and cached.signature == signature:
+                current[file_path] = cached
+                continue
+            changed = True
+            with open(file_path, "r", encoding="utf-8") as f:
+                content = f.read()
+            current[file_path] = ActivityDocument(
+                nombre=activity_name_from_path(file_path),
+                archivo=file_path,
+                contenido=content,
+                signature=signature,
+            )
+        if changed:
+            self._activities = current
+            self._generation += 1
+
+    def activities(self) -> List[ActivityDocument]:
+        """Actividades de la biblioteca ordenadas por ruta"""
+        with self._lock:
+            self._refresh_activities()
+            return list(self._activities.values())
+
+    def activity(self, file_path: str) -> Optional[ActivityDocument]:
+        """Actividad de la biblioteca por ruta, o None si no existe"""
+        with self._lock:
+            self._refresh_activities()
+            return self._activities.get(file_path)
+
+    def library_summary(self, previews: bool = True) -> str:
+        """Texto de la biblioteca con nombre, archivo y (opcional) resumen de cada actividad"""
+        with self._lock:
+            self._refresh_activities()
+            if self._library_key != self._generation:
+                self._library_text = {}
+                self._library_key = self._generation
+            if previews not in self._library_text:
+                result = "BIBLIOTECA DE ACTIVIDADES DISPONIBLES:\n\n"
+                for i, activity in enumerate(self._activities.values(), 1):
+                    result += f"{i}. {activity.nombre}\n"
+                    result += f"   Archivo: {activity.archivo}\n"
+                    if previews:
+                        result += f"   Resumen: {activity.resumen[:PREVIEW_CHARS]}...\n"
+                    result += "\n"
+                self._library_text[previews] = result
+            return self._library_text[previews]
+
+    def full_activity(self, file_path: str) -> str:
+        """Contenido completo de una actividad (lanza OSError si no existe)"""
+        with self._lock:
+            signature = _file_signature(file_path)
+            doc = self._activities.get(file_path)
+            if doc is not None and doc.signature == signature:
+                return doc.contenido
+            cached = self._files.get(file_path)
+            if cached is not None and cached[0] == signature:
+                return cached[1]
+            with open(file_path, "r", encoding="utf-8") as f:
+                content = f.read()
+            self._files[file_path] = (signature, content)
+            return content
+
+    # ------------------------------------------------------------------
+    # Versión
+    # ------------------------------------------------------------------
+    def version(self) -> str:
+        """Huella del estado actual del corpus (cambia si cambia cualquier fichero)"""
+        with self._lock:
+            self._refresh_activities()
+            try:
+                self._refresh_profiles()
+            except (OSError, ValueError):
+                self._profiles_signature = None
+            key = (self._profiles_signature, self._generation)
+            if self._version is None or self._version[0] != key:
+                h = hashlib.sha1()
+                h.update(repr((self.profiles_path, self._profiles_signature)).encode())
+                for path, doc in self._activities.items():
+                    h.update(repr((path, doc.signature)).encode())
+                self._version = (key, h.hexdigest()[:16])
+            return self._version[1]
+
+
+_corpora: Dict[Tuple[str, str], ActivityCorpus] = {}
+_corpora_lock = threading.Lock()
+
+
+def get_corpus(data_dir: str = DATA_DIR, profiles_file: str = PROFILES_FILE) -> ActivityCorpus:
+    """Devuelve el corpus compartido del proceso para ese directorio de datos"""
+    key = (data_dir, profiles_file)
+    with _corpora_lock:
+        corpus = _corpora.get(key)
+        if corpus is None:
+            corpus = ActivityCorpus(data_dir, profiles_file, SHARED_CHECK_INTERVAL)
+            _corpora[key] = corpus
+        return corpus
@@ -0,0 +1,284 @@
+"""
+Validador local de cobertura y regeneración dirigida de los huecos.
+
+El prompt del diseñador pide adaptaciones específicas para cada estudiante,
+pero nada comprobaba que llegaran. Tras el diseño se revisa en local (sin
+LLM, en milisegundos):
+
+- estudiantes del aula sin ninguna adaptación,
+- neurotipos del aula que no aparecen en ninguna adaptación ni estrategia,
+- fases vacías (sin tareas o sin instrucciones),
+- apartados de evaluación vacíos.
+
+Cada tipo de hueco se completa con una llamada pequeña y directa al LLM del
+diseñador (sin crew), con solo el contexto necesario, y las llamadas van en
+paralelo. Con la plantilla JSON los valores se insertan en su ruta y se
+vuelven a validar; en texto libre se añaden al final del diseño.
+"""
+
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Sequence, Tuple
+
+from agents.candidates import mentions
+from agents.classroom import TYPICAL, StudentDigest, classroom_digest
+from agents.retrieval import fold_accents
+from agents.structured import (
+    StructuredResult, build_activity, extract_json, get_path, schema_text, set_path, skeleton
+)
+from templates.activity_template import AdaptacionEstudiante, PlantillaActividad
+
+EVALUATION_FIELDS = ("criterios_evaluacion_generales", "rubrica_inclusion", "estrategias_evaluacion_adaptadas")
+GAP_WORKERS = 4
+_PHASE_HEADING_RE = re.compile(r"^\s*(?:#{1,6}\s*|\*\*)?\s*fase\b", re.IGNORECASE | re.MULTILINE)
+_EVALUATION_HEADING_RE = re.compile(r"^\s*(?:#{1,6}\s*|\*\*)?\s*(?:\d+\.\s*)?evaluaci[oó]n\b",
+                                    re.IGNORECASE | re.MULTILINE)
+
+# Llamada directa al modelo: prompt -> respuesta
+Generator = Callable[[str], str]
+
+
+@dataclass
+class CoverageReport:
+    """Huecos encontrados en un diseño"""
+    estudiantes: List[str] = field(default_factory=list)
+    neurotipos: List[str] = field(default_factory=list)
+    fases: List[str] = field(default_factory=list)
+    evaluacion: List[str] = field(default_factory=list)
+
+    @property
+    def completo(self) -> bool:
+        return not (self.estudiantes or self.neurotipos or self.fases or self.evaluacion)
+
+    def summary(self) -> str:
+        parts = []
+        if self.estudiantes:
+            parts.append(f"estudiantes {', '.join(self.estudiantes)}")
+        if self.neurotipos:
+            parts.append(f"neurotipos {', '.join(self.neurotipos)}")
+        if self.fases:
+            parts.append(f"fases {', '.join(self.fases)}")
+        if self.evaluacion:
+            parts.append(f"evaluación ({', '.join(self.evaluacion)})")
+        return "; ".join(parts) or "nada"
+
+
+@dataclass
+class CoverageOutcome:
+    """Huecos antes y después de completarlos y llamadas hechas"""
+    antes: CoverageReport
+    despues: CoverageReport
+    llamadas: int = 0
+
+
+def _folded(text: str) -> str:
+    return fold_accents(text.lower()).replace("_", " ")
+
+
+def classroom_neurotypes(digest) -> List[str]:
+    """Neurotipos del aula que necesitan adaptaciones propias"""
+    return [name for name in digest.neurotipos if name != TYPICAL]
+
+
+def _neurotype_in(name: str, texts: Sequence[str]) -> bool:
+    target = _folded(name)
+    return any(target in _folded(text) for text in texts)
+
+
+def check_activity(activity: PlantillaActividad, students: Sequence[dict]) -> CoverageReport:
+    """Huecos de una actividad validada contra la plantilla"""
+    digest = classroom_digest(students)
+    adaptations = [ad for fase in activity.fases for tarea in fase.tareas for ad in tarea.adaptaciones_por_estudiante]
+    adapted = {ad.estudiante_id for ad in adaptations}
+    labels = [ad.neurotipo for ad in adaptations] + list(activity.adaptaciones_proactivas)
+    labels += [name for fase in activity.fases for name in fase.estrategias_adaptacion]
+    phases = ["fases"] if not activity.fases else [
+        f"fases[{i}]" for i, fase in enumerate(activity.fases)
+        if not fase.tareas or not any(tarea.instrucciones_paso_a_paso for tarea in fase.tareas)
+    ]
+    return CoverageReport(
+        estudiantes=[s.id for s in digest.estudiantes if s.id not in adapted],
+        neurotipos=[name for name in classroom_neurotypes(digest) if not _neurotype_in(name, labels)],
+        fases=phases,
+        evaluacion=[name for name in EVALUATION_FIELDS if not getattr(activity, name)],
+    )
+
+
+def check_markdown(text: str, students: Sequence[dict]) -> CoverageReport:
+    """Huecos de un diseño en texto libre (menciones y encabezados)"""
+    digest = classroom_digest(students)
+    return CoverageReport(
+        estudiantes=[s["id"] for s in students if not mentions(text, s)],
+        neurotipos=[name for name in classroom_neurotypes(digest) if not _neurotype_in(name, [text])],
+        fases=[] if _PHASE_HEADING_RE.search(text) else ["fases"],
+        evaluacion=[] if _EVALUATION_HEADING_RE.search(text) else ["evaluación"],
+    )
+
+
+def student_line(student: StudentDigest) -> str:
+    supports = list(student.necesidades) + (["tolerancia a la frustración baja"] if student.tolerancia_baja else [])
+    return (f"- {student.id} {student.nombre} ({student.neurotipo}, apoyo {student.apoyo}, {student.canal}): "
+            f"intereses {', '.join(student.intereses) or '-'}; apoyos {', '.join(supports) or '-'}")
+
+
+def _context(data: Dict[str, Any]) -> str:
+    return f'Actividad "{data.get("titulo", "")}": {data.get("descripcion_general", "")}'
+
+
+def adaptations_prompt(data: Dict[str, Any], students: Sequence[StudentDigest], neurotypes: Sequence[str]) -> str:
+    """Adaptaciones solo para los estudiantes y neurotipos que faltan"""
+    tasks = [f"- fases[{i}].tareas[{j}]: {tarea.get('nombre', '')} — {tarea.get('descripcion', '')}"
+             for i, fase in enumerate(data.get("fases", [])) for j, tarea in enumerate(fase.get("tareas", []))]
+    example = dict(skeleton(AdaptacionEstudiante), tarea="fases[0].tareas[0]")
+    proactive = ""
+    if neurotypes:
+        proactive = (f'\nAñade también "adaptaciones_proactivas" (neurotipo -> adaptación) para: '
+                     f'{", ".join(neurotypes)}.')
+    return f"""{_context(data)}
+
+Faltan adaptaciones específicas para estos estudiantes:
+{chr(10).join(student_line(s) for s in students) or "(ninguno)"}
+
+Tareas de la actividad:
+{chr(10).join(tasks) or "(sin tareas)"}
+
+Escribe una adaptación para cada estudiante listado en cada tarea, indicando en "tarea" su ruta.{proactive}
+Responde únicamente con este JSON:
+{json.dumps({"adaptaciones": [example], "adaptaciones_proactivas": {"neurotipo": "texto"}}, ensure_ascii=False)}"""
+
+
+def phase_prompt(data: Dict[str, Any], path: str) -> str:
+    """Tareas de una fase vacía"""
+    phase = get_path(data, path) if path != "fases" else None
+    target = f"{path}.tareas" if phase is not None else "fases"
+    described = f'la fase "{phase.get("nombre", "")}": {phase.get("descripcion", "")}' if phase else "la actividad"
+    return f"""{_context(data)}
+
+Completa {described}. Devuelve SOLO el valor de `{target}` con instrucciones paso a paso y adaptaciones
+por estudiante, siguiendo este esquema JSON (los valores son de ejemplo):
+{schema_text(target if phase is not None else "fases")}
+
+Responde únicamente con el JSON, sin texto adicional."""
+
+
+def evaluation_prompt(data: Dict[str, Any], fields: Sequence[str], neurotypes: Sequence[str]) -> str:
+    """Apartados de evaluación vacíos"""
+    schema = {name: skeleton(PlantillaActividad.model_fields[name].annotation) for name in fields}
+    return f"""{_context(data)}
+
+Faltan los apartados de evaluación {", ".join(fields)}. Las estrategias adaptadas son por neurotipo
+({", ".join(neurotypes) or "todos"}) y la rúbrica debe ser inclusiva.
+Responde únicamente con este JSON:
+{json.dumps(schema, ensure_ascii=False)}"""
+
+
+def llm_generator(llm: Any) -> Generator:
+    """Pregunta directamente al LLM del diseñador, sin lanzar un crew"""
+    def generate(prompt: str) -> str:
+        response = llm.call([{"role": "user", "content": prompt}])
+        text = response if isinstance(response, str) else str(response)
+        return text.split("Final Answer:", 1)[-1].strip()
+    return generate
+
+
+def _run(jobs: List[Tuple[str, Callable[[], Any]]]) -> Dict[str, Any]:
+    def safe(job):
+        try:
+            return job()
+        except Exception:
+            return None
+
+    if not jobs:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(GAP_WORKERS, len(jobs))) as pool:
+        results = list(pool.map(safe, [job for _, job in jobs]))
+    return {name: result for (name, _), result in zip(jobs, results)}
+
+
+def fill_structured_gaps(structure: StructuredResult, students: Sequence[dict],
+                         generate: Generator) -> Tuple[StructuredResult, CoverageOutcome]:
+    """Completa los huecos de la actividad con una llamada por tipo de hueco"""
+    before = check_activity(structure.actividad, students)
+    if before.completo:
+        return structure, CoverageOutcome(before, before)
+    digest = classroom_digest(students)
+    data = structure.actividad.model_dump()
+    missing = [s for s in digest.estudiantes if s.id in before.estudiantes]
+    by_id = {s.id: s for s in digest.estudiantes}
+
+    jobs: List[Tuple[str, Callable[[], Any]]] = []
+    if missing or before.neurotipos:
+        prompt = adaptations_prompt(data, missing, before.neurotipos)
+        jobs.append(("adaptaciones", lambda: extract_json(generate(prompt))))
+    for path in before.fases:
+        jobs.append((path, lambda path=path: extract_json(generate(phase_prompt(data, path)))))
+    if before.evaluacion:
+        prompt_eval = evaluation_prompt(data, before.evaluacion, classroom_neurotypes(digest))
+        jobs.append(("evaluacion", lambda: extract_json(generate(prompt_eval))))
+    results = _run(jobs)
+
+    for path in before.fases:
+        value = results.get(path)
+        if isinstance(value, list):
+            set_path(data, f"{path}.tareas" if path != "fases" else "fases", value)
+    generated = results.get("adaptaciones")
+    if isinstance(generated, dict):
+        for item in generated.get("adaptaciones") or []:
+            student = by_id.get(str(item.get("estudiante_id", ""))) if isinstance(item, dict) else None
+            tarea = get_path(data, str(item.get("tarea", ""))) if student else None
+            if not isinstance(tarea, dict) or "adaptaciones_por_estudiante" not in tarea:
+                continue
+            adaptation = {k: v for k, v in item.items() if k != "tarea"}
+            adaptation.update(estudiante_id=student.id, neurotipo=student.neurotipo)
+            tarea["adaptaciones_por_estudiante"].append(adaptation)
+        proactive = generated.get("adaptaciones_proactivas")
+        if isinstance(proactive, dict):
+            data["adaptaciones_proactivas"] = {**{str(k): str(v) for k, v in proactive.items()},
+                                               **data.get("adaptaciones_proactivas", {})}
+    evaluation = results.get("evaluacion")
+    if isinstance(evaluation, dict):
+        for name in before.evaluacion:
+            if evaluation.get(name):
+                data[name] = evaluation[name]
+
+    rebuilt = build_activity(data, max_rounds=0)
+    completed = StructuredResult(rebuilt.actividad, structure.reparados,
+                                 sorted(set(structure.sin_resolver) | set(rebuilt.sin_resolver)),
+                                 structure.llamadas_reparacion)
+    return completed, CoverageOutcome(before, check_activity(completed.actividad, students), len(jobs))
+
+
+def markdown_prompt(text: str, report: CoverageReport, students: Sequence[StudentDigest]) -> str:
+    """Solo las secciones que faltan en un diseño en texto libre"""
+    title = next((line.lstrip("# ").strip() for line in text.splitlines() if line.strip()), "")
+    asks = []
+    if students:
+        asks.append("Adaptaciones específicas para estos estudiantes en cada fase:\n"
+                    + "\n".join(student_line(s) for s in students))
+    if report.neurotipos:
+        asks.append(f"Adaptaciones proactivas para los neurotipos: {', '.join(report.neurotipos)}")
+    if report.fases:
+        asks.append("Fases de la actividad con sus tareas e instrucciones paso a paso")
+    if report.evaluacion:
+        asks.append("Evaluación: criterios generales, adaptaciones por neurotipo y rúbrica inclusiva")
+    return f"""La actividad "{title}" está incompleta. Escribe en markdown SOLO lo que falta, sin repetir
+lo que ya tiene:
+
+{chr(10).join(f"{i}. {ask}" for i, ask in enumerate(asks, 1))}
+
+Empieza cada bloque con un encabezado de nivel 2."""
+
+
+def fill_markdown_gaps(text: str, students: Sequence[dict], generate: Generator) -> Tuple[str, CoverageOutcome]:
+    """Añade al final del diseño las secciones que faltan (una sola llamada)"""
+    before = check_markdown(text, students)
+    if before.completo:
+        return text, CoverageOutcome(before, before)
+    digest = classroom_digest(students)
+    missing = [s for s in digest.estudiantes if s.id in before.estudiantes]
+    addition = _run([("texto", lambda: generate(markdown_prompt(text, before, missing)))]).get("texto")
+    if addition:
+        text = text.rstrip() + "\n\n" + addition.strip() + "\n"
+    return text, CoverageOutcome(before, check_markdown(text, students), 1)
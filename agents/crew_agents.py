@@ -1,67 +1,118 @@
+import asyncio
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from crewai import Agent, Task, Crew
-from langchain_community.chat_models import ChatLiteLLM
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 from pydantic import BaseModel
 
+from agents.candidates import (
+    CANDIDATE_TEMPERATURES, MAX_CANDIDATES, CandidateScore, rank_candidates, score_candidate, variant_llm
+)
+from agents.cascade import get_cascade_stats, stage_llm
+from agents.classroom import classroom_digest
+from agents.coverage import CoverageOutcome, fill_markdown_gaps, fill_structured_gaps, llm_generator
+from agents.corpus import get_corpus
+from agents.grouping import GroupingPlan, plan_groups
+from agents.llm_cache import LLMResponseCache, cached_llm, get_llm_cache
+from agents.llm_clients import LLMClientRegistry, get_llm_registry
+from agents.chunking import render_sections, select_sections
+from agents.profiles import profile_encodings
+from agents.refinement import (
+    CHANGES_MARK, END_MARK, SECTION_MARK, RefinementOutcome, RefinementPlan, plan_refinement,
+    students_for_feedback
+)
+from agents.streaming import enable_streaming, stage_aliases
+from agents.structured import (
+    StructuredResult, apply_units, build_activity, extract_json, llm_repairer, plan_units,
+    render_markdown, render_units, schema_text, units_schema
+)
+from agents.prompt_budget import BudgetReport, PromptComponent, fit_prompt, upstream_text, upstream_variants
+from agents.vector_index import hybrid_search_activities, semantic_search_activities
+
+# Secciones de la biblioteca que recibe el investigador: presupuestos de tokens
+# (de mayor a menor, para compactar), actividades candidatas y peso extra de
+# sus secciones
+RESEARCH_SECTION_TOKENS = (1500, 750, 300)
+RESEARCH_CANDIDATE_ACTIVITIES = 3
+RESEARCH_ACTIVITY_BOOST = 1.5
+
 def load_student_profiles() -> str:
     """Carga los perfiles de estudiantes"""
     try:
-        with open("data/perfiles_4_primaria.json", "r", encoding="utf-8") as f:
-            data = json.load(f)
-        return json.dumps(data, ensure_ascii=False, indent=2)
+        return get_corpus().profiles_json()
     except Exception as e:
         return f"Error cargando perfiles: {str(e)}"
 
-def load_activity_library() -> str:
+def load_activity_library(previews: bool = True) -> str:
     """Carga la biblioteca de actividades desde archivos .md"""
     try:
-        import glob
-        activities = []
-        
-        # Buscar todos los archivos k_*.md en la carpeta data
-        activity_files = glob.glob("data/k_*.md")
-        
-        for file_path in activity_files:
-            with open(file_path, "r", encoding="utf-8") as f:
-                content = f.read()
-                # Extraer el nombre de la actividad del nombre del archivo
-                activity_name = file_path.split("/")[-1].replace("k_", "").replace(".md", "").replace("_", " ").title()
-                
-                activities.append({
-                    "nombre": activity_name,
-                    "archivo": file_path,
-                    "contenido": content[:500] + "..." if len(content) > 500 else content  # Resumen para el contexto inicial
-                })
-        
-        # Formatear como texto legible
-        result = "BIBLIOTECA DE ACTIVIDADES DISPONIBLES:\n\n"
-        for i, activity in enumerate(activities, 1):
-            result += f"{i}. {activity['nombre']}\n"
-            result += f"   Archivo: {activity['archivo']}\n"
-            result += f"   Resumen: {activity['contenido'][:200]}...\n\n"
-        
-        return result
+        return get_corpus().library_summary(previews)
     except Exception as e:
         return f"Error cargando biblioteca: {str(e)}"
 
 def load_full_activity(file_path: str) -> str:
     """Carga el contenido completo de una actividad específica"""
     try:
-        with open(file_path, "r", encoding="utf-8") as f:
-            return f.read()
+        return get_corpus().full_activity(file_path)
     except Exception as e:
         return f"Error cargando actividad {file_path}: {str(e)}"
 
+def load_similar_activities(query: str, k: int = 3) -> str:
+    """Lista las actividades semánticamente más parecidas a la consulta"""
+    try:
+        result = ""
+        for activity, score in semantic_search_activities(query, k=k):
+            result += f"- {activity.nombre} ({activity.archivo}, similitud {score:.2f})\n"
+        return result or "Sin actividades similares\n"
+    except Exception as e:
+        return f"Error buscando actividades similares: {str(e)}"
+
+def classroom_size() -> int:
+    """Número de estudiantes del aula seleccionada"""
+    try:
+        return len(get_corpus().students())
+    except Exception:
+        return 0
+
+def classroom_variants(request_text: str = "") -> List[str]:
+    """Perfil precalculado del aula para el prompt, con las materias de la solicitud"""
+    try:
+        return classroom_digest().render_for_request(request_text)
+    except Exception as e:
+        return [f"Error cargando perfiles: {str(e)}"]
+
+def profile_variants(request_text: str = "") -> List[str]:
+    """Perfiles para el prompt en formato compacto, filtrados por la materia de la solicitud"""
+    try:
+        return profile_encodings(get_corpus().students(), request_text)
+    except Exception as e:
+        return [f"Error cargando perfiles: {str(e)}"]
+
+@dataclass
+class ResearchContext:
+    """Material de la biblioteca preparado para el prompt del investigador"""
+    query: str
+    section_variants: List[str]
+    library_variants: List[str]
+    similar: str
+
+def json_instructions() -> str:
+    """Instrucciones de salida JSON con el esquema compacto de PlantillaActividad"""
+    return f"""
+            
+            FORMATO DE SALIDA: devuelve la actividad como un único objeto JSON válido con exactamente
+            estas claves y tipos (los valores son de ejemplo; las fases, tareas, adaptaciones y grupos
+            se repiten tantas veces como haga falta):
+            {schema_text()}
+            No añadas texto fuera del JSON."""
+
 class AnalystAgent:
-    def __init__(self):
-        # Gemini para análisis básico usando litellm
-        self.llm = ChatLiteLLM(
-            model="gemini/gemini-1.5-flash",
-            api_key=os.getenv("GEMINI_API_KEY") or os.getenv("LLM_API_KEY"),
-            temperature=0.7
-        )
+    def __init__(self, llm_cache: Optional[LLMResponseCache] = None,
+                 registry: Optional[LLMClientRegistry] = None):
+        # Modelo para análisis básico según su nivel (o su cascada) en config/llm.json
+        self.llm = stage_llm(registry or get_llm_registry(), "analyst")
         self.agent = Agent(
             role='Analista Educativo',
             goal='Analizar la solicitud del profesor y el contexto del aula para entender las necesidades específicas de aprendizaje',
@@ -70,40 +121,44 @@ class AnalystAgent:
             desde el paradigma de adaptación de terreno.""",
             verbose=True,
             allow_delegation=False,
-            llm=self.llm
+            llm=cached_llm(self.llm, llm_cache)
         )
+        self.last_budget: Optional[BudgetReport] = None
     
     def create_analysis_task(self, user_request: str) -> Task:
-        student_profiles = load_student_profiles()
+        # El perfil del aula llega ya calculado (una vez por huella de los perfiles)
+        prompt, self.last_budget = fit_prompt("analysis", [
+            PromptComponent("solicitud", [user_request], priority=10),
+            PromptComponent("aula", classroom_variants(user_request), priority=5),
+        ])
+        classroom = prompt["aula"]
         return Task(
             description=f"""Analiza la siguiente solicitud del profesor: "{user_request}"
             
-            Aquí están los perfiles de los 8 estudiantes del aula:
-            {student_profiles}
+            El perfil del aula ya está calculado a partir de los perfiles de los estudiantes;
+            no lo vuelvas a describir, úsalo como referencia:
+            {classroom}
             
             Tu trabajo es:
             1. Identificar el tema, materia y nivel educativo solicitado
-            2. Analizar las necesidades específicas de cada neurotipo presente en el aula
-            3. Identificar los desafíos potenciales y oportunidades de colaboración
+            2. Relacionar la solicitud con las fortalezas, apoyos y competencias por reforzar del aula
+            3. Identificar los desafíos potenciales y oportunidades de colaboración de esta actividad
             4. Determinar los principios de diseño universal que se deben aplicar
             
-            Entrega un análisis detallado que incluya:
+            Entrega un análisis centrado en la solicitud que incluya:
             - Resumen de la solicitud
-            - Perfil del aula (neurotipos presentes y sus características)
+            - Implicaciones para cada neurotipo y para los estudiantes con competencias por reforzar
             - Consideraciones pedagógicas clave
             - Recomendaciones para el diseño de la actividad""",
             agent=self.agent,
-            expected_output="Análisis completo del contexto educativo y recomendaciones para el diseño de la actividad"
+            expected_output="Análisis de la solicitud sobre el perfil precalculado del aula y recomendaciones para el diseño de la actividad"
         )
 
 class ResearcherAgent:
-    def __init__(self):
-        # Gemini para búsqueda en biblioteca usando litellm
-        self.llm = ChatLiteLLM(
-            model="gemini/gemini-1.5-flash",
-            api_key=os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY"),
-            temperature=0.7
-        )
+    def __init__(self, llm_cache: Optional[LLMResponseCache] = None,
+                 registry: Optional[LLMClientRegistry] = None):
+        # Modelo para búsqueda en biblioteca según su nivel (o su cascada) en config/llm.json
+        self.llm = stage_llm(registry or get_llm_registry(), "researcher")
         self.agent = Agent(
             role='Investigador de Actividades',
             goal='Buscar en la biblioteca de actividades ejemplos relevantes que sirvan de inspiración para el diseño',
@@ -112,35 +167,59 @@ class ResearcherAgent:
             que funcionan bien para diferentes neurotipos.""",
             verbose=True,
             allow_delegation=False,
-            llm=self.llm
+            llm=cached_llm(self.llm, llm_cache)
         )
+        self.last_budget: Optional[BudgetReport] = None
     
-    def create_research_task(self, analysis_result: str) -> Task:
-        activity_library = load_activity_library()
-        
-        # Cargar 2-3 actividades completas más relevantes basándose en palabras clave
-        relevant_activities = ""
-        keywords = ["matemáticas", "fracciones", "colaborativo", "parejas", "ciencias", "lengua"]
-        loaded_count = 0
+    def prepare_context(self, query: str) -> ResearchContext:
+        """Recupera de la biblioteca el material del prompt (no necesita el análisis)"""
+        # Las actividades mejor situadas (BM25 + vectores) tienen más peso
+        boost = {
+            activity.archivo: RESEARCH_ACTIVITY_BOOST
+            for activity, _ in hybrid_search_activities(query, k=RESEARCH_CANDIDATE_ACTIVITIES)
+        }
+        return ResearchContext(
+            query=query,
+            section_variants=[
+                render_sections(select_sections(query, budget, boost=boost))
+                for budget in RESEARCH_SECTION_TOKENS
+            ],
+            library_variants=[load_activity_library(), load_activity_library(previews=False)],
+            similar=load_similar_activities(query),
+        )
+    
+    def create_research_task(self, analysis_result: str, user_request: str = "",
+                             context: Optional[ResearchContext] = None) -> Task:
+        # Seleccionar las secciones más relevantes de la biblioteca sobre la
+        # solicitud y, si ya está disponible como texto, el análisis previo,
+        # salvo que el contexto ya venga preparado
+        if context is None:
+            query = user_request
+            if isinstance(analysis_result, str):
+                query += "\n" + analysis_result
+            context = self.prepare_context(query)
         
-        import glob
-        for file_path in glob.glob("data/k_*.md"):
-            if loaded_count >= 1:
-                break
-            with open(file_path, "r", encoding="utf-8") as f:
-                preview = f.read()[:200].lower()
-                if any(keyword in preview for keyword in keywords):
-                    relevant_activities += f"\n\n--- ACTIVIDAD COMPLETA: {file_path} ---\n"
-                    relevant_activities += load_full_activity(file_path)
-                    loaded_count += 1
+        prompt, self.last_budget = fit_prompt("research", [
+            PromptComponent("analisis", upstream_variants(analysis_result), priority=8),
+            PromptComponent("secciones", context.section_variants, priority=6),
+            PromptComponent("biblioteca", context.library_variants, priority=4, required=False),
+            PromptComponent("similares", [context.similar], priority=2, required=False),
+        ])
+        analysis_text = prompt["analisis"]
+        activity_library = prompt["biblioteca"]
+        similar_activities = prompt["similares"]
+        relevant_activities = prompt["secciones"]
         
         return Task(
-            description=f"""Basándote en el análisis previo: {analysis_result}
+            description=f"""Basándote en el análisis previo: {analysis_text}
             
             Aquí está la biblioteca de actividades disponible:
             {activity_library}
             
-            Y aquí están algunas actividades completas relevantes para inspiración:
+            Actividades semánticamente similares a la solicitud:
+            {similar_activities}
+            
+            Y aquí están las secciones más relevantes de esas actividades para inspiración:
             {relevant_activities}
             
             Tu trabajo es:
@@ -162,13 +241,11 @@ class ResearcherAgent:
         )
 
 class DesignerAgent:
-    def __init__(self):
-        # Gemini para diseño complejo usando litellm
-        self.llm = ChatLiteLLM(
-            model="gemini/gemini-1.5-flash",
-            api_key=os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY"),
-            temperature=0.7
-        )
+    def __init__(self, llm_cache: Optional[LLMResponseCache] = None,
+                 registry: Optional[LLMClientRegistry] = None):
+        # Modelo para diseño complejo según su nivel (o su cascada) en config/llm.json
+        registry = registry or get_llm_registry()
+        self.llm = stage_llm(registry, "designer")
         self.agent = Agent(
             role='Diseñador de Actividades Inclusivas',
             goal='Crear una actividad completa siguiendo el template, con adaptaciones específicas para cada estudiante',
@@ -177,13 +254,52 @@ class DesignerAgent:
             todos los neurotipos sin modificaciones posteriores.""",
             verbose=True,
             allow_delegation=False,
-            llm=self.llm
+            llm=cached_llm(self.llm, llm_cache)
         )
+        # Los candidatos usan el modelo de "candidate" si se configura (p. ej. uno más barato)
+        if "candidate" in registry.config.agents or os.getenv("IA4EDU_MODEL_CANDIDATE"):
+            self.candidate_llm = cached_llm(registry.llm_for("candidate"), llm_cache)
+        else:
+            self.candidate_llm = self.agent.llm
+        self.last_budget: Optional[BudgetReport] = None
+    
+    def candidate_agent(self, temperature: Optional[float]) -> Agent:
+        """Copia del diseñador para un candidato, con su propia temperatura"""
+        agent = self.agent.copy()
+        agent.llm = variant_llm(self.candidate_llm, temperature)
+        return agent
     
-    def create_design_task(self, analysis_result: str, research_result: str) -> Task:
-        student_profiles = load_student_profiles()
+    def create_design_task(self, analysis_result: str, research_result: str, user_request: str = "",
+                           profiles: Optional[List[str]] = None, structured: bool = False,
+                           grouping: Optional[str] = None) -> Task:
+        if profiles is None:
+            profiles = profile_variants(user_request or upstream_text(analysis_result))
+        components = [
+            PromptComponent("analisis", upstream_variants(analysis_result), priority=6),
+            PromptComponent("investigacion", upstream_variants(research_result), priority=4),
+            PromptComponent("perfiles", profiles, priority=8),
+        ]
+        if grouping:
+            components.append(PromptComponent("agrupaciones", [grouping], priority=9))
+        prompt, self.last_budget = fit_prompt("design", components)
+        student_profiles = prompt["perfiles"]
+        class_size = classroom_size()
+        if grouping:
+            # Los grupos y roles ya vienen calculados por el optimizador local
+            assignment = f"""4. ASIGNACIÓN DE ESTUDIANTES (ya calculada, no la cambies):
+            {prompt["agrupaciones"]}
+            - Usa estos grupos, rotaciones y roles en las fases y tareas
+            - Puedes adaptar el nombre de cada rol a la temática de la actividad"""
+            if structured:
+                assignment += """
+            - Deja "asignaciones_grupos" como [] en el JSON: se rellena automáticamente"""
+        else:
+            assignment = f"""4. ASIGNACIÓN DE ESTUDIANTES:
+            - Formar grupos/parejas considerando los perfiles de los {class_size} estudiantes
+            - Asignar roles específicos que aprovechen las fortalezas de cada uno
+            - Justificar las decisiones de agrupación"""
         return Task(
-            description=f"""Usando el análisis: {analysis_result} y la investigación: {research_result}
+            description=f"""Usando el análisis: {prompt["analisis"]} y la investigación: {prompt["investigacion"]}
             
             Perfiles de estudiantes para adaptar la actividad:
             {student_profiles}
@@ -210,10 +326,7 @@ class DesignerAgent:
             - Lista de tareas con instrucciones paso a paso
             - Adaptaciones específicas por neurotipo
             
-            4. ASIGNACIÓN DE ESTUDIANTES:
-            - Formar grupos/parejas considerando los perfiles de los 8 estudiantes
-            - Asignar roles específicos que aprovechen las fortalezas de cada uno
-            - Justificar las decisiones de agrupación
+            {assignment}
             
             5. MATERIALES Y RECURSOS:
             - Materiales base para todos
@@ -226,20 +339,18 @@ class DesignerAgent:
             - Rúbrica inclusiva
             
             IMPORTANTE: Aplica el paradigma de adaptación de terreno diseñando desde el inicio para todos los neurotipos.
-            Crea adaptaciones ESPECÍFICAS para cada uno de los 8 estudiantes usando sus perfiles individuales.""",
+            Crea adaptaciones ESPECÍFICAS para cada uno de los {class_size} estudiantes usando sus perfiles individuales.{json_instructions() if structured else ""}""",
             agent=self.agent,
-            expected_output="Actividad completa estructurada según el template con adaptaciones específicas para cada estudiante",
+            expected_output=("Objeto JSON con la actividad completa según la plantilla" if structured else
+                             "Actividad completa estructurada según el template con adaptaciones específicas para cada estudiante"),
             context=[analysis_result, research_result] if isinstance(analysis_result, Task) else []
         )
 
 class RefinementAgent:
-    def __init__(self):
-        # Gemini para refinamiento usando litellm
-        self.llm = ChatLiteLLM(
-            model="gemini/gemini-1.5-flash",
-            api_key=os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY"),
-            temperature=0.7
-        )
+    def __init__(self, llm_cache: Optional[LLMResponseCache] = None,
+                 registry: Optional[LLMClientRegistry] = None):
+        # Modelo para refinamiento según su nivel (o su cascada) en config/llm.json
+        self.llm = stage_llm(registry or get_llm_registry(), "refinement")
         self.agent = Agent(
             role='Especialista en Refinamiento',
             goal='Revisar y mejorar la actividad basándose en feedback del profesor',
@@ -248,13 +359,20 @@ class RefinementAgent:
             y el paradigma de adaptación de terreno.""",
             verbose=True,
             allow_delegation=False,
-            llm=self.llm
+            llm=cached_llm(self.llm, llm_cache)
         )
+        self.last_budget: Optional[BudgetReport] = None
     
-    def create_refinement_task(self, activity_design: str, teacher_feedback: str) -> Task:
-        student_profiles = load_student_profiles()
+    def create_refinement_task(self, activity_design: str, teacher_feedback: str,
+                               structured: bool = False) -> Task:
+        prompt, self.last_budget = fit_prompt("refinement", [
+            PromptComponent("actividad", [upstream_text(activity_design)], priority=10),
+            PromptComponent("feedback", [teacher_feedback], priority=10),
+            PromptComponent("perfiles", profile_variants(f"{upstream_text(activity_design)}\n{teacher_feedback}"), priority=5),
+        ])
+        student_profiles = prompt["perfiles"]
         return Task(
-            description=f"""Tienes la actividad diseñada: {activity_design}
+            description=f"""Tienes la actividad diseñada: {prompt["actividad"]}
             
             Y el feedback del profesor: {teacher_feedback}
             
@@ -272,30 +390,172 @@ class RefinementAgent:
             - Actividad revisada con las mejoras implementadas
             - Explicación de los cambios realizados
             - Justificación de cómo los cambios mantienen o mejoran la inclusividad
-            - Recomendaciones adicionales si las hay""",
+            - Recomendaciones adicionales si las hay{json_instructions() + " La explicación de los cambios va en notas_implementacion." if structured else ""}""",
             agent=self.agent,
-            expected_output="Actividad mejorada basada en el feedback del profesor con explicación de cambios",
+            expected_output=("Objeto JSON con la actividad mejorada según la plantilla" if structured else
+                             "Actividad mejorada basada en el feedback del profesor con explicación de cambios"),
             context=[activity_design] if isinstance(activity_design, Task) else []
         )
+    
+    def create_section_refinement_task(self, plan: RefinementPlan, teacher_feedback: str) -> Task:
+        """Tarea que reescribe solo las secciones de la actividad afectadas por el feedback"""
+        targets_text = plan.render_targets()
+        students = students_for_feedback(get_corpus().students(), teacher_feedback)
+        prompt, self.last_budget = fit_prompt("refinement", [
+            PromptComponent("secciones", [targets_text], priority=10),
+            PromptComponent("feedback", [teacher_feedback], priority=10),
+            PromptComponent("esquema", [plan.outline()], priority=6, required=False),
+            PromptComponent("perfiles", profile_encodings(students, f"{targets_text}\n{teacher_feedback}"), priority=5),
+        ])
+        return Task(
+            description=f"""El profesor ha dado este feedback sobre una actividad ya diseñada: {teacher_feedback}
+            
+            Esquema de la actividad (→ marca las secciones que debes revisar):
+            {prompt["esquema"]}
+            
+            Secciones a revisar, cada una entre su marcador de inicio y {END_MARK}:
+            {prompt["secciones"]}
+            
+            Perfiles de los estudiantes implicados:
+            {prompt["perfiles"]}
+            
+            Tu trabajo es:
+            1. Reescribir SOLO esas secciones para atender el feedback
+            2. Mantener su encabezado, su formato y lo que ya funciona
+            3. Asegurar que las adaptaciones para cada neurotipo siguen siendo efectivas
+            
+            Entrega cada sección revisada entre los mismos marcadores (por ejemplo
+            {SECTION_MARK.format(key=plan.targets[0])} ... {END_MARK}) y, al final, tras la línea {CHANGES_MARK},
+            una explicación breve de los cambios. No repitas el resto de la actividad.""",
+            agent=self.agent,
+            expected_output="Secciones revisadas entre sus marcadores y explicación breve de los cambios"
+        )
+    
+    def create_structured_refinement_task(self, activity: Dict[str, Any], units: List[str],
+                                          teacher_feedback: str, outline: str = "") -> Task:
+        """Tarea que reescribe solo los subobjetos JSON de la actividad afectados por el feedback"""
+        targets_text = render_units(activity, units)
+        students = students_for_feedback(get_corpus().students(), teacher_feedback)
+        prompt, self.last_budget = fit_prompt("refinement", [
+            PromptComponent("fragmentos", [targets_text], priority=10),
+            PromptComponent("feedback", [teacher_feedback], priority=10),
+            PromptComponent("esquema", [units_schema(units)], priority=9),
+            PromptComponent("indice", [outline], priority=6, required=False),
+            PromptComponent("perfiles", profile_encodings(students, f"{targets_text}\n{teacher_feedback}"), priority=5),
+        ])
+        return Task(
+            description=f"""El profesor ha dado este feedback sobre una actividad ya diseñada: {teacher_feedback}
+            
+            Índice de la actividad (→ marca las secciones afectadas):
+            {prompt["indice"]}
+            
+            Fragmentos JSON a revisar, cada uno entre su marcador de inicio y {END_MARK}:
+            {prompt["fragmentos"]}
+            
+            Esquema de cada fragmento:
+            {prompt["esquema"]}
+            
+            Perfiles de los estudiantes implicados:
+            {prompt["perfiles"]}
+            
+            Tu trabajo es:
+            1. Reescribir SOLO esos fragmentos para atender el feedback
+            2. Mantener sus claves, sus tipos y lo que ya funciona
+            3. Asegurar que las adaptaciones para cada neurotipo siguen siendo efectivas
+            
+            Entrega cada fragmento revisado como JSON válido entre los mismos marcadores (por ejemplo
+            {SECTION_MARK.format(key=units[0])} ... {END_MARK}) y, al final, tras la línea {CHANGES_MARK},
+            una explicación breve de los cambios. No repitas el resto de la actividad.""",
+            agent=self.agent,
+            expected_output="Fragmentos JSON revisados entre sus marcadores y explicación breve de los cambios"
+        )
 
 class IA4EDUCrew:
-    def __init__(self, gemini_api_key: str):
+    def __init__(self, gemini_api_key: str, use_cache: bool = True,
+                 registry: Optional[LLMClientRegistry] = None, candidates: int = 1):
         # Configurar variable de entorno para que los agentes la usen
         os.environ["GEMINI_API_KEY"] = gemini_api_key
         
+        # Caché de respuestas compartida (None si se desactiva)
+        self.llm_cache = get_llm_cache() if use_cache else None
+        
         # Inicializar agentes (cada uno con Gemini)
-        self.analyst = AnalystAgent()
-        self.researcher = ResearcherAgent()
-        self.designer = DesignerAgent()
-        self.refinement = RefinementAgent()
+        self.analyst = AnalystAgent(self.llm_cache, registry)
+        self.researcher = ResearcherAgent(self.llm_cache, registry)
+        self.designer = DesignerAgent(self.llm_cache, registry)
+        self.refinement = RefinementAgent(self.llm_cache, registry)
+        
+        # Informes de presupuesto de tokens de la última ejecución
+        self.budget_reports: List[BudgetReport] = []
+        
+        # Resultado del último refinamiento (secciones reescritas y explicación)
+        self.last_refinement: Optional[RefinementOutcome] = None
+        
+        # Registro detallado de CrewAI (se apaga al mostrar el streaming en vivo)
+        self.verbose = True
+        
+        # Salida JSON según PlantillaActividad; la última actividad validada y su markdown
+        self.structured = True
+        self.last_structure: Optional[StructuredResult] = None
+        self.last_markdown: Optional[str] = None
+        
+        # Agrupaciones calculadas localmente para el último diseño
+        self.last_grouping: Optional[GroupingPlan] = None
+        
+        # Diseños candidatos por solicitud y sus puntuaciones (la mejor primero)
+        self.candidates = candidates
+        self.last_candidates: List[CandidateScore] = []
+        
+        # Comprobación local de cobertura tras el diseño y huecos completados
+        self.fill_gaps = True
+        self.last_coverage: Optional[CoverageOutcome] = None
+    
+    def enable_streaming(self):
+        """Pide al LLM de cada agente que emita los tokens según llegan"""
+        self.verbose = False
+        for agent in (self.analyst, self.researcher, self.designer, self.refinement):
+            enable_streaming(agent.agent.llm)
+            agent.agent.verbose = False
+    
+    def design_stages(self) -> List[Tuple[Agent, str]]:
+        """Etapas del diseño para el seguimiento en vivo"""
+        return [
+            (self.analyst.agent, "Análisis"),
+            (self.researcher.agent, "Investigación"),
+            (self.designer.agent, "Diseño")
+        ]
+    
+    def refine_stages(self) -> List[Tuple[Agent, str]]:
+        """Etapas del refinamiento para el seguimiento en vivo"""
+        return [(self.refinement.agent, "Refinamiento")]
+    
+    def plan_grouping(self, user_request: str) -> Optional[GroupingPlan]:
+        """Grupos y roles para la solicitud (None si no se pueden leer los perfiles)"""
+        try:
+            self.last_grouping = plan_groups(get_corpus().students(), user_request)
+        except Exception:
+            self.last_grouping = None
+        return self.last_grouping
     
     def design_activity(self, user_request: str) -> str:
         """Ejecuta el flujo completo de diseño de actividad"""
+        if self.candidates > 1:
+            return self.design_candidates(user_request, self.candidates)
+        self.last_candidates = []
         
         # Crear tareas
+        grouping = self.plan_grouping(user_request)
         analysis_task = self.analyst.create_analysis_task(user_request)
-        research_task = self.researcher.create_research_task(analysis_task)
-        design_task = self.designer.create_design_task(analysis_task, research_task)
+        research_task = self.researcher.create_research_task(analysis_task, user_request)
+        design_task = self.designer.create_design_task(
+            analysis_task, research_task, user_request, structured=self.structured,
+            grouping=grouping.render() if grouping else None
+        )
+        self.budget_reports = [
+            self.analyst.last_budget,
+            self.researcher.last_budget,
+            self.designer.last_budget
+        ]
         
         # Crear crew
         crew = Crew(
@@ -309,23 +569,308 @@ class IA4EDUCrew:
                 research_task,
                 design_task
             ],
-            verbose=True
+            verbose=self.verbose
         )
         
         # Ejecutar crew
         result = crew.kickoff()
-        return result
+        return self.structure_output(result, self.designer.agent.llm, grouping)
+    
+    def design_candidates(self, user_request: str, count: int) -> str:
+        """Diseña varios candidatos en paralelo y devuelve el mejor según el puntuador local
+
+        El análisis y la investigación se ejecutan una sola vez; cada candidato
+        usa una copia del diseñador con otra temperatura. Las puntuaciones
+        quedan en ``last_candidates``.
+        """
+        count = max(1, min(count, MAX_CANDIDATES))
+        grouping = self.plan_grouping(user_request)
+        analysis_task = self.analyst.create_analysis_task(user_request)
+        research_task = self.researcher.create_research_task(analysis_task, user_request)
+        upstream = Crew(
+            agents=[self.analyst.agent, self.researcher.agent],
+            tasks=[analysis_task, research_task],
+            verbose=self.verbose
+        ).kickoff()
+        analysis_text, research_text = (upstream_text(output) for output in upstream.tasks_output)
+        
+        profiles = profile_variants(user_request)
+        tasks = []
+        for temperature in CANDIDATE_TEMPERATURES[:count]:
+            task = self.designer.create_design_task(
+                analysis_text, research_text, user_request, profiles, self.structured,
+                grouping.render() if grouping else None
+            )
+            task.agent = self.designer.candidate_agent(temperature)
+            tasks.append(task)
+        self.budget_reports = [
+            self.analyst.last_budget,
+            self.researcher.last_budget,
+            self.designer.last_budget
+        ]
+        
+        try:
+            students = get_corpus().students()
+        except Exception:
+            students = []
+        # Los candidatos cuentan para la etapa "Diseño" del diseñador en el seguimiento y las trazas
+        with stage_aliases(self.designer.agent, [task.agent for task in tasks]), \
+                ThreadPoolExecutor(max_workers=count, thread_name_prefix="ia4edu-candidato") as pool:
+            futures = [pool.submit(self.run_candidate, index, task, user_request, students, grouping)
+                       for index, task in enumerate(tasks)]
+            outcomes = [future.result() for future in futures]
+        
+        self.last_candidates = rank_candidates([score for score, _, _ in outcomes])
+        winner = self.last_candidates[0].indice
+        _, result, structure = outcomes[winner]
+        return self.adopt_structure(*self.complete_coverage(result, structure, tasks[winner].agent.llm))
+    
+    def run_candidate(self, index: int, task: Task, user_request: str, students: List[dict],
+                      grouping: Optional[GroupingPlan] = None):
+        """Ejecuta un candidato y lo puntúa: (puntuación, resultado, actividad validada)"""
+        crew = Crew(agents=[task.agent], tasks=[task], verbose=self.verbose)
+        result = crew.kickoff()
+        structure = self.parse_structure(result, task.agent.llm, grouping)
+        text = render_markdown(structure.actividad) if structure is not None else upstream_text(result)
+        llm = getattr(task.agent.llm, "inner", task.agent.llm)
+        score = score_candidate(index, text, students, user_request, structure,
+                                getattr(llm, "model", ""), getattr(llm, "temperature", None))
+        return score, result, structure
+    
+    def resume_design(self, activity_design: str, template: Optional[Dict[str, Any]] = None) -> str:
+        """Parte de un diseño anterior sin ejecutar el crew
+
+        Si el diseño trae su plantilla JSON se vuelve a validar para que los
+        refinamientos sigan editando sus subobjetos.
+        """
+        self.last_candidates = []
+        self.budget_reports = []
+        if not (self.structured and template):
+            return self.adopt_structure(activity_design, None)
+        return self.adopt_structure(activity_design, build_activity(template))
     
     def refine_activity(self, activity_design: str, teacher_feedback: str) -> str:
-        """Refina la actividad basándose en feedback del profesor"""
+        """Refina la actividad basándose en feedback del profesor
+
+        Si el feedback afecta a unas pocas secciones solo se reescriben esas; si
+        no, se reescribe la actividad entera. Si es la última actividad
+        estructurada, se editan directamente sus subobjetos JSON. En todos los
+        casos se devuelve el texto de la actividad completa ya actualizada.
+        """
+        if self.is_structured(activity_design):
+            return self.refine_structured(teacher_feedback)
+        plan = self.plan_refinement(activity_design, teacher_feedback)
+        if plan is not None:
+            task = self.refinement.create_section_refinement_task(plan, teacher_feedback)
+            self.budget_reports = [self.refinement.last_budget]
+            crew = Crew(agents=[self.refinement.agent], tasks=[task], verbose=self.verbose)
+            refined = self.apply_refinement(plan, crew.kickoff())
+            if refined is not None:
+                return refined
         
         refinement_task = self.refinement.create_refinement_task(activity_design, teacher_feedback)
+        self.budget_reports = [self.refinement.last_budget]
         
         crew = Crew(
             agents=[self.refinement.agent],
             tasks=[refinement_task],
-            verbose=True
+            verbose=self.verbose
         )
         
         result = crew.kickoff()
-        return result
\ No newline at end of file
+        self.last_refinement = RefinementOutcome(scoped=False)
+        self.last_structure = self.last_markdown = None
+        return upstream_text(result)
+    
+    def is_structured(self, activity_design: Any) -> bool:
+        """La actividad es la última que se validó contra la plantilla"""
+        return (self.structured and self.last_structure is not None
+                and isinstance(activity_design, str) and activity_design == self.last_markdown)
+    
+    def structure_output(self, result, llm, grouping: Optional[GroupingPlan] = None):
+        """Valida la salida JSON contra PlantillaActividad y la devuelve en markdown
+
+        Los subobjetos que no validan se vuelven a pedir uno a uno a ``llm``.
+        Si la salida no es JSON se devuelve tal cual, como texto libre. Las
+        agrupaciones calculadas sustituyen a las que haya escrito el modelo.
+        """
+        structure = self.parse_structure(result, llm, grouping)
+        return self.adopt_structure(*self.complete_coverage(result, structure, llm))
+    
+    def complete_coverage(self, result, structure: Optional[StructuredResult], llm):
+        """Busca en local estudiantes, neurotipos, fases y evaluación sin cubrir y completa solo esos huecos
+
+        Devuelve el resultado y la actividad ya completados.
+        """
+        self.last_coverage = None
+        if not self.fill_gaps or not (structure is not None or isinstance(result, str) or hasattr(result, "raw")):
+            return result, structure
+        try:
+            students = get_corpus().students()
+        except Exception:
+            return result, structure
+        if structure is not None:
+            structure, self.last_coverage = fill_structured_gaps(structure, students, llm_generator(llm))
+            return result, structure
+        text, self.last_coverage = fill_markdown_gaps(upstream_text(result), students, llm_generator(llm))
+        if hasattr(result, "raw"):
+            result.raw = text
+            return result, None
+        return text, None
+    
+    def parse_structure(self, result, llm, grouping: Optional[GroupingPlan] = None) -> Optional[StructuredResult]:
+        """Actividad validada a partir de la salida (None sin modo estructurado o si no es JSON)"""
+        if not self.structured:
+            return None
+        data = extract_json(upstream_text(result))
+        if not isinstance(data, dict):
+            return None
+        if grouping is not None:
+            data["asignaciones_grupos"] = [group.model_dump() for group in grouping.asignaciones()]
+        return build_activity(data, llm_repairer(llm))
+    
+    def adopt_structure(self, result, structure: Optional[StructuredResult]):
+        """Fija la actividad como la última y devuelve su markdown (o el resultado tal cual)"""
+        self.last_structure = structure
+        self.last_markdown = render_markdown(structure.actividad) if structure is not None else None
+        if structure is None:
+            return result
+        if hasattr(result, "raw"):
+            result.raw = self.last_markdown
+            return result
+        return self.last_markdown
+    
+    def refine_structured(self, teacher_feedback: str) -> str:
+        """Refinamiento de la actividad estructurada: solo los subobjetos afectados o, si no, entera"""
+        self.last_refinement = None
+        activity = self.last_structure.actividad
+        markdown = self.last_markdown
+        plan = plan_refinement(markdown, teacher_feedback)
+        units = plan_units(markdown, plan) if plan is not None else []
+        if units:
+            task = self.refinement.create_structured_refinement_task(
+                activity.model_dump(), units, teacher_feedback, plan.outline()
+            )
+            self.budget_reports = [self.refinement.last_budget]
+            crew = Crew(agents=[self.refinement.agent], tasks=[task], verbose=self.verbose)
+            output = upstream_text(crew.kickoff())
+            structure, replaced, changes = apply_units(activity, units, output, llm_repairer(self.refinement.agent.llm))
+            if structure is not None:
+                self.last_structure = structure
+                self.last_markdown = render_markdown(structure.actividad)
+                titles = {section.key: section.titulo for section in plan.sections}
+                self.last_refinement = RefinementOutcome(
+                    scoped=True,
+                    sections=[titles[key] for key in plan.targets],
+                    total_sections=len(plan.sections),
+                    changes=changes
+                )
+                return self.last_markdown
+        
+        task = self.refinement.create_refinement_task(
+            json.dumps(activity.model_dump(), ensure_ascii=False), teacher_feedback, structured=True
+        )
+        self.budget_reports = [self.refinement.last_budget]
+        crew = Crew(agents=[self.refinement.agent], tasks=[task], verbose=self.verbose)
+        result = self.structure_output(crew.kickoff(), self.refinement.agent.llm)
+        self.last_refinement = RefinementOutcome(scoped=False)
+        return upstream_text(result)
+    
+    def plan_refinement(self, activity_design: str, teacher_feedback: str) -> Optional[RefinementPlan]:
+        """Secciones a reescribir, o None para reescribir la actividad completa"""
+        self.last_refinement = None
+        if not isinstance(activity_design, str):
+            return None
+        return plan_refinement(activity_design, teacher_feedback)
+    
+    def apply_refinement(self, plan: RefinementPlan, result) -> Optional[str]:
+        """Inserta las secciones devueltas por el modelo; None si no devolvió ninguna"""
+        refined, replaced, changes = plan.apply(upstream_text(result))
+        if not replaced:
+            return None
+        titles = {section.key: section.titulo for section in plan.sections}
+        self.last_refinement = RefinementOutcome(
+            scoped=True,
+            sections=[titles[key] for key in replaced],
+            total_sections=len(plan.sections),
+            changes=changes
+        )
+        return refined
+
+    async def design_activity_async(self, user_request: str):
+        """Flujo de diseño asíncrono: la recuperación se solapa con el análisis
+
+        La búsqueda en la biblioteca, la compactación de perfiles y los grupos solo
+        dependen de la solicitud, así que se preparan en hilos mientras el
+        analista espera al LLM. Cada etapa recibe como texto la salida de la
+        anterior.
+        """
+        if self.candidates > 1:
+            return await asyncio.to_thread(self.design_candidates, user_request, self.candidates)
+        self.last_candidates = []
+        analysis_task = self.analyst.create_analysis_task(user_request)
+        analysis_crew = Crew(agents=[self.analyst.agent], tasks=[analysis_task], verbose=self.verbose)
+        analysis_result, research_context, design_profiles, grouping = await asyncio.gather(
+            analysis_crew.kickoff_async(),
+            asyncio.to_thread(self.researcher.prepare_context, user_request),
+            asyncio.to_thread(profile_variants, user_request),
+            asyncio.to_thread(self.plan_grouping, user_request),
+        )
+        analysis_text = upstream_text(analysis_result)
+
+        research_task = await asyncio.to_thread(
+            self.researcher.create_research_task, analysis_text, user_request, research_context
+        )
+        research_crew = Crew(agents=[self.researcher.agent], tasks=[research_task], verbose=self.verbose)
+        research_text = upstream_text(await research_crew.kickoff_async())
+
+        design_task = await asyncio.to_thread(
+            self.designer.create_design_task, analysis_text, research_text, user_request, design_profiles,
+            self.structured, grouping.render() if grouping else None
+        )
+        self.budget_reports = [
+            self.analyst.last_budget,
+            self.researcher.last_budget,
+            self.designer.last_budget
+        ]
+        design_crew = Crew(agents=[self.designer.agent], tasks=[design_task], verbose=self.verbose)
+        result = await design_crew.kickoff_async()
+        return await asyncio.to_thread(self.structure_output, result, self.designer.agent.llm, grouping)
+
+    async def refine_activity_async(self, activity_design: str, teacher_feedback: str) -> str:
+        """Versión asíncrona de refine_activity"""
+        if self.is_structured(activity_design):
+            return await asyncio.to_thread(self.refine_structured, teacher_feedback)
+        plan = self.plan_refinement(activity_design, teacher_feedback)
+        if plan is not None:
+            task = await asyncio.to_thread(
+                self.refinement.create_section_refinement_task, plan, teacher_feedback
+            )
+            self.budget_reports = [self.refinement.last_budget]
+            crew = Crew(agents=[self.refinement.agent], tasks=[task], verbose=self.verbose)
+            refined = self.apply_refinement(plan, await crew.kickoff_async())
+            if refined is not None:
+                return refined
+
+        refinement_task = await asyncio.to_thread(
+            self.refinement.create_refinement_task, activity_design, teacher_feedback
+        )
+        self.budget_reports = [self.refinement.last_budget]
+
+        crew = Crew(
+            agents=[self.refinement.agent],
+            tasks=[refinement_task],
+            verbose=self.verbose
+        )
+        result = await crew.kickoff_async()
+        self.last_refinement = RefinementOutcome(scoped=False)
+        self.last_structure = self.last_markdown = None
+        return upstream_text(result)
+
+    def cascade_stats(self) -> List[Dict[str, Any]]:
+        """Llamadas, escalados y latencias por etapa y nivel de la cascada de modelos"""
+        return get_cascade_stats().summary()
+
+    def cache_stats(self) -> Optional[Dict[str, Any]]:
+        """Aciertos/fallos y ocupación de la caché de respuestas (None si está desactivada)"""
+        return self.llm_cache.info() if self.llm_cache is not None else None
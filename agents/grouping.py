@@ -0,0 +1,381 @@
+"""
+Formación de grupos y reparto de roles sin LLM.
+
+A partir de los perfiles se puntúa la complementariedad de cada pareja de
+estudiantes (canal preferido, temperamento, tolerancia a la frustración,
+nivel de competencia en las materias de la solicitud y neurotipo) y se
+busca la partición con mayor puntuación mediante búsqueda local con
+intercambios y varios arranques deterministas. En las rotaciones se penaliza
+repetir compañeros y roles. El resultado son ``AsignacionGrupo`` que el
+diseñador recibe ya calculadas.
+"""
+
+import itertools
+import random
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from agents.classroom import TYPICAL, neurotype_of
+from agents.profiles import SUBJECTS, detect_subjects
+from templates.activity_template import AsignacionGrupo
+
+DEFAULT_GROUP_SIZE = 4
+# Rotaciones cuando la solicitud las pide sin decir cuántas
+DEFAULT_ROTATIONS = 3
+MAX_ROTATIONS = 20
+
+# Penalizaciones en rotaciones: repetir compañero o repetir rol
+REPEAT_PARTNER_PENALTY = 4.0
+REPEAT_ROLE_PENALTY = 1.0
+
+# Arranques de la búsqueda local (semillas fijas: el resultado es reproducible)
+RESTARTS = 4
+
+LEVEL_VALUES = {"INICIADO": 1, "EN_PROCESO": 2, "CONSEGUIDO": 3, "SUPERADO": 4}
+NEUTRAL_LEVEL = 2.5
+
+ROLES = ("coordinador/a", "verificador/a", "secretario/a", "portavoz", "responsable de materiales")
+
+_NUMBER_WORDS = {"dos": 2, "tres": 3, "cuatro": 4, "cinco": 5, "seis": 6, "siete": 7, "ocho": 8,
+                 "diez": 10}
+_NUMBER = r"(\d+|" + "|".join(_NUMBER_WORDS) + r")"
+_SIZE_RES = (
+    (re.compile(r"\bindividual(es|mente)?\b"), 1),
+    (re.compile(r"\b(en |por )?parejas?\b"), 2),
+    (re.compile(r"\btr[ií]os?\b"), 3),
+)
+_SIZE_NUMBER_RE = re.compile(r"\b(grupos?|equipos?)\s+de\s+" + _NUMBER + r"\b")
+_ROTATIONS_RE = re.compile(_NUMBER + r"\s+rotaci[oó]n(es)?\b")
+_ROTATIONS_WORD_RE = re.compile(r"\brot(aci[oó]n|aciones|ar|an|ando)\b")
+
+
+def _number(text: str) -> int:
+    return int(text) if text.isdigit() else _NUMBER_WORDS[text]
+
+
+def group_size_from_request(text: str) -> int:
+    """Tamaño de grupo pedido en la solicitud (por defecto DEFAULT_GROUP_SIZE)"""
+    lowered = text.lower()
+    match = _SIZE_NUMBER_RE.search(lowered)
+    if match:
+        return max(1, _number(match.group(2)))
+    for pattern, size in _SIZE_RES:
+        if pattern.search(lowered):
+            return size
+    return DEFAULT_GROUP_SIZE
+
+
+def rotations_from_request(text: str) -> int:
+    """Número de rotaciones pedidas (1 si la solicitud no habla de rotar)"""
+    lowered = text.lower()
+    match = _ROTATIONS_RE.search(lowered)
+    if match:
+        return min(MAX_ROTATIONS, max(1, _number(match.group(1))))
+    return DEFAULT_ROTATIONS if _ROTATIONS_WORD_RE.search(lowered) else 1
+
+
+def group_sizes(total: int, size: int) -> List[int]:
+    """Tamaños equilibrados; el resto se reparte o forma un grupo menor de al menos 2"""
+    size = max(1, min(size, total))
+    remainder = total % size
+    count = total // size
+    if remainder >= max(2, size - 1):
+        count += 1
+    count = max(1, count)
+    base, extra = divmod(total, count)
+    return [base + 1 if i < extra else base for i in range(count)]
+
+
+def grouping_type(size: int) -> str:
+    if size == 1:
+        return "individual"
+    if size == 2:
+        return "parejas"
+    return f"grupos_{size}"
+
+
+@dataclass
+class StudentFeatures:
+    """Rasgos de un estudiante que intervienen en la puntuación"""
+    id: str
+    nombre: str
+    canal: str
+    temperamento: str
+    tolerancia: str
+    apoyo: str
+    neurotipo: str
+    nivel: float
+
+    @classmethod
+    def from_profile(cls, student: dict, subjects: Sequence[str]) -> "StudentFeatures":
+        levels = [LEVEL_VALUES[level] for subject in subjects
+                  for level in (student.get(subject) or {}).values() if level in LEVEL_VALUES]
+        return cls(
+            id=str(student.get("id", "")),
+            nombre=student.get("nombre", ""),
+            canal=student.get("canal_preferido", ""),
+            temperamento=student.get("temperamento", ""),
+            tolerancia=student.get("tolerancia_frustracion", ""),
+            apoyo=student.get("nivel_apoyo", ""),
+            neurotipo=neurotype_of(student.get("diagnostico_formal", "")),
+            nivel=sum(levels) / len(levels) if levels else NEUTRAL_LEVEL,
+        )
+
+
+def pair_reasons(a: StudentFeatures, b: StudentFeatures) -> List[Tuple[float, str]]:
+    """Contribuciones (puntos, motivo) de la pareja a la complementariedad"""
+    reasons = []
+    if a.canal and b.canal and a.canal != b.canal:
+        reasons.append((1.0, f"canales complementarios ({a.canal} y {b.canal})"))
+    calm = ("reflexivo", "equilibrado")
+    if a.temperamento == b.temperamento == "impulsivo":
+        reasons.append((-3.0, "dos temperamentos impulsivos"))
+    elif "impulsivo" in (a.temperamento, b.temperamento):
+        impulsive, other = (a, b) if a.temperamento == "impulsivo" else (b, a)
+        if other.temperamento in calm:
+            reasons.append((1.5, f"{other.nombre} ({other.temperamento}) equilibra la impulsividad de {impulsive.nombre}"))
+    tolerances = {a.tolerancia, b.tolerancia}
+    if a.tolerancia == b.tolerancia == "baja":
+        reasons.append((-3.0, "dos tolerancias a la frustración bajas"))
+    elif tolerances == {"baja", "alta"}:
+        low, high = (a, b) if a.tolerancia == "baja" else (b, a)
+        reasons.append((2.0, f"la calma de {high.nombre} sostiene a {low.nombre} ante la frustración"))
+    elif tolerances == {"baja", "media"}:
+        reasons.append((0.5, "tolerancias a la frustración compatibles"))
+    gap = abs(a.nivel - b.nivel)
+    if 0.5 <= gap <= 1.5:
+        expert, novice = (a, b) if a.nivel > b.nivel else (b, a)
+        reasons.append((2.0, f"niveles cercanos para la tutoría entre iguales ({expert.nombre} apoya a {novice.nombre})"))
+    elif gap > 2.0:
+        reasons.append((-1.0, "niveles de competencia muy distantes"))
+    elif max(a.nivel, b.nivel) < NEUTRAL_LEVEL:
+        reasons.append((-2.0, "ambos con la competencia en proceso"))
+    if a.neurotipo != TYPICAL and b.neurotipo != TYPICAL:
+        reasons.append((-2.0, "concentra dos perfiles con necesidades específicas"))
+    if a.apoyo == b.apoyo == "alto":
+        reasons.append((-3.0, "dos estudiantes con apoyo alto"))
+    return reasons
+
+
+def role_affinity(role: str, student: StudentFeatures) -> float:
+    """Afinidad de un estudiante con un rol según su perfil"""
+    if role == "coordinador/a":
+        return ({"alta": 2.0, "media": 1.0}.get(student.tolerancia, 0.0)
+                + {"equilibrado": 1.5, "reflexivo": 1.0, "impulsivo": -1.0}.get(student.temperamento, 0.0)
+                + (1.0 if student.apoyo == "bajo" else 0.0))
+    if role == "verificador/a":
+        return (student.nivel - NEUTRAL_LEVEL
+                + {"TEA": 1.0, "Altas_Capacidades": 2.0}.get(student.neurotipo, 0.0))
+    if role == "secretario/a":
+        return ((2.0 if student.canal == "visual" else 0.0)
+                + (1.0 if student.temperamento == "reflexivo" else 0.0)
+                + (1.0 if student.neurotipo == "TEA" else 0.0))
+    if role == "portavoz":
+        return ((2.0 if student.canal == "auditivo" else 0.0)
+                + (0.5 if student.neurotipo == "Altas_Capacidades" else 0.0)
+                - (1.0 if student.neurotipo == "TEA" else 0.0))
+    if role == "responsable de materiales":
+        return ((3.0 if student.canal == "kinestesico" else 0.0)
+                + (2.0 if student.neurotipo == "TDAH" else 0.0))
+    return 0.0
+
+
+@dataclass
+class GroupingPlan:
+    """Agrupaciones calculadas: una lista de grupos por rotación"""
+    tamano: int
+    rotaciones: List[List[AsignacionGrupo]]
+    puntuaciones: List[float] = field(default_factory=list)
+    nombres: Dict[str, str] = field(default_factory=dict)
+
+    def asignaciones(self) -> List[AsignacionGrupo]:
+        """Todos los grupos; con varias rotaciones el id lleva la rotación (R2-A)"""
+        if len(self.rotaciones) == 1:
+            return list(self.rotaciones[0])
+        return [group.model_copy(update={"grupo_id": f"R{r}-{group.grupo_id}"})
+                for r, groups in enumerate(self.rotaciones, 1) for group in groups]
+
+    def render(self) -> str:
+        """Texto compacto para el prompt del diseñador"""
+        lines = [f"AGRUPACIONES CALCULADAS ({grouping_type(self.tamano)}, "
+                 f"{len(self.rotaciones)} {'rotaciones' if len(self.rotaciones) > 1 else 'rotación'})"]
+        for r, groups in enumerate(self.rotaciones, 1):
+            if len(self.rotaciones) > 1:
+                lines.append(f"Rotación {r}:")
+            for group in groups:
+                members = ", ".join(
+                    f"{sid} {self.nombres.get(sid, '')} ({group.roles_asignados.get(sid, '-')})".replace("  ", " ")
+                    for sid in group.estudiantes
+                )
+                lines.append(f"- Grupo {group.grupo_id}: {members}. {group.justificacion_agrupacion}")
+        return "\n".join(lines)
+
+
+class GroupingOptimizer:
+    """Búsqueda local de la partición con mayor complementariedad"""
+
+    def __init__(self, students: Sequence[dict], subjects: Optional[Sequence[str]] = None,
+                 roles: Sequence[str] = ROLES, restarts: int = RESTARTS, seed: int = 0):
+        subjects = SUBJECTS if subjects is None else tuple(subjects)
+        self.features = [StudentFeatures.from_profile(s, subjects) for s in students]
+        self.roles = tuple(roles)
+        self.restarts = restarts
+        self.seed = seed
+        n = len(self.features)
+        self.reasons = [[pair_reasons(self.features[i], self.features[j]) if i != j else []
+                         for j in range(n)] for i in range(n)]
+        self.base = [[sum(points for points, _ in self.reasons[i][j]) for j in range(n)] for i in range(n)]
+        self.affinity = [[role_affinity(role, f) for role in self.roles] for f in self.features]
+
+    # ------------------------------------------------------------------
+    # Partición
+    # ------------------------------------------------------------------
+    @staticmethod
+    def _group_score(matrix, members: Sequence[int]) -> float:
+        if len(members) < 2:
+            return 0.0
+        total = sum(matrix[a][b] for a, b in itertools.combinations(members, 2))
+        return total / (len(members) - 1)
+
+    def _local_search(self, matrix, groups: List[List[int]]) -> Tuple[float, List[List[int]]]:
+        """Intercambios de estudiantes entre grupos mientras mejore la puntuación
+
+        ``sums[k][g]`` guarda la afinidad de k con los miembros del grupo g, así
+        que cada intercambio se evalúa en O(1) y se actualiza en O(n).
+        """
+        n = len(matrix)
+        sums = [[sum(matrix[k][m] for m in group) for group in groups] for k in range(n)]
+        inverse = [1 / max(1, len(group) - 1) for group in groups]
+        pairs = list(itertools.combinations(range(len(groups)), 2))
+        improved = True
+        while improved:
+            improved = False
+            for g1, g2 in pairs:
+                first, second = groups[g1], groups[g2]
+                w1, w2 = inverse[g1], inverse[g2]
+                for x in range(len(first)):
+                    for y in range(len(second)):
+                        i, j = first[x], second[y]
+                        sums_i, sums_j = sums[i], sums[j]
+                        delta = ((sums_j[g1] - matrix[j][i] - sums_i[g1]) * w1
+                                 + (sums_i[g2] - matrix[i][j] - sums_j[g2]) * w2)
+                        if delta > 1e-9:
+                            first[x], second[y] = j, i
+                            for k in range(n):
+                                change = matrix[k][j] - matrix[k][i]
+                                sums[k][g1] += change
+                                sums[k][g2] -= change
+                            improved = True
+        return sum(self._group_score(matrix, g) for g in groups), groups
+
+    def partition(self, sizes: Sequence[int], matrix=None, rng_seed: int = 0) -> Tuple[float, List[List[int]]]:
+        """Mejor partición en grupos de los tamaños dados tras varios arranques"""
+        matrix = matrix or self.base
+        n = len(self.features)
+        best: Optional[Tuple[float, List[List[int]]]] = None
+        for restart in range(max(1, self.restarts)):
+            order = list(range(n))
+            random.Random(rng_seed * 1000 + restart).shuffle(order)
+            groups, start = [], 0
+            for size in sizes:
+                groups.append(order[start:start + size])
+                start += size
+            score, groups = self._local_search(matrix, groups)
+            if best is None or score > best[0] + 1e-9:
+                best = (score, [list(g) for g in groups])
+        return best
+
+    # ------------------------------------------------------------------
+    # Roles y justificación
+    # ------------------------------------------------------------------
+    def assign_roles(self, members: Sequence[int], used: Dict[int, set]) -> Dict[int, str]:
+        """Reparto de roles distintos que maximiza la afinidad (evita repetir rol en rotaciones)"""
+        if len(members) == 1:
+            return {members[0]: "trabajo individual"}
+        best_score, best = None, None
+        slots = min(len(members), len(self.roles))
+        for roles in itertools.permutations(range(len(self.roles)), slots):
+            score = 0.0
+            for member, role in zip(members, roles):
+                score += self.affinity[member][role]
+                if role in used.get(member, ()):
+                    score -= REPEAT_ROLE_PENALTY
+            if best_score is None or score > best_score + 1e-9:
+                best_score, best = score, roles
+        assignment = {member: self.roles[role] for member, role in zip(members, best)}
+        for member in members[slots:]:
+            assignment[member] = "apoyo al equipo"
+        return assignment
+
+    def justification(self, members: Sequence[int]) -> str:
+        reasons = sorted(
+            (reason for a, b in itertools.combinations(members, 2) for reason in self.reasons[a][b]
+             if reason[0] > 0),
+            key=lambda reason: -reason[0],
+        )
+        seen, texts = set(), []
+        for _, text in reasons:
+            if text not in seen:
+                seen.add(text)
+                texts.append(text)
+        if not texts:
+            return "Grupo equilibrado según los perfiles."
+        text = "; ".join(texts[:3]).rstrip(".")
+        return text[0].upper() + text[1:] + "."
+
+    # ------------------------------------------------------------------
+    # Rotaciones
+    # ------------------------------------------------------------------
+    def plan(self, size: int, rotations: int = 1) -> GroupingPlan:
+        """Agrupaciones para ``rotations`` rotaciones de grupos de ``size``"""
+        n = len(self.features)
+        if n == 0:
+            return GroupingPlan(size, [[] for _ in range(rotations)])
+        sizes = group_sizes(n, size)
+        matrix = [row[:] for row in self.base]
+        used_roles: Dict[int, set] = {}
+        result, scores = [], []
+        for rotation in range(rotations):
+            score, groups = self.partition(sizes, matrix, rng_seed=self.seed + rotation)
+            scores.append(round(score, 3))
+            groups.sort(key=lambda g: min(self.features[m].id for m in g))
+            assigned = []
+            for index, members in enumerate(groups):
+                members.sort(key=lambda m: self.features[m].id)
+                roles = self.assign_roles(members, used_roles)
+                for member, role in roles.items():
+                    used_roles.setdefault(member, set()).add(self.roles.index(role) if role in self.roles else -1)
+                for a, b in itertools.combinations(members, 2):
+                    matrix[a][b] -= REPEAT_PARTNER_PENALTY
+                    matrix[b][a] -= REPEAT_PARTNER_PENALTY
+                assigned.append(AsignacionGrupo(
+                    grupo_id=_group_label(index),
+                    estudiantes=[self.features[m].id for m in members],
+                    tipo_agrupacion=grouping_type(len(members)),
+                    justificacion_agrupacion=self.justification(members),
+                    roles_asignados={self.features[m].id: roles[m] for m in members},
+                ))
+            result.append(assigned)
+        names = {f.id: f.nombre for f in self.features}
+        return GroupingPlan(size, result, scores, names)
+
+
+def _group_label(index: int) -> str:
+    letters = ""
+    index += 1
+    while index:
+        index, rest = divmod(index - 1, 26)
+        letters = chr(ord("A") + rest) + letters
+    return letters
+
+
+def plan_groups(students: Sequence[dict], request_text: str = "", size: Optional[int] = None,
+                rotations: Optional[int] = None, seed: int = 0) -> GroupingPlan:
+    """Agrupaciones para una solicitud: tamaño, rotaciones y materias salen del texto"""
+    subjects = detect_subjects(request_text) if request_text else list(SUBJECTS)
+    optimizer = GroupingOptimizer(students, subjects, seed=seed)
+    return optimizer.plan(
+        size or group_size_from_request(request_text),
+        rotations or rotations_from_request(request_text),
+    )
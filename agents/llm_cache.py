@@ -0,0 +1,253 @@
+"""
+Caché en disco de respuestas del LLM direccionada por contenido.
+
+La clave combina modelo, temperatura, palabras de parada, versión del corpus y
+el prompt normalizado. Las respuestas se guardan en un único fichero SQLite
+con expulsión LRU por tamaño total y por antigüedad.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Union
+
+from crewai.llms.base_llm import BaseLLM
+from crewai.utilities.events import LLMStreamChunkEvent
+from crewai.utilities.events.base_events import BaseEvent
+from crewai.utilities.events.crewai_event_bus import crewai_event_bus
+from crewai.utilities.llm_utils import create_llm
+
+from agents.corpus import CACHE_DIR, get_corpus
+
+DEFAULT_CACHE_PATH = os.path.join(CACHE_DIR, "llm_cache.sqlite")
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+DEFAULT_MAX_AGE = 30 * 24 * 3600
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_prompt(messages: Union[str, List[Dict[str, str]]]) -> List[List[str]]:
+    """Mensajes con los espacios colapsados, para que la sangría no cambie la clave"""
+    if isinstance(messages, str):
+        messages = [{"role": "user", "content": messages}]
+    return [
+        [message.get("role", ""), _WHITESPACE_RE.sub(" ", str(message.get("content", ""))).strip()]
+        for message in messages
+    ]
+
+
+def cache_key(model: str, temperature: Optional[float], messages: Union[str, List[Dict[str, str]]],
+              corpus_version: str = "", stop: Optional[List[str]] = None) -> str:
+    """Clave SHA-256 de una llamada al LLM"""
+    payload = json.dumps({
+        "model": model,
+        "temperature": temperature,
+        "stop": sorted(stop or []),
+        "corpus": corpus_version,
+        "messages": normalize_prompt(messages),
+    }, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class CacheStats:
+    """Contadores de la caché en este proceso"""
+    hits: int = 0
+    misses: int = 0
+    writes: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class LLMResponseCache:
+    """Almacén SQLite de respuestas con expulsión LRU por tamaño y antigüedad"""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_MAX_BYTES,
+                 max_age: float = DEFAULT_MAX_AGE):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_access ON responses(last_access)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        """Respuesta guardada para la clave, o None (cuenta acierto/fallo)"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.max_age:
+                self.stats.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE responses SET last_access = ?, hits = hits + 1 WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            self.stats.hits += 1
+            return row[0]
+
+    def put(self, key: str, model: str, response: str):
+        """Guarda una respuesta y aplica la política de expulsión"""
+        now = time.time()
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created_at, last_access, hits) "
+                "VALUES (?, ?, ?, ?, ?, ?, 0)",
+                (key, model, response, size, now, now),
+            )
+            self.stats.writes += 1
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        cursor = self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.max_age,))
+        self.stats.evictions += cursor.rowcount
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM responses ORDER BY last_access ASC"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            self.stats.evictions += 1
+
+    def clear(self):
+        """Vacía la caché"""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def info(self) -> Dict[str, Any]:
+        """Estadísticas del proceso y ocupación en disco"""
+        with self._lock:
+            entries, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {
+            "hits": self.stats.hits,
+            "misses": self.stats.misses,
+            "writes": self.stats.writes,
+            "evictions": self.stats.evictions,
+            "hit_rate": round(self.stats.hit_rate, 3),
+            "entries": entries,
+            "bytes": total,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class LLMCacheHitEvent(BaseEvent):
+    """Respuesta servida desde la caché sin llamar al modelo"""
+    type: str = "ia4edu_llm_cache_hit"
+    model: str
+    messages: Any
+    response: str
+
+
+class CachedLLM(BaseLLM):
+    """LLM de CrewAI que consulta la caché antes de llamar al modelo real"""
+
+    def __init__(self, inner: BaseLLM, cache: LLMResponseCache):
+        self.inner = inner
+        self.cache = cache
+        super().__init__(model=inner.model, temperature=getattr(inner, "temperature", None))
+
+    @property
+    def stop(self) -> Optional[List[str]]:
+        return self.inner.stop
+
+    @stop.setter
+    def stop(self, value: Optional[List[str]]):
+        # CrewAI fija aquí las palabras de parada; deben llegar al LLM real
+        self.inner.stop = value
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        if tools or available_functions:
+            return self.inner.call(messages, tools, callbacks, available_functions, **kwargs)
+        key = cache_key(self.model, self.temperature, messages, get_corpus().version(), self.stop)
+        cached = self.cache.get(key)
+        if cached is not None:
+            if getattr(self.inner, "stream", False):
+                # Quien sigue el streaming recibe la respuesta guardada de una vez
+                crewai_event_bus.emit(self.inner, LLMStreamChunkEvent(chunk=cached))
+            crewai_event_bus.emit(self, LLMCacheHitEvent(model=self.model, messages=messages, response=cached))
+            return cached
+        response = self.inner.call(messages, tools, callbacks, available_functions, **kwargs)
+        if isinstance(response, str) and response.strip():
+            self.cache.put(key, self.model, response)
+        return response
+
+    def supports_stop_words(self) -> bool:
+        return self.inner.supports_stop_words()
+
+    def supports_function_calling(self) -> bool:
+        return getattr(self.inner, "supports_function_calling", lambda: False)()
+
+    def get_context_window_size(self) -> int:
+        return self.inner.get_context_window_size()
+
+
+def cache_enabled() -> bool:
+    """La caché se desactiva con IA4EDU_LLM_CACHE=0"""
+    return os.getenv("IA4EDU_LLM_CACHE", "1").lower() not in ("0", "false", "no", "off")
+
+
+_shared_cache: Optional[LLMResponseCache] = None
+_shared_lock = threading.Lock()
+
+
+def get_llm_cache() -> Optional[LLMResponseCache]:
+    """Caché compartida del proceso, o None si está desactivada"""
+    global _shared_cache
+    if not cache_enabled():
+        return None
+    with _shared_lock:
+        if _shared_cache is None:
+            max_mb = float(os.getenv("IA4EDU_LLM_CACHE_MAX_MB", DEFAULT_MAX_BYTES / (1024 * 1024)))
+            max_days = float(os.getenv("IA4EDU_LLM_CACHE_MAX_AGE_DAYS", DEFAULT_MAX_AGE / (24 * 3600)))
+            _shared_cache = LLMResponseCache(
+                os.getenv("IA4EDU_LLM_CACHE_PATH", DEFAULT_CACHE_PATH),
+                max_bytes=int(max_mb * 1024 * 1024),
+                max_age=max_days * 24 * 3600,
+            )
+        return _shared_cache
+
+
+def cached_llm(llm: Any, cache: Optional[LLMResponseCache]) -> Any:
+    """Envuelve el cliente (p. ej. ChatLiteLLM) con la caché si está activa"""
+    if cache is None:
+        return llm
+    return CachedLLM(create_llm(llm), cache)
@@ -0,0 +1,173 @@
+"""
+Registro de clientes LLM compartido por todos los agentes.
+
+Cada agente recibe su propio objeto ``LLM`` de CrewAI (CrewAI le fija
+palabras de parada y streaming por separado), pero todos comparten un único
+cliente HTTP con conexiones keep-alive, de modo que las etapas reutilizan la
+conexión TLS en lugar de abrir una nueva por llamada. El modelo y la
+temperatura de cada agente salen de ``config/llm.json`` mediante niveles
+("rapido", "estandar", "potente"). El bloque ``cascada`` indica qué agentes
+empiezan por el nivel más rápido y escalan a los siguientes (ver
+``agents.cascade``).
+"""
+
+import json
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import httpx
+from crewai import LLM
+from litellm.llms.custom_httpx.http_handler import HTTPHandler
+
+DEFAULT_CONFIG_PATH = os.path.join("config", "llm.json")
+DEFAULT_MODEL = "gemini/gemini-1.5-flash"
+DEFAULT_TEMPERATURE = 0.7
+# Variables con la clave del proveedor, por orden de preferencia
+API_KEY_VARS = ("GEMINI_API_KEY", "LLM_API_KEY", "GOOGLE_API_KEY")
+OFF_VALUES = ("0", "false", "no", "off")
+
+
+@dataclass(frozen=True)
+class ModelSettings:
+    """Modelo y parámetros de generación de un agente"""
+    model: str = DEFAULT_MODEL
+    temperature: Optional[float] = DEFAULT_TEMPERATURE
+    max_tokens: Optional[int] = None
+
+
+@dataclass(frozen=True)
+class HTTPSettings:
+    """Parámetros del cliente HTTP compartido"""
+    timeout: float = 120.0
+    connect_timeout: float = 10.0
+    max_connections: int = 20
+    max_keepalive_connections: int = 10
+    keepalive_expiry: float = 120.0
+
+
+@dataclass
+class LLMConfig:
+    """Niveles de modelo, nivel de cada agente y cliente HTTP"""
+    tiers: Dict[str, ModelSettings] = field(default_factory=lambda: {"estandar": ModelSettings()})
+    default_tier: str = "estandar"
+    agents: Dict[str, Any] = field(default_factory=dict)
+    http: HTTPSettings = field(default_factory=HTTPSettings)
+    # Niveles de la cascada, del más rápido al más potente, y agentes que la usan
+    cascade_tiers: List[str] = field(default_factory=list)
+    cascade_agents: List[str] = field(default_factory=list)
+
+    def settings_for(self, agent: str) -> ModelSettings:
+        """Ajustes del agente: su nivel o un bloque propio; IA4EDU_MODEL_<AGENTE> cambia el modelo"""
+        entry = self.agents.get(agent, self.default_tier)
+        if isinstance(entry, dict):
+            settings = ModelSettings(**entry)
+        elif entry in self.tiers:
+            settings = self.tiers[entry]
+        else:
+            raise ValueError(f"Nivel de modelo desconocido para {agent}: {entry}")
+        override = os.getenv(f"IA4EDU_MODEL_{agent.upper()}")
+        if override:
+            settings = ModelSettings(override, settings.temperature, settings.max_tokens)
+        return settings
+
+    def cascade_for(self, agent: str) -> List[str]:
+        """Niveles de la cascada del agente ([] si no la usa, si IA4EDU_CASCADE=0 o si se fija su modelo)"""
+        if agent not in self.cascade_agents or os.getenv(f"IA4EDU_MODEL_{agent.upper()}"):
+            return []
+        if os.getenv("IA4EDU_CASCADE", "1").lower() in OFF_VALUES:
+            return []
+        for tier in self.cascade_tiers:
+            if tier not in self.tiers:
+                raise ValueError(f"Nivel de modelo desconocido en la cascada: {tier}")
+        return list(self.cascade_tiers)
+
+
+def load_llm_config(path: Optional[str] = None) -> LLMConfig:
+    """Lee la configuración (IA4EDU_LLM_CONFIG o config/llm.json); sin fichero, valores por defecto"""
+    path = path or os.getenv("IA4EDU_LLM_CONFIG", DEFAULT_CONFIG_PATH)
+    if not os.path.exists(path):
+        return LLMConfig()
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    tiers = {name: ModelSettings(**values) for name, values in data.get("niveles", {}).items()}
+    default_tier = data.get("por_defecto", "estandar")
+    if default_tier not in tiers:
+        tiers[default_tier] = ModelSettings()
+    cascade = data.get("cascada", {})
+    return LLMConfig(
+        tiers=tiers,
+        default_tier=default_tier,
+        agents=data.get("agentes", {}),
+        http=HTTPSettings(**data.get("http", {})),
+        cascade_tiers=cascade.get("niveles", []),
+        cascade_agents=cascade.get("agentes", []),
+    )
+
+
+def resolve_api_key() -> Optional[str]:
+    """Clave del proveedor a partir de la primera variable definida"""
+    return next((os.getenv(var) for var in API_KEY_VARS if os.getenv(var)), None)
+
+
+class LLMClientRegistry:
+    """Crea los LLM de los agentes sobre un cliente HTTP compartido"""
+
+    def __init__(self, config: Optional[LLMConfig] = None):
+        self.config = config or load_llm_config()
+        self._http: Optional[HTTPHandler] = None
+        self._lock = threading.Lock()
+
+    @property
+    def http_client(self) -> HTTPHandler:
+        """Cliente HTTP con pool de conexiones keep-alive (se crea al primer uso)"""
+        with self._lock:
+            if self._http is None:
+                http = self.config.http
+                self._http = HTTPHandler(client=httpx.Client(
+                    timeout=httpx.Timeout(http.timeout, connect=http.connect_timeout),
+                    limits=httpx.Limits(
+                        max_connections=http.max_connections,
+                        max_keepalive_connections=http.max_keepalive_connections,
+                        keepalive_expiry=http.keepalive_expiry,
+                    ),
+                ))
+            return self._http
+
+    def llm_for(self, agent: str) -> LLM:
+        """LLM de CrewAI para el agente, con su modelo y el cliente compartido"""
+        return self.llm_with(self.config.settings_for(agent))
+
+    def llm_for_tier(self, tier: str) -> LLM:
+        """LLM de CrewAI con los ajustes de un nivel"""
+        return self.llm_with(self.config.tiers[tier])
+
+    def llm_with(self, settings: ModelSettings) -> LLM:
+        return LLM(
+            model=settings.model,
+            temperature=settings.temperature,
+            max_tokens=settings.max_tokens,
+            api_key=resolve_api_key(),
+            timeout=self.config.http.timeout,
+            client=self.http_client,
+        )
+
+    def close(self):
+        with self._lock:
+            if self._http is not None:
+                self._http.close()
+                self._http = None
+
+
+_shared_registry: Optional[LLMClientRegistry] = None
+_shared_lock = threading.Lock()
+
+
+def get_llm_registry() -> LLMClientRegistry:
+    """Registro compartido del proceso"""
+    global _shared_registry
+    with _shared_lock:
+        if _shared_registry is None:
+            _shared_registry = LLMClientRegistry()
+        return _shared_registry
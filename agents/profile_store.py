@@ -0,0 +1,249 @@
+"""
+Repositorio de perfiles con muchas aulas.
+
+Los perfiles de cada aula se indexan en un SQLite local (regenerable, en
+``CACHE_DIR``) con una fila por alumno y un índice por aula, de modo que una
+solicitud solo lee los alumnos de su aula. Fuentes admitidas en el directorio
+de datos:
+
+- ``perfiles_<aula>.json``: el formato original, un aula por fichero con la
+  lista ``estudiantes``.
+- ``aulas/*.jsonl``: un alumno por línea con ``aula_id`` y, opcionalmente,
+  ``centro``, ``curso`` y ``grupo``. Se leen en streaming, línea a línea y por
+  lotes, sin cargar el fichero entero.
+
+Un aula puede repartirse entre varias fuentes: sus alumnos se guardan por
+(aula, fuente, orden) y se leen en el orden de las fuentes. Cada fuente se
+vuelve a importar solo cuando cambia su mtime o su tamaño, y una importación
+que falla a medias se deshace entera.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from agents.corpus import CACHE_DIR, DATA_DIR
+
+CLASSROOM_FILE_PATTERN = "perfiles_*.json"
+BULK_PATTERN = os.path.join("aulas", "*.jsonl")
+# Campos de cada línea JSONL que describen el aula y no al alumno
+CLASSROOM_FIELDS = ("aula_id", "centro", "curso", "grupo")
+INSERT_BATCH = 1000
+# Sube al cambiar el esquema: el índice es regenerable y se reconstruye
+STORE_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS classrooms (
+    id TEXT NOT NULL,
+    centro TEXT NOT NULL DEFAULT '',
+    curso TEXT NOT NULL DEFAULT '',
+    grupo TEXT NOT NULL DEFAULT '',
+    source TEXT NOT NULL,
+    PRIMARY KEY (id, source)
+);
+CREATE INDEX IF NOT EXISTS idx_classrooms_centro ON classrooms(centro, id);
+CREATE TABLE IF NOT EXISTS students (
+    aula_id TEXT NOT NULL,
+    orden INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (aula_id, source, orden)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_students_source ON students(source);
+"""
+
+# Primera fuente de cada aula: de ella salen centro, curso y grupo
+FIRST_SOURCE = "c.source = (SELECT MIN(source) FROM classrooms WHERE id = c.id)"
+
+
+def classroom_id_from_path(path: str) -> str:
+    """``perfiles_4_primaria.json`` -> ``4_primaria``"""
+    base = os.path.basename(path)
+    return base[len("perfiles_"):-len(".json")]
+
+
+def default_store_path(data_dir: str) -> str:
+    """Un índice por directorio de datos"""
+    digest = hashlib.sha1(os.path.abspath(data_dir).encode("utf-8")).hexdigest()[:8]
+    return os.path.join(CACHE_DIR, f"perfiles_{digest}.sqlite")
+
+
+def iter_jsonl(path: str) -> Iterator[dict]:
+    """Registros de un JSONL leídos línea a línea (se saltan las líneas vacías)"""
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{path}:{number}: JSON inválido ({e})") from e
+
+
+@dataclass
+class ClassroomInfo:
+    """Aula indexada"""
+    id: str
+    centro: str
+    curso: str
+    grupo: str
+    alumnos: int
+
+
+class ProfileStore:
+    """Índice de aulas y alumnos; lee solo el aula pedida"""
+
+    def __init__(self, data_dir: str = DATA_DIR, path: Optional[str] = None):
+        self.data_dir = data_dir
+        self.path = path or default_store_path(data_dir)
+        self._lock = threading.Lock()
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] != STORE_VERSION:
+            self._conn.executescript("DROP TABLE IF EXISTS students; DROP TABLE IF EXISTS classrooms; "
+                                     "DROP TABLE IF EXISTS sources;")
+            self._conn.execute(f"PRAGMA user_version = {STORE_VERSION}")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    # ------------------------------------------------------------------
+    # Importación
+    # ------------------------------------------------------------------
+    def sources(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.data_dir, CLASSROOM_FILE_PATTERN))) + \
+            sorted(glob.glob(os.path.join(self.data_dir, BULK_PATTERN)))
+
+    def sync(self) -> int:
+        """Reimporta las fuentes nuevas o modificadas; devuelve cuántas se importaron"""
+        with self._lock:
+            known = dict((path, (mtime, size)) for path, mtime, size in
+                         self._conn.execute("SELECT path, mtime_ns, size FROM sources"))
+            current = self.sources()
+            imported = 0
+            for path in current:
+                st = os.stat(path)
+                signature = (st.st_mtime_ns, st.st_size)
+                if known.get(path) == signature:
+                    continue
+                try:
+                    self._import(path, signature)
+                except Exception:
+                    self._conn.rollback()
+                    raise
+                self._conn.commit()
+                imported += 1
+            for path in set(known) - set(current):
+                self._forget(path)
+                self._conn.execute("DELETE FROM sources WHERE path = ?", (path,))
+            self._conn.commit()
+            return imported
+
+    def _forget(self, path: str):
+        self._conn.execute("DELETE FROM students WHERE source = ?", (path,))
+        self._conn.execute("DELETE FROM classrooms WHERE source = ?", (path,))
+
+    def _import(self, path: str, signature: Tuple[int, int]):
+        self._forget(path)
+        if path.endswith(".jsonl"):
+            self._import_jsonl(path)
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            aula = classroom_id_from_path(path)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO classrooms (id, centro, curso, grupo, source) VALUES (?, ?, ?, ?, ?)",
+                (aula, data.get("centro", ""), data.get("curso", aula), data.get("grupo", ""), path),
+            )
+            self._conn.executemany(
+                "INSERT INTO students (aula_id, orden, source, data) VALUES (?, ?, ?, ?)",
+                [(aula, i, path, json.dumps(s, ensure_ascii=False)) for i, s in enumerate(data.get("estudiantes", []))],
+            )
+        self._conn.execute("INSERT OR REPLACE INTO sources (path, mtime_ns, size) VALUES (?, ?, ?)",
+                           (path, *signature))
+
+    def _import_jsonl(self, path: str):
+        counters: Dict[str, int] = {}
+        batch = []
+        for record in iter_jsonl(path):
+            aula = str(record.get("aula_id", ""))
+            if not aula:
+                raise ValueError(f"{path}: falta aula_id en el alumno {record.get('id', '?')}")
+            if aula not in counters:
+                counters[aula] = 0
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO classrooms (id, centro, curso, grupo, source) VALUES (?, ?, ?, ?, ?)",
+                    (aula, record.get("centro", ""), record.get("curso", ""), record.get("grupo", ""), path),
+                )
+            student = {k: v for k, v in record.items() if k not in CLASSROOM_FIELDS}
+            batch.append((aula, counters[aula], path, json.dumps(student, ensure_ascii=False)))
+            counters[aula] += 1
+            if len(batch) >= INSERT_BATCH:
+                self._insert(batch)
+                batch = []
+        self._insert(batch)
+
+    def _insert(self, rows):
+        if rows:
+            self._conn.executemany(
+                "INSERT INTO students (aula_id, orden, source, data) VALUES (?, ?, ?, ?)", rows
+            )
+
+    # ------------------------------------------------------------------
+    # Consultas
+    # ------------------------------------------------------------------
+    def classrooms(self, centro: Optional[str] = None) -> List[ClassroomInfo]:
+        """Aulas indexadas con su número de alumnos"""
+        query = ("SELECT c.id, c.centro, c.curso, c.grupo, "
+                 "(SELECT COUNT(*) FROM students s WHERE s.aula_id = c.id) FROM classrooms c "
+                 "WHERE " + FIRST_SOURCE)
+        params: tuple = ()
+        if centro:
+            query += " AND c.centro = ?"
+            params = (centro,)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY c.centro, c.id", params).fetchall()
+        return [ClassroomInfo(*row) for row in rows]
+
+    def classroom(self, aula_id: str) -> Optional[ClassroomInfo]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT c.id, c.centro, c.curso, c.grupo, "
+                "(SELECT COUNT(*) FROM students s WHERE s.aula_id = c.id) FROM classrooms c "
+                "WHERE c.id = ? AND " + FIRST_SOURCE,
+                (aula_id,),
+            ).fetchone()
+        return ClassroomInfo(*row) if row else None
+
+    def students(self, aula_id: str) -> List[dict]:
+        """Alumnos de un aula en el orden de sus fuentes (usa la clave primaria por aula)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM students WHERE aula_id = ? ORDER BY source, orden", (aula_id,)
+            ).fetchall()
+        return [json.loads(data) for data, in rows]
+
+    def signature(self, aula_id: str) -> Optional[tuple]:
+        """Firma de las fuentes del aula (cambia si se reimporta cualquiera)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT s.path, s.mtime_ns, s.size FROM classrooms c JOIN sources s ON s.path = c.source "
+                "WHERE c.id = ? ORDER BY s.path", (aula_id,),
+            ).fetchall()
+        return tuple(value for row in rows for value in row) if rows else None
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,296 @@
+"""
+Proyección y codificación compacta de los perfiles de estudiantes.
+
+En lugar de enviar el JSON completo con sangría, cada estudiante ocupa una
+línea con sus campos separados por ``|`` y los niveles de competencia
+abreviados. Solo se incluyen las materias relevantes para la solicitud. Los
+campos que no son los habituales (por ejemplo ``observaciones`` u otra materia
+con sus competencias) se añaden como columnas extra con su nombre. La
+codificación es reversible (``decode_profiles``) para poder comprobar que no
+se pierde información.
+"""
+
+import json
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+from agents.retrieval import tokenize
+
+SUBJECTS = ("matematicas", "lengua", "ciencias")
+
+# Términos (se comparan ya tokenizados) que delatan la materia de una solicitud
+SUBJECT_KEYWORDS = {
+    "matematicas": """matemáticas matemático fracciones fracción números numeración sumas restas
+        multiplicación división operaciones cálculo geometría figuras formas áreas perímetro
+        medida problemas decimales llevadas dinero euros porcentajes estadística gráficos""",
+    "lengua": """lengua lectura leer escritura escribir texto textos cuento poesía verbos verbales
+        gramática ortografía vocabulario redacción narración comprensión lectora oral expresión""",
+    "ciencias": """ciencias científico experimento experimentos ecosistemas célula células plantas
+        animales cuerpo humano naturaleza energía materia agua clima método laboratorio""",
+}
+_SUBJECT_TERMS = {subject: set(tokenize(words)) for subject, words in SUBJECT_KEYWORDS.items()}
+
+LEVEL_CODES = {
+    "INICIADO": "I",
+    "EN_PROCESO": "P",
+    "CONSEGUIDO": "C",
+    "SUPERADO": "S",
+}
+_LEVEL_NAMES = {code: level for level, code in LEVEL_CODES.items()}
+
+# Campos escalares y de lista en el orden de la línea codificada
+FIELDS = (
+    ("id", "id", False),
+    ("nombre", "nombre", False),
+    ("diagnostico_formal", "diagnostico", False),
+    ("nivel_apoyo", "apoyo", False),
+    ("canal_preferido", "canal", False),
+    ("estilo_aprendizaje", "estilos", True),
+    ("temperamento", "temperamento", False),
+    ("tolerancia_frustracion", "tolerancia", False),
+    ("intereses", "intereses", True),
+    ("necesidades_especiales", "necesidades", True),
+)
+# Campos que se omiten en la variante mínima (los cubren otros campos)
+MINIMAL_SKIP = ("estilo_aprendizaje", "intereses")
+
+# Sufijos de las columnas extra según el tipo de valor (sin sufijo: texto)
+LIST_SUFFIX = "[]"
+MAP_SUFFIX = "{}"
+JSON_SUFFIX = "#"
+
+FIELD_SEP = " | "
+LIST_SEP = ","
+MISSING = "-"
+HEADER_PREFIX = "# campos: "
+
+
+def detect_subjects(text: str, threshold: float = 0.5) -> List[str]:
+    """Materias mencionadas en el texto; todas si no se reconoce ninguna
+
+    Se devuelven las materias con al menos ``threshold`` veces las menciones de
+    la más citada, para que un diseño largo no arrastre todas las materias.
+    """
+    counts = Counter()
+    for token in tokenize(text):
+        for subject, terms in _SUBJECT_TERMS.items():
+            if token in terms:
+                counts[subject] += 1
+    if not counts:
+        return list(SUBJECTS)
+    top = max(counts.values())
+    return [subject for subject in SUBJECTS if counts[subject] >= top * threshold]
+
+
+def project_profiles(students: Iterable[dict], subjects: Optional[Sequence[str]] = None,
+                     skip_fields: Sequence[str] = ()) -> List[dict]:
+    """Copia de los perfiles solo con las materias y campos pedidos"""
+    subjects = SUBJECTS if subjects is None else tuple(subjects)
+    projected = []
+    for student in students:
+        item = {}
+        for key, value in student.items():
+            if key in skip_fields:
+                continue
+            if key in SUBJECTS and key not in subjects:
+                continue
+            item[key] = value
+        projected.append(item)
+    return projected
+
+
+def _escape(value: str) -> str:
+    return (value.replace("\\", "\\\\").replace("|", "\\p")
+            .replace(LIST_SEP, "\\c").replace("=", "\\e").replace("\n", " "))
+
+
+def _unescape(value: str) -> str:
+    out, i = [], 0
+    while i < len(value):
+        if value[i] == "\\" and i + 1 < len(value):
+            out.append({"\\": "\\", "p": "|", "c": LIST_SEP, "e": "="}.get(value[i + 1], value[i + 1]))
+            i += 2
+        else:
+            out.append(value[i])
+            i += 1
+    return "".join(out)
+
+
+def _level_code(level: str) -> str:
+    return LEVEL_CODES.get(level, _escape(level))
+
+
+def _is_text_list(value) -> bool:
+    return isinstance(value, list) and all(isinstance(v, str) for v in value)
+
+
+def _is_text_map(value) -> bool:
+    return isinstance(value, dict) and all(isinstance(k, str) and isinstance(v, str) for k, v in value.items())
+
+
+def _extra_columns(students: Sequence[dict], skip_fields: Sequence[str]) -> List[tuple]:
+    """(clave, columna) de los campos no habituales, en orden de aparición
+
+    El tipo de la columna sale de todos sus valores; lo que no es texto, lista
+    de textos o mapa de textos (o choca con una columna fija) va como JSON.
+    """
+    known = {key for key, _, _ in FIELDS} | set(SUBJECTS) | set(skip_fields)
+    reserved = {label for _, label, _ in FIELDS} | set(SUBJECTS)
+    values: Dict[str, list] = {}
+    for student in students:
+        for key, value in student.items():
+            if key not in known and value is not None:
+                values.setdefault(key, []).append(value)
+    columns = []
+    for key, items in values.items():
+        if all(isinstance(v, str) for v in items) and key not in reserved:
+            suffix = ""
+        elif all(_is_text_list(v) for v in items) and key not in reserved:
+            suffix = LIST_SUFFIX
+        elif all(_is_text_map(v) for v in items):
+            suffix = MAP_SUFFIX
+        else:
+            suffix = JSON_SUFFIX
+        columns.append((key, _escape(key) + suffix))
+    return columns
+
+
+def _pairs(mapping: dict, code: Callable[[str], str] = _escape) -> str:
+    return LIST_SEP.join(f"{_escape(name)}={code(value)}" for name, value in mapping.items())
+
+
+def encode_profiles(students: Iterable[dict], subjects: Optional[Sequence[str]] = None,
+                    skip_fields: Sequence[str] = ()) -> str:
+    """Codifica los perfiles en una línea por estudiante
+
+    La primera línea describe los campos y la leyenda de niveles.
+    """
+    students = list(students)
+    subjects = [s for s in SUBJECTS if subjects is None or s in subjects]
+    fields = [f for f in FIELDS if f[0] not in skip_fields]
+    extra = _extra_columns(students, skip_fields)
+    columns = ([label + ("[]" if is_list else "") for _, label, is_list in fields] + subjects
+               + [column for _, column in extra])
+    legend = ", ".join(f"{code}={level}" for level, code in LEVEL_CODES.items())
+    lines = [f"{HEADER_PREFIX}{FIELD_SEP.join(columns)} (niveles: {legend}; {MISSING}=sin dato)"]
+
+    for student in students:
+        cells = []
+        for key, _, is_list in fields:
+            value = student.get(key)
+            if value is None:
+                cells.append(MISSING)
+            elif is_list:
+                cells.append(_cell(LIST_SEP.join(_escape(str(v)) for v in value)))
+            else:
+                cells.append(_cell(_escape(str(value))))
+        for subject in subjects:
+            competencies = student.get(subject)
+            if competencies is None:
+                cells.append(MISSING)
+            else:
+                cells.append(_cell(_pairs(competencies, _level_code)))
+        for key, column in extra:
+            value = student.get(key)
+            if value is None:
+                cells.append(MISSING)
+            elif column.endswith(JSON_SUFFIX):
+                cells.append(_cell(_escape(json.dumps(value, ensure_ascii=False))))
+            elif column.endswith(MAP_SUFFIX):
+                cells.append(_cell(_pairs(value)))
+            elif column.endswith(LIST_SUFFIX):
+                cells.append(_cell(LIST_SEP.join(_escape(v) for v in value)))
+            else:
+                cells.append(_cell(_escape(value)))
+        lines.append(FIELD_SEP.join(cells))
+    return "\n".join(lines)
+
+
+def _cell(text: str) -> str:
+    """Un "-" literal no debe confundirse con un dato ausente"""
+    return "\\-" if text == MISSING else text
+
+
+def decode_profiles(text: str) -> List[dict]:
+    """Reconstruye los perfiles a partir de ``encode_profiles``"""
+    lines = text.splitlines()
+    header = lines[0][len(HEADER_PREFIX):].split(" (niveles:")[0]
+    columns = header.split(FIELD_SEP)
+    labels = {label: (key, is_list) for key, label, is_list in FIELDS}
+
+    students = []
+    for line in lines[1:]:
+        if not line.strip():
+            continue
+        cells = _split_fields(line)
+        student: Dict[str, object] = {}
+        for column, cell in zip(columns, cells):
+            if cell == MISSING:
+                continue
+            if column in SUBJECTS:
+                student[column] = _decode_pairs(cell, lambda code: _LEVEL_NAMES.get(code, _unescape(code)))
+                continue
+            if column.rstrip("[]") not in labels:
+                student.update(_decode_extra(column, cell))
+                continue
+            key, is_list = labels[column.rstrip("[]")]
+            if is_list:
+                student[key] = [_unescape(v) for v in _split(cell, LIST_SEP)] if cell else []
+            else:
+                student[key] = _unescape(cell)
+        students.append(student)
+    return students
+
+
+def _decode_pairs(cell: str, decode: Optional[Callable[[str], str]] = None) -> Dict[str, str]:
+    pairs = {}
+    for pair in _split(cell, LIST_SEP) if cell else []:
+        name, code = pair.split("=", 1)
+        pairs[_unescape(name)] = (decode or _unescape)(code)
+    return pairs
+
+
+def _decode_extra(column: str, cell: str) -> Dict[str, object]:
+    """Campo no habitual a partir de su columna y su celda"""
+    for suffix in (JSON_SUFFIX, MAP_SUFFIX, LIST_SUFFIX):
+        if column.endswith(suffix):
+            key = _unescape(column[:-len(suffix)])
+            break
+    else:
+        return {_unescape(column): _unescape(cell)}
+    if suffix == JSON_SUFFIX:
+        return {key: json.loads(_unescape(cell))}
+    if suffix == MAP_SUFFIX:
+        return {key: _decode_pairs(cell)}
+    return {key: [_unescape(v) for v in _split(cell, LIST_SEP)] if cell else []}
+
+
+def _split(text: str, sep: str) -> List[str]:
+    """Divide por un separador de un carácter respetando los escapes"""
+    parts, current, i = [], [], 0
+    while i < len(text):
+        if text[i] == "\\" and i + 1 < len(text):
+            current.append(text[i:i + 2])
+            i += 2
+        elif text[i] == sep:
+            parts.append("".join(current))
+            current = []
+            i += 1
+        else:
+            current.append(text[i])
+            i += 1
+    parts.append("".join(current))
+    return parts
+
+
+def _split_fields(line: str) -> List[str]:
+    return [cell.strip() for cell in _split(line, "|")]
+
+
+def profile_encodings(students: List[dict], request_text: str = "") -> List[str]:
+    """Variantes para el prompt: materias de la solicitud y, después, sin campos secundarios"""
+    subjects = detect_subjects(request_text) if request_text else list(SUBJECTS)
+    return [
+        encode_profiles(students, subjects),
+        encode_profiles(students, subjects, skip_fields=MINIMAL_SKIP),
+    ]
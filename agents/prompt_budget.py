@@ -0,0 +1,208 @@
+"""
+Presupuesto de tokens por etapa y compactación de los componentes del prompt.
+
+Cada prompt se describe como una lista de componentes con prioridad y una
+serie de variantes de más completa a más compacta. Si el total supera el
+presupuesto de la etapa se compacta primero el componente menos prioritario,
+y solo se eliminan los componentes opcionales cuando ya no quedan variantes.
+"""
+
+import json
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from agents.tokens import estimate_tokens
+
+# Presupuesto (tokens) de la parte variable del prompt de cada etapa
+DEFAULT_STAGE_BUDGETS = {
+    "analysis": 2500,
+    "research": 4000,
+    "design": 5000,
+    "refinement": 6000,
+}
+
+UPSTREAM_IN_CONTEXT = "(resultado de la etapa anterior, incluido a continuación como contexto)"
+
+_HEADING_LINE_RE = re.compile(r"^\s*(#{1,6}\s|\d+[.)]\s|[A-ZÁÉÍÓÚÑ][A-ZÁÉÍÓÚÑ ]{3,}:?\s*$|\*\*[^*]+\*\*:?\s*$)")
+_BULLET_LINE_RE = re.compile(r"^\s*([-*•]|\d+[.)])\s+")
+
+
+def stage_budget(stage: str) -> int:
+    """Presupuesto de la etapa; se puede ajustar con IA4EDU_PROMPT_BUDGET_<ETAPA>"""
+    override = os.getenv(f"IA4EDU_PROMPT_BUDGET_{stage.upper()}")
+    if override:
+        return int(override)
+    return DEFAULT_STAGE_BUDGETS.get(stage, DEFAULT_STAGE_BUDGETS["design"])
+
+
+def minify_json(text: str) -> str:
+    """JSON sin sangría ni espacios (devuelve el texto tal cual si no es JSON)"""
+    try:
+        return json.dumps(json.loads(text), ensure_ascii=False, separators=(",", ":"))
+    except ValueError:
+        return text
+
+
+def summarize_text(text: str, max_tokens: int) -> str:
+    """Resumen extractivo: conserva títulos y el inicio de cada bloque hasta el límite
+
+    Se recorren primero los encabezados, después las viñetas y por último el
+    resto de líneas, pero el resultado mantiene el orden original del texto.
+    """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    lines = [line for line in text.splitlines() if line.strip()]
+    ranked = sorted(
+        range(len(lines)),
+        key=lambda i: (
+            0 if _HEADING_LINE_RE.match(lines[i]) else 1 if _BULLET_LINE_RE.match(lines[i]) else 2,
+            i,
+        ),
+    )
+    keep = set()
+    used = 0
+    for i in ranked:
+        cost = estimate_tokens(lines[i]) + 1
+        if used + cost > max_tokens:
+            continue
+        keep.add(i)
+        used += cost
+    summary = "\n".join(lines[i] for i in sorted(keep))
+    return summary + "\n[...]" if summary else text[: max_tokens * 4] + " [...]"
+
+
+def upstream_text(value: Any) -> str:
+    """Texto de un resultado previo; si es una Task, CrewAI ya lo pasa como contexto"""
+    if isinstance(value, str):
+        return value
+    if hasattr(value, "raw"):
+        return value.raw
+    return UPSTREAM_IN_CONTEXT
+
+
+def upstream_variants(value: Any, ratios: Sequence[float] = (0.5, 0.25)) -> List[str]:
+    """Variantes de un resultado previo: completo y resúmenes cada vez más cortos"""
+    text = upstream_text(value)
+    variants = [text]
+    tokens = estimate_tokens(text)
+    for ratio in ratios:
+        summary = summarize_text(text, max(int(tokens * ratio), 50))
+        if summary != variants[-1]:
+            variants.append(summary)
+    return variants
+
+
+@dataclass
+class PromptComponent:
+    """Parte variable de un prompt
+
+    ``variants`` va de la versión más completa a la más compacta. Un componente
+    no obligatorio puede eliminarse cuando se agotan sus variantes. A mayor
+    ``priority``, más tarde se compacta.
+    """
+    name: str
+    variants: List[str]
+    priority: int = 0
+    required: bool = True
+
+    def __post_init__(self):
+        if not self.variants:
+            self.variants = [""]
+
+
+@dataclass
+class ComponentUsage:
+    """Tokens de un componente antes y después del ajuste"""
+    name: str
+    tokens_before: int
+    tokens_after: int
+    level: int
+    dropped: bool = False
+
+
+@dataclass
+class BudgetReport:
+    """Resultado del ajuste de un prompt a su presupuesto"""
+    stage: str
+    budget: int
+    components: List[ComponentUsage] = field(default_factory=list)
+
+    @property
+    def tokens_before(self) -> int:
+        return sum(c.tokens_before for c in self.components)
+
+    @property
+    def tokens_after(self) -> int:
+        return sum(c.tokens_after for c in self.components)
+
+    @property
+    def over_budget(self) -> bool:
+        return self.tokens_after > self.budget
+
+    @property
+    def compacted(self) -> List[str]:
+        return [c.name for c in self.components if c.level > 0 and not c.dropped]
+
+    @property
+    def dropped(self) -> List[str]:
+        return [c.name for c in self.components if c.dropped]
+
+    def summary(self) -> str:
+        """Una línea legible con el ajuste realizado"""
+        text = f"[{self.stage}] {self.tokens_before} -> {self.tokens_after} tokens (presupuesto {self.budget})"
+        if self.compacted:
+            text += f"; compactado: {', '.join(self.compacted)}"
+        if self.dropped:
+            text += f"; eliminado: {', '.join(self.dropped)}"
+        if self.over_budget:
+            text += "; sigue por encima del presupuesto"
+        return text
+
+
+def fit_prompt(stage: str, components: List[PromptComponent],
+               budget: Optional[int] = None) -> Tuple[Dict[str, str], BudgetReport]:
+    """Ajusta los componentes al presupuesto de la etapa
+
+    Devuelve el texto elegido para cada componente y el informe de lo que se
+    compactó o eliminó.
+    """
+    budget = stage_budget(stage) if budget is None else budget
+    levels = {c.name: 0 for c in components}
+    dropped = {c.name: False for c in components}
+    costs = {c.name: [estimate_tokens(v) for v in c.variants] for c in components}
+
+    def current_cost(c: PromptComponent) -> int:
+        return 0 if dropped[c.name] else costs[c.name][levels[c.name]]
+
+    total = sum(current_cost(c) for c in components)
+    while total > budget:
+        candidates = [
+            c for c in components
+            if not dropped[c.name]
+            and (levels[c.name] + 1 < len(c.variants) or not c.required)
+            and current_cost(c) > 0
+        ]
+        if not candidates:
+            break
+        # El menos prioritario primero y, a igual prioridad, el más grande
+        target = min(candidates, key=lambda c: (c.priority, -current_cost(c)))
+        if levels[target.name] + 1 < len(target.variants):
+            levels[target.name] += 1
+        else:
+            dropped[target.name] = True
+        total = sum(current_cost(c) for c in components)
+
+    chosen: Dict[str, str] = {}
+    report = BudgetReport(stage=stage, budget=budget)
+    for c in components:
+        chosen[c.name] = "" if dropped[c.name] else c.variants[levels[c.name]]
+        report.components.append(ComponentUsage(
+            name=c.name,
+            tokens_before=costs[c.name][0],
+            tokens_after=current_cost(c),
+            level=levels[c.name],
+            dropped=dropped[c.name],
+        ))
+    return chosen, report
@@ -0,0 +1,290 @@
+"""
+Refinamiento por secciones de una actividad ya diseñada.
+
+La actividad se divide por encabezados en secciones contiguas (su
+concatenación reproduce el texto exacto). A partir del feedback se eligen las
+secciones afectadas: referencias explícitas ("fase 2"), tipos de sección
+("materiales", "adaptación para TDAH") y coincidencia léxica. El modelo solo
+reescribe esas secciones, delimitadas con marcadores, y después se insertan en
+su sitio. Si el feedback afecta a toda la actividad se devuelve None y se hace
+la reescritura completa.
+"""
+
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from agents.chunking import classify_section, section_kinds
+from agents.retrieval import BM25Index, fold_accents
+from agents.tokens import estimate_tokens
+
+# Máximo de secciones que se reescriben y fracción del documento a partir de
+# la cual compensa reescribirlo entero
+MAX_TARGET_SECTIONS = 4
+MAX_TARGET_RATIO = 0.6
+# Puntuación BM25 mínima, relativa a la mejor, para añadir una sección
+RELATIVE_SCORE_THRESHOLD = 0.6
+# Longitud máxima, relativa a la sección y con un margen en caracteres, de una
+# respuesta sin marcadores que se acepta como la sección reescrita
+UNMARKED_MAX_GROWTH = 2.0
+UNMARKED_SLACK_CHARS = 400
+
+SECTION_MARK = "<<<{key}>>>"
+END_MARK = "<<<FIN>>>"
+CHANGES_MARK = "<<<CAMBIOS>>>"
+
+_MD_HEADING_RE = re.compile(r"^(#{1,4})\s+(.*?)\s*#*\s*$")
+_BOLD_HEADING_RE = re.compile(r"^\*\*([^*]+?)\*\*:?\s*$")
+_NUMBERED_HEADING_RE = re.compile(r"^\d+[.)]\s+([A-ZÁÉÍÓÚÑ][A-ZÁÉÍÓÚÑ ]{3,}):?\s*$")
+_REPLACEMENT_RE = re.compile(r"<<<(S\d+)>>>[ \t]*\n?(.*?)<<<FIN>>>", re.DOTALL)
+
+# Expresiones que indican un cambio de toda la actividad
+GLOBAL_FEEDBACK = (
+    "toda la actividad", "actividad completa", "actividad entera", "en general", "todo el documento",
+    "mas corta", "mas larga", "mas breve", "desde cero", "rehaz", "otra actividad", "cambia el tema",
+    "duracion total",
+)
+_ORDINALS = {"uno": "1", "una": "1", "primera": "1", "primer": "1", "dos": "2", "segunda": "2",
+             "tres": "3", "tercera": "3", "cuatro": "4", "cuarta": "4", "cinco": "5", "quinta": "5"}
+_REFERENCE_RE = re.compile(
+    r"\b(fase|dia|sesion|tarea|grupo|pareja|semana)\s+(\d+|" + "|".join(_ORDINALS) + r")\b"
+)
+
+# Neurotipos que se pueden mencionar en el feedback -> prefijo de diagnostico_formal
+# Siglas como palabra completa ("teatro" no es "tea"); "autis" y "alta(s)
+# capacidad(es)" como prefijo para admitir sus variantes
+NEUROTYPE_TERMS = {
+    r"\btdah\b": "tdah",
+    r"\btea\b": "tea",
+    r"\bautis": "tea",
+    r"\baltas? capacidad": "altas_capacidades",
+}
+
+
+@dataclass
+class DesignSection:
+    """Tramo contiguo de la actividad que empieza en un encabezado"""
+    key: str
+    titulo: str
+    nivel: int
+    tipo: str
+    texto: str
+
+    @property
+    def tokens(self) -> int:
+        return estimate_tokens(self.texto)
+
+
+def _heading(line: str, last_md_level: int) -> Optional[Tuple[int, str]]:
+    """Nivel y título si la línea es un encabezado (markdown, negrita o numerado)"""
+    stripped = line.strip()
+    match = _MD_HEADING_RE.match(stripped)
+    if match:
+        return len(match.group(1)), match.group(2)
+    match = _BOLD_HEADING_RE.match(stripped) or _NUMBERED_HEADING_RE.match(stripped)
+    if match:
+        return max(last_md_level + 1, 2), match.group(1).strip()
+    return None
+
+
+def split_design(text: str) -> List[DesignSection]:
+    """Divide la actividad en secciones contiguas sin perder ningún carácter"""
+    sections: List[DesignSection] = []
+    stack: List[Tuple[int, str]] = []
+    current: List[str] = []
+    title, level = "Preámbulo", 0
+    last_md_level = 1
+
+    def flush():
+        if not current:
+            return
+        ruta = [heading for _, heading in stack] or [title]
+        sections.append(DesignSection(
+            key=f"S{len(sections) + 1}",
+            titulo=title,
+            nivel=level,
+            tipo=classify_section(ruta),
+            texto="".join(current),
+        ))
+
+    for line in text.splitlines(keepends=True):
+        heading = _heading(line, last_md_level)
+        if heading is not None:
+            flush()
+            level, title = heading
+            if _MD_HEADING_RE.match(line.strip()):
+                last_md_level = level
+            while stack and stack[-1][0] >= level:
+                stack.pop()
+            stack.append((level, title))
+            current = [line]
+        else:
+            current.append(line)
+    flush()
+    return sections
+
+
+def _with_children(sections: List[DesignSection], index: int) -> List[int]:
+    """Índice de la sección y de las que cuelgan de ella"""
+    result = [index]
+    for j in range(index + 1, len(sections)):
+        if sections[j].nivel <= sections[index].nivel:
+            break
+        result.append(j)
+    return result
+
+
+def feedback_references(feedback: str) -> List[str]:
+    """Referencias explícitas del feedback normalizadas ("fase 2", "dia 1")"""
+    return [f"{word} {_ORDINALS.get(number, number)}"
+            for word, number in _REFERENCE_RE.findall(fold_accents(feedback))]
+
+
+def feedback_neurotypes(feedback: str) -> List[str]:
+    """Prefijos de diagnóstico de los neurotipos mencionados en el feedback"""
+    folded = " ".join(re.findall(r"[a-z0-9ñ]+", fold_accents(feedback)))
+    found = []
+    for pattern, prefix in NEUROTYPE_TERMS.items():
+        if prefix not in found and re.search(pattern, folded):
+            found.append(prefix)
+    return found
+
+
+def students_for_feedback(students: Sequence[dict], feedback: str) -> List[dict]:
+    """Estudiantes aludidos por el feedback (por neurotipo o nombre); todos si ninguno"""
+    folded = fold_accents(feedback)
+    neurotypes = feedback_neurotypes(feedback)
+    selected = [
+        student for student in students
+        if any(fold_accents(student.get("diagnostico_formal", "")).startswith(n) for n in neurotypes)
+        or re.search(r"\b" + re.escape(fold_accents(student.get("nombre", "-")).split(" ")[0]) + r"\b", folded)
+    ]
+    return selected or list(students)
+
+
+@dataclass
+class RefinementOutcome:
+    """Resumen de un refinamiento: si fue por secciones, cuáles y por qué"""
+    scoped: bool
+    sections: List[str] = field(default_factory=list)
+    total_sections: int = 0
+    changes: str = ""
+
+
+@dataclass
+class RefinementPlan:
+    """Secciones de la actividad que hay que reescribir para un feedback"""
+    sections: List[DesignSection]
+    targets: List[str]
+    neurotypes: List[str] = field(default_factory=list)
+
+    def _by_key(self) -> Dict[str, DesignSection]:
+        return {section.key: section for section in self.sections}
+
+    @property
+    def target_sections(self) -> List[DesignSection]:
+        by_key = self._by_key()
+        return [by_key[key] for key in self.targets]
+
+    @property
+    def target_tokens(self) -> int:
+        return sum(section.tokens for section in self.target_sections)
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(section.tokens for section in self.sections)
+
+    def outline(self) -> str:
+        """Esquema de la actividad; las secciones a reescribir van marcadas con →"""
+        lines = []
+        for section in self.sections:
+            marker = "→" if section.key in self.targets else " "
+            indent = "  " * max(section.nivel - 1, 0)
+            lines.append(f"{marker} {section.key} {indent}{section.titulo}")
+        return "\n".join(lines)
+
+    def render_targets(self) -> str:
+        """Texto de las secciones a reescribir entre sus marcadores"""
+        return "\n\n".join(
+            f"{SECTION_MARK.format(key=section.key)}\n{section.texto.rstrip()}\n{END_MARK}"
+            for section in self.target_sections
+        )
+
+    def _is_single_section(self, output: str) -> bool:
+        """La respuesta sin marcadores es claramente solo la sección pedida
+
+        No lo es si trae encabezados de nivel 1 o 2 distintos del título de la
+        sección (p. ej. la actividad entera) o si es mucho más larga que ella.
+        """
+        if SECTION_MARK[:3] in output:
+            return False
+        section = self.target_sections[0]
+        if len(output.strip()) > len(section.texto.strip()) * UNMARKED_MAX_GROWTH + UNMARKED_SLACK_CHARS:
+            return False
+        own_title = fold_accents(section.titulo)
+        for line in output.splitlines():
+            match = _MD_HEADING_RE.match(line.strip())
+            if match and len(match.group(1)) <= 2 and fold_accents(match.group(2)) != own_title:
+                return False
+        return True
+
+    def apply(self, output: str) -> Tuple[str, List[str], str]:
+        """Inserta las secciones reescritas: (actividad, claves sustituidas, explicación)"""
+        replacements = {key: body for key, body in _REPLACEMENT_RE.findall(output) if key in self.targets}
+        if not replacements and len(self.targets) == 1 and self._is_single_section(output):
+            # El modelo devolvió solo el texto de la única sección pedida
+            replacements = {self.targets[0]: output}
+        parts = []
+        for section in self.sections:
+            body = replacements.get(section.key)
+            if body is None or not body.strip():
+                parts.append(section.texto)
+                continue
+            trailing = section.texto[len(section.texto.rstrip()):] or "\n"
+            parts.append(body.strip() + trailing)
+        changes = output.split(CHANGES_MARK, 1)[1].strip() if CHANGES_MARK in output else ""
+        replaced = [key for key in self.targets if replacements.get(key, "").strip()]
+        return "".join(parts), replaced, changes
+
+
+def plan_refinement(design: str, feedback: str, max_sections: int = MAX_TARGET_SECTIONS,
+                    max_ratio: float = MAX_TARGET_RATIO) -> Optional[RefinementPlan]:
+    """Decide qué secciones toca el feedback; None si conviene reescribirlo todo"""
+    sections = split_design(design)
+    if len(sections) < 2:
+        return None
+    folded = fold_accents(feedback)
+    if any(phrase in folded for phrase in GLOBAL_FEEDBACK):
+        return None
+
+    kinds = [kind for kind in section_kinds(feedback) if kind != "dia"]
+    index = BM25Index.build((str(i), f"{s.titulo}\n{s.texto}") for i, s in enumerate(sections))
+    hits = index.search(feedback, k=len(sections))
+    scores = {int(hit.doc_id): hit.score for hit in hits}
+    best = max(scores.values(), default=0.0)
+
+    # 1. Referencias explícitas ("fase 2") con sus subsecciones; si además se
+    #    nombra otro tipo de sección, solo las de ese tipo dentro de ellas
+    chosen: Set[int] = set()
+    for reference in feedback_references(feedback):
+        for i, section in enumerate(sections):
+            if reference in fold_accents(section.titulo):
+                chosen.update(_with_children(sections, i))
+    specific = [kind for kind in kinds if kind != "desarrollo"]
+    if chosen and specific:
+        narrowed = {i for i in chosen if sections[i].tipo in specific}
+        chosen = narrowed or chosen
+
+    # 2. Secciones del tipo mencionado y secciones con buena coincidencia léxica
+    if not chosen:
+        chosen = {i for i, section in enumerate(sections) if section.tipo in kinds}
+        chosen.update(i for i, score in scores.items() if best and score >= best * RELATIVE_SCORE_THRESHOLD)
+
+    if not chosen:
+        return None
+    ranked = sorted(chosen, key=lambda i: (sections[i].tipo not in kinds, -scores.get(i, 0.0), i))
+    targets = sorted(ranked[:max_sections])
+    plan = RefinementPlan(sections, [sections[i].key for i in targets], feedback_neurotypes(feedback))
+    if plan.target_tokens > plan.total_tokens * max_ratio:
+        return None
+    return plan
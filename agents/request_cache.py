@@ -0,0 +1,275 @@
+"""
+Caché semántica de solicitudes casi repetidas.
+
+Muchas solicitudes son paráfrasis de otras ya diseñadas ("actividad de
+fracciones 4º primaria por parejas" frente a "Crea una actividad de
+matemáticas sobre fracciones para 4º de primaria, para trabajar en parejas").
+Cada solicitud se normaliza en cuatro partes:
+
+- tema: los términos que quedan al quitar el relleno ("crea", "actividad"...),
+  la materia, el nivel y el agrupamiento; se vectoriza en local con
+  ``embed_text``;
+- nivel: curso y etapa, si se indican;
+- materias: las que se nombran o delatan los términos del tema
+  (``detect_subjects``);
+- agrupación: el tamaño de grupo pedido.
+
+Una solicitud reutiliza un diseño anterior del mismo perfil de aula si el tema
+supera el umbral de similitud, la agrupación coincide y ni el nivel ni las
+materias se contradicen. El índice vive junto al historial (``ActivityStore``), apunta a sus
+actividades (que guardan el diseño ya refinado) y está acotado: al pasar de
+``max_entries`` se expulsan las entradas usadas hace más tiempo.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from agents.activity_store import ActivityStore
+from agents.grouping import group_size_from_request
+from agents.profiles import SUBJECTS, detect_subjects
+from agents.retrieval import fold_accents, tokenize
+from agents.vector_index import embed_text
+
+REQUEST_DIM = 1024
+DEFAULT_THRESHOLD = 0.8
+DEFAULT_MAX_ENTRIES = 500
+
+# Palabras que no cambian qué actividad se pide
+FILLER_WORDS = (
+    "crea crear creame necesito quiero queria diseña diseñar diseñame haz hacer prepara preparar propon "
+    "actividad actividades proyecto trabajar trabajo estudiantes alumnos alumnado niños clase aula sobre tema "
+    "matematicas ciencias naturales sociales lengua ingles musica plastica educacion fisica "
+    "infantil primaria secundaria eso bachillerato curso nivel "
+    "parejas pareja grupos grupo equipos equipo individual trios cooperativo cooperativa"
+)
+# Materias sin perfil propio que solo se reconocen por su nombre
+NAMED_SUBJECTS = {
+    "musica": ("musica",),
+    "plastica": ("plastica", "artes plasticas"),
+    "educacion_fisica": ("educacion fisica",),
+    "ingles": ("ingles",),
+    "sociales": ("sociales", "geografia"),
+}
+_STAGES = ("infantil", "primaria", "secundaria", "eso", "bachillerato")
+_ORDINALS = {"primero": 1, "primer": 1, "segundo": 2, "tercero": 3, "tercer": 3,
+             "cuarto": 4, "quinto": 5, "sexto": 6}
+_FILLER = {stem for word in FILLER_WORDS.split() + list(_ORDINALS) for stem in tokenize(word)}
+_GRADE_RE = re.compile(r"\b([1-6])\s*(?:º|°|ª|o|a|er|ero)(?=\W|$)")
+_ORDINAL_RE = re.compile(r"\b(" + "|".join(_ORDINALS) + r")\b")
+_DIGIT_RE = re.compile(r"\d")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS request_cache (
+    id INTEGER PRIMARY KEY,
+    activity_id INTEGER NOT NULL,
+    profile_hash TEXT NOT NULL,
+    nivel TEXT NOT NULL,
+    materias TEXT NOT NULL DEFAULT '',
+    agrupacion INTEGER NOT NULL,
+    tema TEXT NOT NULL,
+    solicitud TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_request_cache_profile ON request_cache(profile_hash);
+CREATE INDEX IF NOT EXISTS idx_request_cache_used ON request_cache(last_used);
+CREATE TRIGGER IF NOT EXISTS request_cache_activity_ad AFTER DELETE ON activities BEGIN
+    DELETE FROM request_cache WHERE activity_id = old.id;
+END;
+"""
+
+
+@dataclass(frozen=True)
+class RequestKey:
+    """Solicitud normalizada: tema, nivel, agrupación y materias"""
+    tema: str
+    nivel: str
+    agrupacion: int
+    materias: str
+
+
+def request_subjects(text: str) -> str:
+    """Materias de la solicitud, ordenadas; vacío si no se reconoce ninguna"""
+    folded = fold_accents(text.lower())
+    subjects = set(detect_subjects(text))
+    if subjects == set(SUBJECTS):
+        # detect_subjects devuelve todas cuando no reconoce ninguna
+        subjects = set()
+    subjects.update(subject for subject, names in NAMED_SUBJECTS.items()
+                    if any(re.search(rf"\b{name}\b", folded) for name in names))
+    return " ".join(sorted(subjects))
+
+
+def request_key(text: str) -> RequestKey:
+    """Separa el tema de la solicitud de su nivel y su agrupación"""
+    lowered = text.lower()
+    folded = fold_accents(lowered)
+    grades = sorted({int(g) for g in _GRADE_RE.findall(lowered)}
+                    | {_ORDINALS[w] for w in _ORDINAL_RE.findall(folded)})
+    stages = [stage for stage in _STAGES if re.search(rf"\b{stage}\b", folded)]
+    nivel = " ".join([str(g) for g in grades] + stages)
+    tema = " ".join(term for term in tokenize(text)
+                    if term not in _FILLER and not _DIGIT_RE.search(term))
+    return RequestKey(tema, nivel, group_size_from_request(text), request_subjects(text))
+
+
+def levels_compatible(a: str, b: str) -> bool:
+    """Un nivel sin indicar vale para cualquiera (el perfil del aula ya fija el curso)"""
+    return not a or not b or a == b
+
+
+def subjects_compatible(a: str, b: str) -> bool:
+    """Sin materia reconocible vale cualquiera; si no, deben ser las mismas"""
+    return not a or not b or a == b
+
+
+def request_cache_enabled() -> bool:
+    """La caché de solicitudes se desactiva con IA4EDU_REQUEST_CACHE=0"""
+    return os.getenv("IA4EDU_REQUEST_CACHE", "1").lower() not in ("0", "false", "no", "off")
+
+
+@dataclass
+class RequestMatch:
+    """Diseño anterior que sirve de punto de partida"""
+    entry_id: int
+    activity_id: int
+    solicitud: str
+    similitud: float
+
+
+@dataclass
+class RequestCacheStats:
+    """Contadores de la caché en este proceso"""
+    hits: int = 0
+    misses: int = 0
+    reused: int = 0
+    writes: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class RequestCache:
+    """Índice acotado de solicitudes ya diseñadas, por perfil de aula"""
+
+    def __init__(self, store: ActivityStore, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 threshold: float = DEFAULT_THRESHOLD):
+        self.store = store
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.stats = RequestCacheStats()
+        self._lock = threading.Lock()
+        # Comparte el fichero del historial: el disparador borra las entradas de actividades eliminadas
+        self._conn = sqlite3.connect(store.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._add_subjects_column()
+        self._conn.commit()
+
+    def _add_subjects_column(self):
+        """Índices creados antes de guardar las materias: se añaden a partir de la solicitud"""
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(request_cache)")}
+        if "materias" in columns:
+            return
+        self._conn.execute("ALTER TABLE request_cache ADD COLUMN materias TEXT NOT NULL DEFAULT ''")
+        rows = self._conn.execute("SELECT id, solicitud FROM request_cache").fetchall()
+        self._conn.executemany("UPDATE request_cache SET materias = ? WHERE id = ?",
+                               [(request_subjects(solicitud), entry_id) for entry_id, solicitud in rows])
+
+    def lookup(self, request: str, profile_hash: str) -> Optional[RequestMatch]:
+        """Solicitud anterior más parecida del mismo aula, si supera el umbral"""
+        key = request_key(request)
+        best: Optional[Tuple[float, tuple]] = None
+        if key.tema:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id, activity_id, solicitud, nivel, vector, materias FROM request_cache "
+                    "WHERE profile_hash = ? AND agrupacion = ?", (profile_hash, key.agrupacion),
+                ).fetchall()
+            rows = [row for row in rows
+                    if levels_compatible(key.nivel, row[3]) and subjects_compatible(key.materias, row[5])]
+            if rows:
+                matrix = np.frombuffer(b"".join(row[4] for row in rows), dtype=np.float32).reshape(len(rows), -1)
+                scores = matrix @ embed_text(key.tema, REQUEST_DIM)
+                index = int(np.argmax(scores))
+                best = (float(scores[index]), rows[index])
+        with self._lock:
+            if best is None or best[0] < self.threshold:
+                self.stats.misses += 1
+                return None
+            self.stats.hits += 1
+            similarity, (entry_id, activity_id, solicitud, _, _, _) = best
+            self._conn.execute("UPDATE request_cache SET last_used = ?, hits = hits + 1 WHERE id = ?",
+                               (time.time(), entry_id))
+            self._conn.commit()
+        return RequestMatch(entry_id, activity_id, solicitud, round(similarity, 3))
+
+    def add(self, request: str, profile_hash: str, activity_id: int) -> Optional[int]:
+        """Indexa una solicitud ya diseñada (no se indexan las que no tienen tema)"""
+        key = request_key(request)
+        if not key.tema:
+            return None
+        vector = embed_text(key.tema, REQUEST_DIM).tobytes()
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO request_cache (activity_id, profile_hash, nivel, materias, agrupacion, tema, solicitud, "
+                "vector, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (activity_id, profile_hash, key.nivel, key.materias, key.agrupacion, key.tema, request, vector,
+                 now, now),
+            )
+            self.stats.writes += 1
+            self._evict()
+            self._conn.commit()
+            return cursor.lastrowid
+
+    def _evict(self):
+        excess = self._conn.execute("SELECT COUNT(*) FROM request_cache").fetchone()[0] - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM request_cache WHERE id IN "
+                "(SELECT id FROM request_cache ORDER BY last_used ASC, id ASC LIMIT ?)", (excess,)
+            )
+            self.stats.evictions += excess
+
+    def mark_reused(self):
+        """El profesor aceptó partir del diseño encontrado"""
+        with self._lock:
+            self.stats.reused += 1
+
+    def forget(self, entry_id: int):
+        with self._lock:
+            self._conn.execute("DELETE FROM request_cache WHERE id = ?", (entry_id,))
+            self._conn.commit()
+
+    def info(self) -> Dict[str, Any]:
+        """Aciertos del proceso, aciertos acumulados y ocupación del índice"""
+        with self._lock:
+            entries, total_hits = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM request_cache"
+            ).fetchone()
+        return {
+            "hits": self.stats.hits,
+            "misses": self.stats.misses,
+            "reused": self.stats.reused,
+            "evictions": self.stats.evictions,
+            "hit_rate": round(self.stats.hit_rate, 3),
+            "entries": entries,
+            "total_hits": total_hits,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
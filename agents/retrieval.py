@@ -0,0 +1,177 @@
+"""
+Recuperación léxica de actividades: tokenización en español e índice BM25.
+
+El índice es invertido y guarda, para cada término, el impacto BM25 ya
+calculado de cada documento. Una búsqueda solo suma pesos de las listas de
+los términos de la consulta, sin recorrer la biblioteca entera.
+"""
+
+import heapq
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from agents.corpus import ActivityCorpus, ActivityDocument, get_corpus
+
+_WORD_RE = re.compile(r"[a-z0-9ñ]+")
+
+STOPWORDS = frozenset("""
+a al algo algunas algunos ante antes como con contra cual cuando de del desde donde
+durante e el ella ellas ellos en entre era es esa esas ese eso esos esta estas este
+esto estos fue ha hay la las le les lo los mas me mi muy nada ni no nos o os otra
+otro para pero poco por porque que quien se ser si sin sobre son su sus tambien
+te tiene todo todos tu un una unas uno unos y ya cada puede ser sea hacer debe
+""".split())
+
+# Sufijos derivativos frecuentes, de más largo a más corto
+_SUFFIXES = (
+    "amientos", "imientos", "amiento", "imiento", "aciones", "uciones", "adoras",
+    "adores", "ancias", "encias", "idades", "mente", "acion", "ucion", "adora",
+    "ador", "ancia", "encia", "idad", "ismos", "ismo", "istas", "ista",
+    "ables", "ibles", "able", "ible", "osos", "osas", "oso", "osa",
+    "ivos", "ivas", "ivo", "iva",
+)
+_VOWELS = "aeiou"
+
+
+def fold_accents(text: str) -> str:
+    """Pasa a minúsculas y elimina tildes conservando la ñ"""
+    text = text.lower().replace("ñ", "\0")
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return text.replace("\0", "ñ")
+
+
+def stem(word: str) -> str:
+    """Stemmer ligero para español: sufijos derivativos, plural y género"""
+    if len(word) <= 4:
+        return word
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            word = word[:-len(suffix)]
+            break
+    if word.endswith("es") and len(word) > 5 and word[-3] not in _VOWELS:
+        word = word[:-2]
+    elif word.endswith("s") and len(word) > 4:
+        word = word[:-1]
+    if word[-1] in "aoe" and len(word) > 4:
+        word = word[:-1]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """Tokeniza texto en español: minúsculas, sin tildes, sin stopwords y con stemming"""
+    return [
+        stem(token)
+        for token in _WORD_RE.findall(fold_accents(text))
+        if token not in STOPWORDS and len(token) > 1
+    ]
+
+
+@dataclass(frozen=True)
+class SearchHit:
+    """Resultado de una búsqueda: identificador del documento y puntuación BM25"""
+    doc_id: str
+    score: float
+
+
+class BM25Index:
+    """Índice invertido con puntuación BM25 precalculada por término y documento"""
+
+    # Máximo de términos distintos de la consulta que se evalúan (los de mayor IDF)
+    max_query_terms = 48
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_ids: List[str] = []
+        self.postings: Dict[str, List[Tuple[int, float]]] = {}
+        self.idf: Dict[str, float] = {}
+
+    @classmethod
+    def build(cls, documents: Iterable[Tuple[str, str]], k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        """Construye el índice a partir de pares (doc_id, texto)"""
+        index = cls(k1=k1, b=b)
+        term_freqs: List[Counter] = []
+        for doc_id, text in documents:
+            index.doc_ids.append(doc_id)
+            term_freqs.append(Counter(tokenize(text)))
+
+        n_docs = len(term_freqs)
+        if n_docs == 0:
+            return index
+        lengths = [sum(tf.values()) for tf in term_freqs]
+        avgdl = (sum(lengths) / n_docs) or 1.0
+
+        raw: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        for doc_idx, tf in enumerate(term_freqs):
+            for term, freq in tf.items():
+                raw[term].append((doc_idx, freq))
+
+        for term, docs in raw.items():
+            df = len(docs)
+            idf = math.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+            index.idf[term] = idf
+            postings = []
+            for doc_idx, freq in docs:
+                norm = k1 * (1.0 - b + b * lengths[doc_idx] / avgdl)
+                postings.append((doc_idx, idf * freq * (k1 + 1.0) / (freq + norm)))
+            index.postings[term] = postings
+        return index
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def search(self, query: str, k: int = 5) -> List[SearchHit]:
+        """Devuelve los k documentos con mayor puntuación BM25 para la consulta"""
+        query_terms = Counter(t for t in tokenize(query) if t in self.postings)
+        if not query_terms or k <= 0:
+            return []
+        if len(query_terms) > self.max_query_terms:
+            terms = heapq.nlargest(self.max_query_terms, query_terms, key=self.idf.__getitem__)
+            query_terms = Counter({t: query_terms[t] for t in terms})
+
+        scores: Dict[int, float] = defaultdict(float)
+        for term, qtf in query_terms.items():
+            # Las repeticiones en la consulta suman con rendimiento decreciente
+            weight = 1.0 + math.log(qtf)
+            for doc_idx, impact in self.postings[term]:
+                scores[doc_idx] += weight * impact
+
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [SearchHit(self.doc_ids[doc_idx], score) for doc_idx, score in best]
+
+
+_index_cache: Dict[int, Tuple[str, BM25Index]] = {}
+_index_lock = threading.Lock()
+
+
+def get_activity_index(corpus: Optional[ActivityCorpus] = None) -> BM25Index:
+    """Índice BM25 de la biblioteca, reconstruido solo cuando cambia el corpus"""
+    corpus = corpus or get_corpus()
+    version = corpus.version()
+    with _index_lock:
+        cached = _index_cache.get(id(corpus))
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        index = BM25Index.build(
+            (doc.archivo, f"{doc.nombre}\n{doc.contenido}") for doc in corpus.activities()
+        )
+        _index_cache[id(corpus)] = (version, index)
+        return index
+
+
+def search_activities(query: str, k: int = 3,
+                      corpus: Optional[ActivityCorpus] = None) -> List[Tuple[ActivityDocument, float]]:
+    """Busca en la biblioteca las k actividades más relevantes para la consulta"""
+    corpus = corpus or get_corpus()
+    results = []
+    for hit in get_activity_index(corpus).search(query, k):
+        doc = corpus.activity(hit.doc_id)
+        if doc is not None:
+            results.append((doc, hit.score))
+    return results
@@ -0,0 +1,349 @@
+"""
+Servicio HTTP para atender a todo un centro desde un mismo equipo.
+
+Las solicitudes de diseño y refinamiento se convierten en trabajos de una
+cola asyncio acotada que atiende un número fijo de trabajadores. Cada
+trabajador tiene su propio ``IA4EDUCrew`` (los agentes de CrewAI no deben
+compartirse entre ejecuciones simultáneas) creado una sola vez al arrancar;
+el corpus, los índices de la biblioteca, la caché de respuestas y los
+clientes HTTP del LLM son del proceso y se mantienen calientes entre
+peticiones. Cada trabajo publica su estado y el de sus etapas, que se pueden
+consultar o seguir en vivo como server-sent events. Las actividades se
+registran en el mismo historial (``ActivityStore``) que la sesión
+interactiva.
+"""
+
+import asyncio
+import json
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+
+from agents.activity_store import ActivityStore
+from agents.batch import result_text
+from agents.streaming import DONE, FAILED, PENDING, RUNNING, StreamMonitor
+
+DESIGN, REFINEMENT = "diseño", "refinamiento"
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_QUEUE = 100
+# Trabajos terminados que se conservan para consultar su resultado
+DEFAULT_MAX_JOBS = 1000
+
+
+@dataclass
+class Job:
+    """Trabajo de diseño o refinamiento y los eventos que ha publicado"""
+    id: str
+    tipo: str
+    solicitud: str = ""
+    feedback: str = ""
+    actividad_id: Optional[int] = None
+    estado: str = PENDING
+    creado: float = field(default_factory=time.time)
+    iniciado: Optional[float] = None
+    terminado: Optional[float] = None
+    diseno: Optional[str] = None
+    error: Optional[str] = None
+    etapas: Dict[str, str] = field(default_factory=dict)
+    eventos: List[Tuple[str, Dict[str, Any]]] = field(default_factory=list)
+    cambio: asyncio.Event = field(default_factory=asyncio.Event)
+
+    @property
+    def finalizado(self) -> bool:
+        return self.estado in (DONE, FAILED)
+
+    def to_dict(self, diseno: bool = True) -> Dict[str, Any]:
+        data = {
+            "id": self.id,
+            "tipo": self.tipo,
+            "estado": self.estado,
+            "actividad_id": self.actividad_id,
+            "etapas": dict(self.etapas),
+            "creado": self.creado,
+            "iniciado": self.iniciado,
+            "terminado": self.terminado,
+        }
+        if self.solicitud:
+            data["solicitud"] = self.solicitud
+        if self.feedback:
+            data["feedback"] = self.feedback
+        if diseno and self.diseno is not None:
+            data["diseno"] = self.diseno
+        if self.error is not None:
+            data["error"] = self.error
+        return data
+
+
+class ServiceBusy(Exception):
+    """La cola de trabajos está llena"""
+
+
+class ActivityBusy(Exception):
+    """La actividad ya tiene un refinamiento pendiente"""
+
+
+def quiet(crew: Any) -> Any:
+    """Apaga el registro detallado de CrewAI (el servicio informa por eventos)"""
+    crew.verbose = False
+    for agent, _ in crew.design_stages() + crew.refine_stages():
+        agent.verbose = False
+    return crew
+
+
+class DesignService:
+    """Cola de trabajos atendida por un conjunto fijo de crews ya inicializados"""
+
+    def __init__(self, crew_factory: Callable[[], Any], workers: int = DEFAULT_WORKERS,
+                 store: Optional[ActivityStore] = None, max_queue: int = DEFAULT_MAX_QUEUE,
+                 max_jobs: int = DEFAULT_MAX_JOBS):
+        self.crew_factory = crew_factory
+        self.workers = max(1, workers)
+        self.store = store
+        self.max_queue = max_queue
+        self.max_jobs = max_jobs
+        self.crews: List[Any] = []
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        """Crea los crews (una vez) y lanza los trabajadores"""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        if self.store is None:
+            self.store = await asyncio.to_thread(ActivityStore)
+        if not self.crews:
+            # En serie: la primera creación importa CrewAI y prepara los clientes compartidos
+            self.crews = await asyncio.to_thread(lambda: [quiet(self.crew_factory()) for _ in range(self.workers)])
+        self._tasks = [asyncio.create_task(self._worker(crew), name=f"ia4edu-worker-{i}")
+                       for i, crew in enumerate(self.crews)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit_design(self, solicitud: str) -> Job:
+        return self._submit(Job(uuid.uuid4().hex, DESIGN, solicitud=solicitud))
+
+    def submit_refinement(self, actividad_id: int, feedback: str) -> Job:
+        """Encola un refinamiento (KeyError si la actividad no existe)"""
+        if any(job.actividad_id == actividad_id and not job.finalizado for job in self.jobs.values()):
+            raise ActivityBusy(f"La actividad {actividad_id} ya tiene un trabajo pendiente")
+        if self.store.get(actividad_id) is None:
+            raise KeyError(f"No existe la actividad {actividad_id}")
+        return self._submit(Job(uuid.uuid4().hex, REFINEMENT, feedback=feedback, actividad_id=actividad_id))
+
+    def _submit(self, job: Job) -> Job:
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise ServiceBusy(f"Hay {self.max_queue} trabajos en cola; inténtalo más tarde")
+        self.jobs[job.id] = job
+        self._forget_old()
+        self._publish(job, "estado", {"estado": job.estado, "en_cola": self._queue.qsize()})
+        return job
+
+    def _forget_old(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.finalizado]
+        for job_id in finished[:max(0, len(self.jobs) - self.max_jobs)]:
+            del self.jobs[job_id]
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def _publish(self, job: Job, tipo: str, data: Dict[str, Any]):
+        """Añade un evento y despierta a quien siga el trabajo (solo desde el bucle)"""
+        job.eventos.append((tipo, data))
+        changed, job.cambio = job.cambio, asyncio.Event()
+        changed.set()
+
+    async def events(self, job: Job) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """Eventos del trabajo desde el principio; termina cuando el trabajo acaba"""
+        sent = 0
+        while True:
+            changed = job.cambio
+            while sent < len(job.eventos):
+                sent += 1
+                yield job.eventos[sent - 1]
+            if job.finalizado:
+                return
+            await changed.wait()
+
+    def _set_state(self, job: Job, estado: str):
+        job.estado = estado
+        if estado == RUNNING:
+            job.iniciado = time.time()
+        elif estado in (DONE, FAILED):
+            job.terminado = time.time()
+        data = {"estado": estado}
+        if job.actividad_id is not None:
+            data["actividad_id"] = job.actividad_id
+        if job.error is not None:
+            data["error"] = job.error
+        self._publish(job, "estado", data)
+
+    async def _worker(self, crew: Any):
+        while True:
+            job = await self._queue.get()
+            try:
+                self._set_state(job, RUNNING)
+                try:
+                    await asyncio.to_thread(self._execute, crew, job)
+                except Exception as e:
+                    job.error = f"{type(e).__name__}: {e}"
+                    self._set_state(job, FAILED)
+                else:
+                    self._set_state(job, DONE)
+            finally:
+                self._queue.task_done()
+
+    def _stage_listener(self, job: Job) -> Callable[[StreamMonitor], None]:
+        """Publica los cambios de estado de las etapas desde el hilo del trabajador"""
+        def on_update(monitor: StreamMonitor):
+            for stage in monitor.snapshot():
+                if job.etapas.get(stage.label, PENDING) != stage.status:
+                    job.etapas[stage.label] = stage.status
+                    data = {"etapa": stage.label, "estado": stage.status,
+                            "segundos": round(stage.elapsed, 2) if stage.elapsed is not None else None}
+                    self._loop.call_soon_threadsafe(self._publish, job, "etapa", data)
+        return on_update
+
+    def _execute(self, crew: Any, job: Job):
+        """Ejecuta el trabajo con el crew del trabajador y lo registra en el historial"""
+        stages = crew.design_stages() if job.tipo == DESIGN else crew.refine_stages()
+        job.etapas = {label: PENDING for _, label in stages}
+        # Sin exclusividad: varios trabajadores siguen a la vez el bus de eventos, cada uno sus agentes
+        with StreamMonitor(stages, on_update=self._stage_listener(job), exclusive=False):
+            if job.tipo == DESIGN:
+                design = result_text(crew.design_activity(job.solicitud))
+                job.actividad_id = self.store.create(job.solicitud, design, self._template(crew, design))
+            else:
+                stored = self.store.get(job.actividad_id)
+                if stored is None:
+                    raise KeyError(f"No existe la actividad {job.actividad_id}")
+                current = crew.resume_design(stored.diseno, stored.plantilla)
+                design = crew.refine_activity(current, job.feedback)
+                outcome = crew.last_refinement
+                self.store.add_refinement(job.actividad_id, job.feedback, design, self._template(crew, design),
+                                          por_secciones=bool(outcome and outcome.scoped),
+                                          cambios=(outcome.changes if outcome else "") or "")
+        job.diseno = design
+
+    @staticmethod
+    def _template(crew: Any, design: str) -> Optional[Dict[str, Any]]:
+        if crew.is_structured(design):
+            return crew.last_structure.actividad.model_dump()
+        return None
+
+    def status(self) -> Dict[str, Any]:
+        """Trabajadores, cola, trabajos por estado y caché de respuestas"""
+        states: Dict[str, int] = {}
+        for job in self.jobs.values():
+            states[job.estado] = states.get(job.estado, 0) + 1
+        return {
+            "trabajadores": self.workers,
+            "en_cola": self._queue.qsize() if self._queue is not None else 0,
+            "max_cola": self.max_queue,
+            "trabajos": states,
+            "cache": self.crews[0].cache_stats() if self.crews else None,
+        }
+
+
+class DesignRequest(BaseModel):
+    solicitud: str = Field(..., min_length=1, description="Actividad que se quiere diseñar")
+
+
+class RefinementRequest(BaseModel):
+    feedback: str = Field(..., min_length=1, description="Qué hay que cambiar o mejorar")
+
+
+def sse(tipo: str, data: Dict[str, Any]) -> str:
+    """Un evento en formato server-sent events"""
+    return f"event: {tipo}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def create_app(service: DesignService) -> FastAPI:
+    """Aplicación HTTP sobre el servicio (los trabajadores viven lo que la aplicación)"""
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        await service.start()
+        try:
+            yield
+        finally:
+            await service.stop()
+
+    app = FastAPI(title="IA4EDU", description="Diseño y refinamiento de actividades inclusivas",
+                  lifespan=lifespan)
+
+    def job_or_404(job_id: str) -> Job:
+        job = service.get(job_id)
+        if job is None:
+            raise HTTPException(404, f"No existe el trabajo {job_id}")
+        return job
+
+    # Los envíos son async: la cola asyncio solo se toca desde el bucle del servidor
+    @app.post("/disenos", status_code=202)
+    async def design(body: DesignRequest):
+        try:
+            return service.submit_design(body.solicitud).to_dict()
+        except ServiceBusy as e:
+            raise HTTPException(503, str(e))
+
+    @app.post("/actividades/{actividad_id}/refinamientos", status_code=202)
+    async def refine(actividad_id: int, body: RefinementRequest):
+        try:
+            return service.submit_refinement(actividad_id, body.feedback).to_dict()
+        except KeyError as e:
+            raise HTTPException(404, str(e.args[0]))
+        except ActivityBusy as e:
+            raise HTTPException(409, str(e))
+        except ServiceBusy as e:
+            raise HTTPException(503, str(e))
+
+    @app.get("/trabajos/{job_id}")
+    async def job_status(job_id: str):
+        return job_or_404(job_id).to_dict()
+
+    @app.get("/trabajos/{job_id}/eventos")
+    async def job_events(job_id: str):
+        job = job_or_404(job_id)
+
+        async def stream():
+            async for tipo, data in service.events(job):
+                yield sse(tipo, data)
+            yield sse("fin", job.to_dict())
+
+        return StreamingResponse(stream(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache"})
+
+    @app.get("/actividades")
+    def history(consulta: Optional[str] = None, materia: Optional[str] = None, nivel: Optional[str] = None,
+                limite: int = 20):
+        if consulta:
+            activities = service.store.search(consulta, limit=limite, materia=materia, nivel=nivel)
+        else:
+            activities = service.store.history(limit=limite, materia=materia, nivel=nivel)
+        return {"total": service.store.count(), "actividades": [asdict(a) for a in activities]}
+
+    @app.get("/actividades/{actividad_id}")
+    def activity(actividad_id: int):
+        stored = service.store.get(actividad_id)
+        if stored is None:
+            raise HTTPException(404, f"No existe la actividad {actividad_id}")
+        return asdict(stored)
+
+    @app.get("/estado")
+    async def status():
+        return service.status()
+
+    return app
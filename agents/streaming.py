@@ -0,0 +1,233 @@
+"""
+Seguimiento en vivo de las etapas del crew y de los tokens que van llegando.
+
+``StreamMonitor`` se suscribe al bus de eventos de CrewAI: los eventos de
+tarea marcan qué etapa está en curso y los fragmentos de LLM en streaming se
+acumulan en esa etapa. La interfaz lee el estado desde otro hilo para pintar
+la vista en vivo. CrewAI solo se importa al activar el monitor, para que la
+interfaz pueda cargar este módulo sin pagar su coste de arranque.
+
+Las copias de un agente que trabajan en su nombre (los candidatos del
+diseñador) se registran con ``stage_aliases`` y cuentan para la etapa del
+agente original; la etapa sigue en curso hasta que terminan todas sus tareas.
+Si la cascada rechaza la respuesta de un nivel, el texto que ya había llegado
+de ese nivel se descarta y la etapa vuelve a llenarse con el siguiente.
+"""
+
+import contextlib
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+PENDING, RUNNING, DONE, FAILED = "pendiente", "en curso", "hecho", "error"
+
+# id de la copia -> agente de la etapa a la que cuenta
+_aliases: Dict[int, Any] = {}
+_aliases_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def stage_aliases(agent: Any, copies: Sequence[Any]) -> Iterator[None]:
+    """Mientras dure el bloque, las tareas de ``copies`` cuentan como de ``agent``"""
+    with _aliases_lock:
+        _aliases.update({id(copy): agent for copy in copies})
+    try:
+        yield
+    finally:
+        with _aliases_lock:
+            for copy in copies:
+                _aliases.pop(id(copy), None)
+
+
+def stage_agent(agent: Any) -> Any:
+    """Agente cuya etapa corresponde a ``agent`` (él mismo si no es una copia registrada)"""
+    with _aliases_lock:
+        return _aliases.get(id(agent), agent)
+
+
+def enable_streaming(llm: Any, enabled: bool = True) -> bool:
+    """Activa el streaming en el LLM real (también si está envuelto por la caché)"""
+    target = getattr(llm, "inner", llm)
+    if not hasattr(target, "stream"):
+        return False
+    target.stream = enabled
+    return True
+
+
+@dataclass
+class StageProgress:
+    """Estado de una etapa del flujo"""
+    label: str
+    agent: Any
+    status: str = PENDING
+    text: str = ""
+    chunks: int = 0
+    started_at: Optional[float] = None
+    first_token_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    @property
+    def elapsed(self) -> Optional[float]:
+        if self.started_at is None:
+            return None
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+
+class StreamMonitor:
+    """Recoge eventos de tarea y fragmentos de streaming por etapa
+
+    ``stages`` son pares (agente, etiqueta) en el orden del flujo. Se usa como
+    gestor de contexto para registrar y retirar los manejadores del bus. Con
+    ``exclusive`` se silencian mientras tanto los demás receptores de
+    fragmentos (el listener de CrewAI los imprime tal cual en la salida).
+    """
+
+    def __init__(self, stages: Sequence[Tuple[Any, str]],
+                 on_update: Optional[Callable[["StreamMonitor"], None]] = None,
+                 exclusive: bool = True):
+        self.stages: List[StageProgress] = [StageProgress(label, agent) for agent, label in stages]
+        self.on_update = on_update
+        self.exclusive = exclusive
+        self._silenced: List[Callable] = []
+        self.started_at = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self._current: Optional[StageProgress] = None
+        # Tareas en curso por etapa (varias a la vez con los candidatos)
+        self._active: Dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._handlers: List[Tuple[Any, Callable]] = []
+
+    def __enter__(self) -> "StreamMonitor":
+        from crewai.utilities.events import (
+            LLMStreamChunkEvent, TaskCompletedEvent, TaskFailedEvent, TaskStartedEvent
+        )
+        from crewai.utilities.events.crewai_event_bus import crewai_event_bus
+        from agents.cascade import LLMEscalationEvent
+
+        self._handlers = [
+            (TaskStartedEvent, self._on_task_started),
+            (TaskCompletedEvent, self._on_task_completed),
+            (TaskFailedEvent, self._on_task_failed),
+            (LLMStreamChunkEvent, self._on_chunk),
+            (LLMEscalationEvent, self._on_escalation),
+        ]
+        if self.exclusive:
+            chunk_handlers = crewai_event_bus._handlers.get(LLMStreamChunkEvent, [])
+            self._silenced = list(chunk_handlers)
+            chunk_handlers.clear()
+        for event_type, handler in self._handlers:
+            crewai_event_bus.register_handler(event_type, handler)
+        return self
+
+    def __exit__(self, *exc):
+        from crewai.utilities.events import LLMStreamChunkEvent
+        from crewai.utilities.events.crewai_event_bus import crewai_event_bus
+
+        for event_type, handler in self._handlers:
+            handlers = crewai_event_bus._handlers.get(event_type, [])
+            if handler in handlers:
+                handlers.remove(handler)
+        if self._silenced:
+            crewai_event_bus._handlers.setdefault(LLMStreamChunkEvent, []).extend(self._silenced)
+            self._silenced = []
+        return False
+
+    def _stage_for(self, task: Any) -> Optional[StageProgress]:
+        agent = stage_agent(getattr(task, "agent", None))
+        for stage in self.stages:
+            if stage.agent is agent:
+                return stage
+        return None
+
+    def _notify(self):
+        if self.on_update is not None:
+            self.on_update(self)
+
+    def _on_task_started(self, source, event):
+        stage = self._stage_for(event.task or source)
+        if stage is None:
+            return
+        with self._lock:
+            active = self._active.get(id(stage), 0)
+            self._active[id(stage)] = active + 1
+            if not active:
+                stage.status, stage.started_at = RUNNING, time.perf_counter()
+                stage.text, stage.chunks = "", 0
+            self._current = stage
+        self._notify()
+
+    def _on_chunk(self, source, event):
+        if event.tool_call or not event.chunk:
+            return
+        with self._lock:
+            stage = self._current
+            if stage is None:
+                return
+            now = time.perf_counter()
+            if stage.first_token_at is None:
+                stage.first_token_at = now
+            if self.first_token_at is None:
+                self.first_token_at = now
+            stage.text += event.chunk
+            stage.chunks += 1
+        self._notify()
+
+    def _on_escalation(self, source, event):
+        # Los fragmentos del nivel rechazado no forman parte de la respuesta
+        with self._lock:
+            stage = self._current
+            if stage is None:
+                return
+            stage.text, stage.chunks = "", 0
+        self._notify()
+
+    def _on_task_completed(self, source, event):
+        stage = self._stage_for(event.task or source)
+        if stage is None:
+            return
+        with self._lock:
+            if event.output is not None and event.output.raw:
+                stage.text = event.output.raw
+            if self._finish(stage) and stage.status != FAILED:
+                stage.status, stage.finished_at = DONE, time.perf_counter()
+        self._notify()
+
+    def _on_task_failed(self, source, event):
+        stage = self._stage_for(event.task or source)
+        if stage is None:
+            return
+        with self._lock:
+            stage.status = FAILED
+            if self._finish(stage):
+                stage.finished_at = time.perf_counter()
+        self._notify()
+
+    def _finish(self, stage: StageProgress) -> bool:
+        """Descuenta una tarea de la etapa; True si era la última en curso"""
+        active = max(0, self._active.get(id(stage), 0) - 1)
+        self._active[id(stage)] = active
+        if active:
+            return False
+        if self._current is stage:
+            self._current = None
+        return True
+
+    @property
+    def current(self) -> Optional[StageProgress]:
+        """Etapa en curso o, si no hay, la última que produjo texto"""
+        with self._lock:
+            if self._current is not None:
+                return self._current
+            return next((s for s in reversed(self.stages) if s.text), None)
+
+    @property
+    def time_to_first_token(self) -> Optional[float]:
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.started_at
+
+    def snapshot(self) -> List[StageProgress]:
+        """Copia del estado de las etapas, para pintar sin bloquear el flujo"""
+        with self._lock:
+            return [StageProgress(**vars(stage)) for stage in self.stages]
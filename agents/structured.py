@@ -0,0 +1,627 @@
+"""
+Salida estructurada de la actividad según ``PlantillaActividad``.
+
+El diseñador y el agente de refinamiento devuelven un objeto JSON con la
+forma de la plantilla. La validación es incremental: cada campo y cada
+elemento de las listas de objetos (fases, tareas, grupos...) se comprueba por
+separado, de modo que lo que es válido se conserva y solo los subobjetos
+incompletos o mal formados se vuelven a pedir al modelo con un prompt
+acotado a ellos: uno por elemento de lista y uno solo para todos los campos
+de primer nivel que fallen. La actividad validada se presenta en markdown con
+un encabezado por fase, tarea y grupo; ``section_paths`` relaciona cada
+sección de ese markdown con la ruta JSON de la que sale, para que el
+refinamiento por secciones edite directamente los subobjetos.
+"""
+
+import json
+import re
+import typing
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple, Union
+
+from pydantic import BaseModel, TypeAdapter, ValidationError
+
+from agents.refinement import CHANGES_MARK, END_MARK, SECTION_MARK, RefinementPlan, split_design
+from templates.activity_template import PlantillaActividad
+
+Path = List[Union[str, int]]
+
+# Campos que no pueden quedar vacíos: son las secciones que el profesor echa en falta
+REQUIRED_CONTENT = (
+    "titulo", "descripcion_general", "objetivos_aprendizaje", "fases",
+    "asignaciones_grupos", "criterios_evaluacion_generales",
+)
+CONTAINER_FIELDS = ("fases", "asignaciones_grupos")
+# Separa los campos de primer nivel que se reparan juntos en una sola llamada
+FIELDS_SEPARATOR = ","
+MAX_REPAIR_ROUNDS = 2
+REPAIR_WORKERS = 4
+
+# Secciones de nivel 2 del markdown y los campos de la plantilla que contienen
+RENDER_GROUPS = (
+    ("1. Información general", ("materia", "tema_principal", "nivel_educativo", "duracion_total", "tipo_actividad")),
+    ("2. Objetivos", ("objetivos_aprendizaje", "objetivos_inclusion", "competencias_clave")),
+    ("3. Fases de la actividad", ("fases",)),
+    ("4. Asignación de estudiantes", ("asignaciones_grupos",)),
+    ("5. Materiales y recursos", ("materiales_base", "materiales_adaptacion", "recursos_digitales")),
+    ("6. Evaluación", ("criterios_evaluacion_generales", "rubrica_inclusion", "estrategias_evaluacion_adaptadas")),
+    ("7. Diseño universal y apoyos", ("principios_diseño_universal", "adaptaciones_proactivas", "estrategias_apoyo_pares")),
+    ("8. Notas para el profesor", ("notas_implementacion", "recursos_profesor", "extension_actividades")),
+)
+
+# Subapartados en negrita de esas secciones: uno por campo
+FIELD_LABELS = {
+    "objetivos_aprendizaje": "Objetivos de aprendizaje",
+    "objetivos_inclusion": "Objetivos de inclusión",
+    "competencias_clave": "Competencias clave",
+    "materiales_base": "Materiales base",
+    "materiales_adaptacion": "Materiales de adaptación",
+    "recursos_digitales": "Recursos digitales",
+    "criterios_evaluacion_generales": "Criterios generales",
+    "rubrica_inclusion": "Rúbrica inclusiva",
+    "estrategias_evaluacion_adaptadas": "Evaluación adaptada",
+    "principios_diseño_universal": "Principios de diseño universal",
+    "adaptaciones_proactivas": "Adaptaciones proactivas",
+    "estrategias_apoyo_pares": "Apoyo entre iguales",
+    "notas_implementacion": "Notas de implementación",
+    "recursos_profesor": "Recursos para el profesor",
+    "extension_actividades": "Extensiones",
+}
+_LABEL_FIELDS = {f"{label}:": name for name, label in FIELD_LABELS.items()}
+
+_PATH_TOKEN_RE = re.compile(r"([^.\[\]]+)|\[(\d+)\]")
+_PATH_NESTED_RE = re.compile(r"[.\[]")
+_FENCE_RE = re.compile(r"```(?:json)?\s*\n(.*?)```", re.DOTALL)
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+_UNIT_BLOCK_RE = re.compile(r"<<<([\w\[\]\.ñ]+)>>>[ \t]*\n?(.*?)<<<FIN>>>", re.DOTALL)
+_FASE_RE = re.compile(r"^Fase (\d+)\b")
+_TAREA_RE = re.compile(r"^Tarea (\d+)\.(\d+)\b")
+_GRUPO_RE = re.compile(r"^Grupo\b")
+
+
+# Rutas dentro de la plantilla ("fases[1].tareas[0].objetivo")
+
+def parse_path(path: str) -> Path:
+    return [name if name else int(index) for name, index in _PATH_TOKEN_RE.findall(path)]
+
+
+def format_path(tokens: Sequence[Union[str, int]]) -> str:
+    text = ""
+    for token in tokens:
+        text += f"[{token}]" if isinstance(token, int) else (f".{token}" if text else token)
+    return text
+
+
+def _is_model(annotation: Any) -> bool:
+    return isinstance(annotation, type) and issubclass(annotation, BaseModel)
+
+
+def _list_item(annotation: Any) -> Optional[Any]:
+    if typing.get_origin(annotation) in (list, List):
+        return typing.get_args(annotation)[0]
+    return None
+
+
+def type_at(path: str, root: Any = PlantillaActividad) -> Any:
+    """Tipo que debe tener el valor en esa ruta"""
+    annotation = root
+    for token in parse_path(path):
+        if isinstance(token, int):
+            annotation = _list_item(annotation)
+        else:
+            annotation = annotation.model_fields[token].annotation
+    return annotation
+
+
+def get_path(data: Any, path: str) -> Any:
+    value = data
+    for token in parse_path(path):
+        try:
+            value = value[token]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return value
+
+
+def set_path(data: Dict[str, Any], path: str, value: Any):
+    tokens = parse_path(path)
+    target = data
+    for token, following in zip(tokens, tokens[1:]):
+        if isinstance(token, str) and not isinstance(target.get(token), (dict, list)):
+            target[token] = [] if isinstance(following, int) else {}
+        target = target[token]
+    last = tokens[-1]
+    if isinstance(last, int):
+        while len(target) <= last:
+            target.append({})
+    target[last] = value
+
+
+# Esquema compacto para los prompts
+
+def skeleton(annotation: Any) -> Any:
+    """Ejemplo mínimo de la forma de un tipo (lo que se enseña al modelo)"""
+    if _is_model(annotation):
+        return {name: skeleton(info.annotation) for name, info in annotation.model_fields.items()}
+    origin = typing.get_origin(annotation)
+    if origin in (list, List):
+        return [skeleton(typing.get_args(annotation)[0])]
+    if origin in (dict, Dict):
+        return {"clave": skeleton(typing.get_args(annotation)[1])}
+    return "texto"
+
+
+def schema_text(path: str = "") -> str:
+    annotation = type_at(path) if path else PlantillaActividad
+    return json.dumps(skeleton(annotation), ensure_ascii=False)
+
+
+# Lectura y validación incremental
+
+def extract_json(text: str) -> Optional[Any]:
+    """Primer valor JSON de la respuesta (admite bloque ```json y comas finales)"""
+    if not text:
+        return None
+    candidates = _FENCE_RE.findall(text) + [text]
+    for open_char, close_char in (("{", "}"), ("[", "]")):
+        start, end = text.find(open_char), text.rfind(close_char)
+        if 0 <= start < end:
+            candidates.append(text[start:end + 1])
+    for candidate in candidates:
+        for attempt in (candidate, _TRAILING_COMMA_RE.sub(r"\1", candidate)):
+            try:
+                return json.loads(attempt.strip())
+            except ValueError:
+                continue
+    return None
+
+
+def _coerce(annotation: Any, value: Any) -> Any:
+    """Arreglos locales baratos antes de volver a preguntar al modelo"""
+    if annotation is str:
+        if isinstance(value, (int, float)):
+            return str(value)
+        if isinstance(value, list) and all(isinstance(v, str) for v in value):
+            return "\n".join(value)
+    item = _list_item(annotation)
+    if item is str and isinstance(value, str):
+        return [line.lstrip("-• ").strip() for line in value.splitlines() if line.strip()]
+    if typing.get_origin(annotation) in (dict, Dict) and isinstance(value, dict):
+        inner = typing.get_args(annotation)[1]
+        return {str(k): _coerce(inner, v) for k, v in value.items()}
+    return value
+
+
+@dataclass
+class FieldIssue:
+    """Campo ausente o con un valor que no encaja en la plantilla"""
+    path: str
+    mensaje: str
+
+
+def _check(annotation: Any, value: Any, path: str, issues: List[FieldIssue]):
+    if _is_model(annotation):
+        if not isinstance(value, dict):
+            issues.append(FieldIssue(path, "se esperaba un objeto"))
+            return
+        for name, info in annotation.model_fields.items():
+            sub = f"{path}.{name}" if path else name
+            if value.get(name) is None:
+                issues.append(FieldIssue(sub, "falta el campo"))
+            else:
+                _check(info.annotation, value[name], sub, issues)
+        return
+    item = _list_item(annotation)
+    if item is not None and _is_model(item):
+        if not isinstance(value, list):
+            issues.append(FieldIssue(path, "se esperaba una lista"))
+            return
+        for i, element in enumerate(value):
+            _check(item, element, f"{path}[{i}]", issues)
+        return
+    try:
+        TypeAdapter(annotation).validate_python(value)
+    except ValidationError as e:
+        issues.append(FieldIssue(path, e.errors()[0]["msg"]))
+
+
+def find_issues(data: Any, path: str = "") -> List[FieldIssue]:
+    """Problemas del valor (la actividad entera o un subobjeto) campo a campo"""
+    annotation = type_at(path) if path else PlantillaActividad
+    if isinstance(data, dict) and _is_model(annotation):
+        _normalize(annotation, data)
+    issues: List[FieldIssue] = []
+    _check(annotation, data, path, issues)
+    if not path and isinstance(data, dict):
+        for name in REQUIRED_CONTENT:
+            if data.get(name) in ("", [], {}):
+                issues.append(FieldIssue(name, "está vacío"))
+    return issues
+
+
+def _normalize(model: Any, data: Dict[str, Any]):
+    """Aplica los arreglos locales a todos los niveles, en el sitio"""
+    for name, info in model.model_fields.items():
+        if name not in data or data[name] is None:
+            continue
+        annotation = info.annotation
+        item = _list_item(annotation)
+        if _is_model(annotation) and isinstance(data[name], dict):
+            _normalize(annotation, data[name])
+        elif item is not None and _is_model(item) and isinstance(data[name], list):
+            for element in data[name]:
+                if isinstance(element, dict):
+                    _normalize(item, element)
+        else:
+            data[name] = _coerce(annotation, data[name])
+
+
+def repair_unit(path: str) -> str:
+    """Subobjeto que se vuelve a pedir: el elemento de lista más cercano o el campo"""
+    tokens = parse_path(path)
+    last_index = max((i for i, t in enumerate(tokens) if isinstance(t, int)), default=None)
+    if last_index is None:
+        return format_path(tokens[:1])
+    return format_path(tokens[:last_index + 1])
+
+
+def unit_fields(unit: str) -> List[str]:
+    """Campos de primer nivel de una unidad conjunta ("materia,fases"); la propia unidad si no lo es"""
+    return unit.split(FIELDS_SEPARATOR)
+
+
+def _issue_unit(issue_path: str, path: str) -> str:
+    unit = repair_unit(issue_path)
+    return path if len(unit) < len(path) else unit
+
+
+def group_issues(issues: Sequence[FieldIssue], path: str = "") -> Dict[str, List[FieldIssue]]:
+    """Agrupa los problemas en unidades de reparación
+
+    Cada elemento de lista con problemas es una unidad; todos los campos de
+    primer nivel que fallan van juntos en una sola unidad conjunta. Ninguna
+    unidad queda por encima de ``path``.
+    """
+    units: Dict[str, List[FieldIssue]] = {}
+    for issue in issues:
+        units.setdefault(_issue_unit(issue.path, path), []).append(issue)
+    fields = [unit for unit in units if not _PATH_NESTED_RE.search(unit)]
+    if len(fields) > 1:
+        merged = [issue for unit in fields for issue in units.pop(unit)]
+        units = {FIELDS_SEPARATOR.join(fields): merged, **units}
+    return units
+
+
+def _default(annotation: Any) -> Any:
+    if _is_model(annotation):
+        return {name: _default(info.annotation) for name, info in annotation.model_fields.items()}
+    origin = typing.get_origin(annotation)
+    if origin in (list, List):
+        return []
+    if origin in (dict, Dict):
+        return {}
+    return ""
+
+
+def _sanitize(annotation: Any, value: Any) -> Any:
+    """Conserva lo válido y rellena con vacío lo que no se pudo reparar"""
+    if _is_model(annotation):
+        value = value if isinstance(value, dict) else {}
+        return {name: _sanitize(info.annotation, value.get(name))
+                for name, info in annotation.model_fields.items()}
+    item = _list_item(annotation)
+    if item is not None and _is_model(item):
+        return [_sanitize(item, v) for v in value if isinstance(v, dict)] if isinstance(value, list) else []
+    try:
+        return TypeAdapter(annotation).validate_python(_coerce(annotation, value))
+    except ValidationError:
+        return _default(annotation)
+
+
+# Reparación dirigida
+
+@dataclass
+class StructuredResult:
+    """Actividad validada y qué hubo que reparar por el camino"""
+    actividad: PlantillaActividad
+    reparados: List[str] = field(default_factory=list)
+    sin_resolver: List[str] = field(default_factory=list)
+    llamadas_reparacion: int = 0
+
+
+Repairer = Callable[[str, List[FieldIssue], Dict[str, Any]], Optional[Any]]
+
+
+def repair_prompt(unit: str, issues: Sequence[FieldIssue], data: Dict[str, Any]) -> str:
+    """Prompt acotado a un subobjeto (o a varios campos): su esquema, su valor actual y qué falla"""
+    problems = "\n".join(f"- {issue.path}: {issue.mensaje}" for issue in issues)
+    fields = unit_fields(unit)
+    if len(fields) > 1:
+        names = ", ".join(f"`{name}`" for name in fields)
+        target = f"los campos {names}"
+        schema = json.dumps({name: skeleton(type_at(name)) for name in fields}, ensure_ascii=False)
+        current = json.dumps({name: data.get(name) for name in fields}, ensure_ascii=False)
+        answer = f"un objeto JSON con {target}"
+    else:
+        value = get_path(data, unit)
+        target, answer = f"el valor de `{unit}`", f"el JSON de `{unit}`"
+        schema = schema_text(unit)
+        current = json.dumps(value, ensure_ascii=False) if value is not None else "(ausente)"
+    return f"""Estás completando la actividad "{data.get('titulo', '')}": {data.get('descripcion_general', '')}
+
+Corrige SOLO {target}. Debe seguir este esquema JSON (los valores son de ejemplo):
+{schema}
+
+Valor actual:
+{current}
+
+Problemas detectados:
+{problems}
+
+Conserva lo que ya es correcto. Responde únicamente con {answer}, sin texto adicional."""
+
+
+def llm_repairer(llm: Any) -> Repairer:
+    """Reparador que pregunta directamente al LLM del agente, sin lanzar un crew"""
+    def repair(unit: str, issues: List[FieldIssue], data: Dict[str, Any]) -> Optional[Any]:
+        response = llm.call([{"role": "user", "content": repair_prompt(unit, issues, data)}])
+        text = response if isinstance(response, str) else str(response)
+        text = text.split("Final Answer:", 1)[-1]
+        value = extract_json(text)
+        if value is None and len(unit_fields(unit)) == 1 and type_at(unit) is str:
+            value = text.strip()
+        return value
+    return repair
+
+
+def repair_value(data: Any, repair: Optional[Repairer], path: str = "",
+                 context: Optional[Dict[str, Any]] = None,
+                 max_rounds: int = MAX_REPAIR_ROUNDS) -> Tuple[Any, List[str], int]:
+    """Repara los subobjetos con problemas: (valor, rutas reparadas, llamadas hechas)
+
+    ``path`` indica qué parte de la plantilla es ``data`` (vacío: la actividad
+    entera); ``context`` es la actividad completa para dar contexto al modelo.
+    Las reparaciones de una ronda son independientes y se piden en paralelo;
+    las unidades cuya reparación falló no se vuelven a pedir.
+    """
+    root = {} if context is None else context
+    repaired: List[str] = []
+    failed: Set[str] = set()
+    calls = 0
+    for _ in range(max_rounds if repair is not None else 0):
+        if path:
+            set_path(root, path, data)
+        issues = [issue for issue in find_issues(data, path) if _issue_unit(issue.path, path) not in failed]
+        if not issues:
+            break
+        units = group_issues(issues, path)
+        view = data if not path else root
+
+        def ask(unit):
+            try:
+                return repair(unit, units[unit], view)
+            except Exception:
+                return None
+
+        with ThreadPoolExecutor(max_workers=min(REPAIR_WORKERS, len(units))) as pool:
+            fixes = list(pool.map(ask, units))
+        calls += len(units)
+        for unit, value in zip(units, fixes):
+            fields = unit_fields(unit)
+            if len(fields) > 1:
+                fixed = [name for name in fields if isinstance(value, dict) and value.get(name) is not None]
+                for name in fixed:
+                    data[name] = value[name]
+                repaired.extend(fixed)
+                failed.update(name for name in fields if name not in fixed)
+                continue
+            if value is None:
+                failed.add(unit)
+                continue
+            relative = unit[len(path):].lstrip(".") if path else unit
+            if relative:
+                set_path(data, relative, value)
+            else:
+                data = value
+            repaired.append(unit)
+    return data, repaired, calls
+
+
+def build_activity(data: Any, repair: Optional[Repairer] = None,
+                   max_rounds: int = MAX_REPAIR_ROUNDS) -> StructuredResult:
+    """Valida la actividad campo a campo, repara lo que falla y completa lo irreparable"""
+    data = data if isinstance(data, dict) else {}
+    data, repaired, calls = repair_value(data, repair, max_rounds=max_rounds)
+    unresolved = sorted({repair_unit(issue.path) for issue in find_issues(data)})
+    activity = PlantillaActividad.model_validate(_sanitize(PlantillaActividad, data))
+    return StructuredResult(activity, sorted(set(repaired)), unresolved, calls)
+
+
+# Markdown y correspondencia sección → ruta
+
+def _bullets(items: Sequence[str]) -> str:
+    return "\n".join(f"- {item}" for item in items) or "- (sin especificar)"
+
+
+def _mapping(items: Dict[str, Any]) -> str:
+    lines = []
+    for key, value in items.items():
+        value = ", ".join(value) if isinstance(value, list) else value
+        lines.append(f"- {key}: {value}")
+    return "\n".join(lines) or "- (sin especificar)"
+
+
+def render_markdown(activity: PlantillaActividad) -> str:
+    """Actividad en markdown, con un encabezado por fase, tarea y grupo"""
+    a = activity
+    out = [f"# {a.titulo}\n\n{a.descripcion_general}\n"]
+    out.append(f"""## {RENDER_GROUPS[0][0]}
+- **Materia:** {a.materia}
+- **Tema:** {a.tema_principal}
+- **Nivel educativo:** {a.nivel_educativo}
+- **Duración total:** {a.duracion_total}
+- **Tipo de actividad:** {a.tipo_actividad}
+""")
+    out.append(f"""## {RENDER_GROUPS[1][0]}
+**{FIELD_LABELS['objetivos_aprendizaje']}:**
+{_bullets(a.objetivos_aprendizaje)}
+**{FIELD_LABELS['objetivos_inclusion']}:**
+{_bullets(a.objetivos_inclusion)}
+**{FIELD_LABELS['competencias_clave']}:**
+{_bullets(a.competencias_clave)}
+""")
+    out.append(f"## {RENDER_GROUPS[2][0]}\n")
+    for i, fase in enumerate(a.fases, 1):
+        out.append(f"""### Fase {i}: {fase.nombre}
+{fase.descripcion}
+- **Objetivo:** {fase.objetivo}
+- **Duración:** {fase.duracion_total}
+""")
+        for j, tarea in enumerate(fase.tareas, 1):
+            steps = "\n".join(f"{n}. {step}" for n, step in enumerate(tarea.instrucciones_paso_a_paso, 1))
+            adaptations = "\n".join(
+                f"- {ad.neurotipo} ({ad.estudiante_id}): {'; '.join(ad.estrategias_especificas)}. "
+                f"Rol: {ad.rol_en_grupo}. Apoyo: {ad.apoyo_necesario}. Tiempo: {ad.tiempo_estimado}"
+                + (f". Materiales: {', '.join(ad.materiales_adicionales)}" if ad.materiales_adicionales else "")
+                for ad in tarea.adaptaciones_por_estudiante
+            )
+            out.append(f"""#### Tarea {i}.{j}: {tarea.nombre}
+{tarea.descripcion}
+- **Objetivo:** {tarea.objetivo}
+- **Duración:** {tarea.duracion_estimada}
+- **Materiales:** {", ".join(tarea.materiales) or "(sin especificar)"}
+
+{steps}
+**Adaptaciones:**
+{adaptations or "- (sin adaptaciones)"}
+**Criterios de evaluación:**
+{_bullets(tarea.criterios_evaluacion)}
+""")
+        if fase.estrategias_adaptacion:
+            out.append(f"**Estrategias de adaptación de la fase {i}:**\n{_mapping(fase.estrategias_adaptacion)}\n")
+    out.append(f"## {RENDER_GROUPS[3][0]}\n")
+    for grupo in a.asignaciones_grupos:
+        roles = "\n".join(f"  - {student}: {role}" for student, role in grupo.roles_asignados.items())
+        out.append(f"""### Grupo {grupo.grupo_id} ({grupo.tipo_agrupacion})
+- **Estudiantes:** {", ".join(grupo.estudiantes)}
+- **Justificación:** {grupo.justificacion_agrupacion}
+- **Roles:**
+{roles or "  - (sin roles)"}
+""")
+    out.append(f"""## {RENDER_GROUPS[4][0]}
+**{FIELD_LABELS['materiales_base']}:**
+{_bullets(a.materiales_base)}
+**{FIELD_LABELS['materiales_adaptacion']}:**
+{_mapping(a.materiales_adaptacion)}
+**{FIELD_LABELS['recursos_digitales']}:**
+{_bullets(a.recursos_digitales)}
+""")
+    out.append(f"""## {RENDER_GROUPS[5][0]}
+**{FIELD_LABELS['criterios_evaluacion_generales']}:**
+{_bullets(a.criterios_evaluacion_generales)}
+**{FIELD_LABELS['rubrica_inclusion']}:**
+{_mapping(a.rubrica_inclusion)}
+**{FIELD_LABELS['estrategias_evaluacion_adaptadas']}:**
+{_mapping(a.estrategias_evaluacion_adaptadas)}
+""")
+    out.append(f"""## {RENDER_GROUPS[6][0]}
+**{FIELD_LABELS['principios_diseño_universal']}:**
+{_bullets(a.principios_diseño_universal)}
+**{FIELD_LABELS['adaptaciones_proactivas']}:**
+{_mapping(a.adaptaciones_proactivas)}
+**{FIELD_LABELS['estrategias_apoyo_pares']}:**
+{_bullets(a.estrategias_apoyo_pares)}
+""")
+    out.append(f"""## {RENDER_GROUPS[7][0]}
+**{FIELD_LABELS['notas_implementacion']}:**
+{_bullets(a.notas_implementacion)}
+**{FIELD_LABELS['recursos_profesor']}:**
+{_bullets(a.recursos_profesor)}
+**{FIELD_LABELS['extension_actividades']}:**
+{_bullets(a.extension_actividades)}
+""")
+    return "\n".join(out)
+
+
+def section_paths(markdown: str) -> List[List[str]]:
+    """Rutas de la plantilla de cada sección de ``split_design(markdown)``"""
+    # Las secciones contenedoras (fases, grupos) no tienen ruta propia: la llevan sus hijas
+    groups = {title: [f for f in fields if f not in CONTAINER_FIELDS] for title, fields in RENDER_GROUPS}
+    paths: List[List[str]] = []
+    current: List[str] = ["titulo", "descripcion_general"]
+    group: List[str] = current
+    fase, grupo = None, -1
+    for section in split_design(markdown):
+        title = section.titulo
+        if section.nivel == 2 and title in groups:
+            group = current = groups[title]
+            fase = None
+        elif section.nivel == 3 and _FASE_RE.match(title):
+            fase = int(_FASE_RE.match(title).group(1)) - 1
+            current = [f"fases[{fase}]"]
+        elif section.nivel == 3 and _GRUPO_RE.match(title):
+            grupo += 1
+            current = [f"asignaciones_grupos[{grupo}]"]
+        elif section.nivel == 4 and _TAREA_RE.match(title):
+            match = _TAREA_RE.match(title)
+            current = [f"fases[{int(match.group(1)) - 1}].tareas[{int(match.group(2)) - 1}]"]
+        elif title in _LABEL_FIELDS and _LABEL_FIELDS[title] in group:
+            current = [_LABEL_FIELDS[title]]
+        elif title.startswith("Estrategias de adaptación de la fase"):
+            current = [f"fases[{fase}].estrategias_adaptacion"] if fase is not None else group
+        paths.append(list(current))
+    return paths
+
+
+def plan_units(markdown: str, plan: RefinementPlan) -> List[str]:
+    """Subobjetos que cubren las secciones elegidas (sin repetir los contenidos en otros)"""
+    by_key = dict(zip((s.key for s in split_design(markdown)), section_paths(markdown)))
+    units: List[str] = []
+    for key in plan.targets:
+        for path in by_key.get(key, []):
+            if path not in units:
+                units.append(path)
+    return [u for u in units if not any(u.startswith((o + ".", o + "[")) for o in units)]
+
+
+def render_units(activity: Dict[str, Any], units: Sequence[str]) -> str:
+    """Valor JSON de cada subobjeto entre sus marcadores"""
+    return "\n\n".join(
+        f"{SECTION_MARK.format(key=unit)}\n{json.dumps(get_path(activity, unit), ensure_ascii=False, indent=1)}\n{END_MARK}"
+        for unit in units
+    )
+
+
+def units_schema(units: Sequence[str]) -> str:
+    seen, lines = set(), []
+    for unit in units:
+        schema = schema_text(unit)
+        if schema not in seen:
+            seen.add(schema)
+            lines.append(f"{unit}: {schema}")
+    return "\n".join(lines)
+
+
+def apply_units(activity: PlantillaActividad, units: Sequence[str], output: str,
+                repair: Optional[Repairer] = None) -> Tuple[Optional[StructuredResult], List[str], str]:
+    """Sustituye los subobjetos devueltos por el modelo, validándolos y reparándolos uno a uno"""
+    data = activity.model_dump()
+    blocks = {unit: body for unit, body in _UNIT_BLOCK_RE.findall(output) if unit in units}
+    if not blocks and len(units) == 1 and SECTION_MARK[:3] not in output:
+        blocks = {units[0]: output.split(CHANGES_MARK, 1)[0]}
+    replaced, calls = [], 0
+    for unit, body in blocks.items():
+        value = extract_json(body)
+        if value is None:
+            continue
+        value, _, used = repair_value(value, repair, path=unit, context=data)
+        calls += used
+        set_path(data, unit, value)
+        replaced.append(unit)
+    changes = output.split(CHANGES_MARK, 1)[1].strip() if CHANGES_MARK in output else ""
+    if not replaced:
+        return None, [], changes
+    result = build_activity(data)
+    result.reparados, result.llamadas_reparacion = [], calls
+    return result, [u for u in units if u in replaced], changes
@@ -0,0 +1,22 @@
+"""
+Estimación de tokens para dimensionar prompts sin llamar al modelo.
+"""
+
+import re
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+# Caracteres medios por token en texto español para los tokenizadores BPE
+CHARS_PER_TOKEN = 4.0
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimación rápida del número de tokens de un texto
+
+    Combina palabras/signos y longitud en caracteres: las palabras largas en
+    español se parten en varios tokens y los signos cuentan como uno cada uno.
+    """
+    if not text:
+        return 0
+    pieces = len(_TOKEN_RE.findall(text))
+    return max(pieces, int(len(text) / CHARS_PER_TOKEN + 0.5))
@@ -0,0 +1,329 @@
+"""
+Trazas estructuradas de cada etapa del crew y de cada llamada al LLM.
+
+``Tracer`` se suscribe al bus de eventos de CrewAI igual que
+``StreamMonitor``: cada tarea abre un span de etapa y cada llamada al modelo
+(o respuesta servida desde la caché) un span hijo con el modelo, los tokens
+estimados de prompt y respuesta, los aciertos de caché y los errores. Cada
+etapa cuenta como reintentos las llamadas que siguen a una llamada fallida y,
+aparte, los escalados de la cascada de modelos. Los
+spans terminados se exportan como líneas JSON con la forma de OpenTelemetry
+(``trace_id``, ``span_id``, ``parent_span_id``, tiempos en nanosegundos,
+``attributes`` y ``status``) y se guardan para el resumen por etapa.
+"""
+
+import contextlib
+import json
+import os
+import secrets
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from agents.streaming import stage_agent
+from agents.tokens import estimate_tokens
+
+SERVICE_NAME = "ia4edu"
+
+# Atributos por convención semántica de OpenTelemetry para IA generativa
+MODEL_ATTR = "gen_ai.request.model"
+INPUT_TOKENS_ATTR = "gen_ai.usage.input_tokens"
+OUTPUT_TOKENS_ATTR = "gen_ai.usage.output_tokens"
+
+
+def _new_id(nbytes: int) -> str:
+    return secrets.token_hex(nbytes)
+
+
+def _text(value: Any) -> str:
+    if isinstance(value, str):
+        return value
+    if isinstance(value, list):
+        return "\n".join(str(m.get("content", "")) if isinstance(m, dict) else str(m) for m in value)
+    return str(value or "")
+
+
+@dataclass
+class Span:
+    """Intervalo con nombre dentro de una traza"""
+    name: str
+    trace_id: str
+    parent_span_id: Optional[str] = None
+    kind: str = "INTERNAL"
+    span_id: str = field(default_factory=lambda: _new_id(8))
+    start_ns: int = field(default_factory=time.time_ns)
+    end_ns: Optional[int] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    status: str = "UNSET"
+    status_message: Optional[str] = None
+
+    @property
+    def duration_s(self) -> Optional[float]:
+        if self.end_ns is None:
+            return None
+        return (self.end_ns - self.start_ns) / 1e9
+
+    def add(self, key: str, amount: int = 1):
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def finish(self, error: Optional[str] = None):
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.status, self.status_message = "ERROR", error
+        elif self.status == "UNSET":
+            self.status = "OK"
+
+    def to_otel(self) -> Dict[str, Any]:
+        status = {"code": self.status}
+        if self.status_message:
+            status["message"] = self.status_message
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_time_unix_nano": self.start_ns,
+            "end_time_unix_nano": self.end_ns,
+            "attributes": self.attributes,
+            "status": status,
+            "resource": {"service.name": SERVICE_NAME},
+        }
+
+
+class JSONLSpanExporter:
+    """Añade cada span terminado como una línea JSON"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_otel(), ensure_ascii=False, default=str)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+@dataclass
+class StageSummary:
+    """Totales de una etapa para la tabla final"""
+    etapa: str
+    modelo: str
+    duracion_s: float
+    llamadas: int
+    tokens_prompt: int
+    tokens_respuesta: int
+    aciertos_cache: int
+    reintentos: int
+    escalados: int
+    errores: int
+
+
+class Tracer:
+    """Crea spans de operación, etapa y llamada al LLM a partir de los eventos
+
+    Se usa como gestor de contexto para registrar y retirar los manejadores
+    del bus; ``span()`` abre la operación raíz (un diseño, un refinamiento) de
+    la que cuelgan las etapas. ``stages`` son pares (agente, etiqueta) para
+    nombrar las etapas; sin ellos se usa el rol del agente.
+    """
+
+    def __init__(self, exporter: Optional[JSONLSpanExporter] = None,
+                 stages: Sequence[Tuple[Any, str]] = ()):
+        self.exporter = exporter
+        self.spans: List[Span] = []
+        self._labels: Dict[int, str] = {}
+        self.set_stages(stages)
+        self._roots: List[Span] = []
+        self._tasks: Dict[int, Span] = {}
+        self._thread_task: Dict[int, Span] = {}
+        self._thread_llm: Dict[int, Span] = {}
+        # Etapas cuya última llamada al LLM falló: la siguiente es un reintento
+        self._failed: Dict[str, bool] = {}
+        self._lock = threading.Lock()
+        self._handlers: List[Tuple[Any, Any]] = []
+
+    def set_stages(self, stages: Sequence[Tuple[Any, str]]):
+        self._labels.update({id(agent): label for agent, label in stages})
+
+    def __enter__(self) -> "Tracer":
+        from crewai.utilities.events import (
+            LLMCallCompletedEvent, LLMCallFailedEvent, LLMCallStartedEvent,
+            TaskCompletedEvent, TaskFailedEvent, TaskStartedEvent
+        )
+        from crewai.utilities.events.crewai_event_bus import crewai_event_bus
+        from agents.cascade import LLMEscalationEvent
+        from agents.llm_cache import LLMCacheHitEvent
+
+        self._handlers = [
+            (TaskStartedEvent, self._on_task_started),
+            (TaskCompletedEvent, self._on_task_completed),
+            (TaskFailedEvent, self._on_task_failed),
+            (LLMCallStartedEvent, self._on_llm_started),
+            (LLMCallCompletedEvent, self._on_llm_completed),
+            (LLMCallFailedEvent, self._on_llm_failed),
+            (LLMCacheHitEvent, self._on_cache_hit),
+            (LLMEscalationEvent, self._on_escalation),
+        ]
+        for event_type, handler in self._handlers:
+            crewai_event_bus.register_handler(event_type, handler)
+        return self
+
+    def __exit__(self, *exc):
+        from crewai.utilities.events.crewai_event_bus import crewai_event_bus
+
+        for event_type, handler in self._handlers:
+            handlers = crewai_event_bus._handlers.get(event_type, [])
+            if handler in handlers:
+                handlers.remove(handler)
+        self._handlers = []
+        return False
+
+    def _start(self, name: str, parent: Optional[Span], kind: str = "INTERNAL", **attributes) -> Span:
+        trace_id = parent.trace_id if parent is not None else _new_id(16)
+        return Span(name, trace_id, parent.span_id if parent is not None else None, kind,
+                    attributes=dict(attributes))
+
+    def _end(self, span: Span, error: Optional[str] = None):
+        span.finish(error)
+        with self._lock:
+            self.spans.append(span)
+        if self.exporter is not None:
+            self.exporter.export(span)
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        """Operación raíz; las etapas que se ejecuten dentro cuelgan de ella"""
+        span = self._start(name, self._roots[-1] if self._roots else None, **attributes)
+        self._roots.append(span)
+        try:
+            yield span
+        except BaseException as e:
+            self._roots.remove(span)
+            self._end(span, f"{type(e).__name__}: {e}")
+            raise
+        self._roots.remove(span)
+        self._end(span)
+
+    # Etapas
+
+    def _on_task_started(self, source, event):
+        task = event.task or source
+        agent = getattr(task, "agent", None)
+        label = self._labels.get(id(stage_agent(agent))) or getattr(agent, "role", None) or "tarea"
+        span = self._start(f"etapa {label}", self._roots[-1] if self._roots else None,
+                           **{"ia4edu.stage": label, "ia4edu.agent": getattr(agent, "role", ""),
+                              "ia4edu.llm.retries": 0, "ia4edu.llm.escalations": 0})
+        with self._lock:
+            self._tasks[id(task)] = span
+            self._thread_task[threading.get_ident()] = span
+
+    def _close_task(self, source, event, error: Optional[str] = None):
+        task = event.task or source
+        with self._lock:
+            span = self._tasks.pop(id(task), None)
+            if span is not None and self._thread_task.get(threading.get_ident()) is span:
+                del self._thread_task[threading.get_ident()]
+            if span is not None:
+                self._failed.pop(span.span_id, None)
+        if span is None:
+            return
+        self._end(span, error)
+
+    def _on_task_completed(self, source, event):
+        self._close_task(source, event)
+
+    def _on_task_failed(self, source, event):
+        self._close_task(source, event, event.error)
+
+    # Llamadas al LLM
+
+    def _stage(self) -> Optional[Span]:
+        with self._lock:
+            return self._thread_task.get(threading.get_ident())
+
+    def _on_llm_started(self, source, event):
+        stage = self._stage()
+        if stage is not None:
+            with self._lock:
+                if self._failed.pop(stage.span_id, False):
+                    stage.add("ia4edu.llm.retries")
+        span = self._start("llm", stage or (self._roots[-1] if self._roots else None), "CLIENT", **{
+            MODEL_ATTR: getattr(source, "model", ""),
+            INPUT_TOKENS_ATTR: estimate_tokens(_text(event.messages)),
+            "ia4edu.cache.hit": False,
+            "ia4edu.tokens.estimated": True,
+        })
+        with self._lock:
+            self._thread_llm[threading.get_ident()] = span
+
+    def _finish_llm(self, error: Optional[str] = None, response: Any = None):
+        with self._lock:
+            span = self._thread_llm.pop(threading.get_ident(), None)
+        if span is None:
+            return
+        span.attributes[OUTPUT_TOKENS_ATTR] = estimate_tokens(_text(response))
+        self._account(span, error)
+        self._end(span, error)
+
+    def _on_llm_completed(self, source, event):
+        self._finish_llm(response=event.response)
+
+    def _on_llm_failed(self, source, event):
+        self._finish_llm(error=event.error)
+
+    def _on_cache_hit(self, source, event):
+        span = self._start("llm", self._stage() or (self._roots[-1] if self._roots else None), "CLIENT", **{
+            MODEL_ATTR: event.model,
+            INPUT_TOKENS_ATTR: estimate_tokens(_text(event.messages)),
+            OUTPUT_TOKENS_ATTR: estimate_tokens(event.response),
+            "ia4edu.cache.hit": True,
+            "ia4edu.tokens.estimated": True,
+        })
+        self._account(span)
+        self._end(span)
+
+    def _on_escalation(self, source, event):
+        stage = self._stage()
+        if stage is None:
+            return
+        with self._lock:
+            stage.add("ia4edu.llm.escalations")
+
+    def _account(self, llm_span: Span, error: Optional[str] = None):
+        """Suma la llamada a los totales de su etapa"""
+        stage = self._stage()
+        if stage is None:
+            return
+        with self._lock:
+            stage.add("ia4edu.llm.calls")
+            stage.add(INPUT_TOKENS_ATTR, llm_span.attributes.get(INPUT_TOKENS_ATTR, 0))
+            stage.add(OUTPUT_TOKENS_ATTR, llm_span.attributes.get(OUTPUT_TOKENS_ATTR, 0))
+            stage.add("ia4edu.cache.hits", int(llm_span.attributes["ia4edu.cache.hit"]))
+            stage.add("ia4edu.llm.errors", int(error is not None))
+            self._failed[stage.span_id] = error is not None
+            stage.attributes.setdefault(MODEL_ATTR, llm_span.attributes.get(MODEL_ATTR, ""))
+
+    def stage_summary(self) -> List[StageSummary]:
+        """Totales por etapa, en orden de finalización"""
+        with self._lock:
+            stages = [s for s in self.spans if "ia4edu.stage" in s.attributes]
+        return [
+            StageSummary(
+                etapa=s.attributes["ia4edu.stage"],
+                modelo=s.attributes.get(MODEL_ATTR, ""),
+                duracion_s=s.duration_s or 0.0,
+                llamadas=s.attributes.get("ia4edu.llm.calls", 0),
+                tokens_prompt=s.attributes.get(INPUT_TOKENS_ATTR, 0),
+                tokens_respuesta=s.attributes.get(OUTPUT_TOKENS_ATTR, 0),
+                aciertos_cache=s.attributes.get("ia4edu.cache.hits", 0),
+                reintentos=s.attributes.get("ia4edu.llm.retries", 0),
+                escalados=s.attributes.get("ia4edu.llm.escalations", 0),
+                errores=s.attributes.get("ia4edu.llm.errors", 0) + int(s.status == "ERROR"),
+            )
+            for s in stages
+        ]
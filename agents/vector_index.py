@@ -0,0 +1,272 @@
+"""
+Índice vectorial persistente para búsqueda semántica local de actividades.
+
+Cada actividad se representa con un vector hash de n-gramas de caracteres y
+términos (sin GPU ni modelos externos). Los vectores viven en un fichero
+float32 en disco que se abre con ``np.memmap``; al arrancar solo se embeben
+las actividades nuevas o modificadas y una consulta es un único producto
+matriz-vector con pesos IDF por dimensión.
+"""
+
+import json
+import os
+import threading
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from agents.corpus import CACHE_DIR, ActivityCorpus, ActivityDocument, get_corpus
+from agents.retrieval import SearchHit, fold_accents, get_activity_index, tokenize, _WORD_RE
+
+EMBEDDING_DIM = 4096
+# Cambiar si cambia la forma de calcular los vectores: invalida los índices guardados
+EMBEDDING_SCHEME = "hash-ngram-v1"
+CHAR_NGRAMS = (3, 4)
+# Peso mínimo de una dimensión presente en todos los documentos
+IDF_FLOOR = 0.05
+
+VECTORS_FILE = "vectors.f32"
+MANIFEST_FILE = "manifest.json"
+
+
+def _bucket(feature: str, dim: int) -> int:
+    """Dimensión estable (independiente del proceso) para una característica"""
+    return zlib.crc32(feature.encode("utf-8")) % dim
+
+
+def embed_text(text: str, dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """Vector L2-normalizado de términos y n-gramas de caracteres"""
+    counts: Dict[int, float] = {}
+    for term in tokenize(text):
+        idx = _bucket("w:" + term, dim)
+        counts[idx] = counts.get(idx, 0.0) + 1.0
+    for word in _WORD_RE.findall(fold_accents(text)):
+        padded = f" {word} "
+        for n in CHAR_NGRAMS:
+            for i in range(len(padded) - n + 1):
+                idx = _bucket(padded[i:i + n], dim)
+                counts[idx] = counts.get(idx, 0.0) + 1.0
+
+    vector = np.zeros(dim, dtype=np.float32)
+    if counts:
+        indices = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        values = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        vector[indices] = np.log1p(values)
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+    return vector
+
+
+class VectorIndex:
+    """Matriz de vectores en disco (memmap) con altas incrementales
+
+    Las filas de actividades modificadas o borradas quedan marcadas como muertas
+    y el fichero se compacta cuando las filas muertas superan a las vivas.
+    """
+
+    def __init__(self, index_dir: str, dim: int = EMBEDDING_DIM):
+        self.index_dir = index_dir
+        self.dim = dim
+        self.vectors_path = os.path.join(index_dir, VECTORS_FILE)
+        self.manifest_path = os.path.join(index_dir, MANIFEST_FILE)
+        self._lock = threading.RLock()
+
+        # ruta -> (fila, firma del fichero)
+        self.rows: Dict[str, Tuple[int, List[int]]] = {}
+        self.n_rows = 0
+        self._matrix: Optional[np.memmap] = None
+        self._weights_sq: Optional[np.ndarray] = None
+        self._weights: Optional[np.ndarray] = None
+        self._doc_norms: Optional[np.ndarray] = None
+        self._row_paths: List[Optional[str]] = []
+        self._load()
+
+    # ------------------------------------------------------------------
+    # Persistencia
+    # ------------------------------------------------------------------
+    def _load(self):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return
+        if manifest.get("scheme") != EMBEDDING_SCHEME or manifest.get("dim") != self.dim:
+            return
+        n_rows = manifest.get("n_rows", 0)
+        try:
+            size = os.path.getsize(self.vectors_path)
+        except OSError:
+            return
+        if size < n_rows * self.dim * 4:
+            return
+        if size > n_rows * self.dim * 4:
+            # Filas añadidas sin llegar a registrarse en el manifiesto
+            with open(self.vectors_path, "r+b") as f:
+                f.truncate(n_rows * self.dim * 4)
+        self.rows = {path: (row, signature) for path, (row, signature) in manifest["rows"].items()}
+        self.n_rows = n_rows
+        self._open_matrix()
+
+    def _save_manifest(self):
+        manifest = {
+            "scheme": EMBEDDING_SCHEME,
+            "dim": self.dim,
+            "n_rows": self.n_rows,
+            "rows": self.rows,
+        }
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _open_matrix(self):
+        self._matrix = None
+        self._weights = self._weights_sq = self._doc_norms = None
+        self._row_paths = [None] * self.n_rows
+        for path, (row, _) in self.rows.items():
+            self._row_paths[row] = path
+        if self.n_rows:
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r",
+                                     shape=(self.n_rows, self.dim))
+
+    def _compact(self):
+        """Reescribe el fichero solo con las filas vivas (sin volver a embeber)"""
+        live = sorted(self.rows.items(), key=lambda item: item[1][0])
+        tmp_path = self.vectors_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            for path, (row, _) in live:
+                f.write(np.asarray(self._matrix[row], dtype=np.float32).tobytes())
+        self._matrix = None
+        os.replace(tmp_path, self.vectors_path)
+        self.rows = {path: (new_row, signature)
+                     for new_row, (path, (_, signature)) in enumerate(live)}
+        self.n_rows = len(live)
+
+    # ------------------------------------------------------------------
+    # Sincronización con el corpus
+    # ------------------------------------------------------------------
+    def sync(self, documents: List[ActivityDocument]) -> int:
+        """Embebe solo las actividades nuevas o modificadas; devuelve cuántas"""
+        with self._lock:
+            current = {doc.archivo: doc for doc in documents}
+            pending = [doc for path, doc in current.items()
+                       if path not in self.rows or self.rows[path][1] != list(doc.signature)]
+            removed = [path for path in self.rows if path not in current]
+            if not pending and not removed:
+                return 0
+
+            for path in removed:
+                del self.rows[path]
+            for doc in pending:
+                self.rows.pop(doc.archivo, None)
+            if self._matrix is not None and self.n_rows > 2 * max(len(self.rows), 1):
+                self._compact()
+
+            os.makedirs(self.index_dir, exist_ok=True)
+            # Sin filas registradas se descarta cualquier fichero previo no válido
+            with open(self.vectors_path, "ab" if self.n_rows else "wb") as f:
+                for doc in pending:
+                    vector = embed_text(f"{doc.nombre}\n{doc.contenido}", self.dim)
+                    f.write(vector.tobytes())
+                    self.rows[doc.archivo] = (self.n_rows, list(doc.signature))
+                    self.n_rows += 1
+            self._save_manifest()
+            self._open_matrix()
+            return len(pending)
+
+    def _prepare_weights(self):
+        """IDF por dimensión y normas ponderadas de los documentos (una pasada)"""
+        live_rows = np.array(sorted(row for row, _ in self.rows.values()), dtype=np.int64)
+        live_mask = np.zeros(self.n_rows, dtype=bool)
+        live_mask[live_rows] = True
+        matrix = self._matrix
+        df = np.count_nonzero(matrix[live_mask] > 0, axis=0)
+        n_docs = len(live_rows)
+        weights = (np.log((1.0 + n_docs) / (1.0 + df)) + IDF_FLOOR).astype(np.float32)
+        self._weights = weights
+        self._weights_sq = weights * weights
+        norms = np.sqrt(np.square(matrix) @ self._weights_sq)
+        norms[~live_mask] = np.inf
+        norms[norms == 0] = np.inf
+        self._doc_norms = norms
+
+    # ------------------------------------------------------------------
+    # Búsqueda
+    # ------------------------------------------------------------------
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def search(self, query: str, k: int = 5) -> List[SearchHit]:
+        """Devuelve las k actividades con mayor similitud coseno ponderada"""
+        with self._lock:
+            if self._matrix is None or not self.rows or k <= 0:
+                return []
+            if self._doc_norms is None:
+                self._prepare_weights()
+            q = embed_text(query, self.dim)
+            q_norm = float(np.linalg.norm(q * self._weights))
+            if q_norm == 0:
+                return []
+            scores = (self._matrix @ (q * self._weights_sq)) / (self._doc_norms * q_norm)
+            k = min(k, len(self.rows))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [SearchHit(self._row_paths[row], float(scores[row]))
+                    for row in top if scores[row] > 0 and self._row_paths[row] is not None]
+
+
+_indexes: Dict[int, Tuple[str, VectorIndex]] = {}
+_indexes_lock = threading.Lock()
+
+
+def default_index_dir(corpus: ActivityCorpus) -> str:
+    """Directorio del índice vectorial para el directorio de datos del corpus"""
+    key = zlib.crc32(os.path.abspath(corpus.data_dir).encode("utf-8"))
+    return os.path.join(CACHE_DIR, "vector_index", f"{key:08x}")
+
+
+def get_vector_index(corpus: Optional[ActivityCorpus] = None,
+                     index_dir: Optional[str] = None) -> VectorIndex:
+    """Índice vectorial sincronizado con el corpus (se abre una vez por proceso)"""
+    corpus = corpus or get_corpus()
+    version = corpus.version()
+    with _indexes_lock:
+        cached = _indexes.get(id(corpus))
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        index = cached[1] if cached is not None else VectorIndex(index_dir or default_index_dir(corpus))
+        index.sync(corpus.activities())
+        _indexes[id(corpus)] = (version, index)
+        return index
+
+
+def semantic_search_activities(query: str, k: int = 3,
+                               corpus: Optional[ActivityCorpus] = None) -> List[Tuple[ActivityDocument, float]]:
+    """Busca las k actividades semánticamente más parecidas a la consulta"""
+    corpus = corpus or get_corpus()
+    results = []
+    for hit in get_vector_index(corpus).search(query, k):
+        doc = corpus.activity(hit.doc_id)
+        if doc is not None:
+            results.append((doc, hit.score))
+    return results
+
+
+def hybrid_search_activities(query: str, k: int = 3, corpus: Optional[ActivityCorpus] = None,
+                             rrf_k: int = 60) -> List[Tuple[ActivityDocument, float]]:
+    """Combina BM25 y búsqueda vectorial con reciprocal rank fusion"""
+    corpus = corpus or get_corpus()
+    depth = max(k * 3, 10)
+    fused: Dict[str, float] = {}
+    for hits in (get_activity_index(corpus).search(query, depth),
+                 get_vector_index(corpus).search(query, depth)):
+        for rank, hit in enumerate(hits):
+            fused[hit.doc_id] = fused.get(hit.doc_id, 0.0) + 1.0 / (rrf_k + rank + 1)
+    results = []
+    for path, score in sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]:
+        doc = corpus.activity(path)
+        if doc is not None:
+            results.append((doc, score))
+    return results
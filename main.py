@@ -6,22 +6,28 @@ IA4EDU - Asistente de IA para crear actividades de aprendizaje por proyectos inc
 import os
 import sys
 import json
+import threading
+import contextlib
 from dotenv import load_dotenv
 from rich.console import Console
 from rich.panel import Panel
 from rich.prompt import Prompt, Confirm
 from rich.text import Text
 from rich.markdown import Markdown
+from rich.live import Live
+from rich.table import Table
+from rich.console import Group
 import typer
 from typing import Optional
 
 # Cargar variables de entorno
 load_dotenv()
 
-# Importar agentes
+# Importar agentes (CrewAI se carga en diferido: ver IA4EDUInterface.crew)
 import sys
 sys.path.append('.')
-from agents.crew_agents import IA4EDUCrew
+from agents.corpus import get_corpus
+from agents.streaming import DONE, FAILED, RUNNING, StreamMonitor
 
 app = typer.Typer(
     name="ia4edu",
@@ -31,23 +37,183 @@ app = typer.Typer(
 
 console = Console()
 
+STAGE_ICONS = {RUNNING: "✍️", DONE: "✅", FAILED: "❌"}
+
+class StageView:
+    """Vista en vivo: estado de cada etapa y últimas líneas de la etapa en curso"""
+    
+    def __init__(self, monitor: StreamMonitor, tail_lines: int = 12):
+        self.monitor = monitor
+        self.tail_lines = tail_lines
+    
+    def __rich__(self):
+        table = Table(show_header=False, box=None, padding=(0, 1))
+        for stage in self.monitor.snapshot():
+            elapsed = f"{stage.elapsed:.1f} s" if stage.elapsed is not None else ""
+            table.add_row(STAGE_ICONS.get(stage.status, "⏳"), stage.label, stage.status, elapsed)
+        
+        current = self.monitor.current
+        if current is None:
+            return Group(table)
+        tail = "\n".join(current.text.splitlines()[-self.tail_lines:]) or "…"
+        return Group(table, Panel(tail, title=f"🤖 {current.label}", border_style="cyan"))
+
 class IA4EDUInterface:
-    def __init__(self):
+    def __init__(self, use_cache: bool = True, stream: bool = True, trace_path: Optional[str] = None,
+                 candidates: int = 1):
         self.console = Console()
         self.gemini_api_key = os.getenv("GEMINI_API_KEY")
-        self.crew = None
+        self.use_cache = use_cache
+        self.candidates = candidates
+        self.stream = stream
+        self.trace_path = trace_path
+        self.tracer = None
+        self._trace_stack = contextlib.ExitStack()
+        self._crew = None
+        self._preload: Optional[threading.Thread] = None
+        self._store = None
+        self._request_cache = None
+        self.activity_id: Optional[int] = None
         
         if not self.gemini_api_key:
             self.console.print("❌ [red]Error: No se encontró GEMINI_API_KEY en las variables de entorno[/red]")
             self.console.print("💡 [yellow]Configura tu clave API de Gemini:[/yellow]")
             self.console.print("   export GEMINI_API_KEY='tu_clave_aqui'")
             sys.exit(1)
+    
+    def preload(self):
+        """Importa CrewAI en segundo plano mientras el profesor escribe su solicitud"""
+        if self._preload is None and self._crew is None:
+            self._preload = threading.Thread(
+                target=lambda: __import__("agents.crew_agents"), name="ia4edu-preload", daemon=True
+            )
+            self._preload.start()
+    
+    @property
+    def crew(self):
+        """Crew de agentes; se crea (con sus clientes LLM) en la primera llamada"""
+        if self._crew is None:
+            if self._preload is not None:
+                self._preload.join()
+            from agents.crew_agents import IA4EDUCrew
+            try:
+                self._crew = IA4EDUCrew(self.gemini_api_key, use_cache=self.use_cache, candidates=self.candidates)
+                if self.stream:
+                    self._crew.enable_streaming()
+            except Exception as e:
+                self.console.print(f"❌ [red]Error inicializando IA4EDU: {str(e)}[/red]")
+                sys.exit(1)
+        return self._crew
+    
+    @property
+    def store(self):
+        """Almacén SQLite de actividades (historial y búsqueda)"""
+        if self._store is None:
+            from agents.activity_store import ActivityStore
+            self._store = ActivityStore()
+        return self._store
+    
+    @property
+    def request_cache(self):
+        """Índice de solicitudes ya diseñadas (None si la caché está desactivada)"""
+        from agents.request_cache import RequestCache, request_cache_enabled
+        if self._request_cache is None and self.use_cache and request_cache_enabled():
+            self._request_cache = RequestCache(self.store)
+        return self._request_cache
+    
+    def current_template(self, activity_design: str):
+        """Plantilla JSON de la actividad si el diseño mostrado sale de ella"""
+        if self._crew is not None and self._crew.is_structured(activity_design):
+            return self._crew.last_structure.actividad.model_dump()
+        return None
+    
+    def record_design(self, user_request: str, activity_design: str, index: bool = True):
+        """Registra el diseño inicial en el historial (y su solicitud en la caché de solicitudes)"""
+        try:
+            self.activity_id = self.store.create(user_request, activity_design, self.current_template(activity_design))
+            if index and self.request_cache is not None:
+                from agents.classroom import profile_hash
+                self.request_cache.add(user_request, profile_hash(get_corpus().students()), self.activity_id)
+        except Exception as e:
+            self.console.print(f"⚠️ [yellow]No se pudo registrar la actividad en el historial: {str(e)}[/yellow]")
+    
+    def reuse_design(self, user_request: str) -> Optional[str]:
+        """Ofrece partir de un diseño anterior muy parecido y pasar directamente al refinamiento"""
+        try:
+            from agents.classroom import profile_hash
+            cache = self.request_cache
+            match = cache.lookup(user_request, profile_hash(get_corpus().students())) if cache else None
+            stored = self.store.get(match.activity_id) if match else None
+        except Exception:
+            return None
+        if stored is None:
+            if match is not None:
+                cache.forget(match.entry_id)
+            return None
         
+        info = cache.info()
+        self.console.print("\n♻️  [bold cyan]Ya diseñaste una actividad muy parecida[/bold cyan] "
+                           f"[dim](similitud {match.similitud:.2f}; aciertos de la caché: {info['hits']} de "
+                           f"{info['hits'] + info['misses']} consultas)[/dim]")
+        summary = stored.resumen
+        self.console.print(f"   #{summary.id} [bold]{summary.titulo}[/bold] — «{summary.solicitud}»"
+                           + (f" ({summary.refinamientos} refinamientos)" if summary.refinamientos else ""))
+        if not Confirm.ask("¿Quieres partir de esa actividad y pasar directamente al refinamiento?", default=True):
+            return None
+        cache.mark_reused()
+        design = self.crew.resume_design(stored.diseno, stored.plantilla)
+        self.record_design(user_request, design, index=False)
+        return design
+    
+    def record_refinement(self, feedback: str, activity_design: str):
+        """Añade un refinamiento al historial de la actividad actual"""
+        if self.activity_id is None:
+            return
+        outcome = self._crew.last_refinement if self._crew is not None else None
         try:
-            self.crew = IA4EDUCrew(self.gemini_api_key)
+            self.store.add_refinement(
+                self.activity_id, feedback, activity_design, self.current_template(activity_design),
+                por_secciones=bool(outcome and outcome.scoped),
+                cambios=(outcome.changes if outcome else "") or ""
+            )
         except Exception as e:
-            self.console.print(f"❌ [red]Error inicializando IA4EDU: {str(e)}[/red]")
-            sys.exit(1)
+            self.console.print(f"⚠️ [yellow]No se pudo registrar el refinamiento: {str(e)}[/yellow]")
+    
+    def trace(self, name: str, **attributes):
+        """Span raíz de una operación si se pidió --trace (el trazador se activa al primer uso)"""
+        if not self.trace_path:
+            return contextlib.nullcontext()
+        if self.tracer is None:
+            from agents.tracing import JSONLSpanExporter, Tracer
+            self.tracer = self._trace_stack.enter_context(Tracer(
+                JSONLSpanExporter(self.trace_path),
+                self.crew.design_stages() + self.crew.refine_stages()
+            ))
+        return self.tracer.span(name, **attributes)
+    
+    def show_trace_summary(self):
+        """Tabla con el tiempo, los tokens y la caché de cada etapa trazada"""
+        self._trace_stack.close()
+        if self.tracer is None:
+            return
+        table = Table(title="📈 Resumen por etapa")
+        for column in ("Etapa", "Modelo", "Tiempo (s)", "Llamadas", "Tokens prompt", "Tokens respuesta", "Caché", "Reintentos", "Escalados", "Errores"):
+            table.add_column(column)
+        for stage in self.tracer.stage_summary():
+            table.add_row(
+                stage.etapa,
+                stage.modelo,
+                f"{stage.duracion_s:.1f}",
+                str(stage.llamadas),
+                str(stage.tokens_prompt),
+                str(stage.tokens_respuesta),
+                str(stage.aciertos_cache),
+                str(stage.reintentos),
+                str(stage.escalados),
+                str(stage.errores)
+            )
+        self.console.print(table)
+        self.console.print(f"🧭 [dim]Trazas guardadas en {self.trace_path}[/dim]")
     
     def show_welcome(self):
         """Muestra la pantalla de bienvenida"""
@@ -97,11 +263,11 @@ class IA4EDUInterface:
     def show_student_profiles(self):
         """Muestra información sobre los perfiles de estudiantes"""
         try:
-            with open("data/perfiles_4_primaria.json", "r", encoding="utf-8") as f:
-                data = json.load(f)
+            data = get_corpus().profiles()
             
             self.console.print("\n" + "="*60)
-            self.console.print("👥 [bold cyan]PASO 2: Perfiles de tu aula (8 estudiantes)[/bold cyan]")
+            aula = f" {data['aula']}" if data.get("aula") else ""
+            self.console.print(f"👥 [bold cyan]PASO 2: Perfiles de tu aula{aula} ({len(data['estudiantes'])} estudiantes)[/bold cyan]")
             self.console.print("="*60)
             
             profiles_summary = "## 🧠 Neurotipos en tu aula:\n\n"
@@ -127,17 +293,71 @@ class IA4EDUInterface:
         self.console.print("🤖 [bold cyan]PASO 3: Los agentes están trabajando...[/bold cyan]")
         self.console.print("="*60)
         
-        with self.console.status("🔍 Analizando solicitud y perfiles de estudiantes...", spinner="dots"):
-            try:
-                result = self.crew.design_activity(user_request)
-                # Si result es un objeto CrewOutput, extraer el texto
-                if hasattr(result, 'raw'):
-                    return result.raw
-                else:
-                    return str(result)
-            except Exception as e:
-                self.console.print(f"❌ [red]Error durante el diseño: {str(e)}[/red]")
-                return None
+        try:
+            with self.trace("diseño", **{"ia4edu.request": user_request}):
+                result = self.run_stages(
+                    "🔍 Analizando solicitud y perfiles de estudiantes...",
+                    self.crew.design_stages(), self.crew.design_activity, user_request
+                )
+            self.show_run_stats()
+            # Si result es un objeto CrewOutput, extraer el texto
+            design = result.raw if hasattr(result, 'raw') else str(result)
+            self.record_design(user_request, design)
+            return design
+        except Exception as e:
+            self.console.print(f"❌ [red]Error durante el diseño: {str(e)}[/red]")
+            return None
+    
+    def run_stages(self, status: str, stages, fn, *args):
+        """Ejecuta una llamada del crew mostrando los tokens en vivo (o un spinner)"""
+        if not self.stream:
+            with self.console.status(status, spinner="dots"):
+                return fn(*args)
+        
+        with StreamMonitor(stages) as monitor:
+            with Live(StageView(monitor), console=self.console, refresh_per_second=8):
+                result = fn(*args)
+        if monitor.time_to_first_token is not None:
+            self.console.print(f"⚡ [dim]Primeros tokens a los {monitor.time_to_first_token:.1f} s[/dim]")
+        return result
+    
+    def show_run_stats(self):
+        """Informa de los prompts compactados y de la caché tras una ejecución"""
+        for report in self.crew.budget_reports:
+            if report is not None and (report.compacted or report.dropped or report.over_budget):
+                self.console.print(f"📏 [dim]{report.summary()}[/dim]")
+        
+        structure = self.crew.last_structure
+        if structure is not None and (structure.reparados or structure.sin_resolver):
+            self.console.print(f"🧩 [dim]Plantilla: {len(structure.reparados)} partes reparadas"
+                               + (f", sin completar: {', '.join(structure.sin_resolver)}" if structure.sin_resolver else "")
+                               + "[/dim]")
+        
+        candidates = self.crew.last_candidates
+        if len(candidates) > 1:
+            best = candidates[0]
+            self.console.print(f"🏆 [dim]Candidato {best.indice + 1} de {len(candidates)} elegido "
+                               f"(puntuación {best.total:.2f}; resto: "
+                               + ", ".join(f"{c.total:.2f}" for c in candidates[1:]) + ")[/dim]")
+            if best.faltan:
+                self.console.print(f"⚠️  [yellow]Sin adaptación específica: {', '.join(best.faltan)}[/yellow]")
+        
+        outcome = self.crew.last_coverage
+        if outcome is not None and not outcome.antes.completo:
+            self.console.print(f"🩹 [dim]Cobertura: completados {outcome.antes.summary()} "
+                               f"({outcome.llamadas} llamadas)[/dim]")
+            if not outcome.despues.completo:
+                self.console.print(f"⚠️  [yellow]Siguen sin cubrir: {outcome.despues.summary()}[/yellow]")
+
+        escalated = [row for row in self.crew.cascade_stats() if row["escaladas"]]
+        if escalated:
+            self.console.print("🪜 [dim]Cascada: " + ", ".join(
+                f"{row['agente']} escaló {row['escaladas']}/{row['llamadas']} desde {row['nivel']}" for row in escalated
+            ) + "[/dim]")
+        
+        stats = self.crew.cache_stats()
+        if stats and stats["hits"]:
+            self.console.print(f"💾 [dim]Caché de respuestas: {stats['hits']} aciertos, {stats['misses']} fallos[/dim]")
     
     def show_activity_result(self, activity_design: str):
         """Muestra el resultado de la actividad diseñada"""
@@ -186,20 +406,32 @@ class IA4EDUInterface:
         """Refina la actividad basándose en el feedback"""
         self.console.print("\n🔄 [yellow]Refinando la actividad basándose en tu feedback...[/yellow]")
         
-        with self.console.status("🛠️ El agente de refinamiento está trabajando...", spinner="dots"):
-            try:
-                refined_result = self.crew.refine_activity(activity_design, feedback)
-                # Si result es un objeto CrewOutput, extraer el texto
-                if hasattr(refined_result, 'raw'):
-                    return refined_result.raw
-                else:
-                    return str(refined_result)
-            except Exception as e:
-                self.console.print(f"❌ [red]Error durante el refinamiento: {str(e)}[/red]")
-                return activity_design  # Devolver la versión original si hay error
+        try:
+            with self.trace("refinamiento", **{"ia4edu.feedback": feedback}):
+                refined = self.run_stages(
+                    "🛠️ El agente de refinamiento está trabajando...",
+                    self.crew.refine_stages(), self.crew.refine_activity, activity_design, feedback
+                )
+            self.show_run_stats()
+            outcome = self.crew.last_refinement
+            if outcome is not None and outcome.scoped:
+                self.console.print(
+                    f"✂️ [dim]Secciones revisadas ({len(outcome.sections)} de {outcome.total_sections}): "
+                    f"{', '.join(outcome.sections)}[/dim]"
+                )
+                if outcome.changes:
+                    self.console.print(Panel(outcome.changes, title="📝 Cambios", border_style="yellow"))
+            self.record_refinement(feedback, refined)
+            return refined
+        except Exception as e:
+            self.console.print(f"❌ [red]Error durante el refinamiento: {str(e)}[/red]")
+            return activity_design  # Devolver la versión original si hay error
     
     def save_activity(self, activity_design: str, user_request: str):
         """Guarda la actividad final"""
+        if self.activity_id is not None:
+            self.console.print(f"🗂️ [dim]Actividad #{self.activity_id} registrada en el historial "
+                               f"(python main.py historial --ver {self.activity_id})[/dim]")
         save = Confirm.ask("\n💾 ¿Quieres guardar esta actividad en un archivo?")
         
         if save:
@@ -210,10 +442,13 @@ class IA4EDUInterface:
             import re
             filename = re.sub(r'[^\w\s-]', '', user_request.lower())
             filename = re.sub(r'[-\s]+', '_', filename)[:50]
-            filename = f"output/actividad_{filename}.md"
+            import datetime
+            # El id del historial (o la fecha) evita pisar actividades con la misma solicitud
+            prefix = (f"{self.activity_id:05d}" if self.activity_id is not None
+                      else datetime.datetime.now().strftime('%Y%m%d_%H%M%S'))
+            filename = f"output/actividad_{prefix}_{filename}.md"
             
             try:
-                import datetime
                 with open(filename, "w", encoding="utf-8") as f:
                     f.write(f"# Actividad Generada por IA4EDU\n\n")
                     f.write(f"**Solicitud original:** {user_request}\n\n")
@@ -221,6 +456,8 @@ class IA4EDUInterface:
                     f.write("---\n\n")
                     f.write(activity_design)
                 
+                if self.activity_id is not None:
+                    self.store.mark_saved(self.activity_id)
                 self.console.print(f"✅ [green]Actividad guardada en: {filename}[/green]")
             except Exception as e:
                 self.console.print(f"❌ [red]Error guardando archivo: {str(e)}[/red]")
@@ -229,6 +466,7 @@ class IA4EDUInterface:
         """Ejecuta una sesión interactiva completa"""
         # Pantalla de bienvenida
         self.show_welcome()
+        self.preload()
         
         # Obtener solicitud del usuario
         user_request = self.get_user_request()
@@ -236,11 +474,12 @@ class IA4EDUInterface:
         # Mostrar perfiles de estudiantes
         self.show_student_profiles()
         
-        # Diseñar actividad
-        activity_design = self.design_activity(user_request)
+        # Diseñar actividad (o partir de una casi idéntica ya diseñada)
+        activity_design = self.reuse_design(user_request) or self.design_activity(user_request)
         
         if not activity_design:
             self.console.print("❌ [red]Error: No se pudo generar la actividad[/red]")
+            self.show_trace_summary()
             return
         
         # Ciclo de refinamiento human-in-the-loop
@@ -260,16 +499,41 @@ class IA4EDUInterface:
         
         # Guardar actividad final
         self.save_activity(activity_design, user_request)
+        self.show_trace_summary()
         
         # Mensaje final
         self.console.print("\n🎉 [bold green]¡Gracias por usar IA4EDU![/bold green]")
         self.console.print("📚 [cyan]Tu actividad inclusiva está lista para implementar.[/cyan]")
 
-@app.command()
-def main():
+@app.callback(invoke_without_command=True)
+def main(
+    ctx: typer.Context,
+    no_cache: bool = typer.Option(False, "--no-cache", help="No usar la caché de respuestas del LLM"),
+    no_stream: bool = typer.Option(False, "--no-stream", help="Mostrar un spinner en lugar de los tokens en vivo"),
+    trace: Optional[str] = typer.Option(None, "--trace", help="Exportar trazas por etapa y llamada al LLM a este JSONL"),
+    aula: Optional[str] = typer.Option(None, "--aula", envvar="IA4EDU_AULA", help="Aula cuyos perfiles se usan (ver 'aulas')"),
+    candidatos: int = typer.Option(1, "--candidatos", envvar="IA4EDU_CANDIDATOS", min=1,
+                                   help="Diseños candidatos en paralelo; se muestra el mejor según el puntuador local")
+):
     """🎓 Iniciar el asistente interactivo de IA4EDU"""
+    if candidatos > 1:
+        # El máximo se comprueba aquí para no cargar el puntuador en cada subcomando
+        from agents.candidates import MAX_CANDIDATES
+        if candidatos > MAX_CANDIDATES:
+            raise typer.BadParameter(f"como mucho {MAX_CANDIDATES} candidatos", param_hint="'--candidatos'")
+    if aula:
+        try:
+            get_corpus().select_classroom(aula)
+        except (OSError, ValueError) as e:
+            console.print(f"❌ [red]{str(e)}[/red]")
+            console.print("💡 [yellow]Consulta las aulas disponibles con: python main.py aulas[/yellow]")
+            sys.exit(1)
+    if ctx.invoked_subcommand is not None:
+        ctx.obj = {"use_cache": not no_cache, "candidates": candidatos}
+        return
     try:
-        interface = IA4EDUInterface()
+        interface = IA4EDUInterface(use_cache=not no_cache, stream=not no_stream, trace_path=trace,
+                                    candidates=candidatos)
         interface.run_interactive_session()
     except KeyboardInterrupt:
         console.print("\n👋 [yellow]¡Hasta pronto![/yellow]")
@@ -278,5 +542,279 @@ def main():
         console.print(f"\n❌ [red]Error inesperado: {str(e)}[/red]")
         sys.exit(1)
 
+@app.command()
+def batch(
+    ctx: typer.Context,
+    requests_file: str = typer.Argument(..., help="Fichero JSONL con una solicitud por línea"),
+    output: str = typer.Option("output/lote.jsonl", "--output", "-o", help="JSONL donde se escriben los resultados"),
+    workers: int = typer.Option(4, "--workers", "-w", help="Solicitudes procesadas en paralelo"),
+    timeout: float = typer.Option(600.0, "--timeout",
+                                  help="Segundos máximos por intento (0 = sin límite); cada reintento lanza un "
+                                       "intento nuevo, así que una solicitud puede tardar hasta (reintentos + 1) "
+                                       "veces este plazo, más la espera por un hilo libre"),
+    retries: int = typer.Option(2, "--retries", help="Reintentos por solicitud tras un error o timeout"),
+    restart: bool = typer.Option(False, "--restart", help="Sobrescribir la salida en lugar de reanudarla")
+):
+    """📦 Generar actividades en lote a partir de un fichero JSONL (usa --aula y --candidatos)"""
+    from rich.progress import Progress
+    from agents.batch import BatchRunner, completed_ids, read_requests
+    from agents.crew_agents import IA4EDUCrew
+
+    gemini_api_key = os.getenv("GEMINI_API_KEY")
+    if not gemini_api_key:
+        console.print("❌ [red]Error: No se encontró GEMINI_API_KEY en las variables de entorno[/red]")
+        sys.exit(1)
+    options = ctx.obj or {}
+
+    try:
+        requests = list(read_requests(requests_file))
+    except (OSError, ValueError) as e:
+        console.print(f"❌ [red]Error leyendo solicitudes: {str(e)}[/red]")
+        sys.exit(1)
+
+    pending = len(requests) if restart else len([r for r in requests if r.request_id not in completed_ids(output)])
+    console.print(f"📦 [cyan]{pending} de {len(requests)} solicitudes pendientes → {output}[/cyan]")
+
+    runner = BatchRunner(lambda: IA4EDUCrew(gemini_api_key, use_cache=options.get("use_cache", True),
+                                            candidates=options.get("candidates", 1)),
+                         workers=workers, timeout=timeout or None, retries=retries)
+    failed = 0
+    with Progress(console=console) as progress:
+        task = progress.add_task("Generando actividades", total=pending)
+
+        def on_result(result):
+            nonlocal failed
+            if result.status != "ok":
+                failed += 1
+                progress.console.print(f"⚠️ [yellow]{result.request_id}: {result.status} ({result.error})[/yellow]")
+            progress.advance(task)
+
+        runner.run(requests, output, resume=not restart, on_result=on_result)
+
+    console.print(f"✅ [green]{pending - failed} completadas[/green], [red]{failed} con error[/red]")
+    if failed:
+        sys.exit(1)
+
+@app.command()
+def servir(
+    ctx: typer.Context,
+    host: str = typer.Option("127.0.0.1", "--host", help="Dirección en la que escuchar"),
+    port: int = typer.Option(8000, "--port", "-p", help="Puerto HTTP"),
+    workers: int = typer.Option(2, "--workers", "-w", envvar="IA4EDU_WORKERS", min=1,
+                                help="Trabajos de diseño o refinamiento atendidos a la vez"),
+    cola: int = typer.Option(100, "--cola", min=1, help="Trabajos que pueden esperar en cola"),
+    simulado: bool = typer.Option(False, "--simulado", help="Responder con un LLM simulado, sin red ni clave")
+):
+    """🌐 Servir el diseño, el refinamiento y el historial por HTTP para todo el centro"""
+    try:
+        import uvicorn
+        from agents.service import DesignService, create_app
+    except ImportError as e:
+        console.print(f"❌ [red]Falta una dependencia del servicio: {str(e)}[/red]")
+        console.print("💡 [yellow]Instálala con: pip install fastapi uvicorn[/yellow]")
+        sys.exit(1)
+    from agents.crew_agents import IA4EDUCrew
+
+    gemini_api_key = "clave-simulada" if simulado else os.getenv("GEMINI_API_KEY")
+    if not gemini_api_key:
+        console.print("❌ [red]Error: No se encontró GEMINI_API_KEY en las variables de entorno[/red]")
+        sys.exit(1)
+    options = ctx.obj or {}
+
+    def make_crew():
+        crew = IA4EDUCrew(gemini_api_key, use_cache=options.get("use_cache", True),
+                          candidates=options.get("candidates", 1))
+        if simulado:
+            from agents.benchmark import install_stubs
+            install_stubs(crew, latency=0.2, tokens_per_second=80.0)
+        return crew
+
+    service = DesignService(make_crew, workers=workers, max_queue=cola)
+    console.print(f"🌐 [cyan]IA4EDU en http://{host}:{port} ({workers} trabajadores"
+                  + (", LLM simulado" if simulado else "") + ")[/cyan]")
+    console.print(f"📖 [dim]Documentación de la API en http://{host}:{port}/docs[/dim]")
+    uvicorn.run(create_app(service), host=host, port=port, log_level="warning")
+
+@app.command()
+def benchmark(
+    output: str = typer.Option("output/benchmark.json", "--output", "-o", help="JSON donde se guarda el informe"),
+    latency: float = typer.Option(0.2, "--latency", help="Latencia simulada por llamada al LLM (s)"),
+    tps: float = typer.Option(80.0, "--tps", help="Tokens por segundo simulados"),
+    runs: int = typer.Option(3, "--runs", "-n", help="Ejecuciones por escenario (se informa la mediana)"),
+    stream: bool = typer.Option(False, "--stream", help="Simular la respuesta en streaming"),
+    baseline: Optional[str] = typer.Option(None, "--baseline", "-b", help="Informe anterior con el que comparar"),
+    tolerance: float = typer.Option(0.10, "--tolerance", help="Crecimiento tolerado frente al informe anterior")
+):
+    """⏱️ Medir el flujo de diseño y refinamiento con un LLM simulado, sin red"""
+    from agents.benchmark import BenchmarkRunner, compare_reports, load_report, save_report
+    from agents.crew_agents import IA4EDUCrew
+
+    runner = BenchmarkRunner(lambda: IA4EDUCrew("clave-simulada", use_cache=False),
+                             latency=latency, tokens_per_second=tps, runs=runs, stream=stream)
+    with console.status("[bold green]⏱️ Ejecutando escenarios...", spinner="dots"):
+        report = runner.run()
+    save_report(report, output)
+
+    table = Table(title=f"⏱️ Banco de pruebas ({runs} ejecuciones, {latency}s + {tps:g} tok/s)")
+    for column in ("Escenario", "Etapa", "Tiempo (s)", "Prompt", "Respuesta", "Sobrecoste (s)", "CPU propia (s)", "Memoria (MB)"):
+        table.add_column(column)
+    for name, scenario in report["escenarios"].items():
+        for i, stage in enumerate(scenario["etapas"]):
+            first = i == 0
+            table.add_row(
+                name if first else "",
+                stage["etapa"],
+                f"{stage['wall_s'] or 0:.2f}",
+                str(stage["prompt_tokens"]),
+                str(stage["completion_tokens"]),
+                f"{scenario['sobrecoste_s']:.3f}" if first else "",
+                f"{scenario['cpu_propio_s']:.3f}" if first else "",
+                f"{scenario['memoria_pico_mb']:.1f}" if first else ""
+            )
+    console.print(table)
+    console.print(f"💾 [green]Informe guardado en {output}[/green]")
+
+    if baseline:
+        regressions = compare_reports(load_report(baseline), report, tolerance)
+        if regressions:
+            for regression in regressions:
+                console.print(f"⚠️ [yellow]{regression}[/yellow]")
+            sys.exit(1)
+        console.print(f"✅ [green]Sin regresiones frente a {baseline}[/green]")
+
+@app.command()
+def perfiles():
+    """👥 Mostrar los perfiles de estudiantes del aula"""
+    corpus = get_corpus()
+    try:
+        students = corpus.students()
+    except (OSError, ValueError) as e:
+        console.print(f"❌ [red]Error cargando perfiles: {str(e)}[/red]")
+        sys.exit(1)
+    
+    aula = f" {corpus.classroom}" if corpus.classroom else ""
+    table = Table(title=f"👥 Perfiles del aula{aula} ({len(students)} estudiantes)")
+    for column in ("ID", "Nombre", "Diagnóstico", "Apoyo", "Canal", "Intereses"):
+        table.add_column(column)
+    for student in students:
+        table.add_row(
+            str(student.get("id", "")),
+            student.get("nombre", ""),
+            student.get("diagnostico_formal", ""),
+            str(student.get("nivel_apoyo", "")),
+            student.get("canal_preferido", ""),
+            ", ".join(student.get("intereses", []))
+        )
+    console.print(table)
+
+@app.command()
+def aulas(
+    centro: Optional[str] = typer.Option(None, "--centro", "-c", help="Mostrar solo las aulas de este centro")
+):
+    """🏫 Listar las aulas con perfiles disponibles"""
+    store = get_corpus().profile_store()
+    try:
+        store.sync()
+    except (OSError, ValueError) as e:
+        console.print(f"❌ [red]Error indexando perfiles: {str(e)}[/red]")
+        sys.exit(1)
+    classrooms = store.classrooms(centro)
+    table = Table(title=f"🏫 Aulas ({len(classrooms)})")
+    for column in ("Aula", "Centro", "Curso", "Grupo", "Alumnos"):
+        table.add_column(column)
+    for classroom in classrooms:
+        table.add_row(classroom.id, classroom.centro, classroom.curso, classroom.grupo, str(classroom.alumnos))
+    console.print(table)
+
+@app.command()
+def biblioteca():
+    """📚 Listar las actividades de la biblioteca"""
+    from agents.chunking import chunk_activity
+    
+    activities = get_corpus().activities()
+    table = Table(title=f"📚 Biblioteca de actividades ({len(activities)})")
+    for column in ("Actividad", "Archivo", "Secciones", "Palabras"):
+        table.add_column(column)
+    for activity in activities:
+        table.add_row(
+            activity.nombre,
+            os.path.basename(activity.archivo),
+            str(len(chunk_activity(activity))),
+            str(len(activity.contenido.split()))
+        )
+    console.print(table)
+
+@app.command()
+def buscar(
+    consulta: str = typer.Argument(..., help="Texto a buscar en la biblioteca"),
+    k: int = typer.Option(3, "--k", "-k", help="Número de actividades"),
+    secciones: int = typer.Option(0, "--secciones", "-s", help="Mostrar también las N secciones más relevantes")
+):
+    """🔍 Buscar actividades en la biblioteca (léxica + semántica)"""
+    from agents.vector_index import hybrid_search_activities
+    
+    table = Table(title=f"🔍 {consulta}")
+    for column in ("Actividad", "Archivo", "Puntuación"):
+        table.add_column(column)
+    for activity, score in hybrid_search_activities(consulta, k=k):
+        table.add_row(activity.nombre, os.path.basename(activity.archivo), f"{score:.3f}")
+    console.print(table)
+    
+    if secciones:
+        from agents.chunking import get_section_index
+        for section, score in get_section_index().search(consulta, k=secciones):
+            console.print(Panel(
+                section.texto,
+                title=f"{section.actividad} › {section.breadcrumb}",
+                subtitle=f"{score:.2f}",
+                border_style="cyan"
+            ))
+
+@app.command()
+def historial(
+    consulta: Optional[str] = typer.Argument(None, help="Texto a buscar en las actividades generadas"),
+    materia: Optional[str] = typer.Option(None, "--materia", "-m", help="Filtrar por materia"),
+    nivel: Optional[str] = typer.Option(None, "--nivel", help="Filtrar por nivel educativo"),
+    limite: int = typer.Option(20, "--limite", "-n", help="Número máximo de actividades"),
+    ver: Optional[int] = typer.Option(None, "--ver", help="Mostrar una actividad con sus refinamientos")
+):
+    """🗂️ Historial de actividades generadas (con búsqueda de texto completo)"""
+    import datetime
+    from agents.activity_store import ActivityStore
+    
+    store = ActivityStore()
+    fecha = lambda t: datetime.datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M')
+    
+    if ver is not None:
+        activity = store.get(ver)
+        if activity is None:
+            console.print(f"❌ [red]No existe la actividad #{ver}[/red]")
+            sys.exit(1)
+        summary = activity.resumen
+        console.print(f"📝 [bold]Solicitud:[/bold] {summary.solicitud}")
+        console.print(f"🕒 Creada {fecha(summary.created_at)} · actualizada {fecha(summary.updated_at)}")
+        for step in activity.historial:
+            modo = "por secciones" if step.por_secciones else "completo"
+            console.print(f"🔄 [yellow]Refinamiento {step.orden}[/yellow] ({fecha(step.created_at)}, {modo}): {step.feedback}")
+        console.print(Panel(Markdown(activity.diseno), title=f"📋 #{summary.id} {summary.titulo}", border_style="green"))
+        return
+    
+    if consulta:
+        activities = store.search(consulta, limit=limite, materia=materia, nivel=nivel)
+    else:
+        activities = store.history(limit=limite, materia=materia, nivel=nivel)
+    table = Table(title=f"🗂️ {consulta or 'Historial'} ({len(activities)} de {store.count()})")
+    for column in ("ID", "Actualizada", "Título", "Materia", "Nivel", "Refinamientos"):
+        table.add_column(column)
+    if consulta:
+        table.add_column("Fragmento")
+    for activity in activities:
+        row = [str(activity.id), fecha(activity.updated_at), activity.titulo, activity.materia,
+               activity.nivel, str(activity.refinamientos)]
+        if consulta:
+            row.append(activity.fragmento.replace("\n", " "))
+        table.add_row(*row)
+    console.print(table)
+
 if __name__ == "__main__":
     app()
\ No newline at end of file
@@ -0,0 +1,8 @@
+"""
+Configuración común de pytest: sin telemetría de CrewAI (no hay red en los tests)
+"""
+
+import os
+
+os.environ.setdefault("OTEL_SDK_DISABLED", "true")
+os.environ.setdefault("CREWAI_DISABLE_TELEMETRY", "true")
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Tests para el almacén SQLite de actividades generadas
+"""
+
+import os
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.activity_store import ActivityStore, design_metadata, fts_query
+
+DESIGN = """# La Pizzería del Aula
+
+**Materia:** Matemáticas
+**Nivel educativo:** 4º primaria
+
+## 1. Descripción
+Taller de fracciones con pizzas de cartulina.
+"""
+
+MATERIAS = ["Matemáticas", "Lengua", "Ciencias Naturales", "Geografía", "Música"]
+TEMAS = ["fracciones", "ortografía", "fotosíntesis", "ríos de España", "ritmo", "geometría", "poesía"]
+
+
+def synthetic_design(i):
+    tema = TEMAS[i % len(TEMAS)]
+    return (f"# Actividad {i}: {tema}\n\n**Materia:** {MATERIAS[i % len(MATERIAS)]}\n"
+            f"**Nivel educativo:** {i % 6 + 1}º primaria\n\n## 1. Descripción\n"
+            f"Trabajo cooperativo sobre {tema} con materiales manipulativos y apoyos visuales. " * 3)
+
+
+def test_refinement_history_and_search(tmp_path):
+    """La actividad guarda sus refinamientos y se encuentra sin acentos ni palabras completas"""
+    store = ActivityStore(str(tmp_path / "actividades.sqlite"))
+    first = store.create("Actividad de fracciones en parejas", DESIGN)
+    second = store.create("Actividad de fracciones en parejas", DESIGN.replace("Pizzería", "Panadería"))
+    assert first != second and store.count() == 2
+
+    refined = DESIGN.replace("cartulina", "cartulina y pictogramas")
+    assert store.add_refinement(first, "Más apoyos visuales para TEA", refined, cambios="Pictogramas") == 1
+    activity = store.get(first)
+    assert activity.diseno == refined and activity.resumen.refinamientos == 1
+    assert activity.resumen.materia == "Matemáticas" and activity.resumen.nivel == "4º primaria"
+    assert [step.feedback for step in activity.historial] == ["Más apoyos visuales para TEA"]
+    assert activity.historial[0].diseno == refined and activity.historial[0].cambios == "Pictogramas"
+
+    assert [a.id for a in store.history()] == [first, second]
+    found = store.search("pizzeria pictogram")
+    assert [a.id for a in found] == [first] and "«Pizzería»" in found[0].fragmento
+    assert store.search("pictogramas", materia="Lengua") == []
+    assert [a.id for a in store.search('Panadería" (')] == [second]
+    store.close()
+
+
+def test_metadata_prefers_template():
+    """Con plantilla, título, materia y nivel salen del JSON; sin ella, del markdown"""
+    assert design_metadata(DESIGN) == {"titulo": "La Pizzería del Aula", "materia": "Matemáticas",
+                                       "nivel": "4º primaria"}
+    plantilla = {"titulo": "Mercado", "materia": "Matemáticas", "nivel_educativo": "3º primaria"}
+    assert design_metadata("texto libre", plantilla)["nivel"] == "3º primaria"
+    assert fts_query("¿Ríos de España?") == '"Ríos" "de" "España"*'
+
+
+def test_history_and_search_stay_fast_with_many_activities(tmp_path):
+    """Listar y buscar siguen en milisegundos con decenas de miles de actividades"""
+    store = ActivityStore(str(tmp_path / "actividades.sqlite"))
+    now = time.time()
+    store.create_many(
+        (f"Solicitud {i} sobre {TEMAS[i % len(TEMAS)]}", synthetic_design(i), None, now - i)
+        for i in range(20000)
+    )
+    assert store.count() == 20000
+
+    timings = {}
+    for name, query in {
+        "historial": lambda: store.history(limit=20),
+        "historial por materia": lambda: store.history(limit=20, materia="Geografía", offset=200),
+        "búsqueda": lambda: store.search("fotosintesis apoyos", limit=20),
+        "búsqueda filtrada": lambda: store.search("ritmo", limit=20, nivel="3º primaria"),
+    }.items():
+        start = time.perf_counter()
+        for _ in range(5):
+            results = query()
+        timings[name] = (time.perf_counter() - start) / 5 * 1000
+        assert len(results) == 20
+        print(f"   - {name}: {timings[name]:.2f} ms")
+
+    assert store.history(limit=1)[0].titulo == "Actividad 0: fracciones"
+    assert all(ms < 50 for ms in timings.values()), timings
+    store.close()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Tests para el flujo asíncrono de diseño con etapas solapadas
+"""
+
+import asyncio
+import os
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crewai.llms.base_llm import BaseLLM
+
+from agents.crew_agents import IA4EDUCrew
+
+LLM_DELAY = 0.4
+PREPARE_DELAY = 0.4
+
+
+class SlowLLM(BaseLLM):
+    """LLM local con una latencia fija por llamada"""
+
+    def __init__(self, name):
+        super().__init__(model=f"stub/{name}", temperature=0.7)
+        self.prompts = []
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        self.prompts.append(messages)
+        time.sleep(LLM_DELAY)
+        return f"Final Answer: salida de {self.model}"
+
+
+def make_crew():
+    """Crew con LLMs locales y una recuperación artificialmente lenta"""
+    crew = IA4EDUCrew("clave-de-prueba", use_cache=False)
+    crew.fill_gaps = False
+    for name in ("analyst", "researcher", "designer", "refinement"):
+        getattr(crew, name).agent.llm = SlowLLM(name)
+
+    prepare = crew.researcher.prepare_context
+
+    def slow_prepare(query):
+        time.sleep(PREPARE_DELAY)
+        return prepare(query)
+
+    crew.researcher.prepare_context = slow_prepare
+    return crew
+
+
+def test_async_design_overlaps_retrieval_with_analysis():
+    """La recuperación corre mientras el analista espera al LLM"""
+    crew = make_crew()
+    start = time.perf_counter()
+    crew.design_activity("Actividad de fracciones en parejas")
+    sync_elapsed = time.perf_counter() - start
+
+    crew = make_crew()
+    start = time.perf_counter()
+    result = asyncio.run(crew.design_activity_async("Actividad de fracciones en parejas"))
+    async_elapsed = time.perf_counter() - start
+
+    print(f"   - síncrono {sync_elapsed:.2f} s, asíncrono {async_elapsed:.2f} s")
+    assert result.raw == "salida de stub/designer"
+    assert async_elapsed < sync_elapsed - PREPARE_DELAY / 2
+    # Las salidas previas llegan como texto al prompt de las etapas siguientes
+    assert "salida de stub/analyst" in str(crew.researcher.agent.llm.prompts[0])
+    assert "salida de stub/researcher" in str(crew.designer.agent.llm.prompts[0])
+    assert len(crew.budget_reports) == 3
+
+
+def test_async_refinement():
+    """El refinamiento asíncrono devuelve la salida del agente"""
+    crew = make_crew()
+    result = asyncio.run(crew.refine_activity_async("Actividad de fracciones", "Más tiempo en la fase 2"))
+    assert result == "salida de stub/refinement"
+    assert crew.budget_reports == [crew.refinement.last_budget]
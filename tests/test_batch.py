@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Tests para la generación por lotes
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.batch import BatchRunner, read_requests
+
+
+class StubCrew:
+    """Crew local: falla las primeras veces indicadas, se bloquea con "lento" y
+    "tarda" solo la primera vez"""
+
+    failures = {}
+    slow = 2.0
+    calls = []
+    lock = threading.Lock()
+    active = 0
+    max_active = 0
+
+    def design_activity(self, user_request):
+        with StubCrew.lock:
+            StubCrew.calls.append(user_request)
+            first_call = StubCrew.calls.count(user_request) == 1
+            StubCrew.active += 1
+            StubCrew.max_active = max(StubCrew.max_active, StubCrew.active)
+        try:
+            time.sleep(0.05)
+            if "lento" in user_request:
+                time.sleep(StubCrew.slow)
+            elif "tarda" in user_request and first_call:
+                time.sleep(0.4)
+            with StubCrew.lock:
+                pending = StubCrew.failures.get(user_request, 0)
+                if pending:
+                    StubCrew.failures[user_request] = pending - 1
+                    raise RuntimeError("fallo temporal")
+            return f"Actividad para: {user_request}"
+        finally:
+            with StubCrew.lock:
+                StubCrew.active -= 1
+
+
+def write_requests(path, lines):
+    with open(path, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+
+
+def read_output(path):
+    with open(path, encoding="utf-8") as f:
+        return {r["request_id"]: r for r in map(json.loads, f)}
+
+
+def test_read_requests_formats(tmp_path):
+    """Se aceptan "solicitud", "request" y el formato title/body"""
+    path = tmp_path / "in.jsonl"
+    write_requests(path, [
+        {"id": 1, "solicitud": "fracciones en parejas"},
+        {"request": "ecosistemas"},
+        {"request_id": "r-3", "title": "Lengua", "body": "escritura creativa"},
+    ])
+    requests = list(read_requests(str(path)))
+    assert [r.request_id for r in requests] == ["1", "linea-2", "r-3"]
+    assert requests[2].solicitud == "Lengua. escritura creativa"
+
+
+def test_batch_bounded_parallel_with_retries_and_timeout(tmp_path):
+    """El lote respeta el número de hilos, reintenta errores y corta los lentos"""
+    path, output = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    write_requests(path, [{"id": f"r{i}", "solicitud": f"actividad {i}"} for i in range(6)]
+                   + [{"id": "lenta", "solicitud": "actividad lento"}])
+    StubCrew.failures = {"actividad 2": 1, "actividad 3": 5}
+    StubCrew.max_active = 0
+
+    runner = BatchRunner(StubCrew, workers=3, timeout=0.5, retries=1, backoff=0)
+    results = runner.run(list(read_requests(str(path))), str(output))
+
+    assert len(results) == 7
+    assert StubCrew.max_active <= 3
+    written = read_output(output)
+    assert written["r0"]["status"] == "ok" and written["r0"]["actividad"] == "Actividad para: actividad 0"
+    assert written["r2"]["status"] == "ok" and written["r2"]["attempts"] == 2
+    assert written["r3"]["status"] == "error" and "fallo temporal" in written["r3"]["error"]
+    assert written["lenta"]["status"] == "timeout"
+
+
+def test_batch_timeouts_retry_within_worker_limit(tmp_path):
+    """Tras vencer el plazo se reintenta con otro crew sin superar el número de hilos"""
+    path, output = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    write_requests(path, [{"id": "t", "solicitud": "actividad tarda"}]
+                   + [{"id": f"l{i}", "solicitud": f"actividad lento {i}"} for i in range(2)]
+                   + [{"id": f"r{i}", "solicitud": f"actividad {i}"} for i in range(4)])
+    while StubCrew.active:  # intentos abandonados de otros tests
+        time.sleep(0.05)
+    StubCrew.failures = {}
+    StubCrew.calls = []
+    StubCrew.max_active = 0
+    StubCrew.slow = 0.6
+
+    try:
+        runner = BatchRunner(StubCrew, workers=2, timeout=0.3, retries=2, backoff=0)
+        results = runner.run(list(read_requests(str(path))), str(output))
+    finally:
+        StubCrew.slow = 2.0
+
+    assert len(results) == 7
+    assert StubCrew.max_active <= 2
+    written = read_output(output)
+    # Cada intento contado es un crew que de verdad se lanzó
+    assert written["t"]["status"] == "ok" and written["t"]["attempts"] == 2
+    assert StubCrew.calls.count("actividad tarda") == 2
+    for i in range(2):
+        assert written[f"l{i}"]["status"] == "timeout" and written[f"l{i}"]["attempts"] == 3
+        assert StubCrew.calls.count(f"actividad lento {i}") == 3
+    assert all(written[f"r{i}"]["status"] == "ok" for i in range(4))
+
+
+def test_batch_resume_skips_completed(tmp_path):
+    """Al reanudar solo se procesan las solicitudes que no terminaron bien"""
+    path, output = tmp_path / "in.jsonl", tmp_path / "out.jsonl"
+    write_requests(path, [{"id": "a", "solicitud": "uno"}, {"id": "b", "solicitud": "dos"}])
+    StubCrew.failures = {"dos": 1}
+    runner = BatchRunner(StubCrew, workers=2, timeout=None, retries=0, backoff=0)
+
+    first = runner.run(list(read_requests(str(path))), str(output))
+    assert {r.request_id: r.status for r in first} == {"a": "ok", "b": "error"}
+
+    second = runner.run(list(read_requests(str(path))), str(output))
+    assert [r.request_id for r in second] == ["b"] and second[0].status == "ok"
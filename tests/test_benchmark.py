@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Tests para el banco de pruebas con LLM simulado
+"""
+
+import copy
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.benchmark import BenchmarkRunner, compare_reports, load_report, save_report
+from agents.crew_agents import IA4EDUCrew
+
+
+def make_runner(**kwargs):
+    return BenchmarkRunner(lambda: IA4EDUCrew("clave-de-prueba", use_cache=False),
+                           latency=0.01, tokens_per_second=5000, runs=1, **kwargs)
+
+
+def test_report_covers_every_stage(tmp_path):
+    """El informe trae tiempos, tokens y memoria por escenario y etapa"""
+    report = make_runner().run()
+    scenarios = report["escenarios"]
+    assert list(scenarios) == ["diseno", "refinamiento_secciones", "refinamiento_completo"]
+    assert [s["etapa"] for s in scenarios["diseno"]["etapas"]] == ["Análisis", "Investigación", "Diseño"]
+    for scenario in scenarios.values():
+        assert scenario["memoria_pico_mb"] > 0 and scenario["wall_s"] > 0
+        for stage in scenario["etapas"]:
+            assert stage["llamadas"] == 1 and stage["prompt_tokens"] > 0 and stage["wall_s"] > 0
+
+    scoped = scenarios["refinamiento_secciones"]["etapas"][0]["prompt_tokens"]
+    full = scenarios["refinamiento_completo"]["etapas"][0]["prompt_tokens"]
+    print(f"   - prompt de refinamiento: {scoped} por secciones, {full} completo")
+    assert scoped < full
+
+    path = str(tmp_path / "bench.json")
+    save_report(report, path)
+    assert load_report(path)["escenarios"]["diseno"]["etapas"] == scenarios["diseno"]["etapas"]
+
+
+def test_streaming_records_first_token():
+    """Con streaming simulado se mide el tiempo hasta el primer token"""
+    report = make_runner(stream=True).run(only=["refinamiento_completo"])
+    stage = report["escenarios"]["refinamiento_completo"]["etapas"][0]
+    assert 0 < stage["primer_token_s"] < stage["wall_s"]
+
+
+def test_compare_flags_prompt_growth():
+    """Un prompt más grande que el de referencia se marca como regresión"""
+    baseline = make_runner().run(only=["refinamiento_secciones"])
+    assert compare_reports(baseline, baseline) == []
+
+    current = copy.deepcopy(baseline)
+    current["escenarios"]["refinamiento_secciones"]["etapas"][0]["prompt_tokens"] *= 2
+    regressions = compare_reports(baseline, current)
+    assert len(regressions) == 1 and "Refinamiento" in regressions[0]
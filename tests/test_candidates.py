@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Tests para los diseños candidatos en paralelo y su puntuación local
+"""
+
+import copy
+import json
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crewai.llms.base_llm import BaseLLM
+
+from agents.candidates import rank_candidates, score_candidate, variant_llm
+from agents.classroom import neurotype_of
+from agents.corpus import get_corpus
+from agents.crew_agents import IA4EDUCrew
+from agents.llm_cache import CachedLLM, LLMResponseCache
+from agents.streaming import DONE, StreamMonitor
+from agents.structured import build_activity
+from agents.tracing import Tracer
+from tests.test_structured import ACTIVIDAD, adaptacion
+
+
+def complete_activity(students):
+    """La actividad de referencia con una adaptación para cada estudiante del aula"""
+    data = copy.deepcopy(ACTIVIDAD)
+    data["fases"][0]["tareas"][0]["adaptaciones_por_estudiante"] = [
+        adaptacion(s["id"], neurotype_of(s.get("diagnostico_formal", "")), "instrucciones visuales")
+        for s in students
+    ]
+    return data
+
+
+def test_scorer_prefers_full_coverage_and_requested_groups():
+    """Gana el diseño que atiende a todo el aula y respeta el tamaño de grupo"""
+    students = get_corpus().students()
+    request = "Actividad de fracciones en parejas"
+    partial = build_activity(ACTIVIDAD)
+    full = build_activity(complete_activity(students))
+
+    low = score_candidate(0, "", students, request, partial)
+    high = score_candidate(1, "", students, request, full)
+    assert low.cobertura == 0.25 and "003" in low.faltan
+    assert high.cobertura == 1.0 and high.faltan == [] and high.agrupacion == 1.0
+    assert [s.indice for s in rank_candidates([low, high])] == [1, 0]
+
+    markdown = "\n".join(["## Objetivos", "- Fracciones", "## Fases", "- Fase 1",
+                          "## Evaluación", "- Rúbrica"]
+                         + [f"Pareja {i}: {a['nombre']} y {b['nombre']}"
+                            for i, (a, b) in enumerate(zip(students[::2], students[1::2]), 1)])
+    text = score_candidate(0, markdown, students, request)
+    assert text.cobertura == 1.0 and text.agrupacion == 1.0 and text.secciones == 0.5
+
+
+def test_variant_keeps_the_cache_wrapper():
+    """La variante cambia la temperatura del LLM real sin tocar el original"""
+    inner = TemperatureLLM({})
+    cached = CachedLLM(inner, LLMResponseCache(":memory:"))
+    variant = variant_llm(cached, 0.3)
+    assert isinstance(variant, CachedLLM) and variant.cache is cached.cache
+    assert variant.temperature == variant.inner.temperature == 0.3
+    assert cached.temperature == inner.temperature == 0.7
+    assert variant_llm(cached, None) is cached
+
+
+class TemperatureLLM(BaseLLM):
+    """LLM local cuya respuesta depende de la temperatura"""
+
+    def __init__(self, activities):
+        super().__init__(model="stub/disenador", temperature=0.7)
+        self.activities = activities
+        self.temperatures = []
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        self.temperatures.append(self.temperature)
+        activity = self.activities.get(self.temperature)
+        if activity is None:
+            return f"Final Answer: salida de {self.model}"
+        return "Final Answer: ```json\n" + json.dumps(activity, ensure_ascii=False) + "\n```"
+
+
+def test_crew_returns_only_the_best_candidate():
+    """Análisis e investigación una vez; tres diseños en paralelo y se queda el mejor"""
+    students = get_corpus().students()
+    crew = IA4EDUCrew("clave-de-prueba", use_cache=False, candidates=3)
+    crew.verbose = False
+    for name in ("analyst", "researcher"):
+        getattr(crew, name).agent.llm = TemperatureLLM({})
+        getattr(crew, name).agent.verbose = False
+    designer = TemperatureLLM({0.7: ACTIVIDAD, 0.9: complete_activity(students), 0.5: ACTIVIDAD})
+    crew.designer.agent.llm = crew.designer.candidate_llm = designer
+    crew.designer.agent.verbose = False
+
+    result = crew.design_activity("Actividad de fracciones en parejas")
+    assert sorted(designer.temperatures) == [0.5, 0.7, 0.9]
+    assert crew.analyst.agent.llm.temperatures == [0.7]
+    assert [c.temperatura for c in crew.last_candidates][0] == 0.9
+    assert len(crew.last_candidates) == 3 and crew.last_candidates[0].cobertura == 1.0
+    assert result.raw == crew.last_markdown and "La Pizzería del Aula" in crew.last_markdown
+    adapted = {a.estudiante_id for a in crew.last_structure.actividad.fases[0].tareas[0].adaptaciones_por_estudiante}
+    assert adapted == {s["id"] for s in students}
+    assert designer.temperature == 0.7
+
+
+def test_candidates_advance_the_design_stage():
+    """Las copias del diseñador cuentan para la etapa "Diseño" en el seguimiento y las trazas"""
+    students = get_corpus().students()
+    crew = IA4EDUCrew("clave-de-prueba", use_cache=False, candidates=2)
+    crew.verbose = False
+    for name in ("analyst", "researcher", "designer"):
+        getattr(crew, name).agent.llm = TemperatureLLM({0.7: ACTIVIDAD, 0.9: complete_activity(students)})
+        getattr(crew, name).agent.verbose = False
+    crew.designer.candidate_llm = crew.designer.agent.llm
+
+    with StreamMonitor(crew.design_stages(), exclusive=False) as monitor, \
+            Tracer(stages=crew.design_stages()) as tracer:
+        crew.design_activity("Actividad de fracciones en parejas")
+
+    assert [(s.label, s.status) for s in monitor.snapshot()] == [
+        ("Análisis", DONE), ("Investigación", DONE), ("Diseño", DONE)
+    ]
+    assert [s.etapa for s in tracer.stage_summary()].count("Diseño") == 2
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Tests para la cascada de modelos con escalado por confianza
+"""
+
+import json
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crewai.llms.base_llm import BaseLLM
+
+from agents.cascade import CascadeLLM, CascadeStats, design_issue, refinement_issue, text_validator
+from agents.corpus import get_corpus
+from agents.crew_agents import IA4EDUCrew
+from agents.llm_clients import LLMConfig, ModelSettings
+from tests.test_candidates import complete_activity
+from tests.test_structured import ACTIVIDAD
+
+ANALISIS = ("Resumen de la solicitud: taller de fracciones con pizzas. Implicaciones por neurotipo: "
+            "el alumnado con TEA necesita anticipación y el de TDAH movimiento; las altas capacidades "
+            "piden retos abiertos. Recomendaciones para el diseño: fases cortas, roles rotativos, "
+            "materiales manipulativos y apoyos visuales para todos. ") * 2
+
+
+class TierLLM(BaseLLM):
+    """LLM local de un nivel: responde siempre lo mismo y cuenta sus llamadas"""
+
+    def __init__(self, name, answer):
+        super().__init__(model=f"stub/{name}", temperature=0.7)
+        self.answer = answer
+        self.calls = 0
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        self.calls += 1
+        return f"Final Answer: {self.answer}"
+
+
+def activity_json(data):
+    return "```json\n" + json.dumps(data, ensure_ascii=False) + "\n```"
+
+
+def test_validators_reject_incomplete_outputs():
+    """Respuestas cortas, sin apartados o sin cubrir el aula se rechazan"""
+    analyst = text_validator("analyst")
+    assert analyst("", "") == "respuesta vacía"
+    assert analyst("", "Ok").startswith("respuesta demasiado corta")
+    assert analyst("", ANALISIS) is None
+    assert analyst("", "Lorem ipsum dolor sit amet. " * 20).startswith("faltan apartados")
+
+    prompt = "Diseña una actividad completa... FORMATO DE SALIDA: JSON"
+    assert design_issue(prompt, "Aquí tienes una actividad muy completa. " * 30) == "la respuesta no es JSON válido"
+    assert design_issue(prompt, activity_json(ACTIVIDAD)).startswith("sin adaptación para 003")
+    assert design_issue(prompt, activity_json(complete_activity(get_corpus().students()))) is None
+
+    assert refinement_issue("<<<S1>>> ... <<<FIN>>>", "Texto revisado sin marcadores. " * 5) \
+        == "faltan los marcadores de las secciones"
+
+
+def test_cascade_escalates_only_task_calls():
+    """El prompt se repite en el nivel siguiente si se rechaza; las llamadas directas no escalan"""
+    stats = CascadeStats()
+    fast, strong = TierLLM("rapido", "Demasiado breve"), TierLLM("potente", ANALISIS)
+    llm = CascadeLLM("analyst", [("rapido", fast), ("potente", strong)], stats=stats)
+    task = [{"role": "system", "content": "Eres analista"}, {"role": "user", "content": "Analiza"}]
+
+    assert llm.call(task) == f"Final Answer: {ANALISIS}"
+    assert llm.call([{"role": "user", "content": "Corrige SOLO el valor"}]) == "Final Answer: Demasiado breve"
+    assert (fast.calls, strong.calls) == (2, 1)
+
+    rows = {row["nivel"]: row for row in stats.summary()}
+    assert rows["rapido"]["llamadas"] == 2 and rows["rapido"]["tasa_escalado"] == 0.5
+    assert rows["rapido"]["motivos"] == {"respuesta demasiado corta": 1}
+    assert rows["potente"]["escaladas"] == 0 and rows["potente"]["p50_ms"] >= 0
+
+    llm.stop = ["\nObservation:"]
+    assert fast.stop == strong.stop == ["\nObservation:"]
+
+
+def test_config_enables_cascade_per_agent(monkeypatch):
+    """La cascada sale de la configuración y se apaga con IA4EDU_CASCADE=0 o fijando el modelo"""
+    monkeypatch.delenv("IA4EDU_CASCADE", raising=False)
+    monkeypatch.delenv("IA4EDU_MODEL_ANALYST", raising=False)
+    config = LLMConfig(tiers={"rapido": ModelSettings("a"), "potente": ModelSettings("b")},
+                       cascade_tiers=["rapido", "potente"], cascade_agents=["analyst"])
+    assert config.cascade_for("analyst") == ["rapido", "potente"] and config.cascade_for("designer") == []
+    monkeypatch.setenv("IA4EDU_MODEL_ANALYST", "gemini/gemini-2.0-flash")
+    assert config.cascade_for("analyst") == []
+    monkeypatch.delenv("IA4EDU_MODEL_ANALYST")
+    monkeypatch.setenv("IA4EDU_CASCADE", "0")
+    assert config.cascade_for("analyst") == []
+
+
+def test_crew_escalates_the_design_and_keeps_fast_analysis():
+    """El análisis se queda en el nivel rápido y el diseño incompleto sube de nivel"""
+    stats = CascadeStats()
+    crew = IA4EDUCrew("clave-de-prueba", use_cache=False)
+    crew.verbose = False
+    tiers = {}
+    for name, fast_answer, strong_answer in (
+        ("analyst", ANALISIS, ANALISIS),
+        ("researcher", "Investigación corta", ANALISIS + " Actividades, estrategias, grupos, materiales y fases."),
+        ("designer", activity_json(ACTIVIDAD), activity_json(complete_activity(get_corpus().students()))),
+    ):
+        tiers[name] = (TierLLM("rapido", fast_answer), TierLLM("potente", strong_answer))
+        agent = getattr(crew, name).agent
+        agent.llm = CascadeLLM(name, [("rapido", tiers[name][0]), ("potente", tiers[name][1])], stats=stats)
+        agent.verbose = False
+
+    crew.design_activity("Actividad de fracciones en parejas")
+    assert [(fast.calls, strong.calls) for fast, strong in tiers.values()] == [(1, 0), (1, 1), (1, 1)]
+    assert len(crew.last_structure.actividad.fases[0].tareas[0].adaptaciones_por_estudiante) == 8
+    escalated = {row["agente"]: row["escaladas"] for row in stats.summary() if row["nivel"] == "rapido"}
+    assert escalated == {"analyst": 0, "researcher": 1, "designer": 1}
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Tests para el troceado de actividades por secciones
+"""
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.chunking import chunk_markdown, get_section_index, render_sections, select_sections
+from agents.corpus import get_corpus
+
+SAMPLE = """# Actividad
+"Feria de prueba"
+
+## LUNES: Taller de Formas
+### Objetivos del Día
+- Reconocer polígonos
+### Desarrollo del Día
+#### Actividad 1: Recortables
+Recortamos triángulos y cuadrados.
+
+## Adaptaciones Específicas
+### Adaptaciones Individuales
+- TDAH: descansos activos cada 10 minutos
+"""
+
+
+def test_chunk_markdown_builds_addressable_sections():
+    """Cada encabezado con cuerpo se convierte en una sección con metadatos"""
+    sections = chunk_markdown(SAMPLE, "data/k_prueba.md", "Prueba")
+    by_title = {section.titulo: section for section in sections}
+
+    assert "LUNES: Taller de Formas" not in by_title  # sin cuerpo propio
+    objetivos = by_title["Objetivos del Día"]
+    assert objetivos.ruta == ("LUNES: Taller de Formas", "Objetivos del Día")
+    assert objetivos.tipo == "objetivos"
+    assert objetivos.section_id == "data/k_prueba.md#lunes-taller-de-formas-objetivos-del-dia"
+
+    # Los encabezados de nivel 4 quedan dentro de su sección padre
+    desarrollo = by_title["Desarrollo del Día"]
+    assert "Recortamos triángulos" in desarrollo.texto
+    assert desarrollo.tipo == "desarrollo"
+    assert by_title["Adaptaciones Individuales"].tipo == "adaptaciones"
+    assert len({section.section_id for section in sections}) == len(sections)
+
+
+def test_select_sections_respects_token_budget():
+    """La selección nunca supera el presupuesto y prioriza secciones relevantes"""
+    sections = select_sections("adaptaciones para TDAH con descansos", 400)
+    assert sections
+    assert sum(section.tokens for section in sections) <= 400
+    assert any(section.tipo == "adaptaciones" for section in sections)
+    rendered = render_sections(sections)
+    assert rendered.startswith("--- ")
+
+
+def test_sections_cover_whole_library():
+    """Todas las actividades de la biblioteca aportan secciones"""
+    index = get_section_index()
+    files = {section.archivo for section in index.sections.values()}
+    assert files == {activity.archivo for activity in get_corpus().activities()}
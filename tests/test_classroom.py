@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Tests para el resumen precalculado del aula
+"""
+
+import copy
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.classroom import build_digest, classroom_digest, neurotype_of, profile_hash
+from agents.corpus import get_corpus
+
+
+def test_digest_is_computed_from_profiles():
+    """Neurotipos, fortalezas, apoyos y brechas salen de los perfiles sin LLM"""
+    digest = build_digest(get_corpus().students())
+    assert digest.total == 8
+    assert digest.neurotipos["TEA"] == ["003"] and digest.neurotipos["TDAH"] == ["004"]
+    assert list(digest.neurotipos)[-1] == "Típico" and len(digest.neurotipos["Típico"]) == 5
+    assert digest.brechas["matematicas"]["operaciones_complejas"]["INICIADO"] == ["004"]
+    assert digest.ampliacion["matematicas"] == ["005"]
+    luis = next(s for s in digest.estudiantes if s.id == "004")
+    assert luis.tolerancia_baja and "descansos" in luis.necesidades
+
+    text = digest.render(["matematicas"])
+    assert "- TDAH: fortalezas creatividad" in text
+    assert "lengua." not in text and "matematicas.operaciones_complejas: I 004 P 001,006,008" in text
+    assert len(digest.render(["matematicas"], minimal=True)) < len(text)
+    assert neurotype_of("TEA_nivel_2") == "TEA" and neurotype_of("dislexia") == "dislexia"
+
+
+def test_digest_is_cached_by_profile_hash():
+    """Mismo contenido, mismo resumen; cualquier cambio en los perfiles lo recalcula"""
+    students = get_corpus().students()
+    reordered = [dict(reversed(list(s.items()))) for s in students]
+    assert profile_hash(reordered) == profile_hash(students)
+    assert classroom_digest(reordered) is classroom_digest(students)
+
+    changed = copy.deepcopy(students)
+    changed[0]["diagnostico_formal"] = "TDAH_inatento"
+    digest = classroom_digest(changed)
+    assert digest is not classroom_digest(students)
+    assert digest.neurotipos["TDAH"] == ["001", "004"]
+
+
+def test_analysis_prompt_uses_digest():
+    """El analista recibe el aula precalculada en lugar de los perfiles en bruto"""
+    from agents.crew_agents import IA4EDUCrew
+
+    crew = IA4EDUCrew("clave-de-prueba", use_cache=False)
+    description = crew.analyst.create_analysis_task("Actividad de fracciones en parejas").description
+    assert "AULA PRECALCULADA" in description and "no lo vuelvas a describir" in description
+    assert "TEA_nivel_1" not in description
+    print(f"   - presupuesto del análisis: {crew.analyst.last_budget.summary()}")
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Tests para el corpus compartido (caché de perfiles y biblioteca)
+"""
+
+import json
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.corpus import ActivityCorpus, get_corpus
+
+
+def _write(path, content):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def _bump_mtime(path):
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+
+def _make_data_dir(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    _write(data_dir / "perfiles_4_primaria.json",
+           json.dumps({"estudiantes": [{"id": "001", "nombre": "ANA"}]}))
+    _write(data_dir / "k_huerto.md", "# Huerto escolar\nCiencias en el huerto")
+    _write(data_dir / "k_mapas.md", "# Mapas\nOrientación con mapas")
+    return str(data_dir)
+
+
+def test_profiles_are_parsed_once(tmp_path):
+    """Los perfiles se parsean una vez y se reutilizan"""
+    corpus = ActivityCorpus(_make_data_dir(tmp_path))
+    first = corpus.profiles()
+    assert first["estudiantes"][0]["nombre"] == "ANA"
+    assert corpus.profiles() is first
+    assert corpus.profiles_json() is corpus.profiles_json()
+
+
+def test_profiles_reload_on_change(tmp_path):
+    """Un cambio en el fichero de perfiles invalida la caché"""
+    data_dir = _make_data_dir(tmp_path)
+    corpus = ActivityCorpus(data_dir)
+    version = corpus.version()
+    path = os.path.join(data_dir, "perfiles_4_primaria.json")
+    _write(path, json.dumps({"estudiantes": [{"id": "002", "nombre": "LUIS"}]}))
+    _bump_mtime(path)
+    assert corpus.profiles()["estudiantes"][0]["nombre"] == "LUIS"
+    assert corpus.version() != version
+
+
+def test_library_tracks_added_and_changed_files(tmp_path):
+    """La biblioteca detecta actividades nuevas y modificadas"""
+    data_dir = _make_data_dir(tmp_path)
+    corpus = ActivityCorpus(data_dir)
+    summary = corpus.library_summary()
+    assert summary.count("Archivo:") == 2
+    assert corpus.library_summary() is summary
+
+    _write(os.path.join(data_dir, "k_teatro.md"), "# Teatro\nLengua y expresión")
+    assert corpus.library_summary().count("Archivo:") == 3
+
+    path = os.path.join(data_dir, "k_mapas.md")
+    _write(path, "# Mapas\nNueva versión de la actividad")
+    _bump_mtime(path)
+    assert "Nueva versión" in corpus.full_activity(path)
+
+
+def test_shared_corpus_reads_repo_data():
+    """El corpus compartido carga los datos reales del repositorio"""
+    corpus = get_corpus()
+    assert corpus is get_corpus()
+    assert len(corpus.students()) == 8
+    assert any(doc.archivo.endswith("k_feria_acertijos.md") for doc in corpus.activities())
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Tests para el validador local de cobertura y la regeneración de huecos
+"""
+
+import copy
+import json
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.corpus import get_corpus
+from agents.coverage import check_activity, check_markdown, fill_markdown_gaps, fill_structured_gaps
+from agents.structured import build_activity
+from tests.test_structured import ACTIVIDAD, adaptacion, tarea
+
+
+class GapGenerator:
+    """Responde a cada prompt de hueco con un JSON mínimo y guarda los prompts"""
+
+    def __init__(self):
+        self.prompts = []
+
+    def __call__(self, prompt):
+        self.prompts.append(prompt)
+        if "Faltan adaptaciones" in prompt:
+            ids = [line.split()[1] for line in prompt.splitlines() if line.startswith("- 0")]
+            return json.dumps({
+                "adaptaciones": [dict(adaptacion(sid, "?", "apoyo visual"), tarea="fases[0].tareas[0]")
+                                 for sid in ids],
+                "adaptaciones_proactivas": {"Altas_Capacidades": "retos de ampliación"},
+            })
+        if "Completa la fase" in prompt:
+            return json.dumps([tarea("Servir pedidos", [])])
+        return json.dumps({"rubrica_inclusion": {"colabora": "con ayuda"}})
+
+
+def test_checker_finds_every_gap():
+    """Estudiantes sin adaptación, neurotipos, fases vacías y evaluación, sin LLM"""
+    students = get_corpus().students()
+    data = copy.deepcopy(ACTIVIDAD)
+    data["fases"][1]["tareas"] = []
+    data["rubrica_inclusion"] = {}
+    report = check_activity(build_activity(data).actividad, students)
+    assert report.estudiantes == ["002", "003", "004", "005", "006", "007", "008"]
+    assert report.neurotipos == ["Altas_Capacidades"]
+    assert (report.fases, report.evaluacion) == (["fases[1]"], ["rubrica_inclusion"])
+    assert not report.completo and "neurotipos Altas_Capacidades" in report.summary()
+
+    text = "# Taller\n\n## Fase 1\nElena R. usa pictogramas"
+    markdown = check_markdown(text, students)
+    assert "003" not in markdown.estudiantes and markdown.evaluacion == ["evaluación"]
+    assert markdown.fases == [] and "TEA" in markdown.neurotipos
+
+
+def test_structured_gaps_are_filled_with_one_call_each():
+    """Cada tipo de hueco es una llamada pequeña y el resultado queda completo"""
+    students = get_corpus().students()
+    data = copy.deepcopy(ACTIVIDAD)
+    data["fases"][1]["tareas"] = []
+    data["rubrica_inclusion"] = {}
+    generate = GapGenerator()
+    completed, outcome = fill_structured_gaps(build_activity(data), students, generate)
+
+    assert outcome.llamadas == len(generate.prompts) == 3
+    assert outcome.despues.completo and not outcome.antes.completo
+    adapted = completed.actividad.fases[0].tareas[0].adaptaciones_por_estudiante
+    assert len(adapted) == 8 and {ad.neurotipo for ad in adapted if ad.estudiante_id == "003"} == {"TEA"}
+    assert completed.actividad.fases[1].tareas[0].nombre == "Servir pedidos"
+    assert completed.actividad.adaptaciones_proactivas["TEA"] == "agenda visual"
+    # Solo el contexto del hueco, no el diseño entero
+    assert all("Pizzería" in prompt and "asignaciones_grupos" not in prompt for prompt in generate.prompts)
+
+    again, outcome = fill_structured_gaps(completed, students, generate)
+    assert again is completed and outcome.llamadas == 0 and len(generate.prompts) == 3
+
+
+def test_markdown_gaps_are_appended():
+    """En texto libre se pide solo lo que falta y se añade al final"""
+    students = get_corpus().students()
+    prompts = []
+
+    def generate(prompt):
+        prompts.append(prompt)
+        lines = [f"- {s['id']} {s['nombre']}: apoyo visual" for s in students]
+        return "## Adaptaciones\n" + "\n".join(lines) + "\nTEA, TDAH y Altas_Capacidades\n## Evaluación\n- Rúbrica"
+
+    text, outcome = fill_markdown_gaps("# Taller\n\n## Fase 1\nElena R. usa pictogramas", students, generate)
+    assert outcome.llamadas == len(prompts) == 1 and outcome.despues.completo
+    assert text.startswith("# Taller") and text.rstrip().endswith("- Rúbrica")
+    assert "Fases de la actividad" not in prompts[0] and "Evaluación" in prompts[0]
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Tests para el optimizador local de grupos y roles
+"""
+
+import copy
+import itertools
+import json
+import os
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.corpus import get_corpus
+from agents.grouping import group_size_from_request, group_sizes, plan_groups, rotations_from_request
+
+
+def partners(groups):
+    return {frozenset(pair) for group in groups for pair in itertools.combinations(group.estudiantes, 2)}
+
+
+def test_request_sets_size_and_rotations():
+    """El tamaño y las rotaciones salen del texto de la solicitud"""
+    assert group_size_from_request("Actividad de fracciones en parejas") == 2
+    assert group_size_from_request("Proyecto en equipos de tres sobre el agua") == 3
+    assert group_size_from_request("Trabajo individual de lectura") == 1
+    assert rotations_from_request("Feria en parejas con 4 rotaciones") == 4
+    assert rotations_from_request("Parejas que rotan cada día") == 3
+    assert rotations_from_request("Actividad de fracciones") == 1
+    assert group_sizes(7, 2) == [3, 2, 2] and group_sizes(8, 3) == [3, 3, 2] and group_sizes(30, 4) == [5, 5, 4, 4, 4, 4, 4]
+
+
+def test_pairs_are_complementary_and_reproducible():
+    """Cada estudiante está en un grupo, los perfiles de apoyo alto no coinciden y el resultado se repite"""
+    students = get_corpus().students()
+    plan = plan_groups(students, "Actividad de fracciones en parejas")
+    groups = plan.rotaciones[0]
+    assert sorted(sid for g in groups for sid in g.estudiantes) == [s["id"] for s in students]
+    assert all(g.tipo_agrupacion == "parejas" and set(g.roles_asignados) == set(g.estudiantes) for g in groups)
+    assert frozenset({"003", "004"}) not in partners(groups)
+    luis = next(g for g in groups if "004" in g.estudiantes)
+    assert luis.roles_asignados["004"] == "responsable de materiales"
+    assert all(g.justificacion_agrupacion.endswith(".") for g in groups)
+    assert plan_groups(students, "Actividad de fracciones en parejas") == plan
+    assert "AGRUPACIONES CALCULADAS (parejas, 1 rotación)" in plan.render()
+
+
+def test_rotations_scale_to_large_classes():
+    """Treinta estudiantes y diez rotaciones en milisegundos, sin repetir compañero al principio"""
+    base = get_corpus().students()
+    students = []
+    for i in range(30):
+        student = copy.deepcopy(base[i % len(base)])
+        student["id"], student["nombre"] = f"{i + 1:03d}", f"Estudiante {i + 1}"
+        students.append(student)
+
+    start = time.perf_counter()
+    plan = plan_groups(students, "Feria de acertijos en parejas con 10 rotaciones")
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"   - 30 estudiantes, 10 rotaciones: {elapsed:.1f} ms")
+    assert len(plan.rotaciones) == 10 and elapsed < 500
+
+    seen = set()
+    for groups in plan.rotaciones[:4]:
+        current = partners(groups)
+        assert not current & seen
+        seen |= current
+    assert plan.asignaciones()[-1].grupo_id == "R10-O"
+
+
+def test_designer_receives_groupings_and_json_uses_them():
+    """El diseñador recibe los grupos calculados y la plantilla los toma del optimizador"""
+    from agents.crew_agents import IA4EDUCrew
+    from tests.test_structured import ACTIVIDAD
+
+    crew = IA4EDUCrew("clave-de-prueba", use_cache=False)
+    plan = crew.plan_grouping("Actividad de fracciones en parejas")
+    task = crew.designer.create_design_task("análisis", "investigación", "Actividad de fracciones en parejas",
+                                            structured=True, grouping=plan.render())
+    assert "ya calculada, no la cambies" in task.description and "Grupo D:" in task.description
+    assert '"asignaciones_grupos" como []' in task.description
+
+    crew.structure_output(json.dumps(ACTIVIDAD, ensure_ascii=False), None, plan)
+    groups = crew.last_structure.actividad.asignaciones_grupos
+    assert groups == plan.asignaciones() and len(groups) == 4
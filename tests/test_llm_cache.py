@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Tests para la caché en disco de respuestas del LLM
+"""
+
+import os
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crewai.llms.base_llm import BaseLLM
+
+from agents.llm_cache import CachedLLM, LLMResponseCache, cache_key
+
+
+class CountingLLM(BaseLLM):
+    """LLM local que cuenta las llamadas reales"""
+
+    def __init__(self):
+        super().__init__(model="stub/contador", temperature=0.7)
+        self.calls = 0
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        self.calls += 1
+        return f"Final Answer: respuesta {self.calls}"
+
+
+def test_key_ignores_whitespace_but_not_model_or_corpus():
+    """La clave normaliza espacios y distingue modelo, temperatura y corpus"""
+    base = cache_key("gemini/flash", 0.7, "Hola   mundo\n  ", "v1")
+    assert base == cache_key("gemini/flash", 0.7, [{"role": "user", "content": "Hola mundo"}], "v1")
+    assert base != cache_key("gemini/pro", 0.7, "Hola mundo", "v1")
+    assert base != cache_key("gemini/flash", 0.2, "Hola mundo", "v1")
+    assert base != cache_key("gemini/flash", 0.7, "Hola mundo", "v2")
+
+
+def test_cached_llm_returns_stored_response(tmp_path):
+    """La segunda llamada idéntica no llega al modelo"""
+    cache = LLMResponseCache(str(tmp_path / "cache.sqlite"))
+    inner = CountingLLM()
+    llm = CachedLLM(inner, cache)
+    messages = [{"role": "user", "content": "fracciones para 4º de primaria, en parejas"}]
+
+    first = llm.call(messages)
+    second = llm.call(messages)
+    assert first == second
+    assert inner.calls == 1
+    info = cache.info()
+    assert info["hits"] == 1 and info["misses"] == 1 and info["entries"] == 1
+
+    # Las llamadas con herramientas no se cachean
+    llm.call(messages, tools=[{"name": "buscar"}])
+    assert inner.calls == 2
+
+
+def test_stop_words_reach_inner_llm(tmp_path):
+    """Las palabras de parada que fija CrewAI llegan al LLM real"""
+    inner = CountingLLM()
+    llm = CachedLLM(inner, LLMResponseCache(str(tmp_path / "cache.sqlite")))
+    llm.stop = ["\nObservation:"]
+    assert inner.stop == ["\nObservation:"]
+
+
+def test_eviction_by_size_is_lru(tmp_path):
+    """Al superar el tamaño máximo se expulsan las entradas menos usadas"""
+    cache = LLMResponseCache(str(tmp_path / "cache.sqlite"), max_bytes=250)
+    cache.put("a", "m", "x" * 100)
+    cache.put("b", "m", "y" * 100)
+    time.sleep(0.01)
+    assert cache.get("a") is not None  # "a" pasa a ser la más reciente
+    cache.put("c", "m", "z" * 100)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats.evictions == 1
+
+
+def test_eviction_by_age(tmp_path):
+    """Las entradas caducadas no se devuelven y se borran al escribir"""
+    cache = LLMResponseCache(str(tmp_path / "cache.sqlite"), max_age=0.05)
+    cache.put("viejo", "m", "respuesta")
+    time.sleep(0.1)
+    assert cache.get("viejo") is None
+    cache.put("nuevo", "m", "respuesta")
+    assert cache.info()["entries"] == 1
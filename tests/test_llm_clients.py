@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Tests para el registro de clientes LLM compartido
+"""
+
+import json
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.crew_agents import IA4EDUCrew
+from agents.llm_clients import LLMClientRegistry, load_llm_config, resolve_api_key
+
+CONFIG = {
+    "niveles": {
+        "rapido": {"model": "gemini/gemini-1.5-flash-8b", "temperature": 0.5},
+        "estandar": {"model": "gemini/gemini-1.5-flash", "temperature": 0.7},
+    },
+    "por_defecto": "estandar",
+    "agentes": {
+        "analyst": "rapido",
+        "designer": {"model": "gemini/gemini-1.5-pro", "temperature": 0.9, "max_tokens": 4096},
+    },
+    "http": {"max_keepalive_connections": 4},
+}
+
+
+def write_config(tmp_path):
+    path = tmp_path / "llm.json"
+    path.write_text(json.dumps(CONFIG), encoding="utf-8")
+    return str(path)
+
+
+def test_tiers_per_agent(tmp_path, monkeypatch):
+    """Cada agente toma el modelo de su nivel, de su bloque propio o del nivel por defecto"""
+    monkeypatch.delenv("IA4EDU_MODEL_ANALYST", raising=False)
+    config = load_llm_config(write_config(tmp_path))
+    assert config.settings_for("analyst").model == "gemini/gemini-1.5-flash-8b"
+    assert config.settings_for("designer").max_tokens == 4096
+    assert config.settings_for("refinement").model == "gemini/gemini-1.5-flash"
+    assert config.http.max_keepalive_connections == 4
+
+    monkeypatch.setenv("IA4EDU_MODEL_ANALYST", "gemini/gemini-2.0-flash")
+    settings = config.settings_for("analyst")
+    assert settings.model == "gemini/gemini-2.0-flash" and settings.temperature == 0.5
+
+
+def test_missing_config_uses_defaults(tmp_path):
+    """Sin fichero de configuración todos los agentes usan el modelo estándar"""
+    config = load_llm_config(str(tmp_path / "no_existe.json"))
+    assert config.settings_for("researcher").model == "gemini/gemini-1.5-flash"
+
+
+def test_api_key_order(monkeypatch):
+    """La clave se toma de GEMINI_API_KEY, luego LLM_API_KEY y luego GOOGLE_API_KEY"""
+    for var in ("GEMINI_API_KEY", "LLM_API_KEY", "GOOGLE_API_KEY"):
+        monkeypatch.delenv(var, raising=False)
+    assert resolve_api_key() is None
+    monkeypatch.setenv("GOOGLE_API_KEY", "google")
+    monkeypatch.setenv("LLM_API_KEY", "llm")
+    assert resolve_api_key() == "llm"
+    monkeypatch.setenv("GEMINI_API_KEY", "gemini")
+    assert resolve_api_key() == "gemini"
+
+
+def test_agents_share_http_client(tmp_path):
+    """Los cuatro agentes tienen su propio LLM pero un único cliente HTTP"""
+    registry = LLMClientRegistry(load_llm_config(write_config(tmp_path)))
+    crew = IA4EDUCrew("clave-de-prueba", use_cache=False, registry=registry)
+    llms = [a.agent.llm for a in (crew.analyst, crew.researcher, crew.designer, crew.refinement)]
+
+    assert len({id(llm) for llm in llms}) == 4
+    assert all(llm.additional_params["client"] is registry.http_client for llm in llms)
+    assert [llm.model for llm in llms] == [
+        "gemini/gemini-1.5-flash-8b", "gemini/gemini-1.5-flash",
+        "gemini/gemini-1.5-pro", "gemini/gemini-1.5-flash",
+    ]
+    registry.close()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Tests para el repositorio de perfiles con muchas aulas
+"""
+
+import json
+import os
+import shutil
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from agents.corpus import ActivityCorpus, DATA_DIR, PROFILES_FILE
+from agents.profile_store import ProfileStore
+
+with open(os.path.join(DATA_DIR, PROFILES_FILE), encoding="utf-8") as f:
+    BASE = json.load(f)["estudiantes"]
+
+
+def write_network(data_dir, classrooms=300, per_classroom=25):
+    """Red de centros en JSONL: un alumno por línea"""
+    os.makedirs(data_dir / "aulas", exist_ok=True)
+    shutil.copy(os.path.join(DATA_DIR, PROFILES_FILE), data_dir / PROFILES_FILE)
+    with open(data_dir / "aulas" / "red.jsonl", "w", encoding="utf-8") as f:
+        for c in range(classrooms):
+            for i in range(per_classroom):
+                student = dict(BASE[i % len(BASE)], id=f"{c:03d}-{i:02d}")
+                student.update(aula_id=f"A{c:03d}", centro=f"Centro {c // 10}", curso="4º primaria", grupo="B")
+                f.write(json.dumps(student, ensure_ascii=False) + "\n")
+
+
+def test_store_indexes_classrooms_and_loads_only_one(tmp_path):
+    """Miles de alumnos se indexan una vez y un aula se lee en milisegundos"""
+    write_network(tmp_path)
+    store = ProfileStore(str(tmp_path), str(tmp_path / "perfiles.sqlite"))
+    start = time.perf_counter()
+    assert store.sync() == 2
+    print(f"   - importación de 7500 alumnos: {(time.perf_counter() - start) * 1000:.0f} ms")
+    assert store.sync() == 0
+
+    assert len(store.classrooms()) == 301
+    assert [c.id for c in store.classrooms("Centro 3")][:2] == ["A030", "A031"]
+    start = time.perf_counter()
+    students = store.students("A123")
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"   - lectura de un aula: {elapsed:.2f} ms")
+    assert len(students) == 25 and students[0]["id"] == "123-00" and "aula_id" not in students[0]
+    assert elapsed < 50
+    assert store.students("4_primaria") == BASE
+
+    with open(tmp_path / "aulas" / "red.jsonl", "a", encoding="utf-8") as f:
+        f.write(json.dumps(dict(BASE[0], id="nuevo", aula_id="A999"), ensure_ascii=False) + "\n")
+    assert store.sync() == 1 and store.classroom("A999").alumnos == 1
+    os.remove(tmp_path / "aulas" / "red.jsonl")
+    assert store.sync() == 0 and [c.id for c in store.classrooms()] == ["4_primaria"]
+    store.close()
+
+
+def test_corpus_uses_selected_classroom(tmp_path):
+    """El corpus sirve los perfiles del aula elegida y su versión cambia con ella"""
+    write_network(tmp_path, classrooms=3, per_classroom=4)
+    corpus = ActivityCorpus(str(tmp_path))
+    corpus._profile_store = ProfileStore(str(tmp_path), str(tmp_path / "perfiles.sqlite"))
+    original = corpus.version()
+    assert corpus.students() == BASE
+
+    corpus.select_classroom("A002")
+    assert [s["id"] for s in corpus.students()] == ["002-00", "002-01", "002-02", "002-03"]
+    assert corpus.profiles()["aula"] == "A002" and corpus.version() != original
+
+    with pytest.raises(ValueError):
+        corpus.select_classroom("no-existe")
+    corpus.select_classroom("4_primaria")
+    assert corpus.classroom is None and corpus.students() == BASE
+
+
+def test_classroom_split_across_sources(tmp_path):
+    """Un aula repartida en dos ficheros conserva todos sus alumnos"""
+    os.makedirs(tmp_path / "aulas")
+
+    def write(name, ids, extra=""):
+        with open(tmp_path / "aulas" / name, "w", encoding="utf-8") as f:
+            for i in ids:
+                f.write(json.dumps(dict(BASE[0], id=str(i), aula_id="X")) + "\n")
+            f.write(extra)
+
+    write("a.jsonl", range(3))
+    write("b.jsonl", range(3, 5))
+    store = ProfileStore(str(tmp_path), str(tmp_path / "perfiles.sqlite"))
+    assert store.sync() == 2
+    assert [s["id"] for s in store.students("X")] == ["0", "1", "2", "3", "4"]
+    assert store.classroom("X").alumnos == 5 and len(store.classrooms()) == 1
+
+    write("a.jsonl", range(2))
+    assert store.sync() == 1
+    assert [s["id"] for s in store.students("X")] == ["0", "1", "3", "4"]
+
+    # Una fuente rota a medias no deja alumnos importados ni borra los anteriores
+    write("a.jsonl", range(10), extra="{roto\n")
+    with pytest.raises(ValueError):
+        store.sync()
+    assert [s["id"] for s in store.students("X")] == ["0", "1", "3", "4"]
+    store.close()
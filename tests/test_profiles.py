@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Tests para la codificación compacta de perfiles
+"""
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.corpus import get_corpus
+from agents.profiles import (
+    MINIMAL_SKIP, decode_profiles, detect_subjects, encode_profiles, profile_encodings, project_profiles
+)
+from agents.tokens import estimate_tokens
+
+
+def test_round_trip_keeps_all_information():
+    """Codificar y decodificar devuelve exactamente los perfiles originales"""
+    students = get_corpus().students()
+    assert decode_profiles(encode_profiles(students)) == students
+
+
+def test_round_trip_of_subject_projection():
+    """Con filtro de materia se recupera la proyección correspondiente"""
+    students = get_corpus().students()
+    encoded = encode_profiles(students, ["matematicas"], skip_fields=MINIMAL_SKIP)
+    assert "tiempos_verbales" not in encoded
+    assert decode_profiles(encoded) == project_profiles(students, ["matematicas"], MINIMAL_SKIP)
+
+
+def test_round_trip_keeps_extra_fields():
+    """Los campos no habituales viajan como columnas extra y no se pierden"""
+    students = [dict(s) for s in get_corpus().students()[:3]]
+    students[0].update(observaciones="Trabaja mejor | con pausas, y música", musica={"ritmo": "EN_PROCESO"})
+    students[1].update(clubes=["ajedrez", "coro"], edad=9, apoyo="aula, PT")
+    encoded = encode_profiles(students)
+    assert "observaciones" in encoded.splitlines()[0] and "musica{}" in encoded.splitlines()[0]
+    assert decode_profiles(encoded) == students
+    assert decode_profiles(encode_profiles(students, ["lengua"], MINIMAL_SKIP)) == \
+        project_profiles(students, ["lengua"], MINIMAL_SKIP)
+
+
+def test_special_characters_are_escaped():
+    """Separadores y guiones dentro de los valores no rompen el formato"""
+    students = [{
+        "id": "100",
+        "nombre": "Ana | B.",
+        "intereses": ["a,b", "-", "x=y"],
+        "necesidades_especiales": [],
+        "temperamento": "-",
+        "lengua": {"lectura": "NIVEL_NUEVO"},
+    }]
+    assert decode_profiles(encode_profiles(students)) == students
+
+
+def test_detect_subjects():
+    """La materia se detecta a partir de la solicitud"""
+    assert detect_subjects("Actividad sobre fracciones en parejas") == ["matematicas"]
+    assert detect_subjects("Proyecto de ecosistemas") == ["ciencias"]
+    assert detect_subjects("Escritura creativa") == ["lengua"]
+    assert detect_subjects("Una actividad divertida") == ["matematicas", "lengua", "ciencias"]
+
+
+def test_compact_encoding_is_much_smaller():
+    """La codificación compacta ocupa una fracción del JSON con sangría"""
+    corpus = get_corpus()
+    compact = profile_encodings(corpus.students(), "fracciones para 4º de primaria")[0]
+    print(f"   - {estimate_tokens(compact)} tokens frente a {estimate_tokens(corpus.profiles_json())}")
+    assert estimate_tokens(compact) * 3 < estimate_tokens(corpus.profiles_json())
+    assert len(compact.splitlines()) == len(corpus.students()) + 1
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Tests para el presupuesto de tokens de los prompts
+"""
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.prompt_budget import (
+    PromptComponent, fit_prompt, minify_json, stage_budget, summarize_text, upstream_text
+)
+from agents.tokens import estimate_tokens
+
+LONG_TEXT = "\n".join(
+    ["# Análisis del aula"]
+    + [f"- Punto {i}: el estudiante necesita apoyo visual y estructura clara" for i in range(40)]
+    + ["Texto libre " * 30]
+)
+
+
+def test_prompt_under_budget_is_untouched():
+    """Si cabe en el presupuesto no se compacta nada"""
+    prompt, report = fit_prompt("analysis", [
+        PromptComponent("solicitud", ["fracciones en parejas"], priority=10),
+    ], budget=100)
+    assert prompt["solicitud"] == "fracciones en parejas"
+    assert report.compacted == [] and report.dropped == []
+    assert not report.over_budget
+
+
+def test_lowest_priority_is_compacted_then_dropped():
+    """Se compacta primero lo menos prioritario y los opcionales se eliminan al final"""
+    big = "palabra " * 400
+    prompt, report = fit_prompt("research", [
+        PromptComponent("analisis", [big, "resumen corto"], priority=8),
+        PromptComponent("biblioteca", [big, "solo nombres " * 50], priority=2, required=False),
+    ], budget=60)
+    assert prompt["biblioteca"] == ""
+    assert prompt["analisis"] == "resumen corto"
+    assert report.dropped == ["biblioteca"]
+    assert "analisis" in report.compacted
+    assert report.tokens_after <= 60
+    assert "eliminado: biblioteca" in report.summary()
+
+
+def test_required_components_are_never_dropped():
+    """Un componente obligatorio queda en su variante mínima aunque no quepa"""
+    prompt, report = fit_prompt("design", [
+        PromptComponent("actividad", ["texto " * 200], priority=10),
+    ], budget=10)
+    assert prompt["actividad"]
+    assert report.over_budget
+
+
+def test_summarize_keeps_headings_and_order():
+    """El resumen extractivo respeta el límite y conserva los títulos"""
+    summary = summarize_text(LONG_TEXT, 120)
+    assert summary.startswith("# Análisis del aula")
+    assert estimate_tokens(summary) <= 130
+    assert summary.index("Punto 0") < summary.index("Punto 1")
+
+
+def test_helpers():
+    """Minificado de JSON, presupuesto configurable y resultados previos"""
+    assert minify_json('{\n  "a": [1, 2]\n}') == '{"a":[1,2]}'
+    assert minify_json("no es json") == "no es json"
+    os.environ["IA4EDU_PROMPT_BUDGET_ANALYSIS"] = "1234"
+    try:
+        assert stage_budget("analysis") == 1234
+    finally:
+        del os.environ["IA4EDU_PROMPT_BUDGET_ANALYSIS"]
+    assert upstream_text("texto") == "texto"
+    assert "contexto" in upstream_text(object())
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Tests para el refinamiento por secciones
+"""
+
+import os
+import re
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crewai.llms.base_llm import BaseLLM
+
+from agents.crew_agents import IA4EDUCrew
+from agents.corpus import get_corpus
+from agents.refinement import feedback_neurotypes, plan_refinement, split_design, students_for_feedback
+from agents.tokens import estimate_tokens
+
+DESIGN = """# Taller de Fracciones: La Pizzería del Aula
+
+## 1. Información general
+- **Materia:** Matemáticas
+- **Duración total:** 3 sesiones de 50 minutos
+
+## 2. Objetivos
+- Comprender fracciones como partes de un todo
+
+## 3. Fases de la actividad
+
+### Fase 1: Exploración con pizzas de cartulina
+Cada pareja recibe una pizza de cartulina y la divide en partes iguales.
+**Adaptaciones:**
+- TEA: instrucciones visuales paso a paso.
+- TDAH: tareas cortas de 10 minutos con movimiento entre mesas.
+
+### Fase 2: Pedidos de fracciones
+Las parejas atienden pedidos ("quiero 3/4 de pizza") y los representan.
+**Adaptaciones:**
+- TDAH: temporizador visual y rol de repartidor.
+- Altas capacidades: pedidos con fracciones equivalentes.
+
+### Fase 3: Presentación
+Cada pareja presenta su menú de fracciones.
+
+## 4. Asignación de estudiantes
+- Pareja 1: Elena (TEA) y Luis.
+- Pareja 2: Emma (TDAH) y Sara.
+
+## 5. Materiales y recursos
+- Cartulinas, tijeras y rotuladores
+
+## 6. Evaluación
+- Rúbrica con tres niveles
+"""
+
+
+class SectionLLM(BaseLLM):
+    """LLM local que reescribe las secciones marcadas o, sin marcadores, todo"""
+
+    def __init__(self):
+        super().__init__(model="stub/refinamiento", temperature=0.7)
+        self.prompts = []
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        prompt = messages if isinstance(messages, str) else "\n".join(m["content"] for m in messages)
+        self.prompts.append(prompt)
+        keys = sorted(set(re.findall(r"<<<(S\d+)>>>", prompt)), key=lambda k: int(k[1:]))
+        if not keys:
+            return "Final Answer: # Actividad reescrita entera"
+        body = "\n".join(f"<<<{key}>>>\n**Adaptaciones:**\n- TDAH: pasos numerados y pausas activas\n<<<FIN>>>"
+                         for key in keys)
+        return f"Final Answer: {body}\n<<<CAMBIOS>>>\nAdaptaciones de TDAH concretadas."
+
+
+def test_split_is_lossless():
+    """Las secciones concatenadas reproducen el texto exacto"""
+    sections = split_design(DESIGN)
+    assert "".join(s.texto for s in sections) == DESIGN
+    assert [s.titulo for s in sections if s.nivel == 3] == [
+        "Fase 1: Exploración con pizzas de cartulina", "Fase 2: Pedidos de fracciones", "Fase 3: Presentación"
+    ]
+
+
+def test_plan_targets_touched_sections():
+    """El feedback elige solo las secciones afectadas"""
+    tdah = plan_refinement(DESIGN, "La adaptación para TDAH no me parece clara")
+    assert [s.titulo for s in tdah.target_sections] == ["Adaptaciones:", "Adaptaciones:"]
+    assert tdah.target_tokens * 3 < tdah.total_tokens
+
+    phase = plan_refinement(DESIGN, "No entiendo la tarea de la fase 2")
+    assert phase.target_sections[0].titulo == "Fase 2: Pedidos de fracciones"
+    assert all("Fase 1" not in s.titulo for s in phase.target_sections)
+
+    assert plan_refinement(DESIGN, "Cambia la rúbrica")
+    assert plan_refinement(DESIGN, "Necesito más tiempo para la actividad completa") is None
+
+
+def test_unmarked_output_for_single_target():
+    """Sin marcadores solo se acepta una respuesta que sea claramente la sección pedida"""
+    plan = plan_refinement(DESIGN, "Cambia la rúbrica")
+    assert [s.titulo for s in plan.target_sections] == ["6. Evaluación"]
+
+    refined, replaced, _ = plan.apply("## 6. Evaluación\n- Rúbrica con cuatro niveles y autoevaluación\n")
+    assert replaced == plan.targets
+    assert "cuatro niveles" in refined and refined.count("## 6. Evaluación") == 1
+
+    # La actividad entera reescrita no se inserta dentro de la sección
+    whole = DESIGN.replace("Rúbrica con tres niveles", "Rúbrica con cuatro niveles")
+    refined, replaced, _ = plan.apply(whole)
+    assert replaced == [] and refined == DESIGN
+
+
+def test_students_for_feedback():
+    """Solo se envían los perfiles del neurotipo mencionado"""
+    students = get_corpus().students()
+    selected = students_for_feedback(students, "La adaptación para TDAH no me parece clara")
+    assert selected and all(s["diagnostico_formal"].startswith("TDAH") for s in selected)
+    assert students_for_feedback(students, "Más colores") == students
+
+
+def test_neurotype_acronyms_match_whole_words():
+    """"Teatro" o "teatral" no aluden al alumnado TEA"""
+    students = get_corpus().students()
+    assert feedback_neurotypes("Añade una parte de teatro al final") == []
+    assert students_for_feedback(students, "Hazlo más teatral") == students
+    assert feedback_neurotypes("Más apoyo para el alumno con TEA y autismo") == ["tea"]
+    assert feedback_neurotypes("Retos para altas capacidades") == ["altas_capacidades"]
+
+
+def test_crew_refines_only_touched_sections():
+    """El crew reescribe las secciones, las inserta y el prompt es mucho menor"""
+    crew = IA4EDUCrew("clave-de-prueba", use_cache=False)
+    llm = SectionLLM()
+    crew.refinement.agent.llm = llm
+
+    refined = crew.refine_activity(DESIGN, "La adaptación para TDAH no me parece clara")
+    assert refined.count("pasos numerados y pausas activas") == 2
+    assert "- TEA: instrucciones visuales paso a paso." not in refined
+    assert refined.startswith("# Taller de Fracciones") and refined.endswith("- Rúbrica con tres niveles\n")
+    outcome = crew.last_refinement
+    assert outcome.scoped and outcome.sections == ["Adaptaciones:", "Adaptaciones:"]
+    assert outcome.changes == "Adaptaciones de TDAH concretadas."
+    assert "Fase 2: Pedidos de fracciones" in llm.prompts[0]
+    assert "Cada pareja presenta su menú" not in llm.prompts[0]
+
+    feedback = "La adaptación para TDAH no me parece clara"
+    scoped = crew.refinement.create_section_refinement_task(plan_refinement(DESIGN, feedback), feedback)
+    full = crew.refinement.create_refinement_task(DESIGN, feedback)
+    print(f"   - tarea por secciones {estimate_tokens(scoped.description)} tokens, "
+          f"completa {estimate_tokens(full.description)}")
+    assert estimate_tokens(scoped.description) < estimate_tokens(full.description)
+
+    # Un feedback global se resuelve con la reescritura completa
+    refined = crew.refine_activity(DESIGN, "Haz la actividad completa más corta")
+    assert refined == "# Actividad reescrita entera"
+    assert crew.last_refinement.scoped is False
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Tests para la caché semántica de solicitudes casi repetidas
+"""
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.activity_store import ActivityStore
+from agents.request_cache import RequestCache, request_key
+
+DEFAULT_REQUEST = "Crea una actividad de matemáticas sobre fracciones para 4º de primaria, para trabajar en parejas"
+
+
+def test_requests_are_normalized():
+    """El relleno, la materia, el nivel y el agrupamiento salen del tema"""
+    key = request_key("actividad de fracciones 4º primaria por parejas")
+    assert key == request_key(DEFAULT_REQUEST)
+    assert (key.tema, key.nivel, key.agrupacion) == ("fraccion", "4 primaria", 2)
+    assert request_key("Decimales para cuarto de primaria en parejas").nivel == "4 primaria"
+    assert request_key("Actividad para 4º de primaria").tema == ""
+    assert key.materias == "matematicas"
+    assert request_key("Crea una actividad de música sobre el ritmo").materias == "musica"
+
+
+def test_paraphrases_reuse_designs_of_the_same_classroom(tmp_path):
+    """Una paráfrasis encuentra el diseño; otro tema, agrupación o aula no"""
+    store = ActivityStore(str(tmp_path / "actividades.sqlite"))
+    cache = RequestCache(store, max_entries=3)
+    first = store.create(DEFAULT_REQUEST, "# La Pizzería del Aula\n\nFracciones con pizzas")
+    cache.add(DEFAULT_REQUEST, "aula-a", first)
+
+    match = cache.lookup("actividad de fracciones 4º primaria por parejas", "aula-a")
+    assert match.activity_id == first and match.similitud > 0.99
+    assert cache.lookup("Fracciones en parejas", "aula-a").activity_id == first
+    assert cache.lookup("actividad de decimales 4º primaria por parejas", "aula-a") is None
+    assert cache.lookup("actividad de fracciones 4º primaria en grupos de 4", "aula-a") is None
+    assert cache.lookup("actividad de fracciones 6º primaria por parejas", "aula-a") is None
+    assert cache.lookup("actividad de fracciones 4º primaria por parejas", "aula-b") is None
+    assert cache.info()["hits"] == 2 and cache.info()["hit_rate"] == round(2 / 6, 3)
+
+    for topic in ("ecosistemas", "escritura creativa", "el ciclo del agua"):
+        cache.add(f"Proyecto sobre {topic} en parejas", "aula-a", store.create(topic, topic))
+    info = cache.info()
+    assert info["entries"] == 3 and info["evictions"] == 1
+    assert cache.lookup("fracciones en parejas", "aula-a") is None
+
+    water = cache.lookup("el ciclo del agua por parejas", "aula-a")
+    store.delete(water.activity_id)
+    assert cache.info()["entries"] == 2 and cache.lookup("el ciclo del agua por parejas", "aula-a") is None
+    cache.close()
+    store.close()
+
+
+def test_other_subjects_do_not_reuse_designs(tmp_path):
+    """El mismo tema en otra materia no reutiliza el diseño"""
+    store = ActivityStore(str(tmp_path / "actividades.sqlite"))
+    cache = RequestCache(store)
+    rhythm = store.create("ritmo", "# Circuito de ritmo")
+    cache.add("Crea una actividad de educación física sobre el ritmo", "aula-a", rhythm)
+    fractions = store.create("fracciones", "# La Pizzería del Aula")
+    cache.add("Crea una actividad de matemáticas sobre fracciones", "aula-a", fractions)
+
+    assert cache.lookup("Crea una actividad de música sobre el ritmo", "aula-a") is None
+    assert cache.lookup("Crea una actividad de lengua sobre fracciones", "aula-a") is None
+    assert cache.lookup("Actividad de educación física: el ritmo", "aula-a").activity_id == rhythm
+    assert cache.lookup("Actividad sobre el ritmo", "aula-a").activity_id == rhythm
+    cache.close()
+    store.close()
+
+
+def test_crew_resumes_a_structured_design():
+    """Un diseño reutilizado con plantilla se refina por subobjetos, sin ejecutar el crew"""
+    from agents.crew_agents import IA4EDUCrew
+    from agents.structured import build_activity, render_markdown
+    from tests.test_structured import ACTIVIDAD
+
+    crew = IA4EDUCrew("clave-de-prueba", use_cache=False)
+    design = crew.resume_design(render_markdown(build_activity(ACTIVIDAD).actividad), ACTIVIDAD)
+    assert crew.is_structured(design) and crew.last_structure.actividad.titulo == "La Pizzería del Aula"
+    assert crew.resume_design("# Texto libre") == "# Texto libre" and crew.last_structure is None
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Tests para la recuperación léxica BM25 de actividades
+"""
+
+import os
+import random
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.retrieval import BM25Index, fold_accents, search_activities, stem, tokenize
+
+
+def test_tokenize_folds_accents_and_stems():
+    """Tildes, plurales y género se normalizan al mismo término"""
+    assert fold_accents("Matemáticas Niño") == "matematicas niño"
+    assert stem("fracciones") == stem("fracción".replace("ó", "o"))
+    assert tokenize("Las fracciones") == tokenize("la fracción")
+    assert tokenize("parejas") == tokenize("pareja")
+    assert "de" not in tokenize("tiempo de juego")
+
+
+def test_bm25_ranks_relevant_document_first():
+    """El documento con los términos de la consulta queda primero"""
+    index = BM25Index.build([
+        ("huerto", "Cuidamos el huerto escolar y estudiamos las plantas"),
+        ("fracciones", "Fábrica de fracciones: repartimos pizzas en parejas"),
+        ("mapas", "Orientación con mapas y deporte en el patio"),
+    ])
+    hits = index.search("actividad de fracciones por parejas", k=2)
+    assert hits[0].doc_id == "fracciones"
+    assert all(hit.doc_id != "huerto" for hit in hits)
+    assert index.search("astronomía", k=3) == []
+
+
+def test_search_is_fast_on_large_library():
+    """La búsqueda en miles de documentos tarda milisegundos (holgura para CI cargada)"""
+    rng = random.Random(0)
+    vocabulary = [f"termino{i}" for i in range(5000)]
+    docs = [(f"doc{i}", " ".join(rng.choices(vocabulary, k=300))) for i in range(3000)]
+    index = BM25Index.build(docs)
+    query = " ".join(rng.choices(vocabulary, k=6))
+    start = time.perf_counter()
+    for _ in range(50):
+        index.search(query, k=5)
+    elapsed = (time.perf_counter() - start) / 50
+    print(f"   - Búsqueda media: {elapsed * 1000:.3f} ms")
+    assert elapsed < 0.01
+
+
+def test_search_repo_library():
+    """La biblioteca real devuelve la fábrica de fracciones para una consulta de fracciones"""
+    results = search_activities("actividad de matemáticas sobre fracciones", k=3)
+    assert results
+    assert results[0][0].archivo.endswith("k_fabrica_fracciones.md")
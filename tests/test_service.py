@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Tests para el servicio HTTP con cola de trabajos y LLM simulado
+"""
+
+import json
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+
+from agents.activity_store import ActivityStore
+from agents.benchmark import SAMPLE_REQUEST, SCOPED_FEEDBACK, install_stubs
+from agents.crew_agents import IA4EDUCrew
+from agents.service import DesignService, create_app
+
+
+def make_service(tmp_path, workers=1, **kwargs):
+    created = []
+
+    def factory():
+        crew = IA4EDUCrew("clave-de-prueba", use_cache=False)
+        install_stubs(crew, latency=0.01, tokens_per_second=5000)
+        created.append(crew)
+        return crew
+
+    store = ActivityStore(str(tmp_path / "actividades.sqlite"))
+    return DesignService(factory, workers=workers, store=store, **kwargs), created
+
+
+def read_events(client, job_id):
+    """Eventos SSE de un trabajo hasta que termina"""
+    events = []
+    with client.stream("GET", f"/trabajos/{job_id}/eventos") as response:
+        assert response.headers["content-type"].startswith("text/event-stream")
+        for block in response.read().decode().split("\n\n"):
+            if block.strip():
+                kind, data = block.split("\n", 1)
+                events.append((kind[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def test_design_and_refine_through_the_queue(tmp_path):
+    """Diseño y refinamiento como trabajos, con progreso por etapas e historial"""
+    service, _ = make_service(tmp_path)
+    with TestClient(create_app(service)) as client:
+        response = client.post("/disenos", json={"solicitud": SAMPLE_REQUEST})
+        assert response.status_code == 202 and response.json()["estado"] == "pendiente"
+        events = read_events(client, response.json()["id"])
+
+        states = [data["estado"] for kind, data in events if kind == "estado"]
+        assert states == ["pendiente", "en curso", "hecho"]
+        stages = [(data["etapa"], data["estado"]) for kind, data in events if kind == "etapa"]
+        assert ("Análisis", "en curso") in stages and stages[-1] == ("Diseño", "hecho")
+        kind, job = events[-1]
+        assert kind == "fin" and "Pizzería" in job["diseno"]
+
+        activity_id = job["actividad_id"]
+        refine = client.post(f"/actividades/{activity_id}/refinamientos", json={"feedback": SCOPED_FEEDBACK})
+        assert refine.status_code == 202
+        assert read_events(client, refine.json()["id"])[-1][1]["estado"] == "hecho"
+        stored = client.get(f"/actividades/{activity_id}").json()
+        assert stored["resumen"]["refinamientos"] == 1 and stored["historial"][0]["por_secciones"]
+
+        found = client.get("/actividades", params={"consulta": "pizzeria"}).json()
+        assert found["total"] == 1 and found["actividades"][0]["id"] == activity_id
+        assert client.get("/trabajos/no-existe").status_code == 404
+        assert client.post("/actividades/999/refinamientos", json={"feedback": "Más corta"}).status_code == 404
+        assert client.post("/disenos", json={"solicitud": ""}).status_code == 422
+
+
+def test_workers_reuse_their_crews(tmp_path):
+    """Los crews se crean al arrancar y atienden todas las peticiones en paralelo"""
+    service, created = make_service(tmp_path, workers=2)
+    with TestClient(create_app(service)) as client:
+        assert len(created) == 2
+        jobs = [client.post("/disenos", json={"solicitud": f"{SAMPLE_REQUEST} ({i})"}).json()["id"]
+                for i in range(4)]
+        finished = [read_events(client, job_id)[-1][1] for job_id in jobs]
+        assert [job["estado"] for job in finished] == ["hecho"] * 4
+        assert len({job["actividad_id"] for job in finished}) == 4
+        status = client.get("/estado").json()
+        assert status["trabajadores"] == 2 and status["trabajos"] == {"hecho": 4} and status["en_cola"] == 0
+    assert len(created) == 2 and all(crew.verbose is False for crew in created)
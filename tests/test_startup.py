@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Tests de arranque: la CLI no debe importar CrewAI hasta la primera llamada al LLM
+"""
+
+import os
+import re
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Presupuesto de importación de main.py (microsegundos acumulados según -X importtime)
+STARTUP_BUDGET_US = int(os.getenv("IA4EDU_STARTUP_BUDGET_US", "400000"))
+HEAVY_MODULES = ("crewai", "langchain_community", "litellm")
+# Módulos que solo hacen falta al diseñar: pydantic y la plantilla, el puntuador, el resumen del aula
+DESIGN_MODULES = ("pydantic", "templates.activity_template", "agents.candidates", "agents.classroom",
+                  "agents.structured")
+
+
+def importtime(*args):
+    """Módulos importados y tiempo acumulado (µs) de cada uno con -X importtime"""
+    env = dict(os.environ, PYTHONPATH=ROOT, OTEL_SDK_DISABLED="true")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", *args],
+        cwd=ROOT, env=env, capture_output=True, text=True, timeout=120,
+    )
+    assert proc.returncode == 0, proc.stderr[-2000:]
+    times = {}
+    for line in proc.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|(\s*)(\S+)", line)
+        if match:
+            times[match.group(3)] = int(match.group(1))
+    return times, proc.stdout
+
+
+def heavy(times):
+    return sorted(name for name in times if name.split(".")[0] in HEAVY_MODULES)
+
+
+@pytest.mark.slow
+def test_main_import_is_light_and_within_budget():
+    """Importar main.py no carga CrewAI y cabe en el presupuesto"""
+    times, _ = importtime("-c", "import main")
+    print(f"   - import main: {times['main'] / 1000:.0f} ms")
+    assert heavy(times) == []
+    assert [name for name in DESIGN_MODULES if name in times] == []
+    assert times["main"] < STARTUP_BUDGET_US
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize("command", [["perfiles"], ["aulas"], ["biblioteca"], ["buscar", "fracciones", "-s", "1"]])
+def test_light_commands_never_import_crewai(command):
+    """Los subcomandos de consulta funcionan sin importar CrewAI"""
+    times, stdout = importtime("main.py", *command)
+    assert heavy(times) == []
+    assert stdout.strip()
+
+
+@pytest.mark.slow
+def test_history_command_never_imports_crewai(tmp_path, monkeypatch):
+    """El historial se consulta sin importar CrewAI"""
+    monkeypatch.setenv("IA4EDU_STORE", str(tmp_path / "actividades.sqlite"))
+    times, stdout = importtime("main.py", "historial", "fracciones")
+    assert heavy(times) == []
+    assert "Historial" in stdout or "fracciones" in stdout
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Tests para el seguimiento en vivo de etapas y tokens
+"""
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crewai.llms.base_llm import BaseLLM
+from crewai.utilities.events import LLMStreamChunkEvent
+from crewai.utilities.events.crewai_event_bus import crewai_event_bus
+
+from agents.cascade import CascadeLLM, CascadeStats
+from agents.crew_agents import IA4EDUCrew
+from agents.llm_cache import CachedLLM, LLMResponseCache
+from agents.streaming import DONE, PENDING, StreamMonitor, enable_streaming
+from tests.test_cascade import ANALISIS
+
+
+class StreamingStubLLM(BaseLLM):
+    """LLM local que emite su respuesta palabra a palabra si stream está activo"""
+
+    def __init__(self, name, answer=None):
+        super().__init__(model=f"stub/{name}", temperature=0.7)
+        self.answer = answer or f"texto de stub/{name} en vivo"
+        self.stream = False
+        self.calls = 0
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        self.calls += 1
+        response = f"Final Answer: {self.answer}"
+        if self.stream:
+            for word in response.split(" "):
+                crewai_event_bus.emit(self, LLMStreamChunkEvent(chunk=word + " "))
+        return response
+
+
+def test_monitor_tracks_stages_and_chunks():
+    """Cada etapa recibe sus fragmentos y queda marcada como hecha"""
+    crew = IA4EDUCrew("clave-de-prueba", use_cache=False)
+    crew.fill_gaps = False
+    for name in ("analyst", "researcher", "designer"):
+        getattr(crew, name).agent.llm = StreamingStubLLM(name)
+    crew.enable_streaming()
+    assert crew.verbose is False
+
+    updates = []
+    with StreamMonitor(crew.design_stages(), on_update=lambda m: updates.append(1)) as monitor:
+        result = crew.design_activity("Actividad de fracciones en parejas")
+
+    stages = monitor.snapshot()
+    assert [s.status for s in stages] == [DONE, DONE, DONE]
+    assert all(s.chunks > 0 and s.first_token_at is not None for s in stages)
+    assert stages[2].text == result.raw == "texto de stub/designer en vivo"
+    assert monitor.time_to_first_token is not None
+    assert updates
+
+    # Fuera del contexto el monitor deja de recibir eventos
+    crewai_event_bus.emit(None, LLMStreamChunkEvent(chunk="tarde"))
+    assert "tarde" not in monitor.snapshot()[2].text
+
+
+def test_rejected_tier_text_is_discarded():
+    """Lo que emitió un nivel rechazado por la cascada no se queda en la etapa"""
+    crew = IA4EDUCrew("clave-de-prueba", use_cache=False)
+    crew.fill_gaps = False
+    for name in ("analyst", "designer"):
+        getattr(crew, name).agent.llm = StreamingStubLLM(name)
+    strong_answer = ANALISIS + " Actividades, estrategias, grupos, materiales y fases."
+    crew.researcher.agent.llm = CascadeLLM("researcher", [
+        ("rapido", StreamingStubLLM("rapido", "Investigación corta")),
+        ("potente", StreamingStubLLM("potente", strong_answer)),
+    ], stats=CascadeStats())
+    crew.enable_streaming()
+
+    texts = []
+    with StreamMonitor(crew.design_stages(), on_update=lambda m: texts.append(m.snapshot()[1].text)) as monitor:
+        crew.design_activity("Actividad de fracciones en parejas")
+
+    assert any("Investigación corta" in text for text in texts)
+    assert not any("Investigación corta" in text and "Resumen" in text for text in texts)
+    assert monitor.snapshot()[1].text == strong_answer
+
+
+def test_refine_stages_start_pending():
+    """Las etapas empiezan pendientes"""
+    crew = IA4EDUCrew("clave-de-prueba", use_cache=False)
+    monitor = StreamMonitor(crew.refine_stages())
+    assert [(s.label, s.status) for s in monitor.snapshot()] == [("Refinamiento", PENDING)]
+    assert monitor.current is None
+
+
+def test_cache_hit_is_replayed_as_chunk(tmp_path):
+    """Una respuesta servida desde la caché también llega al streaming"""
+    inner = StreamingStubLLM("cache")
+    llm = CachedLLM(inner, LLMResponseCache(str(tmp_path / "cache.sqlite")))
+    assert enable_streaming(llm) and inner.stream
+
+    chunks = []
+
+    def on_chunk(source, event):
+        chunks.append(event.chunk)
+
+    crewai_event_bus.register_handler(LLMStreamChunkEvent, on_chunk)
+    try:
+        llm.call("hola")
+        streamed = len(chunks)
+        llm.call("hola")
+    finally:
+        crewai_event_bus._handlers[LLMStreamChunkEvent].remove(on_chunk)
+
+    assert inner.calls == 1
+    assert streamed > 1
+    assert chunks[streamed:] == ["Final Answer: texto de stub/cache en vivo"]
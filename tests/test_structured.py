@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Tests para la salida JSON según PlantillaActividad y su reparación dirigida
+"""
+
+import copy
+import json
+import os
+import re
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crewai.llms.base_llm import BaseLLM
+
+from agents.crew_agents import IA4EDUCrew
+from agents.refinement import split_design
+from agents.structured import build_activity, find_issues, render_markdown, section_paths
+
+
+def adaptacion(estudiante, neurotipo, estrategia):
+    return {
+        "estudiante_id": estudiante, "neurotipo": neurotipo, "estrategias_especificas": [estrategia],
+        "materiales_adicionales": [], "rol_en_grupo": "repartidor", "tiempo_estimado": "10 min",
+        "apoyo_necesario": "bajo",
+    }
+
+
+def tarea(nombre, adaptaciones):
+    return {
+        "nombre": nombre, "descripcion": f"{nombre} con pizzas de cartulina", "objetivo": "Representar fracciones",
+        "duracion_estimada": "20 min", "materiales": ["cartulina"],
+        "instrucciones_paso_a_paso": ["Recortar la pizza", "Dividirla en partes iguales"],
+        "adaptaciones_por_estudiante": adaptaciones, "criterios_evaluacion": ["Partes iguales"],
+    }
+
+
+ACTIVIDAD = {
+    "titulo": "La Pizzería del Aula",
+    "descripcion_general": "Taller de fracciones con pizzas de cartulina",
+    "materia": "Matemáticas", "tema_principal": "Fracciones", "nivel_educativo": "4º primaria",
+    "duracion_total": "3 sesiones", "tipo_actividad": "manipulativo",
+    "objetivos_aprendizaje": ["Comprender fracciones como partes de un todo"],
+    "objetivos_inclusion": ["Participación de todos"],
+    "competencias_clave": ["Matemática"],
+    "fases": [
+        {
+            "nombre": "Exploración", "descripcion": "Primer contacto", "objetivo": "Explorar",
+            "duracion_total": "50 min",
+            "tareas": [tarea("Dividir la pizza", [adaptacion("001", "TEA", "instrucciones visuales")])],
+            "preguntas_clave_adaptacion": ["¿Qué apoyos necesita?"],
+            "estrategias_adaptacion": {"TEA": "anticipación"},
+        },
+        {
+            "nombre": "Pedidos", "descripcion": "Pedidos de fracciones", "objetivo": "Aplicar",
+            "duracion_total": "50 min",
+            "tareas": [tarea("Atender pedidos", [adaptacion("002", "TDAH", "temporizador visual")])],
+            "preguntas_clave_adaptacion": [], "estrategias_adaptacion": {"TDAH": "movimiento"},
+        },
+    ],
+    "asignaciones_grupos": [{
+        "grupo_id": "A", "estudiantes": ["001", "002"], "tipo_agrupacion": "parejas",
+        "justificacion_agrupacion": "Complementan fortalezas", "roles_asignados": {"001": "cocinero"},
+    }],
+    "materiales_base": ["Cartulinas"], "materiales_adaptacion": {"TEA": ["pictogramas"]},
+    "recursos_digitales": [], "criterios_evaluacion_generales": ["Rúbrica con tres niveles"],
+    "rubrica_inclusion": {"participa": "siempre"}, "estrategias_evaluacion_adaptadas": {"TDAH": "oral"},
+    "principios_diseño_universal": ["Múltiples formas de representación"],
+    "adaptaciones_proactivas": {"TEA": "agenda visual"}, "estrategias_apoyo_pares": ["Tutoría entre iguales"],
+    "notas_implementacion": [], "recursos_profesor": [], "extension_actividades": [],
+}
+
+
+def broken_activity():
+    """Actividad con una tarea sin objetivo, pasos en texto y sin competencias"""
+    data = copy.deepcopy(ACTIVIDAD)
+    del data["fases"][1]["tareas"][0]["objetivo"]
+    data["fases"][0]["tareas"][0]["instrucciones_paso_a_paso"] = "- Recortar\n- Dividir"
+    del data["competencias_clave"]
+    return data
+
+
+def test_incremental_validation_repairs_only_broken_subobjects():
+    """Solo se vuelven a pedir los subobjetos inválidos; lo arreglable se arregla en local"""
+    asked = []
+
+    def repair(unit, issues, data):
+        asked.append(unit)
+        return ["Matemática"] if unit == "competencias_clave" else ACTIVIDAD["fases"][1]["tareas"][0]
+
+    result = build_activity(broken_activity(), repair)
+    assert sorted(asked) == ["competencias_clave", "fases[1].tareas[0]"]
+    assert result.sin_resolver == [] and result.llamadas_reparacion == 2
+    assert result.actividad.fases[0].tareas[0].instrucciones_paso_a_paso == ["Recortar", "Dividir"]
+    assert find_issues(result.actividad.model_dump()) == []
+
+
+def test_unrepairable_fields_are_reported():
+    """Si la reparación falla la actividad sigue siendo válida y se informa de lo pendiente"""
+    result = build_activity(broken_activity(), lambda unit, issues, data: None)
+    assert result.sin_resolver == ["competencias_clave", "fases[1].tareas[0]"]
+    assert result.actividad.competencias_clave == []
+
+
+def test_missing_top_level_fields_are_repaired_in_one_call():
+    """Los campos de primer nivel ausentes se piden juntos y lo que falla no se vuelve a pedir"""
+    data = {key: copy.deepcopy(ACTIVIDAD[key]) for key in ("titulo", "descripcion_general", "fases")}
+    del data["fases"][1]["tareas"][0]["objetivo"]
+    asked = []
+
+    def repair(unit, issues, view):
+        asked.append(unit)
+        if "," in unit:
+            return {name: ACTIVIDAD[name] for name in unit.split(",")}
+        return None
+
+    result = build_activity(data, repair)
+    merged = [unit for unit in asked if "," in unit]
+    assert len(asked) == 2 and result.llamadas_reparacion == 2 and "fases[1].tareas[0]" in asked
+    assert set(merged[0].split(",")) == set(ACTIVIDAD) - {"titulo", "descripcion_general", "fases"}
+    assert result.sin_resolver == ["fases[1].tareas[0]"]
+    assert result.actividad.materia == "Matemáticas" and result.actividad.competencias_clave == ["Matemática"]
+
+    result = build_activity({"titulo": "Sin nada más"}, lambda unit, issues, view: None)
+    assert result.llamadas_reparacion == 1 and "materia" in result.sin_resolver
+
+
+def test_markdown_sections_map_to_paths():
+    """Cada sección del markdown sabe de qué subobjeto sale"""
+    markdown = render_markdown(build_activity(ACTIVIDAD).actividad)
+    mapping = {s.titulo: paths for s, paths in zip(split_design(markdown), section_paths(markdown))}
+    assert mapping["Fase 2: Pedidos"] == ["fases[1]"]
+    assert mapping["Tarea 2.1: Atender pedidos"] == ["fases[1].tareas[0]"]
+    assert mapping["Grupo A (parejas)"] == ["asignaciones_grupos[0]"]
+    assert mapping["2. Objetivos"] == ["objetivos_aprendizaje", "objetivos_inclusion", "competencias_clave"]
+    assert mapping["Rúbrica inclusiva:"] == ["rubrica_inclusion"]
+
+
+class JSONLLM(BaseLLM):
+    """LLM local que devuelve JSON: la actividad, sus reparaciones o fragmentos revisados"""
+
+    def __init__(self, name, activity=None):
+        super().__init__(model=f"stub/{name}", temperature=0.7)
+        self.activity = activity
+        self.prompts = []
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        prompt = messages if isinstance(messages, str) else "\n".join(m["content"] for m in messages)
+        self.prompts.append(prompt)
+        if "Corrige SOLO el valor de `fases[1].tareas[0]`" in prompt:
+            return json.dumps(ACTIVIDAD["fases"][1]["tareas"][0], ensure_ascii=False)
+        if "Corrige SOLO el valor de `competencias_clave`" in prompt:
+            return '["Matemática"]'
+        units = re.findall(r"<<<(fases\[\d+\]\.tareas\[\d+\])>>>", prompt)
+        if units:
+            revised = tarea("Atender pedidos", [adaptacion("002", "TDAH", "pasos numerados y pausas activas")])
+            body = "\n".join(f"<<<{u}>>>\n{json.dumps(revised, ensure_ascii=False)}\n<<<FIN>>>" for u in units)
+            return f"Final Answer: {body}\n<<<CAMBIOS>>>\nAdaptaciones de TDAH concretadas."
+        if self.activity is not None:
+            return "Final Answer: ```json\n" + json.dumps(self.activity, ensure_ascii=False) + "\n```"
+        return f"Final Answer: salida de {self.model}"
+
+
+def test_crew_designs_and_refines_structured_activity():
+    """El diseño se valida y repara por partes y el refinamiento edita solo las tareas afectadas"""
+    crew = IA4EDUCrew("clave-de-prueba", use_cache=False)
+    crew.fill_gaps = False
+    crew.analyst.agent.llm = JSONLLM("analyst")
+    crew.researcher.agent.llm = JSONLLM("researcher")
+    designer = crew.designer.agent.llm = JSONLLM("designer", broken_activity())
+    refiner = crew.refinement.agent.llm = JSONLLM("refinement")
+
+    design = crew.design_activity("Actividad de fracciones en parejas").raw
+    assert design.startswith("# La Pizzería del Aula")
+    assert "#### Tarea 2.1: Atender pedidos" in design
+    assert '"fases"' in designer.prompts[0] and '"asignaciones_grupos"' in designer.prompts[0]
+    repairs = designer.prompts[1:]
+    assert len(repairs) == 2 and all('"asignaciones_grupos"' not in p for p in repairs)
+    assert crew.last_structure.reparados == ["competencias_clave", "fases[1].tareas[0]"]
+
+    refined = crew.refine_activity(design, "La adaptación para TDAH no me parece clara")
+    assert "pasos numerados y pausas activas" in refined
+    assert crew.last_refinement.scoped and crew.last_refinement.changes == "Adaptaciones de TDAH concretadas."
+    assert "<<<fases[1].tareas[0]>>>" in refiner.prompts[0]
+    assert "Exploración" not in refiner.prompts[0].split("Fragmentos JSON", 1)[1].split("Esquema", 1)[0]
+    assert crew.last_structure.actividad.titulo == "La Pizzería del Aula"
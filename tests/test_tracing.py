@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Tests para las trazas por etapa y por llamada al LLM
+"""
+
+import json
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crewai.llms.base_llm import BaseLLM
+from crewai.utilities.events import LLMCallCompletedEvent, LLMCallFailedEvent, LLMCallStartedEvent
+from crewai.utilities.events.crewai_event_bus import crewai_event_bus
+from crewai.utilities.events.llm_events import LLMCallType
+
+from agents.cascade import CascadeLLM, CascadeStats
+from agents.crew_agents import IA4EDUCrew
+from agents.llm_cache import CachedLLM, LLMResponseCache
+from agents.tracing import JSONLSpanExporter, Tracer
+
+NAMES = ("analyst", "researcher", "designer")
+
+
+class EventLLM(BaseLLM):
+    """LLM local que emite los mismos eventos que el LLM de CrewAI"""
+
+    def __init__(self, name):
+        super().__init__(model=f"stub/{name}", temperature=0.7)
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        crewai_event_bus.emit(self, LLMCallStartedEvent(messages=messages))
+        response = f"Final Answer: salida de {self.model}"
+        crewai_event_bus.emit(self, LLMCallCompletedEvent(response=response, call_type=LLMCallType.LLM_CALL))
+        return response
+
+
+class FlakyLLM(EventLLM):
+    """Falla la primera llamada, como un error transitorio del proveedor"""
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.failed = False
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        if not self.failed:
+            self.failed = True
+            crewai_event_bus.emit(self, LLMCallStartedEvent(messages=messages))
+            crewai_event_bus.emit(self, LLMCallFailedEvent(error="503 no disponible"))
+            raise RuntimeError("503 no disponible")
+        return super().call(messages, tools, callbacks, available_functions, **kwargs)
+
+
+def make_crew(cache=None):
+    crew = IA4EDUCrew("clave-de-prueba", use_cache=False)
+    crew.fill_gaps = False
+    crew.verbose = False
+    for name in NAMES:
+        llm = EventLLM(name)
+        getattr(crew, name).agent.llm = CachedLLM(llm, cache) if cache is not None else llm
+    return crew
+
+
+def read_spans(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_spans_form_a_tree_per_stage(tmp_path):
+    """Cada etapa cuelga de la operación y cada llamada al LLM de su etapa"""
+    path = str(tmp_path / "trazas.jsonl")
+    crew = make_crew()
+    with Tracer(JSONLSpanExporter(path), crew.design_stages()) as tracer:
+        with tracer.span("diseño", **{"ia4edu.request": "fracciones"}):
+            crew.design_activity("Actividad de fracciones en parejas")
+
+    spans = read_spans(path)
+    root = next(s for s in spans if s["name"] == "diseño")
+    stages = [s for s in spans if s["name"].startswith("etapa ")]
+    llm_calls = [s for s in spans if s["name"] == "llm"]
+    assert [s["attributes"]["ia4edu.stage"] for s in stages] == ["Análisis", "Investigación", "Diseño"]
+    assert all(s["parent_span_id"] == root["span_id"] and s["trace_id"] == root["trace_id"] for s in stages)
+    assert {c["parent_span_id"] for c in llm_calls} == {s["span_id"] for s in stages}
+    for span in spans:
+        assert span["end_time_unix_nano"] >= span["start_time_unix_nano"]
+        assert span["status"]["code"] == "OK"
+
+    analysis = tracer.stage_summary()[0]
+    assert analysis.modelo == "stub/analyst" and analysis.llamadas == 1
+    assert analysis.tokens_prompt > 0 and analysis.aciertos_cache == 0 and analysis.reintentos == 0
+
+
+def test_cache_hits_are_traced(tmp_path):
+    """Una segunda ejecución servida desde la caché aparece como aciertos"""
+    cache = LLMResponseCache(str(tmp_path / "cache.sqlite"))
+    make_crew(cache).design_activity("Actividad de fracciones en parejas")
+
+    crew = make_crew(cache)
+    with Tracer(stages=crew.design_stages()) as tracer:
+        crew.design_activity("Actividad de fracciones en parejas")
+    summary = tracer.stage_summary()
+    assert [s.aciertos_cache for s in summary] == [1, 1, 1]
+    assert all(s.tokens_respuesta > 0 for s in summary)
+    cache.close()
+
+
+def test_retries_and_escalations_are_counted_apart():
+    """Solo cuenta como reintento la llamada tras un fallo; los escalados de la cascada van aparte"""
+    crew = make_crew()
+    crew.analyst.agent.llm = FlakyLLM("analyst")
+    crew.researcher.agent.llm = CascadeLLM("researcher", [("rapido", EventLLM("rapido")), ("potente", EventLLM("potente"))],
+                                           validator=lambda prompt, answer: "respuesta demasiado corta"
+                                           if "rapido" in answer else None, stats=CascadeStats())
+    with Tracer(stages=crew.design_stages()) as tracer:
+        crew.design_activity("Actividad de fracciones en parejas")
+
+    analysis, research, design = tracer.stage_summary()
+    assert (analysis.llamadas, analysis.reintentos, analysis.escalados) == (2, 1, 0)
+    assert (research.llamadas, research.reintentos, research.escalados) == (2, 0, 1)
+    assert (design.llamadas, design.reintentos, design.escalados) == (1, 0, 0)
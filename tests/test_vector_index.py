@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Tests para el índice vectorial persistente (memmap)
+"""
+
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from agents.corpus import ActivityCorpus
+from agents.vector_index import VectorIndex, embed_text
+
+
+def _write(path, content):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def _make_corpus(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    _write(data_dir / "k_fracciones.md", "# Fábrica de fracciones\nRepartimos pizzas en partes iguales")
+    _write(data_dir / "k_huerto.md", "# Huerto escolar\nSembramos semillas y observamos plantas")
+    _write(data_dir / "k_teatro.md", "# Teatro de sombras\nEscribimos un guion y representamos")
+    return ActivityCorpus(str(data_dir))
+
+
+def test_embedding_is_normalized_and_stable():
+    """Los vectores son deterministas y de norma 1"""
+    a = embed_text("fracciones en parejas")
+    b = embed_text("fracciones en parejas")
+    assert a.dtype == np.float32
+    assert np.allclose(a, b)
+    assert abs(float(np.linalg.norm(a)) - 1.0) < 1e-5
+
+
+def test_index_is_persisted_and_loaded_with_memmap(tmp_path):
+    """Un segundo arranque no vuelve a embeber el corpus"""
+    corpus = _make_corpus(tmp_path)
+    index_dir = str(tmp_path / "index")
+    index = VectorIndex(index_dir)
+    assert index.sync(corpus.activities()) == 3
+
+    reopened = VectorIndex(index_dir)
+    assert isinstance(reopened._matrix, np.memmap)
+    assert reopened.sync(corpus.activities()) == 0
+    assert len(reopened) == 3
+
+
+def test_only_changed_files_are_embedded(tmp_path):
+    """Solo se embeben las actividades nuevas o modificadas"""
+    corpus = _make_corpus(tmp_path)
+    index = VectorIndex(str(tmp_path / "index"))
+    index.sync(corpus.activities())
+
+    path = os.path.join(corpus.data_dir, "k_teatro.md")
+    _write(path, "# Teatro de marionetas\nConstruimos marionetas y escribimos un guion largo")
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    _write(os.path.join(corpus.data_dir, "k_mapas.md"), "# Mapas\nOrientación en el patio")
+    assert index.sync(corpus.activities()) == 2
+    assert len(index) == 4
+
+
+def test_search_matches_without_shared_keywords(tmp_path):
+    """Los n-gramas de caracteres encuentran variantes morfológicas"""
+    corpus = _make_corpus(tmp_path)
+    index = VectorIndex(str(tmp_path / "index"))
+    index.sync(corpus.activities())
+    hits = index.search("números fraccionarios", k=2)
+    assert hits[0].doc_id.endswith("k_fracciones.md")